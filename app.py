@@ -1,5 +1,8 @@
 # app.py
 
+import os
+from functools import partial
+
 import streamlit as st
 import pandas as pd
 import numpy as np # 直接入力の初期データ生成に使うため残す
@@ -12,17 +15,44 @@ from components.graph_plotter import (
     plot_stacked_bar_chart,
     plot_scatter_plot,
     plot_heatmap,
-    PLOTLY_TEMPLATES
+    PLOTLY_TEMPLATES,
+    SERIES_LAYOUT_LABELS,
+    SERIES_LAYOUT_SEPARATE
 )
 from components.data_processor import (
     load_and_combine_csv,
+    load_and_combine_csv_streaming,
+    load_and_append_csv,
+    select_filter_bitmap,
     calculate_and_plot_average,
     aggregate_and_plot_time_series,
     perform_advanced_statistics
 )
+from components.cache import file_content_hash
+from components.data_editor import EditLog, load_edited_frame, render_paged_editor
+from components.downsampling import DEFAULT_CHART_WIDTH_PX, METHOD_LABELS, METHOD_LTTB, METHOD_MINMAX
+from components.rasterize import RASTER_POINT_THRESHOLD
+from components.dataset_store import list_datasets, open_dataset, save_dataset
+from components.parallel import DEFAULT_MAX_WORKERS
+from components.heatmap import AGG_SUM, AGGREGATION_LABELS, DEFAULT_HEATMAP_BINS, MAX_HEATMAP_BINS
+from components.dataset import process_peak_rss_bytes, record_session_rss
+from components.dataset_registry import acquire_dataset, registry_stats
+from components.fingerprint import dependency_frame
+from components.query import Query, get_query_cache
+from components.profiling import (
+    PROFILING_DEFAULT, allocation_tracking_available, begin_rerun, end_rerun, profile_span, render_profile_panel
+)
 
 st.set_page_config(layout="wide")
 
+# --- プロファイリング（デバッグ用）: 各処理の時間・行数・メモリ・図の大きさを再実行ごとに記録する ---
+profiling_enabled = st.sidebar.checkbox('プロファイリング（デバッグ用）', value=PROFILING_DEFAULT)
+track_allocations = profiling_enabled and st.sidebar.checkbox(
+    'メモリの割り当ても計測する', value=False, disabled=not allocation_tracking_available(),
+    help='tracemalloc を使います。環境変数 DATA_APP_TRACE_ALLOCATIONS=1 で起動した場合だけ選べます（処理が遅くなります）。'
+)
+profile_recorder = begin_rerun(st.session_state, profiling_enabled, track_allocations)
+
 st.title('データ可視化Webアプリケーション')
 
 # --- データ入力・編集セクション ---
@@ -30,7 +60,7 @@ st.header('1. データの入力・編集')
 st.write('CSVファイルをアップロードするか、以下のテーブルで直接データを入力・編集してください。')
 
 # 初期データフレームの生成（空のDFだと分かりにくいので、初期サンプルデータを入れておく）
-if 'edited_df' not in st.session_state:
+if 'edit_log' not in st.session_state:
     # ユーザーが編集できる初期サンプルデータを作成
     sample_data_for_editor = {
         'Date': [datetime.now() - timedelta(days=i) for i in range(5)][::-1],
@@ -39,20 +69,15 @@ if 'edited_df' not in st.session_state:
         'Customer_Rating': [4.5, 4.6, 4.7, 4.4, 4.8],
         'Region': ['East', 'West', 'East', 'Central', 'West']
     }
-    st.session_state.edited_df = pd.DataFrame(sample_data_for_editor)
+    sample_df = pd.DataFrame(sample_data_for_editor)
     # 日付列を日付型に変換しておく
-    st.session_state.edited_df['Date'] = pd.to_datetime(st.session_state.edited_df['Date']).dt.date
-
-# データエディタの表示
-edited_df_from_editor = st.data_editor(
-    st.session_state.edited_df,
-    num_rows="dynamic", # 行の追加・削除を許可
-    use_container_width=True,
-    key="data_editor" # keyを指定
-)
+    sample_df['Date'] = pd.to_datetime(sample_df['Date']).dt.date
+    # 編集は元のデータを書き換えず、差分として記録する
+    st.session_state.edit_log = EditLog(sample_df)
+edit_log = st.session_state.edit_log
 
-# エディタで編集されたデータをセッションステートに保存
-st.session_state.edited_df = edited_df_from_editor
+# データエディタの表示（1ページ分の行だけを表示し、行の追加・削除も差分として記録する）
+render_paged_editor(edit_log, key="data_editor")
 
 st.markdown('---') # 区切り線
 
@@ -61,35 +86,128 @@ st.header('2. CSVファイルをアップロード (入力データがない場
 st.write('直接入力されたデータがある場合、そちらが優先されます。')
 
 uploaded_files = st.file_uploader("CSVファイルを選択", type=["csv"], accept_multiple_files=True)
-
-df = None # 初期化
+streaming_mode = st.checkbox(
+    'チャンク単位で読み込む（大容量ファイル向け。列構成が異なるファイルも列の和集合で結合します）',
+    value=False
+)
+append_mode = st.checkbox(
+    '追記モード（以前と同じファイルの後ろに追加されたファイルだけを読み込み、集計結果を更新します）',
+    value=False
+)
+max_workers = int(st.number_input(
+    '並列処理のワーカープロセス数（大きなファイルの読み込みと時系列集計に使用。1 の場合は並列化しません）:',
+    min_value=1,
+    max_value=max(os.cpu_count() or 1, DEFAULT_MAX_WORKERS),
+    value=DEFAULT_MAX_WORKERS
+))
+
+# --- 保存済みデータセット（ローカルのArrow形式のストア）から選択 ---
+stored_datasets = {metadata['name']: metadata for metadata in list_datasets()}
+selected_store_name = None
+store_columns = None
+store_start = store_end = None
+if stored_datasets:
+    selected_store_name = st.selectbox(
+        '保存済みのデータセットから選択 (アップロードの代わりに使用できます):',
+        ['（使用しない）'] + list(stored_datasets.keys())
+    )
+    if selected_store_name == '（使用しない）':
+        selected_store_name = None
+    else:
+        store_metadata = stored_datasets[selected_store_name]
+        with st.expander('読み込む列・期間の指定（必要な部分だけを読み込みます）'):
+            store_columns = st.multiselect(
+                '読み込む列 (未選択の場合はすべての列):',
+                store_metadata['columns']
+            ) or None
+            time_ranges = [p for p in store_metadata['partitions'] if p['min_time'] is not None]
+            if store_metadata['time_col'] and time_ranges:
+                min_date = min(pd.Timestamp(p['min_time']) for p in time_ranges).date()
+                max_date = max(pd.Timestamp(p['max_time']) for p in time_ranges).date()
+                date_range = st.date_input(
+                    f"'{store_metadata['time_col']}' の期間:",
+                    value=(min_date, max_date), min_value=min_date, max_value=max_date
+                )
+                if len(date_range) == 2 and (date_range[0], date_range[1]) != (min_date, max_date):
+                    store_start = pd.Timestamp(date_range[0])
+                    # 終了日はその日の終わりまでを含める
+                    store_end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')
+
+dataset_key = None # 型推論などのキャッシュに使う、データセットを識別するキー
+load_dataset = None # データセットが共有レジストリにない場合に DataFrame を読み込む関数
+load_typed = False # load_dataset が型変換済みの DataFrame を返すかどうか
+source_label = None
 
 # データエディタに入力されたデータがあるか確認し、あればそれを優先
-if not st.session_state.edited_df.empty:
-    df = st.session_state.edited_df.copy()
+if len(edit_log):
+    # キーは元のデータと差分の記録から決まる（データ全体をハッシュし直さない）。
+    # 前の版のデータセットの型変換や集計は、編集された行と列の分だけ更新して引き継ぐ
+    previous_handle = st.session_state.get('dataset_handle')
+    dataset_key = edit_log.key
+    load_dataset = partial(load_edited_frame, edit_log,
+                           previous_handle.dataset if previous_handle is not None else None)
+    source_label = 'データエディタのデータ'
     st.info('データエディタで入力されたデータを使用します。')
+elif selected_store_name: # 保存済みデータセットが選択された場合
+    dataset_key = ('store', selected_store_name, stored_datasets[selected_store_name]['saved_at'],
+                   tuple(store_columns) if store_columns else None, store_start, store_end)
+    load_dataset = partial(open_dataset, selected_store_name, columns=store_columns, start=store_start, end=store_end)
+    source_label = f"データセット '{selected_store_name}'"
 elif uploaded_files: # データエディタが空で、ファイルがアップロードされた場合
-    df = load_and_combine_csv(uploaded_files)
-    st.info(f'{len(uploaded_files)} 個のファイルをアップロードし、結合が完了しました！')
+    loader = load_and_combine_csv_streaming if streaming_mode else partial(load_and_combine_csv, max_workers=max_workers)
+    source_label = 'アップロードされたファイル'
+    if append_mode:
+        # 型変換済みのDataFrameが返る（下の型変換はキャッシュから取得されるだけ）
+        appended_df, dataset_key = load_and_append_csv(uploaded_files, loader=loader)
+        if appended_df is None:
+            # 全てのファイルの読み込みに失敗した場合は、データセットを登録しない
+            st.error(f'{source_label}を読み込めませんでした。ファイルの形式と内容を確認してください。')
+            dataset_key = None
+        else:
+            load_dataset = lambda: appended_df
+            load_typed = True
+    else:
+        # 他のセッションが同じファイルをすでに読み込んでいれば、パースせずにそのデータセットを参照する
+        dataset_key = ('upload', tuple(file_content_hash(file) for file in uploaded_files), streaming_mode)
+        load_dataset = partial(loader, uploaded_files)
 else: # どちらもデータがない場合
     st.info('データを直接入力するか、CSVファイルをアップロードしてください。')
 
 
-if df is not None and not df.empty: # データフレームが正常に読み込まれた場合のみ処理を続行
+# 読み込んだデータはプロセス全体で共有する Dataset（正本）として保持し、同じデータを開いたセッションは
+# 同じ配列を参照する。セッションはハンドルを持ち、データが変わったら以前のデータセットへの参照を外す
+dataset = None
+dataset_handle = st.session_state.get('dataset_handle')
+if dataset_handle is not None and dataset_handle.key != dataset_key:
+    dataset_handle.release()
+    dataset_handle = st.session_state.dataset_handle = None
+if dataset_key is not None:
+    try:
+        if dataset_handle is None:
+            with profile_span('dataset_registry.acquire_dataset', 'load') as span:
+                dataset_handle = acquire_dataset(dataset_key, load_dataset, typed=load_typed)
+                span.rows_out = len(dataset_handle.dataset)
+            st.session_state.dataset_handle = dataset_handle
+        dataset = dataset_handle.dataset
+        if selected_store_name and dataset_key[0] == 'store':
+            st.info(f"保存済みデータセット '{selected_store_name}' を読み込みました（{len(dataset):,} 行）。")
+        elif dataset_key[0] in ('upload', 'append'):
+            st.info(f'{len(uploaded_files)} 個のファイルをアップロードし、結合が完了しました！')
+    except Exception as e:
+        st.error(f"{source_label}の読み込み中にエラーが発生しました: {e}")
+    if dataset is not None and len(dataset) == 0:
+        dataset = None
+record_session_rss(st.session_state)
+
+if dataset is not None: # データフレームが正常に読み込まれた場合のみ処理を続行
     # データフレームの型を調整（data_editorからの入力はobject型になりがちなので）
-    for col in df.columns:
-        # 日付型に変換を試みる
-        if 'Date' in col:
-            try:
-                df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-            except:
-                pass # 変換できなければそのまま
-
-        # 数値型に変換を試みる
-        try:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        except:
-            pass # 変換できなければそのまま
+    # 列ごとに型（数値・日時・カテゴリ・文字列）を推論して一括変換する。結果はデータセットごとにキャッシュされる
+    with profile_span('dataset.typed', 'type_inference', rows_in=len(dataset)) as span:
+        df = dataset.typed
+        span.rows_out = len(df)
+    # 列ごとのフィンガープリント。図や集計のキャッシュキーを使う列の値だけから決め、編集した列に依存するものだけを作り直す
+    with profile_span('dataset.fingerprint', 'fingerprint', rows_in=len(dataset)):
+        dataset.fingerprint
 
     st.subheader('現在のデータのプレビュー（最初の5行）')
     st.dataframe(df.head())
@@ -99,6 +217,43 @@ if df is not None and not df.empty: # データフレームが正常に読み込
     st.write('データ型:')
     st.write(df.dtypes)
 
+    # アップロードしたデータは、次回以降CSVをパースせずに開けるようローカルのストアに保存できる
+    if dataset.key[0] in ('upload', 'append'):
+        with st.expander('このデータをデータセットとして保存'):
+            store_name = st.text_input('データセット名:', '')
+            datetime_columns = df.select_dtypes(include=['datetime']).columns.tolist()
+            partition_col = st.selectbox(
+                '月ごとのパーティション分割に使う日時列 (任意):',
+                ['（分割しない）'] + datetime_columns
+            )
+            if st.button('保存'):
+                if not store_name:
+                    st.warning('データセット名を入力してください。')
+                else:
+                    try:
+                        save_dataset(df, store_name,
+                                     time_col=None if partition_col == '（分割しない）' else partition_col,
+                                     source=', '.join(file.name for file in uploaded_files))
+                        st.success(f"データセット '{store_name}' を保存しました。次回からは保存済みデータセットとして選択できます。")
+                    except Exception as e:
+                        st.error(f"データセットの保存中にエラーが発生しました: {e}")
+
+    # サイドバーで選んだ条件の問い合わせ（ここでは行を取り出さない）。グラフと分析はそれぞれ必要な列だけを
+    # 問い合わせから取り出すため、絞り込み後の全ての列を持つ DataFrame は作らない
+    query = Query(dataset).filter_bitmap(select_filter_bitmap(df, dataset.key))
+    with profile_span('query.count', 'query', rows_in=len(dataset)) as span:
+        n_filtered_rows = span.rows_out = query.count()
+    if n_filtered_rows != len(dataset):
+        st.info(f'フィルタリング後の {n_filtered_rows:,} 行 / {len(dataset):,} 行をグラフと分析に使用します。')
+
+    def collect_columns(columns):
+        """問い合わせから指定した列だけを取り出し、(DataFrame, 集計や図のキャッシュに使うキー) を返します。"""
+        view = query.select([col for col in columns if col])
+        with profile_span('query.collect', 'query', rows_in=len(dataset)) as span:
+            result = view.collect()
+            span.rows_out = len(result)
+        return result, view.key
+
     # --- グラフ描画セクション ---
     st.subheader('グラフ描画セクション')
     st.write('---')
@@ -124,16 +279,59 @@ if df is not None and not df.empty: # データフレームが正常に読み込
             PLOTLY_TEMPLATES,
             index=PLOTLY_TEMPLATES.index("plotly") # デフォルトは'plotly'
         )
+
+        # 大量データ向け: 描画前にデータ点を間引き、ブラウザへ送るデータ量を抑える
+        st.sidebar.subheader('描画の最適化')
+        downsample_enabled = st.sidebar.checkbox('データ点が多い場合に間引いて描画する', value=True)
+        chart_width_px = st.sidebar.number_input(
+            'グラフの横幅 (px, 表示点数の上限の基準):',
+            min_value=200, max_value=8000, value=DEFAULT_CHART_WIDTH_PX, step=100
+        )
+        downsample_method_label = st.sidebar.selectbox(
+            '折れ線グラフの間引き方法:',
+            (METHOD_LABELS[METHOD_LTTB], METHOD_LABELS[METHOD_MINMAX])
+        )
+        downsample_method = METHOD_LTTB if downsample_method_label == METHOD_LABELS[METHOD_LTTB] else METHOD_MINMAX
+        rasterize_enabled = st.sidebar.checkbox(
+            f'散布図の点数が {RASTER_POINT_THRESHOLD:,} を超える場合はラスタ（集計画像）で描画する',
+            value=True
+        )
         # --- グラフカスタマイズオプションの追加ここまで ---
 
         if graph_type in ['折れ線グラフ', '棒グラフ', '積み立てグラフ']:
             x_axis_col = st.selectbox('X軸に使う列を選択してください:', columns, index=0)
             y_axis_cols = st.multiselect('Y軸に使う列を1つ以上選択してください:', columns)
 
+            series_layout = SERIES_LAYOUT_SEPARATE
+            if graph_type != '積み立てグラフ' and len(y_axis_cols) > 1:
+                # 複数系列は1つの図にまとめると、共有するX軸の値を系列ごとに送らずに済む
+                layout_options = list(SERIES_LAYOUT_LABELS.keys())
+                series_layout = st.radio(
+                    '複数系列の表示方法:',
+                    layout_options,
+                    format_func=lambda key: SERIES_LAYOUT_LABELS[key],
+                    horizontal=True
+                )
+
             if x_axis_col and y_axis_cols:
-                plot_line_chart(df, x_axis_col, y_axis_cols,
-                                title=custom_title, x_label=custom_x_label,
-                                y_label=custom_y_label, color_theme=selected_color_theme)
+                chart_df, chart_key = collect_columns([x_axis_col] + y_axis_cols)
+                if graph_type == '折れ線グラフ':
+                    plot_line_chart(chart_df, x_axis_col, y_axis_cols,
+                                    title=custom_title, x_label=custom_x_label,
+                                    y_label=custom_y_label, color_theme=selected_color_theme,
+                                    downsample=downsample_enabled, downsample_method=downsample_method,
+                                    chart_width_px=chart_width_px, series_layout=series_layout,
+                                    dataset_key=chart_key)
+                elif graph_type == '棒グラフ':
+                    plot_bar_chart(chart_df, x_axis_col, y_axis_cols,
+                                   title=custom_title, x_label=custom_x_label,
+                                   y_label=custom_y_label, color_theme=selected_color_theme,
+                                   series_layout=series_layout, dataset_key=chart_key)
+                else:
+                    plot_stacked_bar_chart(chart_df, x_axis_col, y_axis_cols,
+                                           title=custom_title, x_label=custom_x_label,
+                                           y_label=custom_y_label, color_theme=selected_color_theme,
+                                           dataset_key=chart_key)
             else:
                 st.warning("X軸とY軸の列を選択してください。")
 
@@ -143,9 +341,12 @@ if df is not None and not df.empty: # データフレームが正常に読み込
             color_col = st.selectbox('色分けに使う列を選択してください (任意):', [''] + columns)
 
             if x_axis_col and y_axis_col:
-                plot_scatter_plot(df, x_axis_col, y_axis_col, color_col if color_col else None,
+                chart_df, chart_key = collect_columns([x_axis_col, y_axis_col, color_col])
+                plot_scatter_plot(chart_df, x_axis_col, y_axis_col, color_col if color_col else None,
                                   title=custom_title, x_label=custom_x_label,
-                                  y_label=custom_y_label, color_theme=selected_color_theme)
+                                  y_label=custom_y_label, color_theme=selected_color_theme,
+                                  downsample=downsample_enabled, chart_width_px=chart_width_px,
+                                  rasterize=rasterize_enabled, dataset_key=chart_key)
             else:
                 st.warning("X軸とY軸の列を選択してください。")
 
@@ -153,11 +354,30 @@ if df is not None and not df.empty: # データフレームが正常に読み込
             x_axis_col = st.selectbox('X軸に使う列を選択してください:', columns, index=0)
             y_axis_col = st.selectbox('Y軸に使う列を選択してください:', columns)
             z_axis_col = st.selectbox('値を表すZ軸に使う列を選択してください (任意):', [''] + columns)
+            heatmap_agg = AGG_SUM
+            heatmap_x_bins = heatmap_y_bins = DEFAULT_HEATMAP_BINS
+            if z_axis_col:
+                heatmap_agg = st.selectbox(
+                    '各セルの集計方法:',
+                    list(AGGREGATION_LABELS),
+                    index=list(AGGREGATION_LABELS).index(AGG_SUM),
+                    format_func=lambda agg: AGGREGATION_LABELS[agg]
+                )
+                bins_x_col, bins_y_col = st.columns(2)
+                heatmap_x_bins = int(bins_x_col.number_input(
+                    'X軸のビン数（数値・日時の列）:', min_value=1, max_value=MAX_HEATMAP_BINS, value=DEFAULT_HEATMAP_BINS
+                ))
+                heatmap_y_bins = int(bins_y_col.number_input(
+                    'Y軸のビン数（数値・日時の列）:', min_value=1, max_value=MAX_HEATMAP_BINS, value=DEFAULT_HEATMAP_BINS
+                ))
 
             if x_axis_col and y_axis_col:
-                plot_heatmap(df, x_axis_col, y_axis_col, z_axis_col if z_axis_col else None,
+                # セルごとの集計結果（相関ヒートマップは数値列）だけを問い合わせから受け取る
+                plot_heatmap(query, x_axis_col, y_axis_col, z_axis_col if z_axis_col else None,
                              title=custom_title, x_label=custom_x_label,
-                             y_label=custom_y_label, color_theme=selected_color_theme)
+                             y_label=custom_y_label, color_theme=selected_color_theme,
+                             agg=heatmap_agg,
+                             x_bins=heatmap_x_bins, y_bins=heatmap_y_bins)
             else:
                 st.warning("X軸とY軸の列を選択してください。")
 
@@ -174,13 +394,39 @@ if df is not None and not df.empty: # データフレームが正常に読み込
     )
 
     if analysis_type == '選択した列の平均値':
-        calculate_and_plot_average(df)
+        calculate_and_plot_average(query)
     elif analysis_type == '時系列データ集計と可視化':
-        aggregate_and_plot_time_series(df)
+        aggregate_and_plot_time_series(query, max_workers=max_workers)
     elif analysis_type == '高度な統計分析':
-        perform_advanced_statistics(df)
+        perform_advanced_statistics(query)
     else:
         st.info('分析の種類を選択すると、オプションが表示されます。')
 
 else: # データフレームがNoneまたは空の場合
-    pass # 上の st.info() でメッセージは表示済み
\ No newline at end of file
+    pass # 上の st.info() でメッセージは表示済み
+
+# --- メモリ使用量（このセッションで観測したピーク RSS と、データセットが保持している配列） ---
+session_peak_rss = record_session_rss(st.session_state)
+with st.sidebar.expander('メモリ使用量'):
+    process_peak_rss = process_peak_rss_bytes()
+    if session_peak_rss is not None:
+        st.write(f'このセッションで観測したピーク RSS: {session_peak_rss / 1024 ** 2:,.1f} MB')
+    if process_peak_rss is not None:
+        st.write(f'プロセス全体のピーク RSS: {process_peak_rss / 1024 ** 2:,.1f} MB')
+    shared = registry_stats()
+    st.write(f"共有データセット: {shared['datasets']} 件（参照中のセッション {shared['references']}、"
+             f"ヒット率 {shared['hit_rate']:.0%}）、保持する配列 {shared['resident_bytes'] / 1024 ** 2:,.1f} MB")
+    if dataset is not None:
+        usage = dataset.memory_usage()
+        st.write(f"データセットが保持する配列: {usage['resident'] / 1024 ** 2:,.1f} MB "
+                 f"(型変換済み {usage['typed'] / 1024 ** 2:,.1f} MB, 絞り込み結果 {usage['filtered'] / 1024 ** 2:,.1f} MB)")
+        st.write(f'このデータセットから作成した派生データ: {len(dependency_frame(dataset.key)):,} 件（依存する列を記録）')
+    query_cache_stats = get_query_cache().stats()
+    st.write(f"問い合わせ結果のキャッシュ: {query_cache_stats['entries']} 件、"
+             f"{query_cache_stats['resident_bytes'] / 1024 ** 2:,.1f} MB（ヒット率 {query_cache_stats['hit_rate']:.0%}）")
+
+# --- プロファイリングの結果（この再実行の記録を閉じてから表示する） ---
+end_rerun(profile_recorder)
+if profiling_enabled:
+    with st.sidebar.expander('プロファイリング', expanded=True):
+        render_profile_panel(st.session_state)
@@ -0,0 +1,347 @@
+# benchmarks/run_benchmarks.py
+"""
+合成データで読み込み・型変換・絞り込み・集計・統計・グラフ描画の各段階を計測し、基準値と比較します。
+ブラウザは使わず、Streamlit の呼び出しは実行環境なし（bare モード）で行います。
+
+    python -m benchmarks.run_benchmarks --sizes 1e4,1e5,1e6
+    python -m benchmarks.run_benchmarks --sizes 1e4,1e5 --save-baseline  # 基準値を保存
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.io as pio
+import streamlit
+import streamlit.logger
+from streamlit import config as streamlit_config
+
+from benchmarks.synthetic import (
+    DATASETS, POWER_TIME_COL, POWER_VALUE_COL, SALES_DATE_COL, SALES_REGION_COL, SALES_REGIONS, SALES_VALUE_COLS,
+    UploadedCSV, csv_bytes
+)
+from components.data_processor import get_csv_cache, load_and_combine_csv
+from components.dataset import Dataset, process_peak_rss_bytes, process_rss_bytes
+from components.figure_cache import get_figure_cache
+from components.graph_plotter import (
+    SERIES_LAYOUT_OVERLAY, plot_bar_chart, plot_heatmap, plot_line_chart, plot_scatter_plot, plot_stacked_bar_chart
+)
+from components.heatmap import heatmap_figure
+from components.online_stats import describe_from_statistics, get_pairwise_moments, get_quantile_sketches
+from components.query import Query
+from components.time_cube import (
+    GRANULARITY_DAY, GRANULARITY_HOUR_OF_DAY, GRANULARITY_MONTH, GRANULARITY_WEEKDAY, GRANULARITY_YEAR,
+    get_time_cube, rollup_date_hour, rollup_time_cube
+)
+from components.type_inference import convert_column_types
+
+DEFAULT_SIZES = '1e4,1e5,1e6'
+MAX_BENCHMARK_ROWS = 10 ** 8
+DEFAULT_CSV_MAX_ROWS = 10 ** 7 # これより大きいデータは CSV を経由せず、生成した DataFrame から始める
+DEFAULT_PLOT_MAX_ROWS = 10 ** 6 # グラフ描画の計測を行う最大の行数
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_TOLERANCE = 1.25 # 基準値に対してこの倍率を超えたら劣化とみなす
+NOISE_FLOOR_SECONDS = 0.05 # 基準値との差がこれ未満の段階は、倍率によらず劣化とみなさない
+MEMORY_SAMPLE_INTERVAL_SECONDS = 0.005
+
+ROLLUP_GRANULARITIES = [
+    GRANULARITY_HOUR_OF_DAY, GRANULARITY_DAY, GRANULARITY_WEEKDAY, GRANULARITY_MONTH, GRANULARITY_YEAR
+]
+
+
+class _PeakMemorySampler:
+    """計測中のプロセスの RSS を一定間隔で読み、開始時点からの増加分の最大値を記録します。"""
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start = process_rss_bytes()
+        self.peak = self.start
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        rss = process_rss_bytes()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    @property
+    def peak_delta(self):
+        if self.start is None:
+            return None
+        return self.peak - self.start
+
+
+def _figure_payload_bytes():
+    """図のキャッシュに保存された図（Plotly の JSON）の合計バイト数。"""
+    cache = get_figure_cache()
+    return sum(len(cache.get(key, '').encode('utf-8')) for key in cache.keys())
+
+
+def _measure(func):
+    """func() の実行時間とメモリの増加分を計測し、func() が返す辞書（rows_out など）に加えて返します。"""
+    with _PeakMemorySampler() as sampler:
+        start = time.perf_counter()
+        extra = func() or {}
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'peak_memory_bytes': sampler.peak_delta, **extra}
+
+
+def _stages(name, source_df, source_csv, n_rows, rep, args):
+    """
+    データセット1つ分の各段階を、実行順に (段階名, 関数) で返します。
+    キャッシュを使わない初回の処理を計測するため、データセットのキーは繰り返しごとに変えます。
+    source_csv（CSV のバイト列）が None の場合は、読み込みの段階を省いて source_df から始めます。
+    """
+    key = ('benchmark', name, n_rows, rep)
+    state = {}
+    if name == 'power_consumption':
+        time_col, value_cols, category_col = POWER_TIME_COL, [POWER_VALUE_COL], None
+    else:
+        time_col, value_cols, category_col = SALES_DATE_COL, SALES_VALUE_COLS, SALES_REGION_COL
+
+    def csv_parse():
+        files = [UploadedCSV(source_csv, f'{name}.csv')]
+        get_csv_cache().clear()
+        state['raw'] = load_and_combine_csv(files, max_workers=args.max_workers)
+        return {'rows_out': len(state['raw'])}
+
+    def type_inference():
+        raw = state.pop('raw', source_df)
+        state['typed'] = convert_column_types(raw, key)
+        state['dataset'] = Dataset(state['typed'], key, typed=True)
+        return {'rows_out': len(state['typed'])}
+
+    def filter_query():
+        typed = state['typed']
+        times = typed[time_col].to_numpy()
+        lo, hi = times[len(times) // 4], times[len(times) * 3 // 4]
+        query = Query(state['dataset']).filter_range(time_col, lo, hi)
+        if category_col is not None:
+            query = query.filter_isin(category_col, SALES_REGIONS[:2])
+        state['query'] = query
+        return {'rows_out': len(query.collect())}
+
+    def filter_query_warm():
+        return {'rows_out': len(state['query'].collect())}
+
+    def time_cube():
+        state['cube'] = get_time_cube(state['typed'], time_col, key, max_workers=args.max_workers)
+        return {'rows_out': len(state['cube'])}
+
+    def rollups():
+        rows_out = 0
+        payload = 0
+        for value_col in value_cols:
+            for granularity in ROLLUP_GRANULARITIES:
+                rows_out += len(rollup_time_cube(state['cube'], value_col, granularity))
+            grid = rollup_date_hour(state['cube'], value_col)
+            fig = heatmap_figure(grid.to_numpy(), grid.columns, grid.index, x_label='date', y_label='hour',
+                                 z_label=value_col)
+            payload += len(pio.to_json(fig, validate=False).encode('utf-8'))
+        return {'rows_out': rows_out, 'payload_bytes': payload}
+
+    def statistics():
+        typed = state['typed']
+        numeric_columns = typed.select_dtypes(include=['number']).columns.tolist()
+        moments = get_pairwise_moments(typed, key)
+        sketches = get_quantile_sketches(typed, key, numeric_columns)
+        return {'rows_out': len(describe_from_statistics(moments, sketches, numeric_columns))}
+
+    def plot(func, *plot_args, **plot_kwargs):
+        def run():
+            get_figure_cache().clear()
+            func(state['typed'], *plot_args, dataset_key=key, **plot_kwargs)
+            return {'payload_bytes': _figure_payload_bytes()}
+        return run
+
+    def plot_query(func, *plot_args, **plot_kwargs):
+        # 問い合わせを受け取るグラフ（ヒートマップ）は、絞り込みのない問い合わせで計測する
+        def run():
+            get_figure_cache().clear()
+            func(Query(state['dataset']), *plot_args, **plot_kwargs)
+            return {'payload_bytes': _figure_payload_bytes()}
+        return run
+
+    stages = []
+    if source_csv is not None:
+        stages.append(('csv_parse', csv_parse))
+    stages += [
+        ('type_inference', type_inference),
+        ('filter', filter_query),
+        ('filter_warm', filter_query_warm),
+        ('time_cube', time_cube),
+        ('rollups', rollups),
+        ('statistics', statistics),
+    ]
+    if n_rows <= args.plot_max_rows:
+        stages += [
+            ('plot_line', plot(plot_line_chart, time_col, value_cols, series_layout=SERIES_LAYOUT_OVERLAY)),
+            ('plot_scatter', plot(plot_scatter_plot, time_col, value_cols[0], color_col=category_col)),
+            ('plot_heatmap', plot_query(plot_heatmap, time_col, value_cols[0], value_cols[-1])),
+        ]
+        if category_col is not None:
+            stages += [
+                ('plot_bar', plot(plot_bar_chart, category_col, value_cols, series_layout=SERIES_LAYOUT_OVERLAY)),
+                ('plot_stacked_bar', plot(plot_stacked_bar_chart, category_col, value_cols)),
+            ]
+    return stages
+
+
+def run_benchmarks(args):
+    """全てのデータセットと行数について各段階を計測し、結果のリストを返します（繰り返しのうち最短の時間を採用）。"""
+    results = []
+    for n_rows in args.sizes:
+        for name in args.datasets:
+            source_df = DATASETS[name](n_rows)
+            # CSV への書き出しは計測に含めない
+            source_csv = csv_bytes(source_df) if n_rows <= args.csv_max_rows else None
+            best = {}
+            for rep in range(args.repeat):
+                for stage, func in _stages(name, source_df, source_csv, n_rows, rep, args):
+                    measured = _measure(func)
+                    if stage not in best or measured['seconds'] < best[stage]['seconds']:
+                        best[stage] = measured
+            for stage, measured in best.items():
+                result = {'dataset': name, 'rows': n_rows, 'stage': stage, **measured}
+                results.append(result)
+                print(_format_result(result), flush=True)
+            del source_df, source_csv
+    return results
+
+
+def _result_key(result):
+    return f"{result['dataset']}/{result['rows']}/{result['stage']}"
+
+
+def _format_bytes(nbytes):
+    if nbytes is None:
+        return '-'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024 or unit == 'GB':
+            return f'{nbytes:.0f}{unit}' if unit == 'B' else f'{nbytes:.1f}{unit}'
+        nbytes /= 1024
+
+
+def _format_result(result):
+    return (f"{result['dataset']:<18} {result['rows']:>11,} {result['stage']:<16} "
+            f"{result['seconds']:>9.4f}s  mem {_format_bytes(result['peak_memory_bytes']):>9}  "
+            f"payload {_format_bytes(result.get('payload_bytes')):>9}")
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    基準値と比較し、劣化した段階を (キー, 指標, 基準値, 今回の値) のリストで返します。
+    時間は倍率が tolerance を超え、かつ差が NOISE_FLOOR_SECONDS 以上の場合に、
+    図の大きさ（payload_bytes）は倍率が tolerance を超えた場合に劣化とみなします。
+    """
+    baseline_results = {_result_key(result): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        base = baseline_results.get(_result_key(result))
+        if base is None:
+            continue
+        seconds, base_seconds = result['seconds'], base['seconds']
+        if seconds > base_seconds * tolerance and seconds - base_seconds >= NOISE_FLOOR_SECONDS:
+            regressions.append((_result_key(result), 'seconds', base_seconds, seconds))
+        payload, base_payload = result.get('payload_bytes'), base.get('payload_bytes')
+        if payload is not None and base_payload and payload > base_payload * tolerance:
+            regressions.append((_result_key(result), 'payload_bytes', base_payload, payload))
+    return regressions
+
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'streamlit': streamlit.__version__,
+    }
+
+
+def _parse_sizes(text):
+    sizes = []
+    for item in text.split(','):
+        n_rows = int(float(item))
+        if not 1 <= n_rows <= MAX_BENCHMARK_ROWS:
+            raise argparse.ArgumentTypeError(f'行数は 1 から {MAX_BENCHMARK_ROWS:.0e} の範囲で指定してください: {item}')
+        sizes.append(n_rows)
+    return sizes
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='合成データで各処理段階の時間・メモリ・図の大きさを計測します。')
+    parser.add_argument('--sizes', type=_parse_sizes, default=_parse_sizes(DEFAULT_SIZES),
+                        help=f'計測する行数（カンマ区切り、1e4 の形式も可。既定: {DEFAULT_SIZES}）')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返しの回数（最短の時間を採用）')
+    parser.add_argument('--csv-max-rows', type=lambda s: int(float(s)), default=DEFAULT_CSV_MAX_ROWS)
+    parser.add_argument('--plot-max-rows', type=lambda s: int(float(s)), default=DEFAULT_PLOT_MAX_ROWS)
+    parser.add_argument('--max-workers', type=int, default=None, help='並列処理のワーカー数（既定はCPU数）')
+    parser.add_argument('--output', help='結果を書き出す JSON ファイル')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='比較する基準値の JSON ファイル')
+    parser.add_argument('--save-baseline', action='store_true', help='今回の結果を基準値として保存する')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    # 実行環境なしで Streamlit を呼び出したときの警告を表示しない。
+    # 設定ファイルの読み込み時にログレベルが設定し直されるため、先に設定を読み込んでおく
+    streamlit_config.get_option('logger.level')
+    streamlit.logger.set_log_level('error')
+    results = run_benchmarks(args)
+    report = {'environment': _environment(), 'peak_rss_bytes': process_peak_rss_bytes(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'基準値を保存しました: {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'基準値のファイルがないため比較しません: {args.baseline}')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for key, metric, base_value, value in regressions:
+        print(f'劣化: {key} {metric} {base_value:.4g} -> {value:.4g} ({value / base_value:.2f}倍)')
+    if regressions:
+        return 1
+    print(f'基準値からの劣化はありません（許容倍率 {args.tolerance}）。')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# benchmarks/synthetic.py
+
+import io
+
+import numpy as np
+import pandas as pd
+
+# data/ のサンプルと同じ列構成の合成データ
+POWER_TIME_COL = 'Timestamp'
+POWER_VALUE_COL = 'Power_Consumption_kW'
+SALES_DATE_COL = '日付'
+SALES_VALUE_COLS = ['製品A売上', '製品B売上', '製品C売上']
+SALES_REGION_COL = '地域'
+SALES_REGIONS = ['東', '西', '南', '北', '中央']
+SALES_DAYS = 3 * 365 # 売上データの日付の範囲（行数が多い場合は1日に複数行）
+
+
+def power_consumption_frame(n_rows, seed=0):
+    """power_consumption.csv と同じ形（1分ごとのタイムスタンプと消費電力）の DataFrame を作成します。"""
+    rng = np.random.default_rng(seed)
+    minutes = np.arange(n_rows, dtype=np.int64)
+    hour_of_day = (minutes // 60) % 24
+    # 日中に高くなる周期と雑音
+    values = 10.0 + 3.0 * np.sin((hour_of_day - 6) / 24 * 2 * np.pi) + rng.normal(0.0, 0.8, n_rows)
+    return pd.DataFrame({
+        POWER_TIME_COL: pd.Timestamp('2024-01-01') + pd.to_timedelta(minutes, unit='min'),
+        POWER_VALUE_COL: np.round(values, 1),
+    })
+
+
+def sales_frame(n_rows, seed=0):
+    """sales_data.csv と同じ形（日付・製品ごとの売上・広告費・顧客満足度・地域）の DataFrame を作成します。"""
+    rng = np.random.default_rng(seed)
+    days = np.arange(n_rows, dtype=np.int64) * SALES_DAYS // max(n_rows, 1)
+    base = rng.integers(80, 150, n_rows)
+    return pd.DataFrame({
+        SALES_DATE_COL: pd.Timestamp('2024-01-01') + pd.to_timedelta(days, unit='D'),
+        SALES_VALUE_COLS[0]: base,
+        SALES_VALUE_COLS[1]: base // 2 + rng.integers(0, 10, n_rows),
+        SALES_VALUE_COLS[2]: base // 5 + rng.integers(0, 5, n_rows),
+        '広告費': rng.integers(5, 20, n_rows),
+        '顧客満足度': np.round(rng.uniform(3.5, 5.0, n_rows), 1),
+        SALES_REGION_COL: np.asarray(SALES_REGIONS, dtype=object)[rng.integers(0, len(SALES_REGIONS), n_rows)],
+    })
+
+
+DATASETS = {
+    'power_consumption': power_consumption_frame,
+    'sales_data': sales_frame,
+}
+
+
+class UploadedCSV(io.BytesIO):
+    """st.file_uploader の UploadedFile と同じ属性（name, size）を持つ、メモリ上の CSV ファイル。"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def csv_bytes(df):
+    """DataFrame を UTF-8 の CSV のバイト列に書き出します。"""
+    return df.to_csv(index=False).encode('utf-8')
@@ -0,0 +1,158 @@
+# components/background_jobs.py
+
+import threading
+import time
+from collections import OrderedDict
+
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+# この行数以上のデータに対する重い集計は、スクリプトの実行をブロックしないようバックグラウンドで行う
+BACKGROUND_MIN_ROWS = 1_000_000
+JOB_POLL_INTERVAL_SECONDS = 1.0 # 実行中のジョブの進捗を画面に反映する間隔
+MAX_FINISHED_JOBS = 32 # 終了したジョブを結果の参照用に保持しておく数
+
+_jobs = OrderedDict() # ジョブのキー -> BackgroundJob
+_slots = {} # スロット（セッションと処理の種類の組など） -> そのスロットで最後に要求されたジョブのキー
+_jobs_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """ジョブが取り消されたことを、ジョブの関数の中から呼び出し元へ伝えるための例外。"""
+
+
+class BackgroundJob:
+    """
+    別スレッドで実行する1つの計算。キーは (処理の種類, データセットのキー, パラメータ...) のタプルです。
+
+    ジョブの関数は func(job, *args) の形で呼び出され、処理の区切りごとに job.report(進捗, 途中結果) を呼びます。
+    取り消されたジョブでは report が JobCancelled を送出するため、関数はその時点で終了します。
+    """
+
+    def __init__(self, key, func, args):
+        self.key = key
+        self._func = func
+        self._args = args
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self.status = JOB_RUNNING
+        self.progress = 0.0
+        self.message = ''
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._thread = threading.Thread(target=self._run, name=f'job-{key[0]}', daemon=True)
+
+    @property
+    def done(self):
+        return self.status != JOB_RUNNING
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """ジョブに取り消しを要求します（次に report を呼んだ時点で停止します）。"""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, progress, partial=None, message=None):
+        """進捗（0〜1）と途中結果を記録します。取り消されていれば JobCancelled を送出します。"""
+        self.check_cancelled()
+        with self._lock:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+            if partial is not None:
+                self.partial = partial
+            if message is not None:
+                self.message = message
+
+    def snapshot(self):
+        """(状態, 進捗, メッセージ, 途中結果, 結果, エラー) を一貫した組で返します。"""
+        with self._lock:
+            return self.status, self.progress, self.message, self.partial, self.result, self.error
+
+    def _start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            result = self._func(self, *self._args)
+        except JobCancelled:
+            status, result, error = JOB_CANCELLED, None, None
+        except Exception as e:
+            status, result, error = JOB_FAILED, None, e
+        else:
+            status, error = JOB_DONE, None
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            if status == JOB_DONE:
+                self.progress = 1.0
+            self.finished_at = time.time()
+
+
+def submit_job(key, func, *args, slot=None):
+    """
+    キーに対応するジョブを返します。実行中または完了済みのジョブがあればそれを使い回し、なければ新しく開始します。
+    slot を指定すると、同じスロットで以前に要求された別のキーのジョブ（入力が変わって不要になったもの）を取り消します。
+    """
+    with _jobs_lock:
+        if slot is not None:
+            previous_key = _slots.get(slot)
+            _slots[slot] = key
+            if previous_key is not None and previous_key != key:
+                _cancel_unreferenced_locked(previous_key)
+
+        job = _jobs.get(key)
+        if job is not None and job.status in (JOB_RUNNING, JOB_DONE) and not job.cancelled:
+            _jobs.move_to_end(key)
+            return job
+
+        job = BackgroundJob(key, func, args)
+        _jobs[key] = job
+        _prune_locked()
+    job._start()
+    return job
+
+
+def _cancel_unreferenced_locked(key):
+    """どのスロットからも参照されなくなったジョブを取り消します（他のセッションが同じ結果を待っていれば続行）。"""
+    if key in _slots.values():
+        return
+    job = _jobs.get(key)
+    if job is not None and not job.done:
+        job.cancel()
+
+
+def _prune_locked():
+    finished = [key for key, job in _jobs.items() if job.done]
+    for key in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+        del _jobs[key]
+
+
+def get_job(key):
+    """キーに対応するジョブを返します（なければ None）。"""
+    with _jobs_lock:
+        return _jobs.get(key)
+
+
+def cancel_slot(slot):
+    """スロットで要求されていたジョブを取り消し、スロットを解放します。"""
+    with _jobs_lock:
+        key = _slots.pop(slot, None)
+        if key is not None:
+            _cancel_unreferenced_locked(key)
+
+
+def list_jobs():
+    """登録されているジョブの (キー, 状態, 進捗) のリストを返します。"""
+    with _jobs_lock:
+        return [(key, job.status, job.progress) for key, job in _jobs.items()]
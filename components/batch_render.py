@@ -0,0 +1,307 @@
+# components/batch_render.py
+"""
+ジョブの定義（JSON）に従って、グラフを Streamlit なしでまとめて HTML や静的画像に書き出します。
+
+    python -m components.batch_render data/batch_jobs_example.json --output-dir reports
+
+ジョブの定義の形式:
+
+    {
+      "output_dir": "reports",
+      "defaults": {"template": "plotly_white", "format": "html", "width": 1200, "height": 600},
+      "datasets": {
+        "power": {"paths": ["power_consumption.csv"]},
+        "saved": {"store": "保存済みデータセット名", "columns": ["Timestamp", "Power_Consumption_kW"]}
+      },
+      "jobs": [
+        {"name": "power_daily", "dataset": "power", "chart": "time_series",
+         "time": "Timestamp", "value": "Power_Consumption_kW", "granularity": "day"},
+        {"name": "sales_corr", "dataset": "sales", "chart": "correlation"}
+      ]
+    }
+
+データセットのファイルのパスは、ジョブの定義のファイルがあるディレクトリからの相対パスです。
+各データセットは、使うジョブがいくつあっても1回だけ読み込みます（時間キューブや積和の集計も共有します）。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from components.compute import ComputeCall, ComputeResult, run_computations
+from components.data_processor import TIME_SERIES_GRANULARITIES, correlation_analysis, time_series_aggregation
+from components.dataset_registry import acquire_dataset
+from components.dataset_store import open_dataset
+from components.graph_plotter import (
+    SERIES_LAYOUT_SEPARATE,
+    bar_chart_figures,
+    heatmap_chart_figure,
+    line_chart_figures,
+    scatter_plot_figure,
+    stacked_bar_chart_figure
+)
+from components.heatmap import AGG_MEAN, AGG_SUM, DEFAULT_HEATMAP_BINS
+from components.parallel import parse_csv_files
+
+CHART_TYPES = ['line', 'bar', 'stacked_bar', 'scatter', 'heatmap', 'time_series', 'correlation']
+HTML_FORMAT = 'html'
+IMAGE_FORMATS = ['png', 'jpeg', 'webp', 'svg', 'pdf'] # 書き出しには kaleido が必要
+DEFAULT_OUTPUT_DIR = 'reports'
+DEFAULT_IMAGE_WIDTH = 1200
+DEFAULT_IMAGE_HEIGHT = 600
+# 時系列の集計粒度（ジョブの定義では英語の名前で指定する）
+GRANULARITIES = sorted(set(TIME_SERIES_GRANULARITIES.values()))
+
+
+class JobSpecError(ValueError):
+    """ジョブの定義に誤りがある場合の例外。"""
+
+
+def load_job_spec(path):
+    """ジョブの定義の JSON を読み込み、検証して返します（データセットのパスは絶対パスにします）。"""
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    datasets = spec.get('datasets') or {}
+    for name, source in datasets.items():
+        if 'paths' in source:
+            source['paths'] = [os.path.join(base_dir, p) for p in source['paths']]
+        elif 'store' not in source:
+            raise JobSpecError(f"データセット '{name}' には paths（CSV ファイル）か store（保存済みデータセット名）が必要です。")
+
+    names = set()
+    for i, job in enumerate(spec.get('jobs') or []):
+        job.setdefault('name', f'job_{i + 1}')
+        if job['name'] in names:
+            raise JobSpecError(f"ジョブ名 '{job['name']}' が重複しています。")
+        names.add(job['name'])
+        if job.get('dataset') not in datasets:
+            raise JobSpecError(f"ジョブ '{job['name']}' のデータセット '{job.get('dataset')}' が定義されていません。")
+        if job.get('chart') not in CHART_TYPES:
+            raise JobSpecError(f"ジョブ '{job['name']}' のグラフの種類 '{job.get('chart')}' は未対応です（{', '.join(CHART_TYPES)}）。")
+        if job['chart'] == 'time_series' and job.get('granularity') not in GRANULARITIES:
+            raise JobSpecError(f"ジョブ '{job['name']}' の集計粒度 '{job.get('granularity')}' は未対応です（{', '.join(GRANULARITIES)}）。")
+        output_format = job.get('format', (spec.get('defaults') or {}).get('format', HTML_FORMAT))
+        if output_format != HTML_FORMAT and output_format not in IMAGE_FORMATS:
+            raise JobSpecError(f"ジョブ '{job['name']}' の出力形式 '{output_format}' は未対応です。")
+    spec['datasets'] = datasets
+    return spec
+
+
+def _source_key(name, source):
+    """データセットを識別するキー（ファイルのパス・更新時刻・サイズ、または保存済みデータセットの指定）。"""
+    if 'paths' in source:
+        stats = tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in source['paths'])
+        return ('batch', stats, json.dumps(source.get('read_csv') or {}, sort_keys=True))
+    columns = source.get('columns')
+    return ('batch_store', source['store'], tuple(columns) if columns else None, source.get('start'), source.get('end'))
+
+
+def _load_source(source, max_workers=None):
+    """データセットの定義に従って DataFrame を読み込みます。"""
+    if 'store' in source:
+        return open_dataset(source['store'], columns=source.get('columns'),
+                            start=source.get('start'), end=source.get('end'))
+    files = [open(p, 'rb') for p in source['paths']]
+    try:
+        parsed = parse_csv_files(files, max_workers=max_workers, **(source.get('read_csv') or {}))
+    finally:
+        for file in files:
+            file.close()
+    for path, df in zip(source['paths'], parsed):
+        if isinstance(df, Exception):
+            raise ValueError(f"ファイル '{path}' の読み込み中にエラーが発生しました: {df}") from df
+    return pd.concat(parsed, ignore_index=True)
+
+
+def _job_call(job, dataset, defaults, max_workers):
+    """ジョブの定義を、図を作成する計算の呼び出し（compute.ComputeCall）にします。"""
+    chart = job['chart']
+    option = lambda name, default=None: job.get(name, defaults.get(name, default))
+    texts = dict(title=job.get('title'), x_label=job.get('x_label'), y_label=job.get('y_label'),
+                 color_theme=option('template'))
+    y_cols = job.get('y')
+    if y_cols is not None and not isinstance(y_cols, list):
+        y_cols = [y_cols]
+
+    if chart == 'line':
+        return ComputeCall(line_chart_figures, dataset.project([job['x']] + y_cols), dataset.key, dict(
+            x_col=job['x'], y_cols=y_cols, **texts, downsample=option('downsample', True),
+            series_layout=option('series_layout', SERIES_LAYOUT_SEPARATE)))
+    if chart == 'bar':
+        return ComputeCall(bar_chart_figures, dataset.project([job['x']] + y_cols), dataset.key, dict(
+            x_col=job['x'], y_cols=y_cols, **texts, series_layout=option('series_layout', SERIES_LAYOUT_SEPARATE)))
+    if chart == 'stacked_bar':
+        return ComputeCall(stacked_bar_chart_figure, dataset.project([job['x']] + y_cols), dataset.key, dict(
+            x_col=job['x'], y_cols=y_cols, **texts))
+    if chart == 'scatter':
+        color_col = job.get('color')
+        columns = [job['x'], y_cols[0]] + ([color_col] if color_col else [])
+        return ComputeCall(scatter_plot_figure, dataset.project(columns), dataset.key, dict(
+            x_col=job['x'], y_col=y_cols[0], color_col=color_col, **texts,
+            downsample=option('downsample', True), rasterize=option('rasterize', True)))
+    if chart == 'heatmap':
+        z_col = job.get('z')
+        columns = list(dict.fromkeys([job['x'], y_cols[0], z_col] if z_col else dataset.typed.columns))
+        return ComputeCall(heatmap_chart_figure, dataset.project(columns), dataset.key, dict(
+            x_col=job['x'], y_col=y_cols[0], z_col=z_col, **texts, agg=job.get('agg', AGG_SUM),
+            x_bins=job.get('x_bins', DEFAULT_HEATMAP_BINS), y_bins=job.get('y_bins', DEFAULT_HEATMAP_BINS)))
+    if chart == 'time_series':
+        return ComputeCall(time_series_aggregation, dataset.typed, dataset.key, dict(
+            time_col=job['time'], value_col=job['value'], granularity=job['granularity'],
+            heatmap_agg=job.get('agg', AGG_MEAN), max_workers=max_workers))
+    # correlation
+    df = dataset.typed
+    columns = job.get('columns') or df.select_dtypes(include=['number']).columns.tolist()
+    return ComputeCall(correlation_analysis, df, dataset.key, dict(columns=columns))
+
+
+def _job_figures(job, value, defaults):
+    """計算の結果から図のリストを取り出します（集計結果と図のタプルの場合は、タイトルとテーマを適用する）。"""
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, tuple):
+        return [value]
+    fig = value[1]
+    if job.get('title'):
+        fig.update_layout(title_text=job['title'])
+    fig.update_layout(template=job.get('template', defaults.get('template')))
+    return [fig]
+
+
+def _write_figure(fig, path, output_format, width, height, include_plotlyjs):
+    if output_format == HTML_FORMAT:
+        fig.write_html(path, include_plotlyjs=include_plotlyjs)
+    else:
+        try:
+            fig.write_image(path, format=output_format, width=width, height=height)
+        except (ValueError, ImportError, RuntimeError) as e:
+            message = ' '.join(str(e).split())
+            raise RuntimeError(f'静的画像の書き出しに失敗しました（kaleido が必要です）: {message}') from e
+
+
+def write_job(job, computed, defaults, output_dir):
+    """
+    計算の結果（compute.ComputeResult）の図をジョブの定義に従って書き出し、
+    書き出したファイルと時間（図の作成・書き出し）を辞書で返します。
+    """
+    result = {'name': job['name'], 'chart': job['chart'], 'dataset': job['dataset'], 'outputs': [],
+              'error': None, 'compute_seconds': computed.seconds, 'cached': computed.cached}
+    start = time.perf_counter()
+    try:
+        if computed.error is not None:
+            raise computed.error
+        figures = _job_figures(job, computed.value, defaults)
+        output_format = job.get('format', defaults.get('format', HTML_FORMAT))
+        for i, fig in enumerate(figures):
+            suffix = f'_{i + 1}' if len(figures) > 1 else ''
+            path = os.path.join(output_dir, f"{job['name']}{suffix}.{output_format}")
+            _write_figure(fig, path, output_format,
+                          width=job.get('width', defaults.get('width', DEFAULT_IMAGE_WIDTH)),
+                          height=job.get('height', defaults.get('height', DEFAULT_IMAGE_HEIGHT)),
+                          include_plotlyjs=defaults.get('include_plotlyjs', 'cdn'))
+            result['outputs'].append(path)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['write_seconds'] = time.perf_counter() - start
+    result['seconds'] = computed.seconds + result['write_seconds']
+    return result
+
+
+def run_batch(spec, output_dir=None, workers=None, max_workers=None, only=None):
+    """
+    ジョブの定義の全てのジョブ（only を指定した場合はその名前のジョブだけ）を workers 個のスレッドで実行し
+    （図の作成は compute.run_computations、書き出しはスレッドプール）、
+    データセットの読み込みとジョブごとの結果を含むレポートを返します。
+    max_workers は CSV のパースと時間キューブの作成に使うワーカープロセス数です。
+    """
+    output_dir = output_dir or spec.get('output_dir') or DEFAULT_OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    defaults = spec.get('defaults') or {}
+    jobs = [job for job in spec.get('jobs') or [] if not only or job['name'] in only]
+
+    # ジョブが使うデータセットだけを、それぞれ1回だけ読み込んで型を変換しておく
+    handles, loads = {}, []
+    for name in dict.fromkeys(job['dataset'] for job in jobs):
+        source = spec['datasets'][name]
+        start = time.perf_counter()
+        load = {'dataset': name, 'error': None}
+        try:
+            handle = acquire_dataset(_source_key(name, source), lambda: _load_source(source, max_workers))
+            load['rows'] = len(handle.dataset.typed)
+            handles[name] = handle
+        except Exception as e:
+            load['error'] = f'{type(e).__name__}: {e}'
+        load['seconds'] = time.perf_counter() - start
+        loads.append(load)
+
+    # 図の作成は計算の一括実行で行う（同じ時間キューブや積和の集計を使うジョブが同時に実行されても、集計は1回だけ）
+    start = time.perf_counter()
+    runnable = [job for job in jobs if job['dataset'] in handles]
+    calls, computed = [], {}
+    for job in runnable:
+        try:
+            calls.append((job['name'], _job_call(job, handles[job['dataset']].dataset, defaults, max_workers)))
+        except Exception as e: # 存在しない列を指定した場合など
+            computed[job['name']] = ComputeResult(None, e, 0.0, False)
+    workers = workers or os.cpu_count() or 1
+    computed.update(zip([name for name, _ in calls],
+                        run_computations([call for _, call in calls], max_workers=workers)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_job, job, computed[job['name']], defaults, output_dir) for job in runnable]
+        results = [future.result() for future in futures]
+    failed_loads = {load['dataset']: load['error'] for load in loads if load['error']}
+    results += [
+        {'name': job['name'], 'chart': job['chart'], 'dataset': job['dataset'], 'outputs': [],
+         'error': f"データセットを読み込めませんでした: {failed_loads[job['dataset']]}", 'seconds': 0.0}
+        for job in jobs if job['dataset'] in failed_loads
+    ]
+    for handle in handles.values():
+        handle.release()
+    return {'output_dir': output_dir, 'datasets': loads, 'jobs': results,
+            'jobs_seconds': time.perf_counter() - start}
+
+
+def _print_report(report):
+    for load in report['datasets']:
+        status = load['error'] or f"{load['rows']:,} 行"
+        print(f"データセット {load['dataset']:<20} {load['seconds']:>8.3f}s  {status}")
+    for result in report['jobs']:
+        status = result['error'] or ', '.join(result['outputs'])
+        print(f"ジョブ {result['name']:<24} {result['chart']:<12} {result['seconds']:>8.3f}s  {status}")
+    n_failed = sum(1 for result in report['jobs'] if result['error'])
+    print(f"{len(report['jobs']) - n_failed} 件成功、{n_failed} 件失敗（ジョブの実行 {report['jobs_seconds']:.3f}s）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ジョブの定義に従って、グラフを HTML や画像にまとめて書き出します。')
+    parser.add_argument('spec', help='ジョブの定義の JSON ファイル')
+    parser.add_argument('--output-dir', help=f'出力先（既定はジョブの定義の output_dir、なければ {DEFAULT_OUTPUT_DIR}）')
+    parser.add_argument('--workers', type=int, default=None, help='同時に実行するジョブの数（既定はCPU数）')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='CSV のパースと時系列の集計に使うワーカープロセス数')
+    parser.add_argument('--only', nargs='+', help='実行するジョブの名前')
+    parser.add_argument('--report', help='ジョブごとの時間と出力を書き出す JSON ファイル')
+    args = parser.parse_args(argv)
+
+    try:
+        spec = load_job_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print(f'ジョブの定義を読み込めませんでした: {e}', file=sys.stderr)
+        return 2
+    report = run_batch(spec, output_dir=args.output_dir, workers=args.workers, max_workers=args.max_workers,
+                       only=args.only)
+    _print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if any(result['error'] for result in report['jobs']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
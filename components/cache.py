@@ -0,0 +1,205 @@
+# components/cache.py
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# UploadedFile.file_id ごとのハッシュ値のメモ（再実行のたびに同じファイルをハッシュし直さないため）
+_FILE_HASH_MEMO_SIZE = 256
+_file_hash_memo = OrderedDict()
+_file_hash_memo_lock = threading.Lock()
+# object 列のバイト数を見積もるときに大きさを調べる要素の数（frame_nbytes）
+OBJECT_SAMPLE_ROWS = 1000
+
+
+def content_hash(data):
+    """バイト列の内容ハッシュ (BLAKE2b, 16バイト) を16進文字列で返します。"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_content_hash(file):
+    """
+    アップロードファイル（またはファイルライクオブジェクト）の内容ハッシュを返します。
+    読み込み位置は先頭に戻します。
+    """
+    memo_key = None
+    file_id = getattr(file, 'file_id', None)
+    if file_id is not None:
+        memo_key = (file_id, getattr(file, 'size', None))
+        with _file_hash_memo_lock:
+            digest = _file_hash_memo.get(memo_key)
+        if digest is not None:
+            return digest
+
+    if hasattr(file, 'getvalue'):
+        # st.file_uploader の UploadedFile は BytesIO なので、コピーせずに全体を取得できる
+        data = file.getvalue()
+    else:
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+    digest = content_hash(data)
+
+    if memo_key is not None:
+        with _file_hash_memo_lock:
+            _file_hash_memo[memo_key] = digest
+            while len(_file_hash_memo) > _FILE_HASH_MEMO_SIZE:
+                _file_hash_memo.popitem(last=False)
+    return digest
+
+
+def frame_fingerprint(df):
+    """
+    DataFrame の内容（列名・型・値）から決まるフィンガープリントを返します。
+    値のハッシュは pd.util.hash_pandas_object でベクトル化して計算します。
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    if len(df.columns) > 0:
+        hasher.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    hasher.update(str(len(df)).encode())
+    return hasher.hexdigest()
+
+
+def options_key(options):
+    """read_csv などのオプション辞書を、キャッシュキーに使えるハッシュ可能な形に変換します。"""
+    if not options:
+        return ()
+    return tuple(sorted((k, repr(v)) for k, v in options.items()))
+
+
+def _object_payload_nbytes(values):
+    """
+    object 配列の要素（文字列など）が保持しているおおよそのバイト数。全ての要素を走査しないよう、
+    最大 OBJECT_SAMPLE_ROWS 個の等間隔の要素の大きさの平均に要素数を掛けて見積もります。
+    """
+    n = len(values)
+    if n == 0:
+        return 0
+    sample = values[::max(n // OBJECT_SAMPLE_ROWS, 1)]
+    return int(sum(map(sys.getsizeof, sample)) * n / len(sample))
+
+
+def column_nbytes(values):
+    """
+    列（Series や Index）が保持しているおおよそのバイト数を返します（object 列の中身も含む）。
+    memory_usage(deep=True) は object 列の全ての要素を Python で走査するため使わず、
+    配列のバイト数（deep=False。Arrow の列はバッファの合計）に、object の要素の見積もり（_object_payload_nbytes）と
+    カテゴリの値の分を足します。
+    """
+    nbytes = int(values.memory_usage(deep=False))
+    array = values.array
+    if isinstance(array, pd.Categorical):
+        return nbytes + column_nbytes(array.categories) - int(array.categories.memory_usage(deep=False))
+    if values.dtype == object or isinstance(array, pd.arrays.StringArray):
+        nbytes += _object_payload_nbytes(np.asarray(array, dtype=object))
+    return nbytes
+
+
+def frame_nbytes(df):
+    """DataFrame が保持しているおおよそのバイト数を返します（object列の中身も含む。column_nbytes の見積もり）。"""
+    return column_nbytes(df.index) + sum(column_nbytes(df.iloc[:, position]) for position in range(df.shape[1]))
+
+
+class LRUByteCache:
+    """
+    合計バイト数の上限を持つ LRU キャッシュ。
+    上限を超えた場合は最も長く使われていないエントリから破棄します。
+    Streamlitは複数セッションをスレッドで処理するため、操作はロックで保護します。
+    """
+
+    def __init__(self, budget_bytes, sizeof=frame_nbytes):
+        self.budget_bytes = budget_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict() # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self):
+        """登録されているキーのリストを返します（古い順）。"""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key, default=None):
+        """キーに対応する値を返します。見つかったエントリは最近使ったものとして扱います。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        """
+        値を登録します。単体で上限を超える値は登録せず False を返します。
+        """
+        if nbytes is None:
+            nbytes = self._sizeof(value)
+        if nbytes > self.budget_bytes:
+            return False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.resident_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.resident_bytes += nbytes
+            self._evict_locked()
+        return True
+
+    def pop(self, key, default=None):
+        """キーに対応するエントリを削除し、その値を返します。"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.resident_bytes -= entry[1]
+            return entry[0]
+
+    def set_budget(self, budget_bytes):
+        """上限バイト数を変更し、必要ならすぐに破棄を行います。"""
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict_locked()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self):
+        """ヒット率や使用バイト数などの統計を辞書で返します。"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': self.resident_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _evict_locked(self):
+        while self.resident_bytes > self.budget_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.resident_bytes -= nbytes
+            self.evictions += 1
@@ -0,0 +1,246 @@
+# components/compute.py
+"""
+Streamlit に依存しない計算（集計・統計量・図の作成）の登録と、共通のメモ化・計測・一括実行。
+
+計算は @computation で登録した関数で、DataFrame と dataset_key、キーワード引数だけを受け取って結果
+（DataFrame、図、それらのタプルなど）を返します。ウィジェットや表示は呼び出し側の描画関数で行います。
+キーワード引数はハッシュ可能な形（リストはタプル、辞書は項目のタプル）に変換し、
+計算の名前・データセットのキー（フィンガープリントがあれば df の列だけから決まるキー）と合わせて結果のキャッシュのキーにします。
+"""
+
+import contextlib
+import functools
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from components.cache import LRUByteCache, frame_fingerprint, frame_nbytes
+from components.fingerprint import ARTIFACT_COMPUTE, record_dependency, scoped_key
+from components.profiling import profile_span
+
+# 計算結果のキャッシュ（プロセス全体で共有）。図は JSON 文字列で保持し、取り出すたびに新しい図を作る
+COMPUTE_CACHE_BUDGET_BYTES = 256 * 1024 * 1024 # 256MB
+
+_MISSING = object()
+
+# 登録された計算（名前 -> ComputeFunction）
+COMPUTATIONS = {}
+
+
+def freeze(value):
+    """
+    引数の値をキャッシュキーに使えるハッシュ可能な値に変換します。
+    リスト・タプル・配列・Index はタプル、辞書は（キー, 値）のソート済みタプル、集合はソート済みタプルにします。
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((freeze(v) for v in value), key=repr))
+    if isinstance(value, (list, tuple, np.ndarray, pd.Index)):
+        return tuple(freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError(f'{type(value).__name__} 型の引数はキャッシュキーに使えません。') from None
+    return value
+
+
+class _PackedFigure(NamedTuple):
+    figure_json: str
+
+
+def _pack(value):
+    """キャッシュに入れる形に変換します（図は JSON 文字列にして、呼び出し側が変更しても影響しないようにする）。"""
+    if isinstance(value, go.Figure):
+        return _PackedFigure(pio.to_json(value, validate=False))
+    if isinstance(value, tuple) and not hasattr(value, '_fields'):
+        return tuple(_pack(v) for v in value)
+    if isinstance(value, list):
+        return [_pack(v) for v in value]
+    return value
+
+
+def _unpack(value):
+    """キャッシュの値を呼び出し側に返す形にします（図は作り直し、DataFrame は浅いコピーにする）。"""
+    if isinstance(value, _PackedFigure):
+        return pio.from_json(value.figure_json, skip_invalid=True)
+    if isinstance(value, tuple) and not hasattr(value, '_fields'):
+        return tuple(_unpack(v) for v in value)
+    if isinstance(value, list):
+        return [_unpack(v) for v in value]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    return value
+
+
+def _packed_nbytes(value):
+    """キャッシュに入れる値のおおよそのバイト数。"""
+    if isinstance(value, _PackedFigure):
+        return len(value.figure_json)
+    if isinstance(value, (tuple, list)):
+        return sum(_packed_nbytes(v) for v in value) + sys.getsizeof(value)
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+_result_cache = LRUByteCache(COMPUTE_CACHE_BUDGET_BYTES, sizeof=_packed_nbytes)
+
+
+def get_compute_cache():
+    """計算結果のキャッシュを返します（上限変更や統計の参照用）。"""
+    return _result_cache
+
+
+# 実行中の計算（キー -> [ロック, 待っている呼び出しの数]）。同じキーの計算が同時に要求された場合は1回だけ行う
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _single_flight(key):
+    with _inflight_lock:
+        entry = _inflight.get(key)
+        if entry is None:
+            entry = _inflight[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _inflight_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight[key]
+
+
+class ComputeResult(NamedTuple):
+    """計算1回分の結果（value）、例外（error）、時間（秒）、キャッシュから取り出したかどうか。"""
+    value: Any
+    error: Any
+    seconds: float
+    cached: bool
+
+
+class ComputeFunction:
+    """
+    登録された計算。呼び出すと、同じ引数の結果がキャッシュにあればそれを返し、なければ計算して保存します。
+    memoize=False の計算（内部で専用のキャッシュを持つ時間キューブや図など）は結果を保存しませんが、
+    同じキーの同時の呼び出しを1回にまとめることと、計測は同じように行います。
+    unkeyed に指定した引数（ワーカー数など、結果に影響しないもの）はキーに含めません。
+    """
+
+    def __init__(self, func, name, category, memoize=True, unkeyed=()):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = name
+        self.category = category
+        self.memoize = memoize
+        self.unkeyed = frozenset(unkeyed)
+        self.calls = 0
+        self.hits = 0
+        self.seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def key(self, df, dataset_key=None, **params):
+        """計算結果のキャッシュキー（計算の名前、df の列に絞ったデータセットのキー、結果に影響する引数）。"""
+        if dataset_key is None:
+            dataset_key = frame_fingerprint(df)
+        return (self.name, scoped_key(dataset_key, df.columns), freeze({k: v for k, v in params.items() if k not in self.unkeyed}))
+
+    def __call__(self, df, dataset_key=None, **params):
+        result = self.run(df, dataset_key, **params)
+        if result.error is not None:
+            raise result.error
+        return result.value
+
+    def run(self, df, dataset_key=None, **params):
+        """計算を1回実行し、例外を送出せずに ComputeResult を返します（一括実行やバッチ処理用）。"""
+        start = time.perf_counter()
+        value, error, cached = None, None, False
+        with profile_span(self.name, self.category, rows_in=len(df)) as span:
+            try:
+                if dataset_key is None:
+                    dataset_key = frame_fingerprint(df)
+                key = self.key(df, dataset_key, **params)
+                with _single_flight(key):
+                    packed = _result_cache.get(key, _MISSING) if self.memoize else _MISSING
+                    cached = packed is not _MISSING
+                    if not cached:
+                        packed = self.func(df, dataset_key=dataset_key, **params)
+                        if self.memoize:
+                            packed = _pack(packed)
+                            _result_cache.put(key, packed)
+                            record_dependency(dataset_key, ARTIFACT_COMPUTE, key, df.columns,
+                                              evict=functools.partial(_result_cache.pop, key),
+                                              scoped=key[1] is not dataset_key)
+                value = _unpack(packed) if self.memoize else packed
+            except Exception as e:
+                error = e
+                span.error = f'{type(e).__name__}: {e}'
+        seconds = time.perf_counter() - start
+        with self._stats_lock:
+            self.calls += 1
+            self.hits += cached
+            self.seconds += seconds
+        return ComputeResult(value, error, seconds, cached)
+
+    def stats(self):
+        with self._stats_lock:
+            return {'name': self.name, 'category': self.category, 'calls': self.calls,
+                    'hits': self.hits, 'seconds': self.seconds}
+
+
+def computation(category='compute', memoize=True, unkeyed=()):
+    """
+    関数を計算として登録するデコレータ。関数は (df, dataset_key, **キーワード引数) を受け取ります。
+    名前は profiled と同じく 'モジュール名.関数名' です。
+    """
+    def decorate(func):
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        function = ComputeFunction(func, name, category, memoize=memoize, unkeyed=unkeyed)
+        COMPUTATIONS[name] = function
+        return function
+    return decorate
+
+
+class ComputeCall(NamedTuple):
+    """一括実行する計算の呼び出し（計算、DataFrame、データセットのキー、キーワード引数）。"""
+    function: ComputeFunction
+    df: Any
+    dataset_key: Any = None
+    params: dict = {}
+
+
+def run_computations(calls, max_workers=None):
+    """
+    計算の呼び出しのリストを max_workers 個のスレッドで実行し、呼び出しと同じ順の ComputeResult のリストを返します。
+    失敗した呼び出しは error に例外が入り、他の呼び出しは続行します。
+    同じキーの呼び出しは、先に始まった1回の計算の結果を共有します。
+    """
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(calls), 32)) as executor:
+        futures = [executor.submit(call.function.run, call.df, call.dataset_key, **call.params) for call in calls]
+        return [future.result() for future in futures]
+
+
+def compute_stats():
+    """登録された計算ごとの呼び出し回数・キャッシュのヒット数・合計時間を DataFrame で返します。"""
+    return pd.DataFrame([function.stats() for function in COMPUTATIONS.values()],
+                        columns=['name', 'category', 'calls', 'hits', 'seconds'])
@@ -0,0 +1,190 @@
+# components/csv_streaming.py
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def _file_bytes(file):
+    """ファイルの中身をバイト列で返します（UploadedFile ならコピーせずに取得）。"""
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return data
+
+
+def estimate_row_count(file):
+    """
+    改行数からデータ行数の上限を見積もります（ヘッダー行を除く）。
+    クォート内の改行や空行があると実際より多めになりますが、少なくなることはほぼありません。
+    """
+    data = _file_bytes(file)
+    if isinstance(data, str):
+        data = data.encode()
+    lines = data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def _as_numpy_dtype(dtype):
+    """拡張型（文字列型など）は object として扱います。"""
+    if isinstance(dtype, np.dtype):
+        return dtype
+    return np.dtype(object)
+
+
+def promote_dtype(a, b):
+    """
+    2つの列型を、両方の値を損失なく格納できる型に統合します。
+    数値どうしは NumPy の昇格規則、それ以外の組み合わせは object になります。
+    """
+    if a is None:
+        return b
+    if a == b:
+        return a
+    numeric_kinds = 'iuf'
+    if a.kind in numeric_kinds and b.kind in numeric_kinds:
+        return np.result_type(a, b)
+    return np.dtype(object)
+
+
+def nullable_dtype(dtype):
+    """欠損値を格納できる型を返します（整数→float64、真偽値→object）。"""
+    if dtype.kind in 'iu':
+        return np.dtype('float64')
+    if dtype.kind == 'b':
+        return np.dtype(object)
+    return dtype
+
+
+def _missing_value(dtype):
+    if dtype.kind == 'M':
+        return np.datetime64('NaT')
+    if dtype.kind == 'm':
+        return np.timedelta64('NaT')
+    return np.nan
+
+
+def _chunk_values(series, dtype):
+    """チャンクの列を統合後の型の ndarray に変換します。"""
+    if dtype.kind in 'iub':
+        # 整数・真偽値の列には欠損がない（欠損があれば read_csv が float/object にする）
+        return series.to_numpy(dtype=dtype)
+    return series.to_numpy(dtype=dtype, na_value=_missing_value(dtype))
+
+
+class _ColumnBuffer:
+    """1列分の事前確保バッファ。型の昇格が必要になったときだけ再確保します。"""
+
+    def __init__(self, dtype, capacity):
+        self.dtype = dtype
+        self.array = np.empty(capacity, dtype=dtype)
+
+    def ensure_dtype(self, dtype):
+        if dtype != self.dtype:
+            self.array = self.array.astype(dtype)
+            self.dtype = dtype
+
+    def ensure_capacity(self, capacity):
+        if capacity > len(self.array):
+            grown = np.empty(max(capacity, len(self.array) * 2), dtype=self.dtype)
+            grown[:len(self.array)] = self.array
+            self.array = grown
+
+    def fill_missing(self, start, stop):
+        self.ensure_dtype(nullable_dtype(self.dtype))
+        self.array[start:stop] = _missing_value(self.dtype)
+
+
+def stream_csv_files(files, chunksize=DEFAULT_CHUNKSIZE, progress_callback=None, **read_csv_kwargs):
+    """
+    複数のCSVファイルをチャンク単位で読み込み、1つのDataFrameにまとめて返します。
+
+    列はすべてのファイルの和集合、型は各チャンクの型を昇格させて統合します。
+    値は列ごとに事前確保したバッファへ直接書き込むため、ピークメモリは最終的なDataFrameの
+    サイズ＋1チャンク程度に収まります（pd.concat のように全ファイル分の中間DataFrameを保持しません）。
+
+    progress_callback(file_index, file_name, rows_read, rows_estimated) を指定すると、
+    チャンクを読み込むたびに進捗を通知します。
+    """
+    files = list(files)
+    if not files:
+        return None
+
+    # 1パス目: ヘッダーだけを読み、列の和集合と行数の見積もりを得る
+    columns = []
+    seen = set()
+    row_estimates = []
+    for file in files:
+        file.seek(0)
+        header = pd.read_csv(file, nrows=0, **read_csv_kwargs).columns
+        for col in header:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+        row_estimates.append(estimate_row_count(file))
+
+    capacity = sum(row_estimates)
+    buffers = {}
+    position = 0
+
+    # 2パス目: チャンクごとに統合スキーマへ合わせてバッファへ書き込む
+    for file_index, file in enumerate(files):
+        file_name = getattr(file, 'name', f'file_{file_index}')
+        rows_read = 0
+        file.seek(0)
+        reader = pd.read_csv(file, chunksize=chunksize, **read_csv_kwargs)
+        with reader:
+            for chunk in reader:
+                n = len(chunk)
+                stop = position + n
+                if stop > capacity:
+                    capacity = max(stop, capacity * 2)
+                    for buf in buffers.values():
+                        buf.ensure_capacity(capacity)
+
+                for col in columns:
+                    buf = buffers.get(col)
+                    if col in chunk.columns:
+                        series = chunk[col]
+                        target = promote_dtype(buf.dtype if buf else None, _as_numpy_dtype(series.dtype))
+                        if buf is None:
+                            buf = buffers[col] = _ColumnBuffer(target, capacity)
+                            if position > 0:
+                                # これまでのファイルにはこの列がなかったので欠損で埋める
+                                buf.fill_missing(0, position)
+                                target = promote_dtype(buf.dtype, target)
+                        buf.ensure_dtype(target)
+                        buf.array[position:stop] = _chunk_values(series, buf.dtype)
+                    elif buf is not None:
+                        buf.fill_missing(position, stop)
+
+                position = stop
+                rows_read += n
+                if progress_callback is not None:
+                    progress_callback(file_index, file_name, rows_read, max(row_estimates[file_index], rows_read))
+
+        if progress_callback is not None:
+            # 見積もりより実際の行数が少なかった場合でも、ファイル完了時は100%にする
+            progress_callback(file_index, file_name, rows_read, rows_read)
+
+    data = {}
+    for col in columns:
+        buf = buffers.get(col)
+        if buf is None:
+            # ヘッダーのみでデータ行がない列
+            data[col] = np.full(position, np.nan)
+            continue
+        values = buf.array[:position]
+        if len(buf.array) > position * 1.1:
+            # 見積もりとの差が大きい場合は余分な領域を解放する（1列ずつなのでピークは増えない）
+            values = values.copy()
+        buffers[col] = None
+        data[col] = values
+
+    # copy=False なら列ごとのバッファをそのまま使い、ブロックの統合によるコピーも発生しない
+    return pd.DataFrame(data, columns=columns, copy=False)
@@ -0,0 +1,392 @@
+# components/data_editor.py
+"""
+大きなデータを編集するための、ページ単位のデータエディタと編集の差分の記録。
+
+st.data_editor にはデータ全体ではなく1ページ分の行だけを渡し、編集は (行ID, 列, 変更前の値, 変更後の値) の
+差分として EditLog に記録します。元のデータ（base）は変更せず、差分を適用したデータは版ごとに1回だけ作成します。
+編集後のデータセットの型変換・フィンガープリント・時間キューブ・積和の集計・分位点スケッチは、
+前の版から変更された行と列の分だけを更新して引き継ぎます（carry_over_caches）。
+値の変わった列はフィンガープリントの比較で求め、前の版の派生データのうちその列に依存するものだけを破棄します。
+フィルタ用インデックスや図・集計の結果はキーが列の値から決まるため、値の変わらない列の分はそのまま使われます。
+"""
+
+import hashlib
+from typing import Any, NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from components.cache import frame_fingerprint
+from components.fingerprint import cached_fingerprint, seed_fingerprint, supersede_dataset
+from components.online_stats import (
+    cached_pairwise_moments,
+    cached_quantile_sketches,
+    seed_pairwise_moments,
+    seed_quantile_sketches
+)
+from components.time_cube import cached_time_cubes, rebuild_time_cube_buckets, seed_time_cube
+from components.type_inference import apply_schema, get_cached_schema, seed_typed_frame
+
+EDIT_UPDATE = 'update' # セルの値の変更
+EDIT_INSERT = 'insert' # 行の追加（new に {列: 値}）
+EDIT_DELETE = 'delete' # 行の削除（old に {列: 値}）
+
+DEFAULT_PAGE_SIZE = 100
+PAGE_SIZES = [50, 100, 500, 1000]
+DELTA_LOG_DISPLAY_ROWS = 100 # 編集履歴として表示する直近の差分の数
+
+
+class EditDelta(NamedTuple):
+    """1件の編集。行の追加・削除では column は None です。"""
+    kind: str
+    row_id: int
+    column: Any
+    old: Any
+    new: Any
+
+
+class EditChanges(NamedTuple):
+    """
+    ある版以降の編集で変わった範囲。
+    removed は値が集計から外れる行（変更・削除された行）、added は値が集計に加わる行（変更・追加された行）の行IDで、
+    columns は値が変更された列です。rows_changed は行の追加・削除があったかどうかです。
+    """
+    removed: np.ndarray
+    added: np.ndarray
+    columns: frozenset
+    rows_changed: bool
+
+
+def _is_same(a, b):
+    """セルの値が同じかどうか（欠損どうしは同じとみなす）。"""
+    a_missing = a is None or (np.ndim(a) == 0 and pd.isna(a))
+    b_missing = b is None or (np.ndim(b) == 0 and pd.isna(b))
+    if a_missing or b_missing:
+        return a_missing and b_missing
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+def _with_values(series, positions, values):
+    """positions の位置の値を values に置き換えた新しい Series を返します（元の Series は変更しません）。"""
+    try:
+        new_values = pd.array(values, dtype=series.dtype)
+    except (TypeError, ValueError):
+        # 列の型で表せない値（数値の列に文字列など）が入る場合は object 型にする（型は後で推論し直す）
+        series = series.astype(object)
+        new_values = values
+    series = series.copy()
+    series.iloc[np.asarray(positions, dtype=np.int64)] = new_values
+    return series
+
+
+class EditLog:
+    """
+    元のデータ（base）に対する編集の記録。base の行は位置を行IDとし、追加した行には続きの行IDを振ります。
+    編集の内容は差分のリスト（deltas）と、列ごとの {行ID: 値}・追加した行・削除した行として保持します。
+    key は元のデータのフィンガープリントと差分の連鎖ハッシュから決まるため、同じ編集をしたデータは同じキーになります。
+    """
+
+    def __init__(self, base):
+        self.base = base.reset_index(drop=True)
+        self.base_key = frame_fingerprint(self.base)
+        self.deltas = []
+        self._cells = {} # 列 -> {行ID: 値}（base の行の変更）
+        self._inserted = {} # 行ID -> {列: 値}
+        self._deleted = np.zeros(len(self.base), dtype=bool)
+        self._next_row_id = len(self.base)
+        self._digest = self.base_key
+        self._frame = None # (版, 差分を適用した DataFrame)
+        self._versions = {self.key: 0} # データセットのキー -> 版
+        self.last_carry_over = None # 直近の版の引き継ぎの結果（CarryOver）
+
+    @property
+    def version(self):
+        return len(self.deltas)
+
+    @property
+    def key(self):
+        """編集後のデータセットのキー。"""
+        return ('editor', self.base_key, self._digest)
+
+    @property
+    def columns(self):
+        return self.base.columns
+
+    def __len__(self):
+        return int(len(self.base) - self._deleted.sum()) + len(self._inserted)
+
+    def row_ids(self):
+        """現在の行の行IDを、表示する順（base の行、追加した行の順）の配列で返します。"""
+        return np.concatenate([
+            np.flatnonzero(~self._deleted),
+            np.fromiter(self._inserted, dtype=np.int64, count=len(self._inserted))
+        ])
+
+    def value(self, row_id, column):
+        """現在のセルの値。"""
+        if row_id in self._inserted:
+            return self._inserted[row_id].get(column)
+        edits = self._cells.get(column)
+        if edits is not None and row_id in edits:
+            return edits[row_id]
+        return self.base[column].iloc[row_id]
+
+    def _row_values(self, row_id):
+        return {col: self.value(row_id, col) for col in self.columns}
+
+    def _append(self, delta):
+        self.deltas.append(delta)
+        self._digest = hashlib.blake2b((self._digest + repr(delta)).encode(), digest_size=16).hexdigest()
+        self._versions[self.key] = self.version
+
+    def version_of(self, dataset_key):
+        """データセットのキーがこの記録のどの版に当たるかを返します（この記録のキーでなければ None）。"""
+        return self._versions.get(dataset_key)
+
+    def update(self, row_id, column, new):
+        """セルの値を変更します。値が変わらない場合は記録せず False を返します。"""
+        old = self.value(row_id, column)
+        if _is_same(old, new):
+            return False
+        if row_id in self._inserted:
+            self._inserted[row_id][column] = new
+        else:
+            self._cells.setdefault(column, {})[row_id] = new
+        self._append(EditDelta(EDIT_UPDATE, row_id, column, old, new))
+        return True
+
+    def insert(self, values):
+        """行を追加し、その行IDを返します。"""
+        row_id = self._next_row_id
+        self._next_row_id += 1
+        values = {col: values.get(col) for col in self.columns}
+        self._inserted[row_id] = values
+        self._append(EditDelta(EDIT_INSERT, row_id, None, None, dict(values)))
+        return row_id
+
+    def delete(self, row_id):
+        """行を削除します。"""
+        old = self._row_values(row_id)
+        if row_id in self._inserted:
+            del self._inserted[row_id]
+        else:
+            self._deleted[row_id] = True
+        self._append(EditDelta(EDIT_DELETE, row_id, None, old, None))
+
+    def page(self, start, stop):
+        """現在のデータの start 行目から stop 行目まで（行IDのインデックス付き）の DataFrame を返します。"""
+        ids = self.row_ids()[start:stop]
+        base_ids = ids[ids < len(self.base)]
+        part = self.base.iloc[base_ids].copy(deep=False) # 列を置き換えるので、元のデータのビューにしない
+        part.index = base_ids
+        for col, edits in self._cells.items():
+            hits = [(position, edits[row_id]) for position, row_id in enumerate(base_ids) if row_id in edits]
+            if hits:
+                part[col] = _with_values(part[col], [p for p, _ in hits], [v for _, v in hits])
+        inserted_ids = ids[ids >= len(self.base)]
+        if len(inserted_ids):
+            inserted = pd.DataFrame([self._inserted[row_id] for row_id in inserted_ids],
+                                    index=inserted_ids, columns=self.columns)
+            part = pd.concat([part, inserted]) if len(part) else inserted
+        return part
+
+    def frame(self):
+        """
+        全ての差分を適用した DataFrame（インデックスは行ID）を返します。版ごとに1回だけ作成し、
+        値を変更した列以外は base の列をそのまま参照します。
+        """
+        if self._frame is not None and self._frame[0] == self.version:
+            return self._frame[1]
+        df = self.base.copy(deep=False)
+        for col, edits in self._cells.items():
+            df[col] = _with_values(self.base[col], list(edits), list(edits.values()))
+        if self._deleted.any():
+            df = df[~self._deleted]
+        if self._inserted:
+            inserted = pd.DataFrame(list(self._inserted.values()), index=list(self._inserted), columns=self.columns)
+            df = pd.concat([df, inserted])
+        self._frame = (self.version, df)
+        return df
+
+    def changes_since(self, version):
+        """version 以降の編集で変わった範囲（EditChanges）を返します。"""
+        removed, added, columns = set(), set(), set()
+        inserted, deleted = set(), set()
+        for delta in self.deltas[version:]:
+            if delta.kind == EDIT_UPDATE:
+                removed.add(delta.row_id)
+                added.add(delta.row_id)
+                columns.add(delta.column)
+            elif delta.kind == EDIT_INSERT:
+                added.add(delta.row_id)
+                inserted.add(delta.row_id)
+            else:
+                removed.add(delta.row_id)
+                deleted.add(delta.row_id)
+        # version の時点になかった行（その後に追加した行）は外れる値がなく、削除した行は加わる値がない
+        removed -= inserted
+        added -= deleted
+        return EditChanges(np.array(sorted(removed), dtype=np.int64), np.array(sorted(added), dtype=np.int64),
+                           frozenset(columns), bool(inserted or deleted))
+
+    def delta_frame(self, last=None):
+        """差分の記録を DataFrame（種類・行ID・列・変更前・変更後）で返します（last を指定すると直近の分だけ）。"""
+        deltas = self.deltas[-last:] if last else self.deltas
+        return pd.DataFrame(
+            [(d.kind, d.row_id, d.column, repr(d.old) if d.old is not None else None,
+              repr(d.new) if d.new is not None else None) for d in deltas],
+            columns=['種類', '行ID', '列', '変更前', '変更後']
+        )
+
+
+class CarryOver(NamedTuple):
+    """版の引き継ぎの結果。changed は値が変わった列、invalidated は破棄した前の版の派生データ（fingerprint.Artifact）です。"""
+    changed: frozenset
+    invalidated: list
+
+
+def _updated_fingerprint(fingerprint, previous_typed, typed, changes):
+    """前の版のフィンガープリントを、変更された行を含むブロックだけ計算し直して新しい版のものにします。"""
+    if not changes.rows_changed:
+        return fingerprint.updated(typed, changes.columns, typed.index.get_indexer(changes.added))
+    # 行の追加・削除があった場合は、最初に変わった行より後の行の位置がずれるので、そこから先を計算し直す
+    positions = np.concatenate([previous_typed.index.get_indexer(changes.removed),
+                                typed.index.get_indexer(changes.added)])
+    from_row = int(positions.min()) if len(positions) else min(len(previous_typed), len(typed))
+    return fingerprint.updated(typed, from_row=from_row)
+
+
+def carry_over_caches(previous_key, previous_typed, new_key, new_df, changes):
+    """
+    前の版のデータセット（previous_key、型変換済みの previous_typed）のキャッシュを、変更された行と列（changes）の分だけ
+    更新して新しい版（new_key、差分を適用した new_df）に登録します。引き継げないものは登録せず、必要になったときに作り直されます。
+    前の版の派生データのうち値の変わった列に依存するものは破棄し、結果を CarryOver で返します。
+    前の版のスキーマがキャッシュにない場合は何もせず None を返します。
+    """
+    schema = get_cached_schema(previous_key)
+    if schema is None:
+        return None
+    # 型変換: スキーマは推論し直さず、行が変わらなければ値の変わった列だけを変換する
+    if changes.rows_changed:
+        typed = apply_schema(new_df, schema)
+    else:
+        typed = previous_typed.copy(deep=False)
+        touched = [col for col in new_df.columns if col in changes.columns]
+        if touched:
+            converted = apply_schema(new_df[touched], schema)
+            for col in touched:
+                typed[col] = converted[col]
+    seed_typed_frame(new_key, typed, schema)
+
+    # 値の変わった列: フィンガープリントがあれば比較して求める（編集して元の値に戻した列は含まれない）
+    fingerprint = cached_fingerprint(previous_key)
+    if fingerprint is not None:
+        new_fingerprint = _updated_fingerprint(fingerprint, previous_typed, typed, changes)
+        seed_fingerprint(new_key, new_fingerprint)
+        changed = frozenset(fingerprint.changed_columns(new_fingerprint))
+    else:
+        changed = frozenset(typed.columns) if changes.rows_changed else changes.columns & set(typed.columns)
+
+    if not changes.rows_changed:
+        # 分位点スケッチは、値の変わらない列の分をそのまま使う
+        sketches = cached_quantile_sketches(previous_key)
+        kept = {col: sketch for col, sketch in (sketches or {}).items() if col not in changed}
+        if kept:
+            seed_quantile_sketches(new_key, kept)
+
+    numeric_columns = typed.select_dtypes(include=['number']).columns.tolist()
+    removed_rows = previous_typed.loc[changes.removed]
+    added_rows = typed.loc[changes.added]
+
+    # 積和の集計: 外れる行の分を引き、加わる行の分を足す（数値列の構成が変わった場合は作り直す）
+    moments = cached_pairwise_moments(previous_key)
+    if moments is not None and moments.columns == numeric_columns:
+        if changed & set(numeric_columns):
+            moments = moments.replace_rows(removed_rows, added_rows, typed)
+        seed_pairwise_moments(new_key, moments)
+
+    # 時間キューブ: 変更された行の時間帯だけを集計し直す
+    for time_col, cube in cached_time_cubes(previous_key).items():
+        if time_col not in typed.columns or not pd.api.types.is_datetime64_any_dtype(typed[time_col].dtype):
+            continue
+        value_cols = list(dict.fromkeys(cube.columns.get_level_values(0)))
+        if value_cols != [col for col in numeric_columns if col != time_col]:
+            continue
+        if changed & (set(value_cols) | {time_col}):
+            times = pd.concat([removed_rows[time_col], added_rows[time_col]])
+            cube = rebuild_time_cube_buckets(cube, typed, time_col, times)
+        seed_time_cube(new_key, time_col, cube)
+
+    return CarryOver(changed, supersede_dataset(previous_key, new_key, changed))
+
+
+def load_edited_frame(log, previous_dataset=None):
+    """
+    EditLog の現在の版の DataFrame を返します（dataset_registry.acquire_dataset の load に渡す関数）。
+    previous_dataset が同じ EditLog の前の版のデータセットであれば、そのキャッシュを変更された範囲だけ更新して引き継ぎます。
+    """
+    df = log.frame()
+    if previous_dataset is not None:
+        version = log.version_of(previous_dataset.key)
+        if version is not None and version < log.version:
+            carry_over = carry_over_caches(previous_dataset.key, previous_dataset.typed, log.key, df,
+                                           log.changes_since(version))
+            if carry_over is not None:
+                log.last_carry_over = carry_over
+    return df
+
+
+def record_page_edits(log, view, edited):
+    """
+    st.data_editor に渡したページ（view）と編集後のページ（edited）を比べ、変更・追加・削除を log に記録します。
+    記録した差分の数を返します。
+    """
+    recorded = 0
+    for row_id in view.index.difference(edited.index):
+        log.delete(int(row_id))
+        recorded += 1
+    common = view.index.intersection(edited.index)
+    for col in view.columns:
+        for row_id, old, new in zip(common, view.loc[common, col], edited.loc[common, col]):
+            if not _is_same(old, new):
+                recorded += log.update(int(row_id), col, new)
+    for _, row in edited.loc[~edited.index.isin(view.index)].iterrows():
+        log.insert(row.to_dict())
+        recorded += 1
+    return recorded
+
+
+def render_paged_editor(log, key='data_editor'):
+    """
+    EditLog の現在のデータを1ページ分ずつ st.data_editor で表示し、編集を差分として記録します。
+    ブラウザに送るのは表示中のページの行だけです。編集を記録したら再実行し、新しい版のページを表示します。
+    """
+    n_rows = len(log)
+    size_col, page_col, info_col = st.columns([1, 1, 2])
+    page_size = size_col.selectbox('1ページの行数:', PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE),
+                                   key=f'{key}_page_size')
+    n_pages = max(1, -(-n_rows // page_size))
+    page = int(page_col.number_input('ページ:', min_value=1, max_value=n_pages, value=1))
+    start = (page - 1) * page_size
+    view = log.page(start, start + page_size)
+    info_col.caption(f'全 {n_rows:,} 行のうち {start + 1 if len(view) else 0:,}〜{start + len(view):,} 行目'
+                     f'（編集 {log.version:,} 件）')
+
+    # 編集を記録するたびにキーを変え、記録済みの編集を反映したページで新しいエディタを表示する
+    edited = st.data_editor(view, num_rows='dynamic', use_container_width=True,
+                            key=f'{key}_{log.key[2]}_{start}_{page_size}')
+    if record_page_edits(log, view, edited):
+        st.rerun()
+
+    if log.deltas:
+        with st.expander(f'編集の履歴（直近 {DELTA_LOG_DISPLAY_ROWS} 件）'):
+            st.dataframe(log.delta_frame(DELTA_LOG_DISPLAY_ROWS), use_container_width=True)
+            carry_over = log.last_carry_over
+            if carry_over is not None:
+                changed = ', '.join(map(str, sorted(carry_over.changed, key=str))) or 'なし'
+                st.caption(f'直近の編集で値が変わった列: {changed} ／ '
+                           f'作り直しが必要になった派生データ: {len(carry_over.invalidated):,} 件')
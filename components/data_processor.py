@@ -1,44 +1,264 @@
 # components/data_processor.py
 
+import numpy as np
 import pandas as pd
 import streamlit as st # Streamlitのエラー表示に使うためインポート
 import plotly.express as px # 新しくインポート。ヒートマップ用
-
-def load_and_combine_csv(uploaded_files):
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from components.cache import LRUByteCache, file_content_hash, frame_fingerprint, options_key
+from components.csv_streaming import DEFAULT_CHUNKSIZE, stream_csv_files
+from components.time_cube import (
+    GRANULARITY_DATE_HOUR,
+    GRANULARITY_DAY,
+    GRANULARITY_HOUR_OF_DAY,
+    GRANULARITY_MONTH,
+    GRANULARITY_WEEKDAY,
+    GRANULARITY_YEAR,
+    build_time_cube,
+    build_time_cube_in_chunks,
+    cached_time_cube,
+    cached_time_cubes,
+    get_time_cube,
+    merge_time_cubes,
+    rollup_date_hour,
+    rollup_time_cube,
+    seed_time_cube
+)
+from components.type_inference import (
+    apply_schema,
+    concat_typed_frames,
+    convert_column_types,
+    get_cached_schema,
+    get_cached_typed_frame,
+    infer_schema,
+    seed_typed_frame
+)
+from components.online_stats import (
+    PairwiseMoments,
+    build_quantile_sketches,
+    cached_pairwise_moments,
+    cached_quantile_sketches,
+    describe_from_statistics,
+    get_pairwise_moments,
+    get_quantile_sketches,
+    iter_row_chunks,
+    merge_quantile_sketches,
+    seed_pairwise_moments,
+    seed_quantile_sketches,
+    summarize_chunks
+)
+from components.filter_index import bitmap_and, get_column_index, materialize
+from components.parallel import parse_csv_files
+from components.heatmap import AGG_MEAN, AGGREGATION_LABELS, heatmap_figure
+from components.profiling import plotly_chart, profiled
+from components.compute import computation
+from components.background_jobs import (
+    BACKGROUND_MIN_ROWS,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_RUNNING,
+    get_job,
+    submit_job
+)
+
+# 読み込み済みDataFrameのキャッシュ（プロセス全体で共有）。
+# キーはファイル内容のハッシュと読み込みオプションなので、ウィジェット操作による再実行では再パースしない。
+CSV_CACHE_BUDGET_BYTES = 1024 * 1024 * 1024 # 1GB
+_csv_frame_cache = LRUByteCache(CSV_CACHE_BUDGET_BYTES)
+
+def get_csv_cache():
+    """CSV読み込みキャッシュを返します（上限変更や統計の参照用）。"""
+    return _csv_frame_cache
+
+@profiled('load')
+def load_and_combine_csv(uploaded_files, max_workers=None, **read_csv_kwargs):
     """
     複数のCSVファイルを読み込み、結合してDataFrameを返します。
     エラーが発生した場合はNoneを返します。
+    ファイル内容のハッシュと読み込みオプションが同じであれば、キャッシュ済みの結合結果を返します。
+    ファイルが大きい場合は max_workers 個のワーカープロセスで並列にパースします（None なら既定のワーカー数）。
     """
     if not uploaded_files:
         return None
 
+    cache_key = (
+        tuple(file_content_hash(file) for file in uploaded_files),
+        options_key(read_csv_kwargs)
+    )
+    cached_df = _csv_frame_cache.get(cache_key)
+    if cached_df is not None:
+        # 呼び出し側での列の追加・置き換えがキャッシュに波及しないよう、浅いコピーを返す
+        return cached_df.copy(deep=False)
+
     combined_df_list = []
-    for file in uploaded_files:
-        try:
-            df_single = pd.read_csv(file)
-            combined_df_list.append(df_single)
-        except Exception as e:
+    has_error = False
+    # ファイルごとの DataFrame（読み込みに失敗したファイルは例外）
+    parsed = parse_csv_files(uploaded_files, max_workers=max_workers, **read_csv_kwargs)
+    for file, df_single in zip(uploaded_files, parsed):
+        if isinstance(df_single, Exception):
+            e = df_single
             st.error(f"ファイル '{file.name}' の読み込み中にエラーが発生しました: {e}")
             st.info("CSVファイルの形式が正しいか、またエンコーディングがUTF-8であるか確認してください。")
+            has_error = True
             continue
+        combined_df_list.append(df_single)
 
     if combined_df_list:
         try:
             df = pd.concat(combined_df_list, ignore_index=True)
-            return df
         except Exception as e:
             st.error(f"結合されたデータの処理中にエラーが発生しました: {e}")
             st.info("結合しようとしているCSVファイルの列名や構造が大きく異なる場合、結合に失敗する可能性があります。")
             return None
+        # 一部のファイルが読めなかった場合は、次回もエラーを表示できるようキャッシュしない
+        if not has_error:
+            _csv_frame_cache.put(cache_key, df)
+        return df.copy(deep=False)
     return None
 
-def calculate_and_plot_average(df):
+@profiled('load')
+def load_and_combine_csv_streaming(uploaded_files, chunksize=DEFAULT_CHUNKSIZE, **read_csv_kwargs):
     """
-    データフレームから選択された数値列の平均値を計算し、表と棒グラフで表示します。
+    複数のCSVファイルをチャンク単位で読み込み、列構成を統合して1つのDataFrameを返します。
+    ファイルごとの進捗をプログレスバーで表示します。エラーが発生した場合はNoneを返します。
+    """
+    if not uploaded_files:
+        return None
+
+    cache_key = (
+        tuple(file_content_hash(file) for file in uploaded_files),
+        options_key(read_csv_kwargs),
+        ('streaming', chunksize)
+    )
+    cached_df = _csv_frame_cache.get(cache_key)
+    if cached_df is not None:
+        return cached_df.copy(deep=False)
+
+    progress_bar = st.progress(0.0, text='読み込みを開始します...')
+    n_files = len(uploaded_files)
+
+    def report_progress(file_index, file_name, rows_read, rows_estimated):
+        file_fraction = rows_read / rows_estimated if rows_estimated else 1.0
+        progress_bar.progress(
+            min((file_index + file_fraction) / n_files, 1.0),
+            text=f"'{file_name}' を読み込み中... {rows_read:,} 行 ({file_index + 1}/{n_files} ファイル目)"
+        )
+
+    try:
+        df = stream_csv_files(uploaded_files, chunksize=chunksize,
+                              progress_callback=report_progress, **read_csv_kwargs)
+    except Exception as e:
+        progress_bar.empty()
+        st.error(f"CSVファイルのチャンク読み込み中にエラーが発生しました: {e}")
+        st.info("CSVファイルの形式が正しいか、またエンコーディングがUTF-8であるか確認してください。")
+        return None
+
+    progress_bar.empty()
+    if df is None:
+        return None
+    _csv_frame_cache.put(cache_key, df)
+    return df.copy(deep=False)
+
+def append_dataset_key(file_hashes):
+    """追記モードで読み込んだデータセットのキー（ファイル内容のハッシュを読み込み順に並べたもの）。"""
+    return ('append', tuple(file_hashes))
+
+@profiled('load')
+def load_and_append_csv(uploaded_files, loader=None, **read_csv_kwargs):
+    """
+    追記モードでCSVファイルを読み込み、(型変換済みのDataFrame, データセットのキー) を返します。
+
+    アップロードされたファイルの先頭部分が以前に読み込んだファイル列と一致する場合、
+    追加されたファイルだけを読み込んで型変換し、以前の結果の後ろに結合します。
+    その際、以前のデータセットに対して作成済みの時間キューブ（時間帯ごとの件数・合計・二乗和・最小・最大）と
+    相関用の積和の集計にも、追加分の集計だけを足し合わせます。以前のデータを再度パース・集計することはありません。
+    """
+    if loader is None:
+        loader = load_and_combine_csv
+    if not uploaded_files:
+        return None, None
+
+    file_hashes = [file_content_hash(file) for file in uploaded_files]
+    dataset_key = append_dataset_key(file_hashes)
+    typed_df = get_cached_typed_frame(dataset_key)
+    if typed_df is not None:
+        return typed_df, dataset_key
+
+    # 以前に読み込んだファイル列のうち、最も長い先頭部分を探す
+    prev_key = prev_typed = prev_schema = None
+    n_prev = 0
+    for n in range(len(file_hashes) - 1, 0, -1):
+        candidate_key = append_dataset_key(file_hashes[:n])
+        candidate_typed = get_cached_typed_frame(candidate_key)
+        candidate_schema = get_cached_schema(candidate_key)
+        if candidate_typed is not None and candidate_schema is not None:
+            prev_key, prev_typed, prev_schema, n_prev = candidate_key, candidate_typed, candidate_schema, n
+            break
+
+    if prev_key is None:
+        df = loader(uploaded_files, **read_csv_kwargs)
+        if df is None:
+            return None, dataset_key
+        return convert_column_types(df, dataset_key), dataset_key
+
+    new_files = uploaded_files[n_prev:]
+    new_df = loader(new_files, **read_csv_kwargs)
+    if new_df is None:
+        return None, dataset_key
+
+    # 既存の列は以前のスキーマに合わせ、新しく現れた列だけ型を推論する
+    new_columns = [col for col in new_df.columns if col not in prev_schema]
+    schema = dict(prev_schema)
+    schema.update(infer_schema(new_df[new_columns]))
+    new_typed = apply_schema(new_df, schema)
+    typed_df = concat_typed_frames(prev_typed, new_typed)
+    seed_typed_frame(dataset_key, typed_df, schema)
+
+    # 以前のデータセットの集計に、追加分の集計だけを足し合わせる
+    for time_col, cube in cached_time_cubes(prev_key).items():
+        if time_col in new_typed.columns:
+            seed_time_cube(dataset_key, time_col, merge_time_cubes(cube, build_time_cube(new_typed, time_col)))
+    prev_moments = cached_pairwise_moments(prev_key)
+    if prev_moments is not None:
+        new_moments = PairwiseMoments.from_frame(new_typed)
+        seed_pairwise_moments(dataset_key, prev_moments.merge(new_moments))
+    prev_sketches = cached_quantile_sketches(prev_key)
+    if prev_sketches is not None:
+        new_sketches = build_quantile_sketches(new_typed, [col for col in prev_sketches if col in new_typed.columns])
+        seed_quantile_sketches(dataset_key, merge_quantile_sketches(prev_sketches, new_sketches))
+
+    st.info(f'追記モード: 新しく追加された {len(new_files)} 個のファイルだけを読み込み、既存の集計に追加しました。')
+    return typed_df.copy(deep=False), dataset_key
+
+def _numeric_columns(query):
+    """問い合わせ対象のデータセットの数値列（真偽値の列は除く）を列の順に返します。"""
+    return [col for col, dtype in query.dataset.typed.dtypes.items()
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+
+@computation('analysis')
+def column_averages(df, dataset_key, columns):
+    """
+    選択された列の平均値の表（列名・平均値）と、その棒グラフの図を返します。
+    df は列ごとの平均値の1行の集計結果です（行を取り出さずに問い合わせで集計したもの）。
+    """
+    average_values = pd.Series({col: df[col].iloc[0] for col in columns}, dtype=np.float64)
+    table = average_values.reset_index().rename(columns={'index': '列名', 0: '平均値'})
+    # plotly.express はファイルの先頭でインポート済
+    fig = px.bar(table, x='列名', y='平均値', title='選択された列の平均値')
+    fig.update_layout(title_x=0.5) # タイトル中央寄せ
+    return table, fig
+
+@profiled('analysis')
+def calculate_and_plot_average(query):
+    """
+    問い合わせ query の結果から選択された数値列の平均値を計算し、表と棒グラフで表示します。
+    平均値は問い合わせの集計で求め、1行の集計結果だけを受け取ります。
     """
     st.write('選択した数値列の平均値を計算し、プロットします。')
 
-    numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
+    numeric_columns = _numeric_columns(query)
 
     if not numeric_columns:
         st.warning("データフレームに数値型の列が見つかりません。")
@@ -52,22 +272,15 @@ def calculate_and_plot_average(df):
     if st.button('平均値を計算しプロット'):
         if cols_to_average:
             try:
-                average_values = df[cols_to_average].mean()
+                averages = query.aggregate([], {col: (col, 'mean') for col in cols_to_average}).collect()
+                average_table, fig_avg_bar = column_averages(averages, dataset_key=query.key,
+                                                             columns=cols_to_average)
 
                 st.subheader('計算結果（平均値）')
-                st.dataframe(average_values.reset_index().rename(columns={'index': '列名', 0: '平均値'}))
+                st.dataframe(average_table)
 
-                # plotly.express はファイルの先頭でインポート済
                 st.subheader('平均値の棒グラフ')
-                fig_avg_bar = px.bar(
-                    average_values.reset_index(),
-                    x='index',
-                    y=0,
-                    title='選択された列の平均値',
-                    labels={'index': '列名', 0: '平均値'}
-                )
-                fig_avg_bar.update_layout(title_x=0.5) # タイトル中央寄せ
-                st.plotly_chart(fig_avg_bar, use_container_width=True)
+                plotly_chart(fig_avg_bar, use_container_width=True)
 
             except Exception as e:
                 st.error(f"平均値の計算またはプロット中にエラーが発生しました: {e}")
@@ -75,16 +288,172 @@ def calculate_and_plot_average(df):
         else:
             st.warning("平均値を計算したい列を1つ以上選択してください。")
 
-def aggregate_and_plot_time_series(df):
+# 集計粒度ごとのグラフのタイトル・X軸ラベル・グラフの種類（曜日別などは棒グラフの方が自然）
+TIME_SERIES_FIGURES = {
+    GRANULARITY_HOUR_OF_DAY: ('全期間における時間帯別平均', '時間帯 (h)', 'line'),
+    GRANULARITY_DAY: ('日別平均', '日付', 'line'),
+    GRANULARITY_WEEKDAY: ('曜日別平均', '曜日', 'bar'),
+    GRANULARITY_MONTH: ('月別平均', '月', 'line'),
+    GRANULARITY_YEAR: ('年別平均', '年', 'line'),
+}
+
+# 集計粒度の選択肢と、時間キューブでの集計粒度の対応
+TIME_SERIES_GRANULARITIES = {
+    '日ごとの時間帯別平均': GRANULARITY_DATE_HOUR,
+    '時間帯別平均 (全期間)': GRANULARITY_HOUR_OF_DAY,
+    '日別平均': GRANULARITY_DAY,
+    '曜日別平均': GRANULARITY_WEEKDAY,
+    '月別平均': GRANULARITY_MONTH,
+    '年別平均': GRANULARITY_YEAR,
+}
+
+def time_series_figure(cube, value_col, granularity, heatmap_agg=AGG_MEAN):
     """
-    時系列データを指定された粒度で集計し、表とグラフで表示します。
+    時間キューブを指定の粒度（time_cube の GRANULARITY_*）で集計し、(集計結果の DataFrame, 図) を返します。
+    GRANULARITY_DATE_HOUR は行が時間帯、列が日付の表で、各セルを heatmap_agg で集計したヒートマップになります。
+    """
+    if granularity == GRANULARITY_DATE_HOUR:
+        # 行が時間帯、列が日付の表をそのまま格子として描画する（縦持ちへの変換や再集計はしない）
+        aggregated_df = rollup_date_hour(cube, value_col, heatmap_agg)
+        agg_label = AGGREGATION_LABELS[heatmap_agg]
+        fig = heatmap_figure(
+            aggregated_df.to_numpy(),
+            x=aggregated_df.columns,
+            y=aggregated_df.index,
+            title=f'日ごとの時間帯別{agg_label} {value_col}',
+            x_label='日付',
+            y_label='時間帯 (h)',
+            z_label=f'{value_col}の{agg_label}'
+        )
+    else:
+        title_prefix, x_label, kind = TIME_SERIES_FIGURES[granularity]
+        aggregated_df = rollup_time_cube(cube, value_col, granularity)
+        # plotly.express はファイルの先頭でインポート済
+        plot = px.line if kind == 'line' else px.bar
+        fig = plot(
+            aggregated_df,
+            x='Period',
+            y='Average_Value',
+            title=f'{title_prefix} {value_col}',
+            labels={'Period': x_label, 'Average_Value': f'{value_col}の平均'}
+        )
+    fig.update_layout(title_x=0.5) # タイトル中央寄せ
+    return aggregated_df, fig
+
+def correlation_figure(correlation_matrix):
+    """相関行列をセルに値を表示したヒートマップの図にします。"""
+    fig = px.imshow(
+        correlation_matrix,
+        text_auto=True, # セルに値を自動表示
+        aspect="auto", # アスペクト比を自動調整
+        title='選択された列間の相関行列',
+        color_continuous_scale=px.colors.sequential.Viridis # カラーバーのスケール
+    )
+    fig.update_layout(title_x=0.5) # タイトル中央寄せ
+    return fig
+
+@computation('analysis', memoize=False, unkeyed=('max_workers',))
+def dataset_time_cube(df, dataset_key, time_col, max_workers=None):
+    """全数値列の時間キューブを返します（time_cube のキャッシュに保持されるため、計算結果のキャッシュには入れない）。"""
+    return get_time_cube(df, time_col, dataset_key, max_workers=max_workers)
+
+@computation('analysis', unkeyed=('max_workers',))
+def time_series_aggregation(df, dataset_key, time_col, value_col, granularity, heatmap_agg=AGG_MEAN,
+                            max_workers=None):
+    """時系列データを指定の粒度で集計し、(集計結果の DataFrame, 図) を返します（集計は時間キューブから行う）。"""
+    cube = dataset_time_cube(df, dataset_key=dataset_key, time_col=time_col, max_workers=max_workers)
+    return time_series_figure(cube, value_col, granularity, heatmap_agg)
+
+@computation('analysis', memoize=False)
+def pairwise_moments(df, dataset_key):
+    """全数値列の積和の集計を返します（online_stats のキャッシュに保持されるため、計算結果のキャッシュには入れない）。"""
+    return get_pairwise_moments(df, dataset_key)
+
+@computation('analysis')
+def descriptive_statistics(df, dataset_key, columns):
+    """df.describe() と同じ形の記述統計量を、積和の集計と分位点スケッチから計算して返します。"""
+    moments = pairwise_moments(df, dataset_key=dataset_key)
+    sketches = get_quantile_sketches(df, dataset_key, columns)
+    return describe_from_statistics(moments, sketches, columns)
+
+@computation('analysis')
+def correlation_analysis(df, dataset_key, columns):
+    """選択された列の相関行列と、そのヒートマップの図を返します（相関行列は積和の集計から取り出す）。"""
+    correlation_matrix = pairwise_moments(df, dataset_key=dataset_key).correlation(columns)
+    return correlation_matrix, correlation_figure(correlation_matrix)
+
+def _session_slot(name):
+    """バックグラウンドジョブのスロット（セッションごと・処理の種類ごとに、最新の要求だけを実行する）。"""
+    ctx = get_script_run_ctx()
+    return (ctx.session_id if ctx is not None else None, name)
+
+def _progress_chunk_rows(n_rows):
+    # 途中結果を20回程度に分けて表示できる大きさのチャンクにする
+    return max(n_rows // 20, 250_000)
+
+def _time_cube_job(job, query, time_col, max_workers):
+    """バックグラウンドで問い合わせの結果を取り出して時間キューブを作成し、チャンクごとに途中のキューブを報告します。"""
+    df = query.collect()
+
+    def report(rows_done, n_rows, cube):
+        job.report(rows_done / n_rows if n_rows else 1.0, partial=cube,
+                   message=f'{rows_done:,} / {n_rows:,} 行を集計済み')
+
+    cube = build_time_cube_in_chunks(df, time_col, chunk_rows=_progress_chunk_rows(len(df)),
+                                     max_workers=max_workers, progress_callback=report)
+    seed_time_cube(query.key, time_col, cube)
+    return cube
+
+@profiled('analysis')
+def _render_time_series_result(aggregated_df, fig, aggregation_granularity):
+    """選択された粒度の集計結果の表とグラフを表示します。"""
+    st.write(f'**{aggregation_granularity} の集計結果**')
+    st.subheader('集計結果（表）')
+    st.dataframe(aggregated_df)
+    plotly_chart(fig, use_container_width=True)
+    if TIME_SERIES_GRANULARITIES[aggregation_granularity] == GRANULARITY_DATE_HOUR:
+        st.info("ヒートマップは、日ごとの時間帯別のパターンを視覚的に把握するのに適しています。")
+
+def _render_time_series_job(job_key, value_col, aggregation_granularity, heatmap_agg=AGG_MEAN):
+    """
+    実行中の時間キューブ作成ジョブの進捗と、処理済みの範囲での途中結果を表示します
+    （フラグメントとして一定間隔で再実行され、ジョブが終わったらアプリ全体を再実行して最終結果を表示します）。
+    """
+    job = get_job(job_key)
+    if job is None:
+        st.rerun()
+    status, progress, message, partial, _, _ = job.snapshot()
+    if status != JOB_RUNNING:
+        st.rerun()
+
+    st.progress(progress, text=f'時間キューブを作成中... {message}')
+    if partial is not None and aggregation_granularity != '選択してください':
+        st.caption(f'途中結果です（データの {progress:.0%} を処理済み）。処理が終わると自動で更新されます。')
+        try:
+            granularity = TIME_SERIES_GRANULARITIES[aggregation_granularity]
+            _render_time_series_result(*time_series_figure(partial, value_col, granularity, heatmap_agg),
+                                       aggregation_granularity)
+        except KeyError:
+            pass # まだ値のない列などは、次の更新で表示する
+
+@profiled('analysis')
+def aggregate_and_plot_time_series(query, max_workers=None):
+    """
+    問い合わせ query の結果の時系列データを指定された粒度で集計し、表とグラフで表示します。
+    集計は生データではなく、問い合わせごとに1度だけ作成する1時間単位の部分集計（時間キューブ）から行うため、
+    粒度を切り替えても生データの再走査は発生しません。行を取り出すのは時間キューブがまだない場合だけで、
+    その場合もタイムスタンプ列と数値列だけを取り出します。
+    行数が多い場合、時間キューブは max_workers 個のワーカープロセスで行を分割して作成します。
+    大きなデータでは時間キューブの作成をバックグラウンドのジョブで行い、処理済みの範囲の途中結果を表示します
+    （タイムスタンプ列やデータセットを変えると、以前のジョブは取り消されます）。
     """
     st.write('タイムスタンプ列と数値列を選択し、集計粒度を指定してプロットします。')
 
-    columns = df.columns.tolist()
+    numeric_columns = _numeric_columns(query)
+    columns = [col for col, dtype in query.dataset.typed.dtypes.items()
+               if col in numeric_columns or pd.api.types.is_datetime64_any_dtype(dtype)]
 
     time_col = st.selectbox('タイムスタンプ列を選択してください:', columns)
-    numeric_columns = df.select_dtypes(include=['number']).columns.tolist() # Numeric columns here
     value_col = st.selectbox('値を計算したい数値列を選択してください:', numeric_columns)
 
     if not time_col or not value_col:
@@ -92,108 +461,47 @@ def aggregate_and_plot_time_series(df):
         return
 
     try:
-        df_copy = df.copy() # 元のDataFrameを変更しないようにコピー
-        df_copy[time_col] = pd.to_datetime(df_copy[time_col])
+        dataset_key = query.key
+        # 全数値列の時間キューブ（作成済みならそれを使い、行は取り出さない）
+        cube = cached_time_cube(dataset_key, time_col)
+        view = query.select([time_col] + [col for col in numeric_columns if col != time_col])
+        job = None
+        if cube is None and query.count() >= BACKGROUND_MIN_ROWS:
+            # 行の取り出しもジョブの中で行う
+            job = submit_job(('time_cube', dataset_key, time_col), _time_cube_job,
+                             view, time_col, max_workers, slot=_session_slot('time_cube'))
+            status, _, _, _, result, error = job.snapshot()
+            if status == JOB_DONE:
+                cube, job = result, None
+            elif status == JOB_FAILED:
+                raise error
+        elif cube is None:
+            cube = dataset_time_cube(view.collect(), dataset_key=dataset_key, time_col=time_col,
+                                     max_workers=max_workers)
 
         aggregation_granularity = st.selectbox(
             '集計粒度を選択してください:',
-            (
-                '選択してください',
-                '日ごとの時間帯別平均',
-                '時間帯別平均 (全期間)',
-                '日別平均',
-                '曜日別平均',
-                '月別平均',
-                '年別平均'
-            )
+            ('選択してください', *TIME_SERIES_GRANULARITIES)
         )
 
-        if aggregation_granularity != '選択してください':
-            st.write(f'**{aggregation_granularity} の集計結果**')
-            aggregated_df = None
-            plot_title = ""
-            x_label = ""
-            y_label = f'{value_col}の平均'
-            # plotly.express はファイルの先頭でインポート済
-
-            if aggregation_granularity == '日ごとの時間帯別平均':
-                df_copy['hour'] = df_copy[time_col].dt.hour
-                df_copy['date'] = df_copy[time_col].dt.date
-                aggregated_df = df_copy.pivot_table(
-                    values=value_col,
-                    index='hour',
-                    columns='date',
-                    aggfunc='mean'
-                )
-                st.subheader('集計結果（表）')
-                st.dataframe(aggregated_df)
-
-                df_plot_heatmap = aggregated_df.reset_index().melt(
-                    id_vars='hour',
-                    var_name='Date',
-                    value_name='Average_Value'
-                )
-                fig = px.density_heatmap(
-                    df_plot_heatmap,
-                    x='Date',
-                    y='hour',
-                    z='Average_Value',
-                    title=f'日ごとの時間帯別平均 {value_col}',
-                    labels={'hour': '時間帯 (h)', 'Date': '日付', 'Average_Value': y_label}
-                )
-                fig.update_layout(title_x=0.5) # タイトル中央寄せ
-                st.plotly_chart(fig, use_container_width=True)
-                st.info("ヒートマップは、日ごとの時間帯別のパターンを視覚的に把握するのに適しています。")
-
-            else: # その他の粒度
-                if aggregation_granularity == '時間帯別平均 (全期間)':
-                    df_copy['period'] = df_copy[time_col].dt.hour
-                    plot_title = f'全期間における時間帯別平均 {value_col}'
-                    x_label = '時間帯 (h)'
-                elif aggregation_granularity == '日別平均':
-                    df_copy['period'] = df_copy[time_col].dt.date
-                    plot_title = f'日別平均 {value_col}'
-                    x_label = '日付'
-                elif aggregation_granularity == '曜日別平均':
-                    df_copy['period'] = df_copy[time_col].dt.day_name()
-                    categories = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-                    df_copy['period'] = pd.Categorical(df_copy['period'], categories=categories, ordered=True)
-                    plot_title = f'曜日別平均 {value_col}'
-                    x_label = '曜日'
-                elif aggregation_granularity == '月別平均':
-                    df_copy['period'] = df_copy[time_col].dt.to_period('M').astype(str)
-                    plot_title = f'月別平均 {value_col}'
-                    x_label = '月'
-                elif aggregation_granularity == '年別平均':
-                    df_copy['period'] = df_copy[time_col].dt.year
-                    plot_title = f'年別平均 {value_col}'
-                    x_label = '年'
-
-                aggregated_df = df_copy.groupby('period')[value_col].mean().reset_index()
-                aggregated_df.columns = ['Period', 'Average_Value']
-
-                st.subheader('集計結果（表）')
-                st.dataframe(aggregated_df)
-
-                if aggregation_granularity in ['日別平均', '月別平均', '年別平均', '時間帯別平均 (全期間)']:
-                    fig = px.line(
-                        aggregated_df,
-                        x='Period',
-                        y='Average_Value',
-                        title=plot_title,
-                        labels={'Period': x_label, 'Average_Value': y_label}
-                    )
-                else: # 曜日別平均などは棒グラフの方が自然
-                    fig = px.bar(
-                        aggregated_df,
-                        x='Period',
-                        y='Average_Value',
-                        title=plot_title,
-                        labels={'Period': x_label, 'Average_Value': y_label}
-                    )
-                fig.update_layout(title_x=0.5) # タイトル中央寄せ
-                st.plotly_chart(fig, use_container_width=True)
+        heatmap_agg = AGG_MEAN
+        if aggregation_granularity == '日ごとの時間帯別平均':
+            heatmap_agg = st.selectbox(
+                'ヒートマップの各セルの集計方法:',
+                list(AGGREGATION_LABELS),
+                format_func=lambda agg: AGGREGATION_LABELS[agg]
+            )
 
+        if job is not None:
+            # 実行中のジョブの進捗と途中結果だけを一定間隔で更新する（スクリプト全体はブロックしない）
+            st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)(_render_time_series_job)(
+                job.key, value_col, aggregation_granularity, heatmap_agg
+            )
+        elif aggregation_granularity != '選択してください':
+            aggregated_df, fig = time_series_figure(
+                cube, value_col, TIME_SERIES_GRANULARITIES[aggregation_granularity], heatmap_agg
+            )
+            _render_time_series_result(aggregated_df, fig, aggregation_granularity)
         else:
             st.info('集計粒度を選択してください。')
 
@@ -203,18 +511,81 @@ def aggregate_and_plot_time_series(df):
         st.error(f"分析中にエラーが発生しました: {e}")
         st.info("選択したタイムスタンプ列が正しい形式か、数値データ列が数値型か確認してください。")
 
-def perform_advanced_statistics(df):
+def _statistics_job(job, query):
+    """
+    バックグラウンドで問い合わせの結果を取り出して全数値列の積和の集計と分位点スケッチを作成し、
+    チャンクごとに途中の集計を報告します。
+    """
+    df = query.collect()
+    n_rows = len(df)
+
+    def report(rows_done, moments, sketches):
+        job.report(rows_done / n_rows if n_rows else 1.0, partial=(moments, sketches),
+                   message=f'{rows_done:,} / {n_rows:,} 行を集計済み')
+
+    moments, sketches = summarize_chunks(iter_row_chunks(df, _progress_chunk_rows(n_rows)), progress_callback=report)
+    seed_pairwise_moments(query.key, moments)
+    seed_quantile_sketches(query.key, sketches)
+    return moments, sketches
+
+def _query_statistics(query, columns):
+    """
+    問い合わせの結果の全数値列の積和の集計と、columns の分位点スケッチを返します。
+    集計済みであればキャッシュから取り出し、まだない場合だけ問い合わせから行を取り出して計算します。
     """
-    データフレームに対して高度な統計分析（記述統計量、相関行列）を実行し、表示します。
+    moments = cached_pairwise_moments(query.key)
+    sketches = cached_quantile_sketches(query.key) or {}
+    if moments is not None and all(col in sketches for col in columns):
+        return moments, {col: sketches[col] for col in columns}
+    df = query.collect()
+    return get_pairwise_moments(df, query.key), get_quantile_sketches(df, query.key, columns)
+
+def _render_statistics_job(job_key, cols_for_describe):
+    """実行中の統計量の集計ジョブの進捗と、処理済みの範囲での記述統計量を表示します（フラグメントとして再実行）。"""
+    job = get_job(job_key)
+    if job is None:
+        st.rerun()
+    status, progress, message, partial, _, _ = job.snapshot()
+    if status != JOB_RUNNING:
+        st.rerun()
+
+    st.progress(progress, text=f'統計量を集計中... {message}')
+    if partial is not None and cols_for_describe:
+        moments, sketches = partial
+        st.caption(f'途中結果です（データの {progress:.0%} を処理済み）。処理が終わると自動で更新されます。')
+        st.dataframe(describe_from_statistics(moments, sketches, cols_for_describe))
+
+@profiled('analysis')
+def perform_advanced_statistics(query):
+    """
+    問い合わせ query の結果に対して高度な統計分析（記述統計量、相関行列）を実行し、表示します。
+    件数・平均・標準偏差・最小・最大と相関行列は、データセットごとに保持する積和の集計から、
+    四分位数は列ごとの分位点スケッチから計算します（追記モードでは追加分だけが集計に加算されます）。
+    選択する列を変えても、集計済みの行列やスケッチから取り出すだけで再計算はしません。
+    行を取り出すのは集計がまだない場合だけで、その場合も数値列だけを取り出します。
+    大きなデータでは集計をバックグラウンドのジョブで行い、処理済みの範囲の途中結果を表示します。
     """
     st.write('選択した数値列の基本的な統計量と相関行列を計算し表示します。')
 
-    numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
+    numeric_columns = _numeric_columns(query)
 
     if not numeric_columns:
         st.warning("データフレームに数値型の列が見つかりません。統計分析を実行できません。")
         return
 
+    view = query.select(numeric_columns)
+    stats_key = view.key
+    job = None
+    if ((cached_pairwise_moments(stats_key) is None or cached_quantile_sketches(stats_key) is None)
+            and query.count() >= BACKGROUND_MIN_ROWS):
+        job = submit_job(('statistics', stats_key), _statistics_job, view, slot=_session_slot('statistics'))
+        status, _, _, _, _, error = job.snapshot()
+        if status == JOB_DONE:
+            job = None
+        elif status == JOB_FAILED:
+            st.error(f"統計量の集計中にエラーが発生しました: {error}")
+            return
+
     st.subheader('1. 基本的な記述統計量')
     st.info("選択した数値列の合計、平均、標準偏差、最小値、最大値などを表示します。")
 
@@ -224,11 +595,13 @@ def perform_advanced_statistics(df):
         default=numeric_columns # デフォルトで全ての数値列を選択
     )
 
-    if cols_for_describe:
+    if job is not None:
+        st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)(_render_statistics_job)(job.key, cols_for_describe)
+    elif cols_for_describe:
         try:
-            # df.describe()で記述統計量を計算
-            descriptive_stats = df[cols_for_describe].describe()
-            st.dataframe(descriptive_stats)
+            # df.describe() と同じ形の記述統計量（積和の集計と分位点スケッチから計算）
+            moments, sketches = _query_statistics(view, cols_for_describe)
+            st.dataframe(describe_from_statistics(moments, sketches, cols_for_describe))
         except Exception as e:
             st.error(f"記述統計量の計算中にエラーが発生しました: {e}")
             st.info("選択した列がすべて数値データであることを確認してください。")
@@ -247,22 +620,26 @@ def perform_advanced_statistics(df):
     if st.button('相関行列を計算しプロット'):
         if len(cols_for_correlation) >= 2:
             try:
-                # 相関行列を計算
-                correlation_matrix = df[cols_for_correlation].corr()
+                # 相関行列を計算（積和の集計から、選択された列の分だけ取り出して計算）
+                if job is not None:
+                    # 集計の途中であれば、処理済みの範囲での相関を表示する
+                    _, progress, _, partial, _, _ = job.snapshot()
+                    if partial is None:
+                        st.info('統計量の集計を開始したところです。しばらくしてから再度お試しください。')
+                        return
+                    correlation_matrix = partial[0].correlation(cols_for_correlation)
+                    fig = correlation_figure(correlation_matrix)
+                    st.caption(f'途中結果です（データの {progress:.0%} を処理済み）。')
+                else:
+                    moments, _ = _query_statistics(view, [])
+                    correlation_matrix = moments.correlation(cols_for_correlation)
+                    fig = correlation_figure(correlation_matrix)
 
                 st.subheader('相関行列（表）')
                 st.dataframe(correlation_matrix)
 
                 # 相関行列をヒートマップで可視化
-                fig_corr_heatmap = px.imshow(
-                    correlation_matrix,
-                    text_auto=True, # セルに値を自動表示
-                    aspect="auto", # アスペクト比を自動調整
-                    title='選択された列間の相関行列',
-                    color_continuous_scale=px.colors.sequential.Viridis # カラーバーのスケール
-                )
-                fig_corr_heatmap.update_layout(title_x=0.5) # タイトル中央寄せ
-                st.plotly_chart(fig_corr_heatmap, use_container_width=True)
+                plotly_chart(fig, use_container_width=True)
 
             except Exception as e:
                 st.error(f"相関行列の計算またはプロット中にエラーが発生しました: {e}")
@@ -270,15 +647,50 @@ def perform_advanced_statistics(df):
         else:
             st.warning("相関を計算するには、2つ以上の数値列を選択してください。")
 
-def apply_filters(df):
+# 絞り込みの条件（filter_bitmap に渡す）。
+# (FILTER_RANGE, 列, 下限, 上限, 上限を含むか) または (FILTER_ISIN, 列, 値のタプル)
+FILTER_RANGE = 'range'
+FILTER_ISIN = 'isin'
+
+@computation('filter')
+def filter_bitmap(df, dataset_key, conditions):
+    """
+    全ての条件を満たす行のビットマップを返します（条件がなければ None）。
+    条件は列ごとのインデックス（データセットごとに1回だけ作成）でビットマップにし、その論理積をとります。
+    """
+    bitmaps = []
+    for condition in conditions:
+        kind, col = condition[0], condition[1]
+        index = get_column_index(df, col, dataset_key)
+        if kind == FILTER_RANGE:
+            low, high, inclusive_high = condition[2:]
+            bitmaps.append(index.range_bitmap(low, high, inclusive_high=inclusive_high))
+        elif kind == FILTER_ISIN:
+            bitmaps.append(index.isin_bitmap(list(condition[2])))
+        else:
+            raise ValueError(f'未対応の絞り込みの条件です: {kind}')
+    return bitmap_and(bitmaps)
+
+@profiled('filter')
+def apply_filters(df, dataset_key=None):
     """
     データフレームにフィルタリングオプションを適用し、フィルタリング後のDataFrameを返します。
+    条件の選択は select_filter_bitmap で行い、最後に1回だけ行を取り出します。
+    """
+    return materialize(df, select_filter_bitmap(df, dataset_key))
+
+@profiled('filter')
+def select_filter_bitmap(df, dataset_key=None):
+    """
+    サイドバーにフィルタリングオプションを表示し、条件を満たす行のビットマップを返します（条件がなければ None）。
+    ウィジェットで選んだ条件を filter_bitmap で列ごとのインデックス（数値・日時はソート済み配列、
+    カテゴリは整数コードとビットマップ）からビットマップにします。行の取り出しは呼び出し側で行います
+    （dataset.Dataset.filtered に渡すと、絞り込んだ結果をデータセットのビューとして保持します）。
+    dataset_key を省略した場合は DataFrame の内容からフィンガープリントを計算します。
     """
     st.sidebar.subheader('データフィルタリング')
     st.sidebar.write('---')
 
-    filtered_df = df.copy() # 元のデータフレームを直接変更しないようにコピー
-
     # フィルタリングオプションの選択
     filter_options = st.sidebar.multiselect(
         'フィルタリングしたい列を選択してください:',
@@ -287,21 +699,30 @@ def apply_filters(df):
 
     if not filter_options:
         st.sidebar.info("フィルタリングする列を選択してください。")
-        return filtered_df # フィルタリングする列が選択されていなければ、元のDataFrameを返す
+        return None # フィルタリングする列が選択されていなければ、条件なし
+
+    if dataset_key is None:
+        dataset_key = frame_fingerprint(df)
+
+    conditions = [] # 列ごとの条件（filter_bitmap に渡す）
 
     # 各選択された列に対するフィルタリングUIとロジック
     for col in filter_options:
         col_type = df[col].dtype
+        index = get_column_index(df, col, dataset_key)
 
         with st.sidebar.expander(f"'{col}' でフィルタリング"):
             if pd.api.types.is_numeric_dtype(col_type):
                 # 数値列のフィルタリング
-                min_val = float(df[col].min())
-                max_val = float(df[col].max())
-                
+                if index.min is None:
+                    st.warning(f"'{col}' 列に有効な数値データが見つかりません。")
+                    continue
+                min_val = float(index.min)
+                max_val = float(index.max)
+
                 # スライダーのステップサイズを調整（整数なら1、小数なら0.1など）
                 step = 1.0
-                if df[col].apply(lambda x: isinstance(x, (int, float)) and not float(x).is_integer()).any():
+                if index.has_fraction:
                     step = (max_val - min_val) / 100.0 # 小数を含む場合、より細かいステップ
 
                 # 最小値と最大値が同じ場合はスライダーを無効化
@@ -317,36 +738,26 @@ def apply_filters(df):
                         step=step,
                         key=f'slider_{col}' # ユニークなキーを設定
                     )
-                filtered_df = filtered_df[
-                    (filtered_df[col] >= selected_range[0]) &
-                    (filtered_df[col] <= selected_range[1])
-                ]
+                conditions.append((FILTER_RANGE, col, selected_range[0], selected_range[1], True))
 
-            elif pd.api.types.is_object_dtype(col_type) or pd.api.types.is_string_dtype(col_type) or pd.api.types.is_categorical_dtype(col_type):
+            elif pd.api.types.is_object_dtype(col_type) or pd.api.types.is_string_dtype(col_type) or isinstance(col_type, pd.CategoricalDtype):
                 # カテゴリ列のフィルタリング
-                unique_values = df[col].unique().tolist()
+                unique_values = index.categories
                 selected_values = st.multiselect(
                     f'{col} の値を選択:',
                     unique_values,
                     default=unique_values,
                     key=f'multiselect_{col}' # ユニークなキーを設定
                 )
-                if selected_values:
-                    filtered_df = filtered_df[filtered_df[col].isin(selected_values)]
-                else:
+                if not selected_values:
                     st.warning(f"'{col}' の値が選択されていません。この列のデータはすべて除外されます。")
-                    filtered_df = pd.DataFrame(columns=df.columns) # 全て除外された場合は空のDataFrame
+                conditions.append((FILTER_ISIN, col, tuple(selected_values)))
 
             elif pd.api.types.is_datetime64_any_dtype(col_type):
-                # 日付列のフィルタリング
-                # 日付列をdatetime型に変換（エラーを無視して変換できないものはNaTにする）
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-                
-                # 有効な日付のみを対象にする
-                valid_dates = df[col].dropna()
-                if not valid_dates.empty:
-                    min_date = valid_dates.min().date()
-                    max_date = valid_dates.max().date()
+                # 日付列のフィルタリング（有効な日付のみを対象にする）
+                if index.min is not None:
+                    min_date = pd.Timestamp(index.min).date()
+                    max_date = pd.Timestamp(index.max).date()
 
                     if min_date == max_date:
                         st.write(f"この列の日付はすべて {min_date} です。")
@@ -370,15 +781,18 @@ def apply_filters(df):
                             start_date = min_date
                             end_date = max_date
 
-                    # 日付でフィルタリング
-                    filtered_df = filtered_df[
-                        (filtered_df[col].dt.date >= start_date) &
-                        (filtered_df[col].dt.date <= end_date)
-                    ]
+                    # 日付でフィルタリング（終了日はその日の終わりまでを含めるため、翌日0時未満とする）
+                    conditions.append((
+                        FILTER_RANGE, col,
+                        np.datetime64(pd.Timestamp(start_date)),
+                        np.datetime64(pd.Timestamp(end_date) + pd.Timedelta(days=1)),
+                        False
+                    ))
                 else:
                     st.warning(f"'{col}' 列に有効な日付データが見つかりません。")
 
             else:
                 st.info(f"'{col}' 列のデータ型 ({col_type}) は現在サポートされていません。")
 
-    return filtered_df
\ No newline at end of file
+    # 全ての条件の論理積をとる
+    return filter_bitmap(df, dataset_key=dataset_key, conditions=conditions)
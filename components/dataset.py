@@ -0,0 +1,178 @@
+# components/dataset.py
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    import resource # プロセスのピーク RSS の取得に使う（Windows にはない）
+except ImportError:
+    resource = None
+
+from components.cache import column_nbytes
+from components.filter_index import materialize
+from components.fingerprint import get_fingerprint
+from components.type_inference import convert_column_types
+
+# データセットごとに保持する行の絞り込み結果の数（絞り込み結果は選ばれた行の分だけ配列を持つため少なくする）。
+# データセットは dataset_registry で複数のセッションから共有されるため、同時に使われる条件の数に合わせている
+MAX_FILTERED_VIEWS = 4
+
+
+def _column_buffer(series):
+    """列のデータを保持している配列（同じ配列を参照する列どうしを重複して数えないための識別に使う）。"""
+    values = series.array
+    if isinstance(values, pd.Categorical):
+        return values.codes
+    if hasattr(values, 'asi8'):
+        # 日時・時間差の列（タイムゾーン付きを含む）はコピーせずに int64 の配列として参照できる
+        return values.asi8
+    return series.to_numpy()
+
+
+def frame_buffers(df):
+    """DataFrame の列が参照している配列ごとのバイト数を {(アドレス, バイト数): 保持バイト数} で返します。"""
+    buffers = {}
+    for col in df.columns:
+        series = df[col]
+        buffer = _column_buffer(series)
+        identity = (buffer.__array_interface__['data'][0], buffer.nbytes)
+        if identity not in buffers:
+            buffers[identity] = column_nbytes(series)
+    return buffers
+
+
+class Dataset:
+    """
+    読み込んだデータの正本（作成後は変更しない）。dataset_registry を通じて、同じデータを開いた全てのセッションで共有します。
+
+    型変換済みの DataFrame を正本とし、型変換・列の射影・行の絞り込みといった派生ビューは
+    最初に要求されたときに作成して保持します。各コンポーネントはこのビューを共有し、全体のコピーは作りません。
+    ビューは正本の列の配列をそのまま参照する浅いコピーで、行を絞り込んだビューだけが選ばれた行の分の配列を持ちます。
+    返すビューの列を追加・削除しても正本には影響しませんが、列の値を直接書き換えてはいけません。
+    """
+
+    def __init__(self, df, key, typed=False):
+        self.key = key
+        self._raw = None if typed else df
+        self._typed = df if typed else None
+        self._typed_buffers = None
+        self._filtered = OrderedDict() # ビットマップのハッシュ -> (ビューのキー, DataFrame, 配列ごとのバイト数)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        frame = self._typed if self._typed is not None else self._raw
+        return len(frame)
+
+    def _typed_frame(self):
+        with self._lock:
+            if self._typed is None:
+                self._typed = convert_column_types(self._raw, self.key)
+                # 型変換後は元の DataFrame を参照しない（読み込みキャッシュから外れればメモリが解放される）
+                self._raw = None
+            return self._typed
+
+    @property
+    def typed(self):
+        """列の型を推論して変換した DataFrame（正本を参照する浅いコピー）。"""
+        return self._typed_frame().copy(deep=False)
+
+    @property
+    def fingerprint(self):
+        """
+        型変換済みの DataFrame の列ごとのフィンガープリント（最初に要求されたときに計算し、キーごとにキャッシュします）。
+        これがあると、図や集計のキャッシュキーが使う列の値だけから決まるようになります（fingerprint.scoped_key）。
+        """
+        return get_fingerprint(self._typed_frame(), self.key)
+
+    def project(self, columns):
+        """指定した列だけの DataFrame を返します（列の配列はコピーしません）。"""
+        typed = self._typed_frame()
+        return pd.DataFrame({col: typed[col] for col in columns}, index=typed.index, copy=False)
+
+    def filtered(self, bitmap):
+        """
+        ビットマップ（filter_index の形式、None は条件なし）で行を絞り込んだビューとそのキーを (キー, DataFrame) で返します。
+        キーは集計や図のキャッシュに使うもので、条件がなければデータセットのキーそのものです。
+        """
+        if bitmap is None:
+            return self.key, self.typed
+        digest = hashlib.blake2b(bitmap.tobytes(), digest_size=16).hexdigest()
+        with self._lock:
+            entry = self._filtered.get(digest)
+            if entry is not None:
+                self._filtered.move_to_end(digest)
+                return entry[0], entry[1].copy(deep=False)
+
+        view = materialize(self._typed_frame(), bitmap)
+        view_key = ('filtered', self.key, digest)
+        with self._lock:
+            self._filtered[digest] = (view_key, view, frame_buffers(view))
+            while len(self._filtered) > MAX_FILTERED_VIEWS:
+                self._filtered.popitem(last=False)
+        return view_key, view.copy(deep=False)
+
+    def memory_usage(self):
+        """
+        正本と派生ビューが保持しているバイト数を返します。
+        resident は同じ配列を参照する列を1回だけ数えた合計です（ビューの多くは正本の配列を共有するため）。
+        """
+        raw_buffers, typed_buffers, filtered_buffers = self._view_buffers()
+        return {
+            'raw': sum(raw_buffers.values()),
+            'typed': sum(typed_buffers.values()),
+            'filtered': sum(sum(buffers.values()) for buffers in filtered_buffers),
+            'resident': sum(self.resident_buffers().values()),
+        }
+
+    def resident_buffers(self):
+        """正本と派生ビューが参照している配列ごとのバイト数（frame_buffers の形式、同じ配列は1回だけ）。"""
+        raw_buffers, typed_buffers, filtered_buffers = self._view_buffers()
+        resident = {}
+        for buffers in [raw_buffers, typed_buffers] + filtered_buffers:
+            resident.update(buffers)
+        return resident
+
+    def _view_buffers(self):
+        with self._lock:
+            raw, typed = self._raw, self._typed
+            if typed is not None and self._typed_buffers is None:
+                self._typed_buffers = frame_buffers(typed)
+            typed_buffers = self._typed_buffers or {}
+            filtered_buffers = [entry[2] for entry in self._filtered.values()]
+        raw_buffers = frame_buffers(raw) if raw is not None else {}
+        return raw_buffers, typed_buffers, filtered_buffers
+
+
+def process_rss_bytes():
+    """現在のプロセスの RSS（バイト）。取得できない環境では None を返します。"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def process_peak_rss_bytes():
+    """プロセス開始以降のピーク RSS（バイト）。取得できない環境では None を返します。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux ではキロバイト単位、macOS ではバイト単位
+    return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+
+
+def record_session_rss(state, name='peak_rss_bytes'):
+    """
+    現在の RSS を測り、state（st.session_state など）に記録しているセッションのピークを更新して返します。
+    セッションはプロセスを共有するため、値はこのセッションの実行中に観測したプロセス全体の RSS の最大値です。
+    """
+    rss = process_rss_bytes()
+    if rss is not None:
+        state[name] = max(state.get(name, 0), rss)
+    return state.get(name)
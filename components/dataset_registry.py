@@ -0,0 +1,161 @@
+# components/dataset_registry.py
+
+import threading
+import time
+import weakref
+
+from components.dataset import Dataset
+
+# どのセッションからも参照されなくなったデータセットを、この秒数が経過した後に破棄する
+DATASET_IDLE_EVICT_SECONDS = 600
+
+_entries = {} # データセットのキー -> _RegistryEntry
+# ハンドルの破棄（weakref.finalize）はガベージコレクションでロックを保持中のスレッドからも呼ばれうるため、再入できるロックにする
+_registry_lock = threading.RLock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_eviction_timer = None # 参照が外れたデータセットを期限に破棄するタイマー（期限の来ていないものがなければ None）
+
+
+class _RegistryEntry:
+    def __init__(self, key):
+        self.key = key
+        self.dataset = None
+        self.refcount = 0
+        self.idle_since = None # 参照が 0 になった時刻
+        self.ready = threading.Event() # 読み込みが終わった（失敗した場合も含む）
+
+
+class DatasetHandle:
+    """
+    セッションが共有データセットを参照していることを表すハンドル。st.session_state に保持します。
+    release() を呼ぶか、セッションの終了でハンドルが破棄されると参照が外れます（どちらか1回だけ数えます）。
+    """
+
+    def __init__(self, key, dataset):
+        self.key = key
+        self.dataset = dataset
+        self._finalizer = weakref.finalize(self, _release, key)
+
+    def release(self):
+        self._finalizer()
+
+
+def acquire_dataset(key, load, typed=False):
+    """
+    キー（ファイル内容のハッシュなど）に対応する共有データセットへのハンドルを返します。
+    登録されていなければ load() で DataFrame を読み込んで登録します。同じキーを同時に要求したセッションは、
+    最初のセッションの読み込みを待って同じ Dataset を参照します（セッションごとの複製は作りません）。
+    typed=True は load() が型変換済みの DataFrame を返す場合に指定します。
+    load() が None を返した場合は ValueError を送出し、データセットを登録しません。
+    """
+    evict_idle_datasets()
+    with _registry_lock:
+        entry = _entries.get(key)
+        owner = entry is None
+        if owner:
+            entry = _RegistryEntry(key)
+            _entries[key] = entry
+            _stats['misses'] += 1
+        else:
+            _stats['hits'] += 1
+        entry.refcount += 1
+        entry.idle_since = None
+
+    if owner:
+        try:
+            df = load()
+            if df is None:
+                raise ValueError('データを読み込めませんでした。')
+            entry.dataset = Dataset(df, key, typed=typed)
+        except BaseException:
+            with _registry_lock:
+                _entries.pop(key, None)
+            raise
+        finally:
+            entry.ready.set()
+    else:
+        entry.ready.wait()
+        if entry.dataset is None:
+            # 先に読み込みを始めたセッションが失敗した場合は、このセッションで読み込み直す
+            with _registry_lock:
+                _stats['hits'] -= 1
+            return acquire_dataset(key, load, typed=typed)
+    return DatasetHandle(key, entry.dataset)
+
+
+def _release(key):
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return
+        entry.refcount = max(entry.refcount - 1, 0)
+        if entry.refcount == 0:
+            entry.idle_since = time.monotonic()
+            _schedule_eviction(entry.idle_since)
+
+
+def _schedule_eviction(now):
+    """
+    参照が外れたデータセットのうち最も早く期限が来るものに合わせて、破棄のタイマーを設定します（_registry_lock を保持して呼ぶ）。
+    新しいセッションが来なくても、期限が来たデータセットは破棄されます。
+    """
+    global _eviction_timer
+    if _eviction_timer is not None:
+        return # 設定済みのタイマーの方が期限が早い（破棄した後に残りの分を設定し直す）
+    due = [entry.idle_since + DATASET_IDLE_EVICT_SECONDS for entry in _entries.values()
+           if entry.refcount == 0 and entry.idle_since is not None]
+    if not due:
+        return
+    timer = threading.Timer(max(min(due) - now, 0), _on_eviction_timer)
+    timer.daemon = True
+    try:
+        timer.start()
+    except RuntimeError: # インタプリタの終了中はスレッドを作れない
+        return
+    _eviction_timer = timer
+
+
+def _on_eviction_timer():
+    global _eviction_timer
+    with _registry_lock:
+        _eviction_timer = None
+    evict_idle_datasets()
+
+
+def evict_idle_datasets(idle_seconds=None):
+    """参照が外れてから idle_seconds（既定は DATASET_IDLE_EVICT_SECONDS）以上経過したデータセットを破棄します。"""
+    if idle_seconds is None:
+        idle_seconds = DATASET_IDLE_EVICT_SECONDS
+    now = time.monotonic()
+    with _registry_lock:
+        idle = [
+            key for key, entry in _entries.items()
+            if entry.refcount == 0 and entry.idle_since is not None and now - entry.idle_since >= idle_seconds
+        ]
+        for key in idle:
+            del _entries[key]
+        _stats['evictions'] += len(idle)
+        _schedule_eviction(now)
+    return len(idle)
+
+
+def registry_stats():
+    """
+    共有データセットの統計を返します。resident_bytes は各データセットの正本と派生ビューが参照している配列の合計で、
+    複数のデータセットが同じ配列を参照している場合（読み込みキャッシュ経由など）も1回だけ数えます。
+    """
+    with _registry_lock:
+        entries = [entry for entry in _entries.values() if entry.dataset is not None]
+        stats = dict(_stats)
+        references = sum(entry.refcount for entry in _entries.values())
+    resident = {}
+    for entry in entries:
+        resident.update(entry.dataset.resident_buffers())
+    requests = stats['hits'] + stats['misses']
+    stats.update({
+        'datasets': len(entries),
+        'references': references,
+        'hit_rate': stats['hits'] / requests if requests else 0.0,
+        'resident_bytes': sum(resident.values()),
+    })
+    return stats
@@ -0,0 +1,271 @@
+# components/dataset_store.py
+
+import json
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from components.time_cube import month_codes, month_labels, wall_clock_ns
+
+# 保存先はアプリ直下の dataset_store/<データセット名>/
+STORE_DIR = Path(__file__).resolve().parent.parent / 'dataset_store'
+METADATA_FILE = 'metadata.json'
+PARTITION_SUFFIX = '.arrow'
+STAGING_SUFFIX = '.tmp' # 書き込み中のデータセットのディレクトリの接尾辞
+NS_PER_UNIT = {'s': 1_000_000_000, 'ms': 1_000_000, 'us': 1_000, 'ns': 1}
+# タイムゾーン付きの列で、パーティションの最小・最大の時刻（瞬間）の現地時刻と、パーティション内の現地時刻の
+# 最小・最大との差の上限（夏時間の切り替えで現地時刻が戻る分）。読み飛ばしの判定をこの分だけ広げる
+WALL_CLOCK_MARGIN = pd.Timedelta(days=1)
+
+
+def _safe_name(name):
+    """データセット名をディレクトリ名として使える形にします。"""
+    name = re.sub(r'[\\/:*?"<>|]', '_', name.strip())
+    if not name or name in ('.', '..') or name.endswith(STAGING_SUFFIX):
+        raise ValueError('データセット名が空、または使用できない名前です。')
+    return name
+
+
+def _dataset_dir(name, store_dir=None):
+    return Path(store_dir or STORE_DIR) / _safe_name(name)
+
+
+def _write_partition(path, df):
+    """DataFrame を非圧縮の Arrow IPC ファイルとして書き出します（再読み込み時にメモリマップでゼロコピーにするため）。"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(str(path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return table.schema
+
+
+def save_dataset(df, name, time_col=None, store_dir=None, source=None):
+    """
+    DataFrame をデータセットとして保存し、メタデータの辞書を返します。
+    time_col を指定すると月ごとのパーティションに分けて保存し、各パーティションの時刻の範囲を記録します
+    （読み込み時にその範囲でパーティションを読み飛ばすため）。同じ名前のデータセットは上書きします。
+    """
+    target = _dataset_dir(name, store_dir)
+    staging = target.with_name(target.name + STAGING_SUFFIX)
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    partitions = []
+    if time_col is not None:
+        timestamps = df[time_col]
+        if not pd.api.types.is_datetime64_any_dtype(timestamps.dtype):
+            raise ValueError(f"'{time_col}' 列は日時型ではないため、パーティション分割に使用できません。")
+        # 月は datetime64 の整数値から求めた月数のコードで分け、安定ソートで各月の行を元の並びのまま取り出す
+        months = month_codes(wall_clock_ns(timestamps))
+        order = np.argsort(months, kind='stable')
+        sorted_months = months[order]
+        boundaries = np.flatnonzero(sorted_months[1:] != sorted_months[:-1]) + 1
+        for start, stop in zip(np.r_[0, boundaries], np.r_[boundaries, len(order)]):
+            if len(order) == 0 or sorted_months[start] == np.iinfo(np.int64).min: # タイムスタンプが欠損の行は別に保存する
+                continue
+            part = df.take(order[start:stop])
+            file_name = f'part-{month_labels([sorted_months[start]])[0]}{PARTITION_SUFFIX}'
+            _write_partition(staging / file_name, part)
+            partitions.append({
+                'file': file_name,
+                'rows': len(part),
+                'min_time': part[time_col].min().isoformat(),
+                'max_time': part[time_col].max().isoformat(),
+            })
+        missing_time = df[timestamps.isna()]
+        if len(missing_time):
+            file_name = f'part-missing{PARTITION_SUFFIX}'
+            _write_partition(staging / file_name, missing_time)
+            partitions.append({'file': file_name, 'rows': len(missing_time), 'min_time': None, 'max_time': None})
+        if not partitions:
+            # 行がない場合も、列の型（スキーマ）を読み込めるように空のパーティションを書き出す
+            file_name = f'part-empty{PARTITION_SUFFIX}'
+            _write_partition(staging / file_name, df)
+            partitions.append({'file': file_name, 'rows': 0, 'min_time': None, 'max_time': None})
+    else:
+        file_name = f'part-0{PARTITION_SUFFIX}'
+        _write_partition(staging / file_name, df)
+        partitions.append({'file': file_name, 'rows': len(df), 'min_time': None, 'max_time': None})
+
+    metadata = {
+        'name': target.name,
+        'columns': [str(col) for col in df.columns],
+        'dtypes': {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+        'rows': len(df),
+        'time_col': time_col,
+        'partitions': partitions,
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'source': source,
+    }
+    with open(staging / METADATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    # 書き込みが完了してから置き換える（途中で失敗しても既存のデータセットは壊れない）
+    if target.exists():
+        shutil.rmtree(target)
+    staging.rename(target)
+    return metadata
+
+
+def list_datasets(store_dir=None):
+    """
+    保存済みデータセットのメタデータのリストを、名前順で返します。
+    書き込み中（または書き込みが中断されて残った）の STAGING_SUFFIX のディレクトリは含めません。
+    """
+    root = Path(store_dir or STORE_DIR)
+    if not root.exists():
+        return []
+    datasets = []
+    for metadata_path in sorted(root.glob(f'*/{METADATA_FILE}')):
+        if metadata_path.parent.name.endswith(STAGING_SUFFIX):
+            continue
+        with open(metadata_path, encoding='utf-8') as f:
+            datasets.append(json.load(f))
+    return datasets
+
+
+def load_metadata(name, store_dir=None):
+    with open(_dataset_dir(name, store_dir) / METADATA_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def delete_dataset(name, store_dir=None):
+    target = _dataset_dir(name, store_dir)
+    if target.exists():
+        shutil.rmtree(target)
+
+
+def _column_tz(metadata):
+    """時刻の列のタイムゾーン（タイムゾーンなしの列は None）。"""
+    dtype = pd.api.types.pandas_dtype(metadata['dtypes'][metadata['time_col']])
+    return getattr(dtype, 'tz', None)
+
+
+def _wall_clock_bound(timestamp, tz):
+    """
+    範囲の境界を、時刻の列の現地時刻（タイムゾーンなし）にします。タイムゾーンなしの境界はそのまま現地時刻とみなし
+    （filter_index と同じ）、タイムゾーン付きの境界は列のタイムゾーンの現地時刻に変換します。
+    """
+    if timestamp is None or timestamp.tz is None:
+        return timestamp
+    return timestamp.tz_convert(tz).tz_localize(None) if tz is not None else timestamp.tz_localize(None)
+
+
+def _overlaps(partition, start, end):
+    """パーティションの時刻の範囲が、現地時刻の [start, end] と重なるかどうか。"""
+    if partition['min_time'] is None:
+        # 時刻が欠損の行だけのパーティションは、範囲指定があれば対象外
+        return start is None and end is None
+    min_time = pd.Timestamp(partition['min_time'])
+    max_time = pd.Timestamp(partition['max_time'])
+    if min_time.tz is not None:
+        # 記録された時刻は UTC からの時差付きなので、時差を外すとその時点の現地時刻になる
+        min_time = min_time.tz_localize(None) - WALL_CLOCK_MARGIN
+        max_time = max_time.tz_localize(None) + WALL_CLOCK_MARGIN
+    if start is not None and max_time < start:
+        return False
+    if end is not None and min_time > end:
+        return False
+    return True
+
+
+def open_dataset_table(name, columns=None, start=None, end=None, store_dir=None):
+    """
+    保存済みデータセットを pyarrow.Table として開きます。
+
+    各パーティションはメモリマップで開くため、読み込んだ列のデータはページキャッシュ上のバッファを
+    そのまま参照します（コピーが発生しない）。
+    columns を指定するとその列だけを読み込み（射影）、start / end を指定すると
+    メタデータの時刻の範囲で重ならないパーティションを読み飛ばしたうえで行を絞り込みます（述語のプッシュダウン）。
+    タイムゾーン付きの時刻の列は、現地時刻で範囲を比較します（タイムゾーンなしの start / end は現地時刻とみなします）。
+    """
+    metadata = load_metadata(name, store_dir)
+    directory = _dataset_dir(name, store_dir)
+    time_col = metadata['time_col']
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    has_range = time_col is not None and (start is not None or end is not None)
+    if has_range:
+        tz = _column_tz(metadata)
+        start, end = _wall_clock_bound(start, tz), _wall_clock_bound(end, tz)
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns)
+        if has_range and time_col not in read_columns:
+            read_columns.append(time_col)
+
+    tables = []
+    for partition in metadata['partitions']:
+        if has_range and not _overlaps(partition, start, end):
+            continue
+        source = pa.memory_map(str(directory / partition['file']), 'r')
+        table = pa.ipc.open_file(source).read_all()
+        if read_columns is not None:
+            table = table.select(read_columns)
+        if has_range:
+            table = table.filter(_time_predicate(table, time_col, start, end))
+        tables.append(table)
+
+    if not tables:
+        schema_source = pa.memory_map(str(directory / metadata['partitions'][0]['file']), 'r')
+        schema = pa.ipc.open_file(schema_source).schema
+        table = schema.empty_table()
+        return table.select(list(columns)) if columns is not None else table
+
+    table = pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+    if columns is not None and read_columns != list(columns):
+        table = table.select(list(columns))
+    return table
+
+
+def _time_predicate(table, time_col, start, end):
+    """
+    時刻の列が [start, end] に入る行のマスク。境界は列の単位（秒・ミリ秒など）の整数に丸めてから比較します。
+    下限は切り上げ、上限は切り捨てにするため、ナノ秒で比較した場合と同じ行が選ばれます。
+    タイムゾーン付きの列は現地時刻（タイムゾーンなし）にしてから、現地時刻の start / end と比較します。
+    """
+    column = table[time_col]
+    if column.type.tz is not None:
+        column = pc.local_timestamp(column)
+    ns_per_unit = NS_PER_UNIT[column.type.unit]
+
+    def as_scalar(timestamp, round_up):
+        ns = timestamp.as_unit('ns').value
+        value = -(-ns // ns_per_unit) if round_up else ns // ns_per_unit
+        return pa.scalar(value, type=column.type)
+
+    mask = None
+    if start is not None:
+        mask = pc.greater_equal(column, as_scalar(start, round_up=True))
+    if end is not None:
+        upper = pc.less_equal(column, as_scalar(end, round_up=False))
+        mask = upper if mask is None else pc.and_(mask, upper)
+    return mask
+
+
+def open_dataset(name, columns=None, start=None, end=None, store_dir=None):
+    """
+    保存済みデータセットを DataFrame として開きます（引数は open_dataset_table と同じ）。
+    パーティションが1つで欠損のない数値列は、メモリマップ上のバッファをそのまま使います。
+    """
+    table = open_dataset_table(name, columns=columns, start=start, end=end, store_dir=store_dir)
+    # split_blocks=True で列ごとのブロックのまま変換し、同じ型の列をまとめる際のコピーを避ける
+    return table.to_pandas(split_blocks=True)
+
+
+def iter_dataset_chunks(name, columns=None, start=None, end=None, chunk_rows=1_000_000, store_dir=None):
+    """
+    保存済みデータセットを最大 chunk_rows 行ずつの DataFrame として順に返します（引数は open_dataset_table と同じ）。
+    全体を1つの DataFrame にせずに集計する場合に使います（online_stats.summarize_chunks など）。
+    """
+    table = open_dataset_table(name, columns=columns, start=start, end=end, store_dir=store_dir)
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        yield batch.to_pandas(split_blocks=True)
@@ -0,0 +1,183 @@
+# components/downsampling.py
+
+import numpy as np
+import pandas as pd
+
+# グラフの横幅（ピクセル）から表示点数の上限を決めるための係数
+DEFAULT_CHART_WIDTH_PX = 1200
+LINE_POINTS_PER_PIXEL = 2 # 折れ線: 1ピクセルあたり最小値・最大値の2点あれば見た目は変わらない
+SCATTER_POINTS_PER_PIXEL = 20 # 散布図: 2次元に広がるので折れ線より多めに残す
+
+METHOD_LTTB = 'lttb'
+METHOD_MINMAX = 'minmax'
+METHOD_GRID = 'grid'
+
+METHOD_LABELS = {
+    METHOD_LTTB: 'LTTB',
+    METHOD_MINMAX: '区間ごとの最小/最大',
+    METHOD_GRID: 'グリッド間引き',
+}
+
+
+def line_point_budget(chart_width_px=DEFAULT_CHART_WIDTH_PX):
+    """折れ線グラフ1系列あたりの表示点数の上限を返します。"""
+    return max(int(chart_width_px * LINE_POINTS_PER_PIXEL), 3)
+
+
+def scatter_point_budget(chart_width_px=DEFAULT_CHART_WIDTH_PX):
+    """散布図全体の表示点数の上限を返します。"""
+    return max(int(chart_width_px * SCATTER_POINTS_PER_PIXEL), 1)
+
+
+def numeric_axis(series, positional_fallback=True):
+    """
+    軸の値を間引き計算用の float 配列に変換します。
+    日時は経過ナノ秒、数値はそのまま、それ以外は行番号（positional_fallback=False ならカテゴリコード）を使います。
+    """
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        values = series.to_numpy(dtype='datetime64[ns]').view(np.int64).astype(np.float64)
+        values[series.isna().to_numpy()] = np.nan
+        return values
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if positional_fallback:
+        return np.arange(len(series), dtype=np.float64)
+    codes, _ = pd.factorize(series)
+    codes = codes.astype(np.float64)
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets で残す行の位置を返します。
+    x は昇順である必要があります（そうでない場合は行番号を渡してください）。
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 先頭と末尾は必ず残し、残りを n_out - 2 個のバケットに分ける
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # 次のバケットの平均点（最後のバケットでは末尾の点）
+        next_start, next_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+        if next_start >= next_stop:
+            next_start, next_stop = n - 1, n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+
+        bucket_x = x[start:stop]
+        bucket_y = y[start:stop]
+        area = np.abs(
+            (x[prev] - avg_x) * (bucket_y - y[prev]) -
+            (x[prev] - bucket_x) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """
+    行を n_out / 2 個の区間に分け、各区間の最小値と最大値の位置を返します。
+    スパイクを確実に残したい計測データ向けです。
+    """
+    n = len(y)
+    n_buckets = max((n_out - 2) // 2, 1) # 先頭・末尾の2点を含めて n_out に収める
+    if n_out >= n:
+        return np.arange(n)
+
+    size = int(np.ceil(n / n_buckets))
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(n_buckets, size)
+    all_nan = np.isnan(blocks).all(axis=1)
+
+    offsets = np.arange(n_buckets) * size
+    arg_min = np.argmin(np.where(np.isnan(blocks), np.inf, blocks), axis=1) + offsets
+    arg_max = np.argmax(np.where(np.isnan(blocks), -np.inf, blocks), axis=1) + offsets
+    # 全て欠損の区間は先頭の位置を残す（欠損による線の切れ目を保つため）
+    arg_min[all_nan] = offsets[all_nan]
+    arg_max[all_nan] = offsets[all_nan]
+
+    indices = np.unique(np.concatenate([arg_min, arg_max, [0, n - 1]]))
+    return indices[indices < n]
+
+
+def downsample_line_indices(x, y, n_out, method=METHOD_LTTB):
+    """
+    折れ線グラフ用に残す行の位置（昇順）を返します。
+    y が欠損の行は LTTB の計算から除外し、x が昇順でない場合は行番号を x として扱います。
+    """
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if method == METHOD_MINMAX:
+        return minmax_indices(y, n_out)
+
+    valid = np.flatnonzero(np.isfinite(y) & np.isfinite(x))
+    if len(valid) <= n_out:
+        return valid
+    xv = x[valid]
+    if not np.all(np.diff(xv) >= 0):
+        xv = valid.astype(np.float64)
+    return valid[lttb_indices(xv, y[valid], n_out)]
+
+
+def grid_thin_indices(x, y, n_out, groups=None, seed=0):
+    """
+    散布図用に、(x, y) 平面をグリッドに区切ってセルごとに最大 k 点だけ残す位置を返します。
+    密集した領域ほど強く間引かれ、まばらな外れ値は残ります。
+    groups（カテゴリコード）を渡すと、色分けごとに別のセルとして扱い少数カテゴリを残します。
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+
+    valid = np.isfinite(x) & np.isfinite(y)
+    positions = np.flatnonzero(valid)
+    if len(positions) <= n_out:
+        return positions
+    xv, yv = x[positions], y[positions]
+
+    grid = max(int(np.sqrt(n_out)), 2)
+    ix = _bin(xv, grid)
+    iy = _bin(yv, grid)
+    cell = ix * grid + iy
+    if groups is not None:
+        cell = cell + groups[positions].astype(np.int64) * (grid * grid)
+
+    order = np.argsort(cell, kind='stable')
+    sorted_cell = cell[order]
+    run_starts = np.flatnonzero(np.r_[True, sorted_cell[1:] != sorted_cell[:-1]])
+    run_lengths = np.diff(np.r_[run_starts, len(sorted_cell)])
+    rank = np.arange(len(sorted_cell)) - np.repeat(run_starts, run_lengths)
+
+    per_cell = max(n_out // len(run_starts), 1)
+    kept = order[rank < per_cell]
+    if len(kept) > n_out:
+        rng = np.random.default_rng(seed)
+        kept = rng.choice(kept, size=n_out, replace=False)
+    return np.sort(positions[kept])
+
+
+def _bin(values, n_bins):
+    lo, hi = values.min(), values.max()
+    if hi <= lo:
+        return np.zeros(len(values), dtype=np.int64)
+    bins = ((values - lo) / (hi - lo) * n_bins).astype(np.int64)
+    return np.minimum(bins, n_bins - 1)
+
+
+def decimation_note(n_shown, n_total, method):
+    """間引きの有無と割合を示す注記文字列を返します。"""
+    label = METHOD_LABELS.get(method, method)
+    return f'表示点数 {n_shown:,} / {n_total:,} ({label}で間引き: {n_shown / n_total:.1%})'
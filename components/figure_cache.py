@@ -0,0 +1,89 @@
+# components/figure_cache.py
+
+import json
+import sys
+
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from components.cache import LRUByteCache
+
+# 作成済みの図（JSON 文字列）のキャッシュ。キーはデータセットのキーとグラフの構造を決めるパラメータ
+FIGURE_CACHE_BUDGET_BYTES = 256 * 1024 * 1024 # 256MB
+_figure_cache = LRUByteCache(FIGURE_CACHE_BUDGET_BYTES, sizeof=sys.getsizeof)
+
+# キャッシュする図はこのテーマで作成し、タイトルや軸ラベルには以下のプレースホルダーを入れておく。
+# 取り出すときにプレースホルダーを実際の文字列に置き換え、テーマを差し替える（トレースは作り直さない）
+BASE_TEMPLATE = 'plotly'
+TITLE_PLACEHOLDER = '@@figure_title@@'
+X_LABEL_PLACEHOLDER = '@@figure_x_label@@'
+Y_LABEL_PLACEHOLDER = '@@figure_y_label@@'
+Z_LABEL_PLACEHOLDER = '@@figure_z_label@@'
+
+
+def get_figure_cache():
+    """図のキャッシュを返します（上限変更や統計の参照用）。"""
+    return _figure_cache
+
+
+def cached_figure(key, build, texts=None, template=None):
+    """
+    キーに対応する図を返します。キャッシュになければ build() で作成して JSON 文字列として保存します。
+    build はテーマを BASE_TEMPLATE、タイトルや軸ラベルをプレースホルダーにして図を作成する関数です。
+    texts は {プレースホルダー: 表示する文字列} で、テーマ（template）とともに取り出した図に適用します。
+    """
+    figure_json = _figure_cache.get(key)
+    if figure_json is None:
+        figure_json = pio.to_json(build(), validate=False)
+        _figure_cache.put(key, figure_json)
+    return apply_cosmetics(figure_json, texts or {}, template)
+
+
+def apply_cosmetics(figure_json, texts, template=None):
+    """
+    JSON 文字列の図のプレースホルダーを置き換え、テーマを適用した go.Figure を返します。
+    プレースホルダーはタイトル・軸ラベル・凡例・ホバーの書式のどこに現れても置き換わります。
+    """
+    for placeholder, text in texts.items():
+        figure_json = figure_json.replace(placeholder, json.dumps(str(text))[1:-1])
+    fig = go.Figure(json.loads(figure_json))
+    _apply_template(fig, template)
+    return fig
+
+
+def _discrete_colors(template):
+    # plotly express と同じ規則（テーマの colorway、なければ D3）
+    return list(template.layout.colorway or px.colors.qualitative.D3)
+
+
+def _continuous_scale(template):
+    sequential = template.layout.colorscale.sequential
+    # plotly express と同じく色のリストを渡し、位置の割り当ては plotly の検証に任せる
+    return [entry[1] for entry in sequential] if sequential else px.colors.sequential.Viridis
+
+
+def _apply_template(fig, template_name):
+    """
+    BASE_TEMPLATE で作成した図にテーマを適用します。
+    plotly express はテーマの色の並びをトレースの色として直接書き込むため、その色も新しいテーマの並びに置き換えます。
+    """
+    template_name = template_name or pio.templates.default or BASE_TEMPLATE
+    if template_name == BASE_TEMPLATE:
+        fig.update_layout(template=BASE_TEMPLATE)
+        return
+    base, target = pio.templates[BASE_TEMPLATE], pio.templates[template_name]
+
+    base_colors = _discrete_colors(base)
+    target_colors = _discrete_colors(target)
+    color_map = {color.lower(): target_colors[i % len(target_colors)] for i, color in enumerate(base_colors)}
+    for trace in fig.data:
+        for part in ('marker', 'line'):
+            style = getattr(trace, part, None)
+            color = getattr(style, 'color', None) if style is not None else None
+            if isinstance(color, str) and color.lower() in color_map:
+                style.color = color_map[color.lower()]
+
+    if fig.layout.coloraxis.colorscale is not None:
+        fig.layout.coloraxis.colorscale = _continuous_scale(target)
+    fig.update_layout(template=template_name)
@@ -0,0 +1,217 @@
+# components/filter_index.py
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache
+from components.fingerprint import ARTIFACT_FILTER_INDEX, record_dependency, scoped_key
+
+# 条件に合う行の割合がこれ未満（またはこれを引いた残りが 1 - これ 超）なら、
+# 列の値を比較せずソート済みの行番号から直接ビットマップを作る
+SCATTER_MAX_FRACTION = 1 / 8
+CATEGORY_BITMAP_MAX = 32 # カテゴリ数がこれ以下なら、カテゴリごとのビットマップを事前に作っておく
+
+FILTER_INDEX_CACHE_BUDGET_BYTES = 512 * 1024 * 1024 # 512MB
+_filter_index_cache = LRUByteCache(FILTER_INDEX_CACHE_BUDGET_BYTES, sizeof=lambda index: index.nbytes)
+
+
+def _empty_bitmap(n_rows):
+    return np.zeros((n_rows + 7) // 8, dtype=np.uint8)
+
+
+def _bitmap_from_positions(positions, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[positions] = True
+    return np.packbits(mask)
+
+
+def bitmap_and(bitmaps):
+    """ビットマップ（np.packbits 形式）の論理積。None（条件なし）は無視し、全て None なら None を返します。"""
+    result = None
+    for bitmap in bitmaps:
+        if bitmap is None:
+            continue
+        result = bitmap.copy() if result is None else np.bitwise_and(result, bitmap, out=result)
+    return result
+
+
+def bitmap_count(bitmap, n_rows):
+    """ビットマップで選択されている行数。"""
+    if bitmap is None:
+        return n_rows
+    return int(np.unpackbits(bitmap, count=n_rows).sum())
+
+
+def materialize(df, bitmap):
+    """ビットマップで選択された行だけの DataFrame を1回の取り出しで作成します（None なら df をそのまま返します）。"""
+    if bitmap is None:
+        return df
+    rows = np.flatnonzero(np.unpackbits(bitmap, count=len(df)))
+    return df.take(rows)
+
+
+class RangeFilterIndex:
+    """
+    数値・日時列の範囲検索用のインデックス。
+    欠損を除いた値のソート済み配列と、その並びの元の行番号を保持し、範囲に入る行数を searchsorted で求めます。
+    元の列がすでに昇順（時系列データのタイムスタンプなど）なら行番号は持たず、範囲は連続した行になります。
+    """
+
+    def __init__(self, series):
+        values = series.to_numpy()
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            if series.dt.tz is not None:
+                values = series.dt.tz_localize(None).to_numpy()
+            present = ~np.isnat(values)
+        else:
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            present = ~np.isnan(values)
+        self.n_rows = len(values)
+        self.values = values # 元の並びの値（範囲の大部分を選ぶときの比較に使う）
+        if present.all() and (len(values) < 2 or (values[1:] >= values[:-1]).all()):
+            self.order = None
+            self.sorted_values = values
+        else:
+            order = np.flatnonzero(present)
+            order = order[np.argsort(values[order], kind='stable')]
+            self.order = order
+            self.sorted_values = values[order]
+        # スライダーの刻み幅の判定用（小数を含むか）
+        self.has_fraction = (
+            values.dtype.kind == 'f' and bool((self.sorted_values != np.floor(self.sorted_values)).any())
+        )
+
+    @property
+    def nbytes(self):
+        order_bytes = self.order.nbytes if self.order is not None else 0
+        sorted_bytes = self.sorted_values.nbytes if self.order is not None else 0
+        return int(self.values.nbytes + sorted_bytes + order_bytes)
+
+    @property
+    def min(self):
+        return self.sorted_values[0] if len(self.sorted_values) else None
+
+    @property
+    def max(self):
+        return self.sorted_values[-1] if len(self.sorted_values) else None
+
+    def _bounds(self, low, high, inclusive_high):
+        lo = np.searchsorted(self.sorted_values, low, side='left') if low is not None else 0
+        hi = (np.searchsorted(self.sorted_values, high, side='right' if inclusive_high else 'left')
+              if high is not None else len(self.sorted_values))
+        return int(lo), int(max(hi, lo))
+
+    def range_bitmap(self, low=None, high=None, inclusive_high=True):
+        """
+        low <= 値 <= high（inclusive_high=False なら 値 < high）の行のビットマップを返します。
+        全ての行が条件を満たす場合は None（条件なし）を返します。
+        """
+        lo, hi = self._bounds(low, high, inclusive_high)
+        selected = hi - lo
+        if selected == self.n_rows:
+            return None
+        if selected == 0:
+            return _empty_bitmap(self.n_rows)
+        if self.order is None:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[lo:hi] = True
+            return np.packbits(mask)
+        if selected <= self.n_rows * SCATTER_MAX_FRACTION:
+            return _bitmap_from_positions(self.order[lo:hi], self.n_rows)
+        if selected >= self.n_rows * (1 - SCATTER_MAX_FRACTION) and len(self.sorted_values) == self.n_rows:
+            # 除外される行が少ない場合は、除外する行だけを書き込む
+            mask = np.ones(self.n_rows, dtype=bool)
+            mask[self.order[:lo]] = False
+            mask[self.order[hi:]] = False
+            return np.packbits(mask)
+        # 中間の割合では、列の値を直接比較する方が行番号を書き込むより速い
+        mask = (self.values >= self.sorted_values[lo]) & (self.values <= self.sorted_values[hi - 1])
+        return np.packbits(mask)
+
+
+class CategoryFilterIndex:
+    """
+    カテゴリ列（文字列列を含む）の isin 用のインデックス。
+    値を整数コードにしておき、カテゴリ数が少なければカテゴリごとのビットマップも作っておきます。
+    欠損（None / NaN / NA）も1つのカテゴリとして末尾のコードにし、選ばれた値に欠損があれば欠損の行を残します。
+    """
+
+    def __init__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            categories = list(series.cat.categories)
+            if (codes < 0).any():
+                if len(categories) > np.iinfo(codes.dtype).max:
+                    codes = codes.astype(np.int32)
+                codes = np.where(codes < 0, len(categories), codes).astype(codes.dtype, copy=False)
+                categories.append(np.nan)
+        else:
+            codes, categories = pd.factorize(series, sort=False, use_na_sentinel=False)
+            categories = list(categories)
+        self.n_rows = len(codes)
+        self.codes = codes
+        self.categories = categories
+        self.missing_code = next((code for code, value in enumerate(categories) if pd.isna(value)), None)
+        self._code_of = {value: code for code, value in enumerate(categories) if code != self.missing_code}
+        self.bitmaps = None
+        if len(self.categories) <= CATEGORY_BITMAP_MAX:
+            self.bitmaps = [np.packbits(codes == code) for code in range(len(self.categories))]
+
+    @property
+    def nbytes(self):
+        bitmap_bytes = sum(bitmap.nbytes for bitmap in self.bitmaps) if self.bitmaps is not None else 0
+        return int(self.codes.nbytes + bitmap_bytes)
+
+    def _code(self, value):
+        if pd.api.types.is_scalar(value) and pd.isna(value):
+            return self.missing_code
+        return self._code_of.get(value)
+
+    def isin_bitmap(self, values):
+        """値が values のいずれかに一致する行のビットマップを返します。全てのカテゴリを選んだ場合は None です。"""
+        selected = sorted({code for code in map(self._code, values) if code is not None})
+        if len(selected) == len(self.categories):
+            return None
+        if not selected:
+            return _empty_bitmap(self.n_rows)
+        if self.bitmaps is not None:
+            selected_set = set(selected)
+            unselected = [code for code in range(len(self.categories)) if code not in selected_set]
+            if len(unselected) < len(selected):
+                # 選ばれなかったカテゴリの方が少なければ、そちらの和の否定をとる
+                return np.invert(np.bitwise_or.reduce([self.bitmaps[code] for code in unselected]))
+            return np.bitwise_or.reduce([self.bitmaps[code] for code in selected])
+        lookup = np.zeros(len(self.categories), dtype=bool)
+        lookup[selected] = True
+        return np.packbits(lookup[self.codes])
+
+
+def build_column_index(series):
+    """列の型に応じて RangeFilterIndex または CategoryFilterIndex を作成します（対応しない型なら None）。"""
+    dtype = series.dtype
+    if pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+        return RangeFilterIndex(series)
+    if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+            or isinstance(dtype, pd.CategoricalDtype)):
+        return CategoryFilterIndex(series)
+    return None
+
+
+def get_column_index(df, col, dataset_key):
+    """
+    データセットの列ごとにキャッシュされたインデックスを返します。
+    キーは列の値のハッシュから決まる（scoped_key）ので、他の列を編集した新しい版のデータセットでもそのまま使えます。
+    """
+    scoped = scoped_key(dataset_key, [col])
+    cache_key = (scoped, col)
+    index = _filter_index_cache.get(cache_key)
+    if index is None:
+        index = build_column_index(df[col])
+        if index is not None:
+            _filter_index_cache.put(cache_key, index)
+            record_dependency(dataset_key, ARTIFACT_FILTER_INDEX, col, [col],
+                              evict=functools.partial(_filter_index_cache.pop, cache_key),
+                              scoped=scoped is not dataset_key)
+    return index
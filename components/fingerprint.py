@@ -0,0 +1,304 @@
+# components/fingerprint.py
+"""
+データセットの列ごとのフィンガープリントと、派生データ（型変換・フィルタ用インデックス・時間キューブ・
+積和の集計・図など）が依存する列の記録。
+
+フィンガープリントは列ごとに ROW_BLOCK_ROWS 行のブロック単位のハッシュを持つため、
+データエディタで一部のセルを編集した場合は、編集された列の該当するブロックだけを計算し直せます。
+図や計算結果のキャッシュは、データセット全体のキーではなく使う列のハッシュから決まるキー（scoped_key）を使うので、
+ある列を編集しても、その列を使わない図や集計はキャッシュから取り出せます。
+依存関係のグラフ（record_dependency）は、新しい版のデータで値が変わった列に依存する派生データだけを
+古い版のキャッシュから破棄するために使います（supersede_dataset）。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache
+
+ROW_BLOCK_ROWS = 65536 # フィンガープリントのブロックあたりの行数
+
+FINGERPRINT_CACHE_BUDGET_BYTES = 64 * 1024 * 1024 # 64MB
+_fingerprint_cache = LRUByteCache(FINGERPRINT_CACHE_BUDGET_BYTES, sizeof=lambda fingerprint: fingerprint.nbytes)
+
+# 派生データの種類
+ARTIFACT_TYPED_FRAME = 'typed_frame'
+ARTIFACT_FILTER_INDEX = 'filter_index'
+ARTIFACT_TIME_CUBE = 'time_cube'
+ARTIFACT_MOMENTS = 'moments'
+ARTIFACT_QUANTILE_SKETCH = 'quantile_sketch'
+ARTIFACT_FIGURE = 'figure'
+ARTIFACT_COMPUTE = 'compute'
+
+MAX_TRACKED_DATASETS = 64 # 依存関係を記録しておくデータセットの数
+MAX_ARTIFACTS_PER_DATASET = 4096 # データセットごとに記録する派生データの数（古いものから記録を外す）
+
+
+def _block_hash(hashes):
+    """行ごとのハッシュ値の配列から、ブロックのハッシュ値（64ビット整数）を計算します。"""
+    return int.from_bytes(hashlib.blake2b(hashes.tobytes(), digest_size=8).digest(), 'little')
+
+
+def _block_hashes(series, block_rows, start_block=0):
+    """列の start_block 番目以降のブロックのハッシュ値の配列を返します。"""
+    hashes = pd.util.hash_pandas_object(series.iloc[start_block * block_rows:], index=False).to_numpy()
+    return np.array([_block_hash(hashes[i:i + block_rows]) for i in range(0, len(hashes), block_rows)],
+                    dtype=np.uint64)
+
+
+class DatasetFingerprint:
+    """
+    DataFrame の列ごとのフィンガープリント。列ごとにブロックのハッシュ値の配列と、それをまとめたダイジェストを持ちます。
+    ダイジェストには型と行数も含めるため、行の追加・削除があると全ての列のダイジェストが変わります。
+    """
+
+    def __init__(self, n_rows, dtypes, blocks, block_rows=ROW_BLOCK_ROWS):
+        self.n_rows = n_rows
+        self.block_rows = block_rows
+        self._dtypes = dict(dtypes)
+        self._blocks = dict(blocks)
+        self._digests = {
+            col: hashlib.blake2b(f'{self._dtypes[col]}:{n_rows}:'.encode() + self._blocks[col].tobytes(),
+                                 digest_size=16).hexdigest()
+            for col in self._blocks
+        }
+
+    @property
+    def columns(self):
+        return list(self._blocks)
+
+    @property
+    def nbytes(self):
+        return int(sum(blocks.nbytes for blocks in self._blocks.values())) + 64 * len(self._blocks)
+
+    def __contains__(self, col):
+        return col in self._blocks
+
+    @classmethod
+    def from_frame(cls, df, block_rows=ROW_BLOCK_ROWS):
+        return cls(len(df), {col: str(df[col].dtype) for col in df.columns},
+                   {col: _block_hashes(df[col], block_rows) for col in df.columns}, block_rows)
+
+    def updated(self, df, columns=(), positions=(), from_row=None):
+        """
+        新しい版の DataFrame（df）のフィンガープリントを、変わった部分だけ計算し直して返します。
+        columns の列は positions（行の位置）を含むブロックだけを、from_row を指定した場合（行の追加・削除）は
+        全ての列の from_row 以降のブロックを計算し直します。型が変わった列と新しい列は全体を計算します。
+        """
+        block_rows = self.block_rows
+        changed_blocks = np.unique(np.asarray(positions, dtype=np.int64) // block_rows)
+        blocks = {}
+        for col in df.columns:
+            dtype = str(df[col].dtype)
+            previous = self._blocks.get(col)
+            if previous is None or self._dtypes[col] != dtype:
+                blocks[col] = _block_hashes(df[col], block_rows)
+            elif from_row is not None:
+                first = min(from_row // block_rows, len(previous))
+                blocks[col] = np.concatenate([previous[:first], _block_hashes(df[col], block_rows, first)])
+            elif col in columns:
+                blocks[col] = previous.copy()
+                for block in changed_blocks:
+                    hashes = pd.util.hash_pandas_object(
+                        df[col].iloc[block * block_rows:(block + 1) * block_rows], index=False
+                    ).to_numpy()
+                    blocks[col][block] = _block_hash(hashes)
+            else:
+                blocks[col] = previous
+        return DatasetFingerprint(len(df), {col: str(df[col].dtype) for col in df.columns}, blocks, block_rows)
+
+    def column_digest(self, col):
+        return self._digests[col]
+
+    def key(self, columns):
+        """指定した列（順序どおり）の値だけから決まるキー。"""
+        hasher = hashlib.blake2b(digest_size=16)
+        for col in dict.fromkeys(columns):
+            hasher.update(repr(col).encode())
+            hasher.update(self._digests[col].encode())
+        return hasher.hexdigest()
+
+    def changed_columns(self, other):
+        """other と値（または型・行数）が異なる列と、片方にしかない列の集合を返します。"""
+        return {col for col in set(self._digests) | set(other._digests)
+                if self._digests.get(col) != other._digests.get(col)}
+
+
+def cached_fingerprint(dataset_key):
+    """キャッシュ済みのフィンガープリントを返します（なければ None。新たに計算はしません）。"""
+    return _fingerprint_cache.get(dataset_key)
+
+
+def seed_fingerprint(dataset_key, fingerprint):
+    """計算済みのフィンガープリントを、データセットのキーに対応づけて登録します。"""
+    _fingerprint_cache.put(dataset_key, fingerprint)
+
+
+def get_fingerprint(df, dataset_key):
+    """データセットのキーごとにキャッシュされたフィンガープリントを返します（なければ df から計算します）。"""
+    fingerprint = _fingerprint_cache.get(dataset_key)
+    if fingerprint is None:
+        fingerprint = DatasetFingerprint.from_frame(df)
+        _fingerprint_cache.put(dataset_key, fingerprint)
+    return fingerprint
+
+
+def _split_key(dataset_key):
+    """
+    絞り込んだビューや問い合わせのキーを、元のデータセットのキーと派生の内容に分けます。
+    派生が行のビットマップによる絞り込みだけかどうかも返します（それ以外の演算は全ての列に依存するとみなす）。
+    """
+    derivation = []
+    bitmap_only = True
+    while isinstance(dataset_key, tuple) and len(dataset_key) == 3 and dataset_key[0] in ('filtered', 'query'):
+        kind, base_key, detail = dataset_key
+        if kind == 'query':
+            bitmap_only = bitmap_only and all(
+                all(predicate[0] == 'bitmap' for predicate in getattr(op, 'predicates', (('other',),)))
+                for op in detail
+            )
+        derivation.append((kind, detail))
+        dataset_key = base_key
+    return dataset_key, tuple(derivation), bitmap_only
+
+
+def base_dataset_key(dataset_key):
+    """絞り込んだビューや問い合わせのキーから、元のデータセットのキーを取り出します。"""
+    return _split_key(dataset_key)[0]
+
+
+def scoped_key(dataset_key, columns):
+    """
+    columns の列だけを使う派生データのキャッシュキーを返します。元のデータセットのフィンガープリントがあれば、
+    キーはその列のハッシュ（と絞り込みなどの派生の内容）から決まり、他の列を編集しても変わりません。
+    フィンガープリントがない場合や、元のデータセットにない列を含む場合は dataset_key をそのまま返します。
+    """
+    base_key, derivation, bitmap_only = _split_key(dataset_key)
+    fingerprint = cached_fingerprint(base_key)
+    if fingerprint is None:
+        return dataset_key
+    columns = list(columns) if bitmap_only else fingerprint.columns
+    if any(col not in fingerprint for col in columns):
+        return dataset_key
+    return ('columns', fingerprint.key(columns), derivation)
+
+
+# --- 依存関係のグラフ ---
+
+Artifact = namedtuple('Artifact', ['kind', 'name', 'columns', 'scoped', 'evict'])
+
+
+class DependencyGraph:
+    """
+    1つのデータセットの派生データと、それが依存する列の対応。
+    派生データは (種類, 名前) で識別し、列から派生データへの逆引きも保持します。
+    """
+
+    def __init__(self):
+        self._artifacts = OrderedDict() # (種類, 名前) -> Artifact
+        self._by_column = {} # 列 -> {(種類, 名前)}
+
+    def __len__(self):
+        return len(self._artifacts)
+
+    def record(self, artifact):
+        artifact_id = (artifact.kind, artifact.name)
+        self._discard(artifact_id)
+        self._artifacts[artifact_id] = artifact
+        for col in artifact.columns:
+            self._by_column.setdefault(col, set()).add(artifact_id)
+        while len(self._artifacts) > MAX_ARTIFACTS_PER_DATASET:
+            self._discard(next(iter(self._artifacts)))
+
+    def _discard(self, artifact_id):
+        artifact = self._artifacts.pop(artifact_id, None)
+        if artifact is None:
+            return None
+        for col in artifact.columns:
+            dependents = self._by_column.get(col)
+            if dependents is not None:
+                dependents.discard(artifact_id)
+                if not dependents:
+                    del self._by_column[col]
+        return artifact
+
+    def dependents(self, columns):
+        """columns のいずれかに依存する派生データのリストを返します。"""
+        artifact_ids = set()
+        for col in columns:
+            artifact_ids |= self._by_column.get(col, set())
+        return [self._artifacts[artifact_id] for artifact_id in self._artifacts if artifact_id in artifact_ids]
+
+    def remove(self, artifacts):
+        for artifact in artifacts:
+            self._discard((artifact.kind, artifact.name))
+
+    def artifacts(self):
+        return list(self._artifacts.values())
+
+
+_graphs = OrderedDict() # 元のデータセットのキー -> DependencyGraph
+_graphs_lock = threading.Lock()
+
+
+def _graph_locked(dataset_key):
+    graph = _graphs.get(dataset_key)
+    if graph is None:
+        graph = _graphs[dataset_key] = DependencyGraph()
+        while len(_graphs) > MAX_TRACKED_DATASETS:
+            _graphs.popitem(last=False)
+    else:
+        _graphs.move_to_end(dataset_key)
+    return graph
+
+
+def record_dependency(dataset_key, kind, name, columns, evict=None, scoped=False):
+    """
+    データセット（絞り込んだビューなどの場合は元のデータセット）の派生データが、columns の列に依存することを記録します。
+    evict はその派生データをキャッシュから破棄する関数です。scoped=True はキャッシュキーが scoped_key で、
+    値の変わらない新しい版のデータセットでもそのまま使える派生データであることを表します。
+    """
+    if dataset_key is None:
+        return
+    artifact = Artifact(kind, name, frozenset(columns), scoped, evict)
+    with _graphs_lock:
+        _graph_locked(base_dataset_key(dataset_key)).record(artifact)
+
+
+def supersede_dataset(previous_key, new_key, changed_columns):
+    """
+    previous_key のデータセットが、changed_columns の列の値だけが異なる new_key のデータセットに置き換わったことを記録します。
+    値の変わった列に依存する古い版の派生データはキャッシュから破棄し、その一覧を返します。
+    それ以外の派生データのうち scoped なもの（キーが列のハッシュで決まるもの）は、新しい版の派生データとして記録を引き継ぎます。
+    """
+    with _graphs_lock:
+        graph = _graphs.get(previous_key)
+        if graph is None:
+            return []
+        invalidated = graph.dependents(changed_columns)
+        graph.remove(invalidated)
+        carried = [artifact for artifact in graph.artifacts() if artifact.scoped]
+        if carried:
+            new_graph = _graph_locked(new_key)
+            for artifact in carried:
+                new_graph.record(artifact)
+    for artifact in invalidated:
+        if artifact.evict is not None:
+            artifact.evict()
+    return invalidated
+
+
+def dependency_frame(dataset_key):
+    """データセットの派生データと依存する列の一覧を DataFrame で返します（表示用）。"""
+    with _graphs_lock:
+        graph = _graphs.get(base_dataset_key(dataset_key))
+        artifacts = graph.artifacts() if graph is not None else []
+    return pd.DataFrame(
+        [(artifact.kind, str(artifact.name), ', '.join(map(str, sorted(artifact.columns, key=str))))
+         for artifact in artifacts],
+        columns=['種類', '名前', '依存する列']
+    )
@@ -1,8 +1,57 @@
 # components/graph_plotter.py
 
+import functools
+
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from components.cache import frame_fingerprint
+from components.figure_cache import (
+    BASE_TEMPLATE,
+    TITLE_PLACEHOLDER,
+    X_LABEL_PLACEHOLDER,
+    Y_LABEL_PLACEHOLDER,
+    cached_figure,
+    get_figure_cache
+)
+from components.fingerprint import ARTIFACT_FIGURE, record_dependency, scoped_key
+from components.downsampling import (
+    DEFAULT_CHART_WIDTH_PX,
+    METHOD_GRID,
+    METHOD_LTTB,
+    decimation_note,
+    downsample_line_indices,
+    grid_thin_indices,
+    line_point_budget,
+    numeric_axis,
+    scatter_point_budget
+)
+from components.heatmap import (
+    AGG_COUNT,
+    AGG_SUM,
+    AGGREGATION_LABELS,
+    DEFAULT_HEATMAP_BINS,
+    compute_heatmap,
+    heatmap_figure,
+    query_heatmap
+)
+from components.compute import computation
+from components.profiling import plotly_chart, profiled
+from components.rasterize import (
+    RASTER_POINT_THRESHOLD,
+    WEBGL_POINT_THRESHOLD,
+    has_finite_points,
+    hex_to_rgb,
+    is_rasterizable,
+    raster_shape,
+    rasterize_by_category,
+    rasterize_points,
+    shade_categories
+)
 
 # --- Plotlyのカラーテーマリストの定義 ---
 PLOTLY_TEMPLATES = [
@@ -10,48 +59,536 @@ PLOTLY_TEMPLATES = [
     "seaborn", "simple_white", "none"
 ]
 
-# --- グラフ描画関数の変更 ---
+# --- 描画前の間引き（ダウンサンプリング） ---
+
+def _downsample_for_line(df, x_col, y_col, chart_width_px, method):
+    """折れ線グラフ用にデータを間引きます。(間引き後のDataFrame, 注記 or None) を返します。"""
+    n_total = len(df)
+    budget = line_point_budget(chart_width_px)
+    if n_total <= budget:
+        return df, None
+    x = numeric_axis(df[x_col])
+    y = numeric_axis(df[y_col], positional_fallback=False)
+    indices = downsample_line_indices(x, y, budget, method=method)
+    return df.iloc[indices], decimation_note(len(indices), n_total, method)
+
+
+def _downsample_for_scatter(df, x_col, y_col, color_col, chart_width_px):
+    """散布図用にデータをグリッド間引きします。(間引き後のDataFrame, 注記 or None) を返します。"""
+    n_total = len(df)
+    budget = scatter_point_budget(chart_width_px)
+    if n_total <= budget:
+        return df, None
+    x = numeric_axis(df[x_col], positional_fallback=False)
+    y = numeric_axis(df[y_col], positional_fallback=False)
+    groups = None
+    if color_col:
+        groups, _ = pd.factorize(df[color_col], use_na_sentinel=False)
+    indices = grid_thin_indices(x, y, budget, groups=groups)
+    return df.iloc[indices], decimation_note(len(indices), n_total, METHOD_GRID)
+
+
+def _add_decimation_annotation(fig, note):
+    """間引きを行った場合、グラフ右上に表示点数の注記を追加します。"""
+    if note:
+        fig.add_annotation(
+            text=note, xref='paper', yref='paper', x=1, y=1,
+            xanchor='right', yanchor='bottom', showarrow=False,
+            font=dict(size=11, color='gray')
+        )
+
+# --- 大量の点を持つ散布図のラスタ表示 ---
+
+MAX_RASTER_CATEGORIES = 20 # 色分けのカテゴリがこれより多い場合、少数派を「その他」にまとめる
+
+def _axis_values_for_plot(centers_or_edges, is_datetime):
+    """ラスタ計算に使った数値（日時は経過ナノ秒）を、軸に渡す値に戻します。"""
+    if is_datetime:
+        return pd.to_datetime(centers_or_edges.astype(np.int64))
+    return centers_or_edges
+
+
+def _limit_categories(codes, uniques):
+    """カテゴリ数を MAX_RASTER_CATEGORIES 以下に抑えます（少数派は「その他」）。"""
+    if len(uniques) <= MAX_RASTER_CATEGORIES:
+        return codes, [str(u) for u in uniques]
+    frequency = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    top = np.argsort(frequency)[::-1][:MAX_RASTER_CATEGORIES - 1]
+    remap = np.full(len(uniques), MAX_RASTER_CATEGORIES - 1, dtype=np.int64)
+    remap[top] = np.arange(len(top))
+    new_codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+    return new_codes, [str(uniques[i]) for i in top] + ['その他']
+
+
+def _build_raster_scatter_figure(df, x_col, y_col, color_col, labels, title, color_theme, chart_width_px):
+    """
+    点を個別に描かず、NumPy で2次元グリッドに集計したラスタとして散布図を描きます。
+    色分けなしは件数（対数）、数値の色分けはセルごとの平均値、カテゴリの色分けはカテゴリ別ラスタの色の混合です。
+    X・Y がともに有限な点が1つもない場合（全て欠損の列など）はラスタにできないため None を返します。
+    """
+    shape = raster_shape(chart_width_px)
+    x_is_datetime = pd.api.types.is_datetime64_any_dtype(df[x_col].dtype)
+    y_is_datetime = pd.api.types.is_datetime64_any_dtype(df[y_col].dtype)
+    x = numeric_axis(df[x_col], positional_fallback=False)
+    y = numeric_axis(df[y_col], positional_fallback=False)
+    if not has_finite_points(x, y):
+        return None
+
+    fig = go.Figure()
+    color_is_numeric = color_col and is_rasterizable(df[color_col]) and not pd.api.types.is_datetime64_any_dtype(df[color_col].dtype)
+
+    if color_col and not color_is_numeric:
+        codes, uniques = pd.factorize(df[color_col])
+        codes, names = _limit_categories(codes, uniques)
+        counts, x_edges, y_edges = rasterize_by_category(x, y, codes, len(names), shape)
+        palette = px.colors.qualitative.Plotly
+        rgb = [hex_to_rgb(palette[i % len(palette)]) for i in range(len(names))]
+        image = shade_categories(counts, rgb)
+
+        dx = x_edges[1] - x_edges[0]
+        dy = y_edges[1] - y_edges[0]
+        x0, y0 = x_edges[0] + dx / 2, y_edges[0] + dy / 2
+        if x_is_datetime: # 日付軸はミリ秒単位の数値を受け付ける
+            x0, dx = x0 / 1e6, dx / 1e6
+        if y_is_datetime:
+            y0, dy = y0 / 1e6, dy / 1e6
+        fig.add_trace(go.Image(z=image, colormodel='rgba', x0=x0, dx=dx, y0=y0, dy=dy, hoverinfo='skip'))
+        # 画像トレースには凡例がないので、色の対応だけを示す空のトレースを追加する
+        for name, color in zip(names, rgb):
+            fig.add_trace(go.Scatter(x=[None], y=[None], mode='markers', name=name,
+                                     marker=dict(color=f'rgb{color}', size=10), showlegend=True))
+        fig.update_layout(legend_title_text=color_col)
+        fig.update_yaxes(autorange=True) # 画像トレースは既定でy軸が反転するため、通常の向きに戻す
+        if x_is_datetime:
+            fig.update_xaxes(type='date')
+        if y_is_datetime:
+            fig.update_yaxes(type='date')
+    else:
+        weights = numeric_axis(df[color_col]) if color_col else None
+        z, x_edges, y_edges, counts = rasterize_points(x, y, shape, weights=weights)
+        x_centers = _axis_values_for_plot((x_edges[:-1] + x_edges[1:]) / 2, x_is_datetime)
+        y_centers = _axis_values_for_plot((y_edges[:-1] + y_edges[1:]) / 2, y_is_datetime)
+        if color_col:
+            fig.add_trace(go.Heatmap(
+                z=z, x=x_centers, y=y_centers, customdata=counts, hoverongaps=False,
+                colorbar=dict(title=f'{color_col} (平均)'),
+                hovertemplate='x=%{x}<br>y=%{y}<br>平均=%{z}<br>件数=%{customdata}<extra></extra>'
+            ))
+        else:
+            with np.errstate(divide='ignore'):
+                log_counts = np.where(counts > 0, np.log10(counts), np.nan)
+            fig.add_trace(go.Heatmap(
+                z=log_counts, x=x_centers, y=y_centers, customdata=counts, hoverongaps=False,
+                colorscale='Viridis', colorbar=dict(title='log10(件数)'),
+                hovertemplate='x=%{x}<br>y=%{y}<br>件数=%{customdata}<extra></extra>'
+            ))
+
+    fig.update_layout(title=title, template=color_theme,
+                      xaxis_title=labels[x_col], yaxis_title=labels[y_col])
+    note = f'ラスタ表示: {len(df):,} 点を {shape[0]}×{shape[1]} セルに集計'
+    return fig, note
+
+# --- 複数系列を1つの図にまとめる描画 ---
+
+SERIES_LAYOUT_SEPARATE = 'separate' # 系列ごとに別の図（従来の動作）
+SERIES_LAYOUT_OVERLAY = 'overlay' # 1つの図に全系列を重ねる
+SERIES_LAYOUT_SUBPLOTS = 'subplots' # 1つの図の中で系列ごとに縦に並べ、X軸を共有する
+
+SERIES_LAYOUT_LABELS = {
+    SERIES_LAYOUT_SEPARATE: '系列ごとに別のグラフ',
+    SERIES_LAYOUT_OVERLAY: '1つのグラフに重ねる',
+    SERIES_LAYOUT_SUBPLOTS: '縦に並べる（X軸を共有）',
+}
+
+def _regular_x_spacing(x_series):
+    """
+    X軸の値が等間隔（数値または日時、欠損なし）なら (x0, dx) を返します。そうでなければ None。
+    等間隔の場合は各トレースに x 配列を持たせず x0/dx だけで表現できるため、系列数が増えても X の値は送られません。
+    """
+    n = len(x_series)
+    dtype = x_series.dtype
+    if n < 3 or x_series.isna().any():
+        return None
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        values = x_series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        steps = np.diff(values)
+        if steps[0] > 0 and np.all(steps == steps[0]):
+            # 日付軸の dx はミリ秒単位
+            return pd.Timestamp(values[0]).isoformat(), steps[0] / 1e6
+        return None
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        values = x_series.to_numpy(dtype=np.float64)
+        steps = np.diff(values)
+        if steps[0] > 0 and np.allclose(steps, steps[0], rtol=1e-9, atol=0):
+            return values[0].item(), steps[0].item()
+    return None
+
+
+def _build_multi_series_figure(df, x_col, y_cols, kind, series_layout, x_label, y_label, title, color_theme):
+    """
+    全ての系列を1つの図にまとめ、系列ごとに1トレースを持つ図を作成します。
+    X の値は1度だけ取り出して全トレースで共有します（等間隔なら x0/dx のみ）。
+    kind は 'line' または 'bar' です。
+    """
+    x_series = df[x_col]
+    spacing = _regular_x_spacing(x_series)
+    if spacing is not None:
+        x_args = dict(x0=spacing[0], dx=spacing[1])
+    else:
+        x_args = dict(x=x_series.to_numpy())
+
+    use_subplots = series_layout == SERIES_LAYOUT_SUBPLOTS
+    if use_subplots:
+        fig = make_subplots(rows=len(y_cols), cols=1, shared_xaxes=True,
+                            vertical_spacing=min(0.05, 0.3 / len(y_cols)))
+    else:
+        fig = go.Figure()
+
+    for i, y_col in enumerate(y_cols):
+        y_values = df[y_col].to_numpy()
+        if kind == 'line':
+            trace = go.Scatter(y=y_values, name=str(y_col), mode='lines', **x_args)
+        else:
+            trace = go.Bar(y=y_values, name=str(y_col), **x_args)
+        if use_subplots:
+            fig.add_trace(trace, row=i + 1, col=1)
+            fig.update_yaxes(title_text=str(y_col), row=i + 1, col=1)
+        else:
+            fig.add_trace(trace)
+
+    if spacing is not None and pd.api.types.is_datetime64_any_dtype(x_series.dtype):
+        fig.update_xaxes(type='date')
+    if use_subplots:
+        fig.update_xaxes(title_text=x_label, row=len(y_cols), col=1)
+        fig.update_layout(height=max(450, 220 * len(y_cols)), showlegend=False)
+    else:
+        fig.update_layout(xaxis_title=x_label, yaxis_title=y_label, legend_title_text='系列')
+        if kind == 'bar':
+            fig.update_layout(barmode='group')
+
+    fig.update_layout(title=title, template=color_theme)
+    return fig
+
+
+def _downsample_multi_series(df, x_col, y_cols, chart_width_px, method):
+    """各系列で残す行の和集合を取り、全系列で共通の行に間引きます。"""
+    n_total = len(df)
+    budget = line_point_budget(chart_width_px)
+    if n_total <= budget:
+        return df, None
+    x = numeric_axis(df[x_col])
+    indices = np.unique(np.concatenate([
+        downsample_line_indices(x, numeric_axis(df[y_col], positional_fallback=False), budget, method=method)
+        for y_col in y_cols
+    ]))
+    return df.iloc[indices], decimation_note(len(indices), n_total, method)
+
+def _figure_key(df, dataset_key, *params):
+    """
+    図のキャッシュのキー（df の列に絞ったデータセットのキーと、グラフの構造を決めるパラメータ）。
+    図が df の列に依存することも記録し、それらの列が編集されたら古い図をキャッシュから破棄できるようにします。
+    """
+    if dataset_key is None:
+        return (frame_fingerprint(df),) + params
+    return _scoped_figure_key(dataset_key, df.columns, *params)
+
+
+def _scoped_figure_key(dataset_key, columns, *params):
+    """columns の列に絞ったデータセットのキーで図のキャッシュのキーを作り、それらの列への依存を記録します。"""
+    scoped = scoped_key(dataset_key, columns)
+    key = (scoped,) + params
+    record_dependency(dataset_key, ARTIFACT_FIGURE, key, columns,
+                      evict=functools.partial(get_figure_cache().pop, key), scoped=scoped is not dataset_key)
+    return key
+
+# --- 図の作成（Streamlit を使わない。バッチ描画などからも呼び出せる） ---
+# 図はデータセットと構造のパラメータごとに図のキャッシュに保存し、タイトル・軸ラベル・テーマは取り出すときに適用する
+# （compute の計算として登録するが、結果は図のキャッシュが持つので計算結果のキャッシュには入れない）
+
+@computation('plot', memoize=False)
+def line_chart_figures(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                       downsample=True, downsample_method=METHOD_LTTB, chart_width_px=DEFAULT_CHART_WIDTH_PX,
+                       series_layout=SERIES_LAYOUT_SEPARATE, dataset_key=None):
+    """
+    折れ線グラフの図のリストを返します（系列ごとに別の図にする場合は y_cols の順、まとめる場合は1つ）。
+    downsample=True の場合、グラフ幅から決まる点数を超える系列は downsample_method（LTTB または最小/最大）で間引きます。
+    """
+    if series_layout != SERIES_LAYOUT_SEPARATE:
+        def build():
+            df_plot, note = (df, None)
+            if downsample:
+                df_plot, note = _downsample_multi_series(df, x_col, y_cols, chart_width_px, downsample_method)
+            fig = _build_multi_series_figure(
+                df_plot, x_col, y_cols, 'line', series_layout,
+                x_label=X_LABEL_PLACEHOLDER, y_label=Y_LABEL_PLACEHOLDER,
+                title=TITLE_PLACEHOLDER, color_theme=BASE_TEMPLATE
+            )
+            fig.update_layout(title_x=0.5)
+            _add_decimation_annotation(fig, note)
+            return fig
+
+        key = _figure_key(df, dataset_key, 'line', x_col, tuple(y_cols), series_layout,
+                          downsample, downsample_method, chart_width_px)
+        return [cached_figure(key, build, {
+            TITLE_PLACEHOLDER: title if title else f'{", ".join(map(str, y_cols))} vs {x_col} の折れ線グラフ',
+            X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+            Y_LABEL_PLACEHOLDER: y_label if y_label else '値'
+        }, color_theme)]
+
+    figures = []
+    for y_col in y_cols:
+        def build(y_col=y_col):
+            df_plot, note = (df, None)
+            if downsample:
+                df_plot, note = _downsample_for_line(df, x_col, y_col, chart_width_px, downsample_method)
+            # 軸ラベルはプレースホルダーにしておき、取り出すときに置き換える
+            fig = px.line(df_plot, x=x_col, y=y_col, title=TITLE_PLACEHOLDER,
+                          labels={x_col: X_LABEL_PLACEHOLDER, y_col: Y_LABEL_PLACEHOLDER},
+                          template=BASE_TEMPLATE)
+            fig.update_layout(title_x=0.5) # ここを追加
+            _add_decimation_annotation(fig, note)
+            return fig
+
+        key = _figure_key(df, dataset_key, 'line', x_col, y_col, downsample, downsample_method, chart_width_px)
+        figures.append(cached_figure(key, build, {
+            TITLE_PLACEHOLDER: title if title else f'{y_col} vs {x_col} の折れ線グラフ',
+            X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+            Y_LABEL_PLACEHOLDER: y_label if y_label else y_col
+        }, color_theme))
+    return figures
+
+
+@computation('plot', memoize=False)
+def bar_chart_figures(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                      series_layout=SERIES_LAYOUT_SEPARATE, dataset_key=None):
+    """棒グラフの図のリストを返します（系列ごとに別の図にする場合は y_cols の順、まとめる場合は1つ）。"""
+    if series_layout != SERIES_LAYOUT_SEPARATE:
+        def build():
+            fig = _build_multi_series_figure(
+                df, x_col, y_cols, 'bar', series_layout,
+                x_label=X_LABEL_PLACEHOLDER, y_label=Y_LABEL_PLACEHOLDER,
+                title=TITLE_PLACEHOLDER, color_theme=BASE_TEMPLATE
+            )
+            fig.update_layout(title_x=0.5)
+            return fig
+
+        key = _figure_key(df, dataset_key, 'bar', x_col, tuple(y_cols), series_layout)
+        return [cached_figure(key, build, {
+            TITLE_PLACEHOLDER: title if title else f'{", ".join(map(str, y_cols))} vs {x_col} の棒グラフ',
+            X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+            Y_LABEL_PLACEHOLDER: y_label if y_label else '値'
+        }, color_theme)]
+
+    figures = []
+    for y_col in y_cols:
+        def build(y_col=y_col):
+            fig = px.bar(df, x=x_col, y=y_col, title=TITLE_PLACEHOLDER,
+                         labels={x_col: X_LABEL_PLACEHOLDER, y_col: Y_LABEL_PLACEHOLDER},
+                         template=BASE_TEMPLATE)
+            fig.update_layout(title_x=0.5) # ここを追加
+            return fig
+
+        key = _figure_key(df, dataset_key, 'bar', x_col, y_col)
+        figures.append(cached_figure(key, build, {
+            TITLE_PLACEHOLDER: title if title else f'{y_col} vs {x_col} の棒グラフ',
+            X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+            Y_LABEL_PLACEHOLDER: y_label if y_label else y_col
+        }, color_theme))
+    return figures
+
+
+@computation('plot', memoize=False)
+def stacked_bar_chart_figure(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                             dataset_key=None):
+    """
+    積み立て棒グラフの図を返します。
+    縦持ちに変換（melt）した DataFrame は作らず、列ごとに1トレースを持つ図を積み上げ表示にします。
+    """
+    def build():
+        fig = _build_multi_series_figure(
+            df, x_col, y_cols, 'bar', SERIES_LAYOUT_OVERLAY,
+            x_label=X_LABEL_PLACEHOLDER, y_label=Y_LABEL_PLACEHOLDER,
+            title=TITLE_PLACEHOLDER, color_theme=BASE_TEMPLATE
+        )
+        fig.update_layout(barmode='stack', title_x=0.5)
+        return fig
+
+    key = _figure_key(df, dataset_key, 'stacked_bar', x_col, tuple(y_cols))
+    return cached_figure(key, build, {
+        TITLE_PLACEHOLDER: title if title else f'{x_col}に対する積み立てグラフ',
+        X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+        Y_LABEL_PLACEHOLDER: y_label if y_label else "値"
+    }, color_theme)
+
+
+@computation('plot', memoize=False)
+def scatter_plot_figure(df, x_col, y_col, color_col=None, title=None, x_label=None, y_label=None, color_theme=None,
+                        downsample=True, chart_width_px=DEFAULT_CHART_WIDTH_PX, rasterize=True,
+                        webgl_threshold=WEBGL_POINT_THRESHOLD, raster_threshold=RASTER_POINT_THRESHOLD,
+                        dataset_key=None):
+    """
+    散布図の図を返します。
+    downsample=True の場合、グラフ幅から決まる点数を超えるとグリッド間引きで密集部分の点を減らします。
+    描画する点数が webgl_threshold を超えると WebGL (Scattergl) で描画し、
+    rasterize=True で元の点数が raster_threshold を超える場合は2次元に集計したラスタとして描画します。
+    """
+    def build():
+        labels = {x_col: X_LABEL_PLACEHOLDER, y_col: Y_LABEL_PLACEHOLDER}
+        raster = None
+        if (rasterize and len(df) > raster_threshold and
+                is_rasterizable(df[x_col]) and is_rasterizable(df[y_col])):
+            raster = _build_raster_scatter_figure(df, x_col, y_col, color_col, labels,
+                                                  TITLE_PLACEHOLDER, BASE_TEMPLATE, chart_width_px)
+        if raster is not None:
+            fig, note = raster
+        else:
+            df_plot, note = (df, None)
+            if downsample:
+                df_plot, note = _downsample_for_scatter(df, x_col, y_col, color_col, chart_width_px)
+            render_mode = 'webgl' if len(df_plot) > webgl_threshold else 'svg'
+            fig = px.scatter(df_plot, x=x_col, y=y_col, color=color_col,
+                             title=TITLE_PLACEHOLDER, labels=labels, template=BASE_TEMPLATE,
+                             render_mode=render_mode)
+        fig.update_layout(title_x=0.5) # ここを追加
+        _add_decimation_annotation(fig, note)
+        return fig
+
+    key = _figure_key(df, dataset_key, 'scatter', x_col, y_col, color_col, downsample, chart_width_px,
+                      rasterize, webgl_threshold, raster_threshold)
+    return cached_figure(key, build, {
+        TITLE_PLACEHOLDER: title if title else f'{y_col} vs {x_col} の散布図',
+        X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+        Y_LABEL_PLACEHOLDER: y_label if y_label else y_col
+    }, color_theme)
+
+
+@computation('plot', memoize=False)
+def heatmap_chart_figure(df, x_col, y_col, z_col=None, title=None, x_label=None, y_label=None, color_theme=None,
+                         dataset_key=None, agg=AGG_SUM, x_bins=DEFAULT_HEATMAP_BINS, y_bins=DEFAULT_HEATMAP_BINS):
+    """
+    ヒートマップの図を返します。
+    X・Y の列をビンに分けた格子の各セルで Z の列を agg（平均・合計・件数・最大）で集計し、
+    その2次元配列を go.Heatmap で描画します。数値・日時の軸は x_bins / y_bins 個の等間隔のビンに区切ります。
+    z_col を省略した場合は数値列の相関ヒートマップです。
+    Z の列が集計できない型の場合や、相関を計算する数値列がない場合は ValueError を送出します。
+    """
+    if z_col:
+        _check_heatmap_values(df[z_col].dtype, z_col, agg)
+        key = _figure_key(df, dataset_key, 'heatmap', x_col, y_col, z_col, agg, x_bins, y_bins)
+        return _cached_heatmap_figure(
+            key, lambda: compute_heatmap(df, x_col, y_col, z_col, agg=agg, x_bins=x_bins, y_bins=y_bins),
+            x_col, y_col, z_col, agg, title, x_label, y_label, color_theme
+        )
+
+    numeric_df = df.select_dtypes(include=['number'])
+    if numeric_df.empty:
+        raise ValueError("ヒートマップを描画するための数値列が見つかりません。")
+
+    def build():
+        corr = numeric_df.corr()
+        fig = px.imshow(corr, text_auto=True, aspect="auto",
+                        title=TITLE_PLACEHOLDER, template=BASE_TEMPLATE)
+        fig.update_layout(title_x=0.5) # ここを追加
+        return fig
+
+    key = _figure_key(df, dataset_key, 'correlation_heatmap')
+    return cached_figure(key, build, {
+        TITLE_PLACEHOLDER: title if title else "数値列の相関ヒートマップ"
+    }, color_theme)
+
+def _check_heatmap_values(dtype, z_col, agg):
+    """Z の列が agg で集計できない型の場合は ValueError を送出します。"""
+    if agg != AGG_COUNT and not (pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)):
+        raise ValueError(f"'{z_col}' 列は数値ではないため、{AGGREGATION_LABELS[agg]}を計算できません。集計方法を「件数」にするか、数値列を選択してください。")
+
+
+def _cached_heatmap_figure(key, compute, x_col, y_col, z_col, agg, title, x_label, y_label, color_theme):
+    """compute() が返す (z の2次元配列, X 軸の値, Y 軸の値) からヒートマップの図を作り、図のキャッシュに保存します。"""
+    def build():
+        z, x_values, y_values = compute()
+        fig = heatmap_figure(z, x_values, y_values, title=TITLE_PLACEHOLDER,
+                             x_label=X_LABEL_PLACEHOLDER, y_label=Y_LABEL_PLACEHOLDER,
+                             z_label=f'{z_col}の{AGGREGATION_LABELS[agg]}', template=BASE_TEMPLATE)
+        fig.update_layout(title_x=0.5) # ここを追加
+        return fig
+
+    return cached_figure(key, build, {
+        TITLE_PLACEHOLDER: title if title else f'ヒートマップ ({z_col} by {x_col}, {y_col})',
+        X_LABEL_PLACEHOLDER: x_label if x_label else x_col,
+        Y_LABEL_PLACEHOLDER: y_label if y_label else y_col
+    }, color_theme)
+
+
+@profiled('plot')
+def heatmap_query_figure(query, x_col, y_col, z_col, title=None, x_label=None, y_label=None, color_theme=None,
+                         agg=AGG_SUM, x_bins=DEFAULT_HEATMAP_BINS, y_bins=DEFAULT_HEATMAP_BINS):
+    """
+    問い合わせ query の結果について、heatmap_chart_figure と同じ Z の列のヒートマップの図を返します。
+    行は取り出さず、セルごとの集計結果だけを問い合わせます（query_heatmap）。
+    """
+    _check_heatmap_values(query.dataset.typed[z_col].dtype, z_col, agg)
+    key = _scoped_figure_key(query.key, [x_col, y_col, z_col], 'heatmap', x_col, y_col, z_col, agg, x_bins, y_bins)
+    return _cached_heatmap_figure(
+        key, lambda: query_heatmap(query, x_col, y_col, z_col, agg=agg, x_bins=x_bins, y_bins=y_bins),
+        x_col, y_col, z_col, agg, title, x_label, y_label, color_theme
+    )
+
+# --- グラフ描画関数（図の作成は上の関数で行い、ここでは Streamlit への表示だけを行う） ---
 # 各関数に title, x_label, y_label, color_theme 引数を追加
 
-def plot_line_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None):
-    """折れ線グラフを描画します。"""
+@profiled('plot')
+def plot_line_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                    downsample=True, downsample_method=METHOD_LTTB, chart_width_px=DEFAULT_CHART_WIDTH_PX,
+                    series_layout=SERIES_LAYOUT_SEPARATE, dataset_key=None):
+    """
+    折れ線グラフを描画します。
+    downsample=True の場合、グラフ幅から決まる点数を超える系列は downsample_method（LTTB または最小/最大）で間引きます。
+    series_layout に SERIES_LAYOUT_OVERLAY / SERIES_LAYOUT_SUBPLOTS を指定すると、全系列を1つの図にまとめます。
+    """
     st.subheader('折れ線グラフ')
     if not isinstance(y_cols, list):
         y_cols = [y_cols]
+    valid_y_cols = [y_col for y_col in y_cols if y_col]
 
-    for y_col in y_cols:
-        if y_col:
-            # 軸ラベルを動的に設定
-            labels = {x_col: x_label if x_label else x_col,
-                      y_col: y_label if y_label else y_col}
-            fig = px.line(df, x=x_col, y=y_col,
-                          title=title if title else f'{y_col} vs {x_col} の折れ線グラフ',
-                          labels=labels, template=color_theme)
-            fig.update_layout(title_x=0.5) # ここを追加
-            st.plotly_chart(fig, use_container_width=True)
-        else:
+    if series_layout != SERIES_LAYOUT_SEPARATE and not valid_y_cols:
+        st.warning(f"折れ線グラフのY軸に有効な列が選択されていません。")
+        return
+    for fig in line_chart_figures(df, x_col=x_col, y_cols=valid_y_cols, title=title, x_label=x_label,
+                                  y_label=y_label, color_theme=color_theme, downsample=downsample,
+                                  downsample_method=downsample_method, chart_width_px=chart_width_px,
+                                  series_layout=series_layout, dataset_key=dataset_key):
+        plotly_chart(fig, use_container_width=True)
+    if series_layout == SERIES_LAYOUT_SEPARATE:
+        for _ in range(len(y_cols) - len(valid_y_cols)):
             st.warning(f"折れ線グラフのY軸に有効な列が選択されていません。")
 
 
-def plot_bar_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None):
-    """棒グラフを描画します。"""
+@profiled('plot')
+def plot_bar_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                   series_layout=SERIES_LAYOUT_SEPARATE, dataset_key=None):
+    """
+    棒グラフを描画します。
+    series_layout に SERIES_LAYOUT_OVERLAY / SERIES_LAYOUT_SUBPLOTS を指定すると、全系列を1つの図にまとめます。
+    """
     st.subheader('棒グラフ')
     if not isinstance(y_cols, list):
         y_cols = [y_cols]
+    valid_y_cols = [y_col for y_col in y_cols if y_col]
 
-    for y_col in y_cols:
-        if y_col:
-            labels = {x_col: x_label if x_label else x_col,
-                      y_col: y_label if y_label else y_col}
-            fig = px.bar(df, x=x_col, y=y_col,
-                         title=title if title else f'{y_col} vs {x_col} の棒グラフ',
-                         labels=labels, template=color_theme)
-            fig.update_layout(title_x=0.5) # ここを追加
-            st.plotly_chart(fig, use_container_width=True)
-        else:
+    if series_layout != SERIES_LAYOUT_SEPARATE and not valid_y_cols:
+        st.warning(f"棒グラフのY軸に有効な列が選択されていません。")
+        return
+    for fig in bar_chart_figures(df, x_col=x_col, y_cols=valid_y_cols, title=title, x_label=x_label,
+                                 y_label=y_label, color_theme=color_theme, series_layout=series_layout,
+                                 dataset_key=dataset_key):
+        plotly_chart(fig, use_container_width=True)
+    if series_layout == SERIES_LAYOUT_SEPARATE:
+        for _ in range(len(y_cols) - len(valid_y_cols)):
             st.warning(f"棒グラフのY軸に有効な列が選択されていません。")
 
-def plot_stacked_bar_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None):
+@profiled('plot')
+def plot_stacked_bar_chart(df, x_col, y_cols, title=None, x_label=None, y_label=None, color_theme=None,
+                           dataset_key=None):
     """積み立て棒グラフを描画します。"""
     st.subheader('積み立て棒グラフ')
     if not y_cols:
@@ -59,61 +596,58 @@ def plot_stacked_bar_chart(df, x_col, y_cols, title=None, x_label=None, y_label=
         return
 
     try:
-        df_melted = df.melt(id_vars=[x_col], value_vars=y_cols, var_name="MetricType", value_name="Value")
-
-        labels = {x_col: x_label if x_label else x_col,
-                  "Value": y_label if y_label else "値"}
-        fig = px.bar(df_melted, x=x_col, y="Value", color="MetricType",
-                     title=title if title else f'{x_col}に対する積み立てグラフ',
-                     barmode='stack', labels=labels, template=color_theme)
-        fig.update_layout(title_x=0.5) # ここを追加
-        st.plotly_chart(fig, use_container_width=True)
+        fig = stacked_bar_chart_figure(df, x_col=x_col, y_cols=y_cols, title=title, x_label=x_label,
+                                       y_label=y_label, color_theme=color_theme, dataset_key=dataset_key)
+        plotly_chart(fig, use_container_width=True)
 
     except Exception as e:
         st.error(f"積み立てグラフの描画中にエラーが発生しました: {e}")
         st.info("選択した列が数値データであり、積み立てに適した形式か確認してください。")
 
 
-def plot_scatter_plot(df, x_col, y_col, color_col=None, title=None, x_label=None, y_label=None, color_theme=None):
-    """散布図を描画します。"""
+@profiled('plot')
+def plot_scatter_plot(df, x_col, y_col, color_col=None, title=None, x_label=None, y_label=None, color_theme=None,
+                      downsample=True, chart_width_px=DEFAULT_CHART_WIDTH_PX, rasterize=True,
+                      webgl_threshold=WEBGL_POINT_THRESHOLD, raster_threshold=RASTER_POINT_THRESHOLD,
+                      dataset_key=None):
+    """散布図を描画します（間引き・WebGL・ラスタ表示の切り替えは scatter_plot_figure を参照）。"""
     st.subheader('散布図')
     if x_col and y_col:
-        labels = {x_col: x_label if x_label else x_col,
-                  y_col: y_label if y_label else y_col}
-        fig = px.scatter(df, x=x_col, y=y_col, color=color_col,
-                         title=title if title else f'{y_col} vs {x_col} の散布図',
-                         labels=labels, template=color_theme)
-        fig.update_layout(title_x=0.5) # ここを追加
-        st.plotly_chart(fig, use_container_width=True)
+        fig = scatter_plot_figure(df, x_col=x_col, y_col=y_col, color_col=color_col, title=title,
+                                  x_label=x_label, y_label=y_label, color_theme=color_theme,
+                                  downsample=downsample, chart_width_px=chart_width_px,
+                                  rasterize=rasterize, webgl_threshold=webgl_threshold,
+                                  raster_threshold=raster_threshold, dataset_key=dataset_key)
+        plotly_chart(fig, use_container_width=True)
     else:
         st.warning("散布図のX軸とY軸に有効な列を選択してください。")
 
-def plot_heatmap(df, x_col, y_col, z_col=None, title=None, x_label=None, y_label=None, color_theme=None):
-    """ヒートマップを描画します。"""
+@profiled('plot')
+def plot_heatmap(query, x_col, y_col, z_col=None, title=None, x_label=None, y_label=None, color_theme=None,
+                 agg=AGG_SUM, x_bins=DEFAULT_HEATMAP_BINS, y_bins=DEFAULT_HEATMAP_BINS):
+    """
+    問い合わせ query の結果のヒートマップを描画します（集計と描画の内容は heatmap_chart_figure を参照）。
+    Z の列のヒートマップはセルごとの集計結果だけを問い合わせ、相関ヒートマップは数値列だけを取り出します。
+    """
     st.subheader('ヒートマップ')
     if x_col and y_col:
-        if z_col:
-            labels = {x_col: x_label if x_label else x_col,
-                      y_col: y_label if y_label else y_col,
-                      z_col: z_col}
-            fig = px.density_heatmap(df, x=x_col, y=y_col, z=z_col,
-                                     title=title if title else f'ヒートマップ ({z_col} by {x_col}, {y_col})',
-                                     labels=labels, template=color_theme)
-            fig.update_layout(title_x=0.5) # ここを追加
-        else:
+        if not z_col:
             st.info("ヒートマップには、通常X, Y軸に加え、色付けする値 (Z軸) が必要です。Z軸が選択されていないため、数値列の相関ヒートマップを表示します。")
-            numeric_df = df.select_dtypes(include=['number'])
-            if not numeric_df.empty:
-                corr = numeric_df.corr()
-                fig = px.imshow(corr, text_auto=True, aspect="auto",
-                                 title=title if title else "数値列の相関ヒートマップ",
-                                 template=color_theme)
-                fig.update_layout(title_x=0.5) # ここを追加
-                st.plotly_chart(fig, use_container_width=True)
+        try:
+            if z_col:
+                fig = heatmap_query_figure(query, x_col, y_col, z_col, title=title, x_label=x_label,
+                                           y_label=y_label, color_theme=color_theme, agg=agg,
+                                           x_bins=x_bins, y_bins=y_bins)
             else:
-                st.warning("ヒートマップを描画するための数値列が見つかりません。")
-                return
-
-        st.plotly_chart(fig, use_container_width=True)
+                numeric_columns = [col for col, dtype in query.dataset.typed.dtypes.items()
+                                   if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+                view = query.select(numeric_columns)
+                fig = heatmap_chart_figure(view.collect(), x_col=x_col, y_col=y_col, title=title,
+                                           x_label=x_label, y_label=y_label, color_theme=color_theme,
+                                           dataset_key=view.key)
+        except ValueError as e:
+            st.warning(str(e))
+            return
+        plotly_chart(fig, use_container_width=True)
     else:
-        st.warning("ヒートマップのX軸とY軸に有効な列を選択してください。")
\ No newline at end of file
+        st.warning("ヒートマップのX軸とY軸に有効な列を選択してください。")
@@ -0,0 +1,262 @@
+# components/heatmap.py
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+AGG_MEAN = 'mean'
+AGG_SUM = 'sum'
+AGG_COUNT = 'count'
+AGG_MAX = 'max'
+
+AGGREGATION_LABELS = {
+    AGG_MEAN: '平均',
+    AGG_SUM: '合計',
+    AGG_COUNT: '件数',
+    AGG_MAX: '最大',
+}
+
+DEFAULT_HEATMAP_BINS = 50 # 数値・日時の軸を等間隔に区切るビンの数の既定値
+MAX_HEATMAP_BINS = 1000
+# 数値・日時以外の軸に並べる値の数の上限。超えた場合は件数の多い値だけを残し、残りは「その他」の1つのビンにまとめる
+# （値ごとのビンのままだと、値の種類が多い列どうしでは格子が巨大になるため）
+MAX_HEATMAP_CATEGORIES = 100
+OTHER_CATEGORY_LABEL = 'その他'
+
+
+def _is_binned_axis(series):
+    return _is_binned_dtype(series.dtype)
+
+
+def _is_binned_dtype(dtype):
+    return pd.api.types.is_datetime64_any_dtype(dtype) or (
+        pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    )
+
+
+def bin_axis(series, n_bins=DEFAULT_HEATMAP_BINS):
+    """
+    列の値を格子の軸のビン番号に変換し、(ビン番号の配列, ビンの数, 軸に表示する値) を返します。
+    数値・日時は最小値から最大値までを n_bins 個の等間隔のビンに区切り（軸の値はビンの中心）、
+    値の種類が n_bins 以下の整数列は値ごとに1つのビンにします。それ以外の列は値ごとに1つのビンです
+    （MAX_HEATMAP_CATEGORIES 種類まで。_category_axis）。タイムゾーン付きの日時は現地時刻で区切ります。
+    欠損値のビン番号は -1 です。
+    """
+    n_bins = max(int(n_bins), 1)
+    if not _is_binned_axis(series):
+        return _category_axis(series)
+
+    is_datetime = pd.api.types.is_datetime64_any_dtype(series.dtype)
+    if is_datetime:
+        # タイムゾーン付きの列は現地時刻で区切る（軸の値も現地時刻にする）
+        if series.dt.tz is not None:
+            series = series.dt.tz_localize(None)
+        values = series.to_numpy(dtype='datetime64[ns]').view(np.int64).astype(np.float64)
+        values[series.isna().to_numpy()] = np.nan
+    else:
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    finite = np.isfinite(values)
+    codes = np.full(len(values), -1, dtype=np.int64)
+    if not finite.any():
+        return codes, 0, np.array([])
+    lo = float(values[finite].min())
+    hi = float(values[finite].max())
+
+    if pd.api.types.is_integer_dtype(series.dtype) and hi - lo + 1 <= n_bins:
+        # 値の種類が少ない整数列（時間帯や曜日など）は、値ごとのビンにする
+        codes[finite] = (values[finite] - lo).astype(np.int64)
+        return codes, int(hi - lo) + 1, np.arange(int(lo), int(hi) + 1)
+
+    if hi == lo:
+        codes[finite] = 0
+        centers = np.array([lo])
+    else:
+        scaled = (values[finite] - lo) / (hi - lo) * n_bins
+        codes[finite] = np.minimum(scaled.astype(np.int64), n_bins - 1) # 最大値は最後のビンに含める
+        edges = np.linspace(lo, hi, n_bins + 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+    if is_datetime:
+        centers = pd.to_datetime(centers.astype(np.int64))
+    return codes, len(centers), centers
+
+
+def _category_axis(series, max_categories=MAX_HEATMAP_CATEGORIES):
+    """
+    数値・日時以外の列を値ごとのビン番号にします（bin_axis と同じ戻り値）。
+    値の種類が max_categories を超える場合は、件数の多い max_categories - 1 個の値を残し（軸の並びは値の順）、
+    残りの値は最後の「その他（N 種類）」のビンにまとめます。
+    """
+    codes, uniques = pd.factorize(series, sort=True)
+    codes = codes.astype(np.int64)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    remap, labels = _cap_categories(uniques, counts, max_categories)
+    if remap is not None:
+        codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+    return codes, len(labels), labels
+
+
+def _cap_categories(uniques, counts, max_categories):
+    """
+    値順の uniques（件数 counts）を軸に並べる値に絞ります。戻り値は (各値の新しいビン番号の配列, 軸の値) で、
+    値の種類が max_categories 以下の場合はビン番号を変えないため None を返します。
+    """
+    if len(uniques) <= max_categories:
+        return None, np.asarray(uniques)
+    kept = np.sort(np.argsort(-np.asarray(counts), kind='stable')[:max_categories - 1])
+    remap = np.full(len(uniques), len(kept), dtype=np.int64)
+    remap[kept] = np.arange(len(kept))
+    labels = np.append(np.asarray(uniques, dtype=object)[kept],
+                       f'{OTHER_CATEGORY_LABEL}（{len(uniques) - len(kept):,} 種類）')
+    return remap, labels
+
+
+def aggregate_grid(x_codes, nx, y_codes, ny, values=None, agg=AGG_COUNT):
+    """
+    ビン番号の組ごとに値を集計し、行が Y、列が X の (ny, nx) の2次元配列を返します。
+    セルの番号 (y * nx + x) に対する np.bincount で全ての行を1回だけ走査します。
+    values が None の場合、または agg が件数の場合は行数を数えます（行のないセルは 0）。
+    それ以外の集計では、値のないセルは NaN です。
+    """
+    valid = (x_codes >= 0) & (y_codes >= 0)
+    if values is not None:
+        values = np.asarray(values, dtype=np.float64)
+        valid &= np.isfinite(values)
+    cells = y_codes[valid] * nx + x_codes[valid]
+    size = nx * ny
+    counts = np.bincount(cells, minlength=size)
+    if values is None or agg == AGG_COUNT:
+        return counts.astype(np.float64).reshape(ny, nx)
+
+    values = values[valid]
+    if agg == AGG_MAX:
+        grid = np.full(size, np.nan)
+        np.fmax.at(grid, cells, values)
+    else:
+        grid = np.bincount(cells, weights=values, minlength=size)
+        if agg == AGG_MEAN:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                grid = grid / counts
+        elif agg != AGG_SUM:
+            raise ValueError(f'未対応の集計方法です: {agg}')
+        grid[counts == 0] = np.nan
+    return grid.reshape(ny, nx)
+
+
+def compute_heatmap(df, x_col, y_col, z_col=None, agg=AGG_MEAN, x_bins=DEFAULT_HEATMAP_BINS,
+                    y_bins=DEFAULT_HEATMAP_BINS):
+    """
+    X・Y の列をビンに分けて Z の列を集計し、(z の2次元配列, X 軸の値, Y 軸の値) を返します。
+    z_col を省略した場合は agg によらず行数（件数）を集計します。
+    """
+    x_codes, nx, x_values = bin_axis(df[x_col], x_bins)
+    y_codes, ny, y_values = bin_axis(df[y_col], y_bins)
+    values = None
+    if z_col is not None:
+        # 件数の場合も、Z の値が欠損の行は数えない
+        values = df[z_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    return aggregate_grid(x_codes, nx, y_codes, ny, values, agg), x_values, y_values
+
+
+def _query_axis(query, col, n_bins, name):
+    """
+    bin_axis と同じビンの分け方を Query で求め、(軸の列 name を追加する関数, 列の値からビン番号を求める関数,
+    ビンの数, 軸に表示する値) を返します。範囲や値ごとの件数は、行を取り出さない小さな集計の問い合わせで求めます。
+    """
+    n_bins = max(int(n_bins), 1)
+    dtype = query.dataset.typed[col].dtype
+    # 日時は現地時刻にした値、それ以外は元の値を name の列にする
+    axis_query = query.bucket(col, None, name)
+    if not _is_binned_dtype(dtype):
+        counts = axis_query.aggregate([name], n=(None, 'size')).collect()
+        uniques = pd.Index(counts[name])
+        remap, labels = _cap_categories(uniques, counts['n'].to_numpy(), MAX_HEATMAP_CATEGORIES)
+
+        def numbers(values):
+            positions = uniques.get_indexer(values)
+            return positions if remap is None else remap[positions]
+        return (lambda q: q.bucket(col, None, name)), numbers, len(labels), labels
+
+    bounds = axis_query.aggregate([], lo=(name, 'min'), hi=(name, 'max')).collect()
+    lo, hi = bounds['lo'].iloc[0], bounds['hi'].iloc[0]
+    if pd.isna(lo):
+        return None, None, 0, np.array([])
+    is_datetime = pd.api.types.is_datetime64_any_dtype(dtype)
+    if is_datetime:
+        lo, hi = pd.Timestamp(lo).as_unit('ns').value, pd.Timestamp(hi).as_unit('ns').value
+    lo, hi = float(lo), float(hi)
+    if pd.api.types.is_integer_dtype(dtype) and hi - lo + 1 <= n_bins:
+        # 値の種類が少ない整数列は、値ごとのビンにする（丸め誤差で隣のビンにならないよう、値をビンの中央に置く）
+        low, high, n = lo - 0.5, hi + 0.5, int(hi - lo) + 1
+        labels = np.arange(int(lo), int(hi) + 1)
+    elif hi == lo:
+        low, high, n = lo, hi, 1
+        labels = np.array([lo])
+    else:
+        low, high, n = lo, hi, n_bins
+        edges = np.linspace(lo, hi, n + 1)
+        labels = (edges[:-1] + edges[1:]) / 2
+    if is_datetime:
+        labels = pd.to_datetime(labels.astype(np.int64))
+
+    def add_axis(q):
+        return q.bucket(col, None, name).bin(name, low, high, n)
+    return add_axis, (lambda values: values.to_numpy(dtype=np.int64)), n, labels
+
+
+def query_heatmap(query, x_col, y_col, z_col=None, agg=AGG_MEAN, x_bins=DEFAULT_HEATMAP_BINS,
+                  y_bins=DEFAULT_HEATMAP_BINS):
+    """
+    compute_heatmap と同じ (z の2次元配列, X 軸の値, Y 軸の値) を Query の集計で求めます。
+    軸のビン番号の組ごとの合計・件数・最大だけを問い合わせるため、行ではなくセルの数の大きさの結果だけを受け取ります。
+    """
+    add_x, x_numbers, nx, x_values = _query_axis(query, x_col, x_bins, '__heatmap_x')
+    add_y, y_numbers, ny, y_values = _query_axis(query, y_col, y_bins, '__heatmap_y')
+    if z_col is None or agg == AGG_COUNT:
+        empty = np.zeros((ny, nx))
+    else:
+        empty = np.full((ny, nx), np.nan)
+    if nx == 0 or ny == 0:
+        return empty, x_values, y_values
+
+    if z_col is None:
+        aggregations = {'count': (None, 'size')}
+    else:
+        # 件数の場合も、Z の値が欠損の行は数えない
+        aggregations = {'count': (z_col, 'count')}
+        if agg in (AGG_MEAN, AGG_SUM):
+            aggregations['sum'] = (z_col, 'sum')
+        elif agg == AGG_MAX:
+            aggregations['max'] = (z_col, 'max')
+        elif agg != AGG_COUNT:
+            raise ValueError(f'未対応の集計方法です: {agg}')
+    cells = add_y(add_x(query)).aggregate(['__heatmap_x', '__heatmap_y'], aggregations).collect()
+
+    # 「その他」にまとめた値のセルは同じセルになるため、セルの番号ごとに足し合わせる（最大は比較）
+    cell = y_numbers(cells['__heatmap_y']) * nx + x_numbers(cells['__heatmap_x'])
+    counts = np.bincount(cell, weights=cells['count'].to_numpy(dtype=np.float64), minlength=nx * ny)
+    if z_col is None or agg == AGG_COUNT:
+        return counts.reshape(ny, nx), x_values, y_values
+    if agg == AGG_MAX:
+        grid = np.full(nx * ny, np.nan)
+        np.fmax.at(grid, cell, cells['max'].to_numpy(dtype=np.float64, na_value=np.nan))
+    else:
+        grid = np.bincount(cell, weights=cells['sum'].to_numpy(dtype=np.float64), minlength=nx * ny)
+        if agg == AGG_MEAN:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                grid = grid / counts
+        grid[counts == 0] = np.nan
+    return grid.reshape(ny, nx), x_values, y_values
+
+
+def heatmap_figure(z, x, y, title=None, x_label=None, y_label=None, z_label=None, template=None):
+    """集計済みの2次元配列 z（行が Y、列が X）を go.Heatmap で描画した図を返します。"""
+    hovertemplate = f'{x_label}=%{{x}}<br>{y_label}=%{{y}}<br>{z_label}=%{{z}}<extra></extra>'
+    fig = go.Figure(go.Heatmap(z=z, x=x, y=y, coloraxis='coloraxis', hovertemplate=hovertemplate))
+    fig.update_layout(
+        title=title,
+        xaxis_title=x_label,
+        yaxis_title=y_label,
+        coloraxis_colorbar_title_text=z_label,
+        template=template
+    )
+    return fig
@@ -0,0 +1,406 @@
+# components/online_stats.py
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache
+from components.fingerprint import ARTIFACT_MOMENTS, ARTIFACT_QUANTILE_SKETCH, record_dependency
+
+MOMENTS_CHUNK_ROWS = 1_000_000 # 行列積を計算する際の1チャンクあたりの行数
+
+MOMENTS_CACHE_BUDGET_BYTES = 64 * 1024 * 1024 # 64MB
+_moments_cache = LRUByteCache(MOMENTS_CACHE_BUDGET_BYTES, sizeof=lambda moments: moments.nbytes)
+
+# 分位点スケッチ（KLL）の精度。k が大きいほど誤差が小さく、メモリは O(k log(n/k)) 程度
+SKETCH_K = 400
+SKETCH_EXACT_MAX_ROWS = 100_000 # 値の数がこれ以下のうちは圧縮せず全て保持する（分位点は厳密に一致）
+SKETCH_CACHE_BUDGET_BYTES = 64 * 1024 * 1024 # 64MB
+_sketch_cache = LRUByteCache(
+    SKETCH_CACHE_BUDGET_BYTES, sizeof=lambda sketches: sum(sketch.nbytes for sketch in sketches.values())
+)
+
+
+class PairwiseMoments:
+    """
+    数値列どうしの相関を計算するための、加算可能な積和の集計。
+
+    列 i, j の両方が欠損でない行について、件数 n[i, j]、合計 sx[i, j]（列 i の値）、
+    二乗和 sxx[i, j]（列 i の値）、積和 sxy[i, j] を保持します（pandas の corr と同じ「ペアごとの欠損除外」）。
+    桁落ちを抑えるため、値は列ごとのシフト量（最初に見た値）を引いてから集計します。
+    集計どうしは足し合わせられるので、新しいデータが届いたときはその分だけ集計して merge します。
+    """
+
+    def __init__(self, columns, shifts):
+        self.columns = list(columns)
+        k = len(self.columns)
+        self.shifts = np.asarray(shifts, dtype=np.float64)
+        self.n = np.zeros((k, k))
+        self.sx = np.zeros((k, k))
+        self.sxx = np.zeros((k, k))
+        self.sxy = np.zeros((k, k))
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+
+    @property
+    def nbytes(self):
+        return int(self.n.nbytes * 4 + self.min.nbytes * 2 + self.shifts.nbytes)
+
+    @classmethod
+    def from_frame(cls, df, columns=None, chunk_rows=MOMENTS_CHUNK_ROWS):
+        """DataFrame の数値列から集計を作成します（行をチャンクに分けて処理）。"""
+        if columns is None:
+            columns = df.select_dtypes(include=['number']).columns.tolist()
+        shifts = []
+        for col in columns:
+            first_valid = df[col].first_valid_index()
+            shifts.append(float(df[col].loc[first_valid]) if first_valid is not None else 0.0)
+        moments = cls(columns, shifts)
+        moments.update(df)
+        return moments
+
+    def update(self, df, chunk_rows=MOMENTS_CHUNK_ROWS):
+        """DataFrame の行を集計に加えます。"""
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            values = np.column_stack([
+                chunk[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in self.columns
+            ]) if self.columns else np.empty((len(chunk), 0))
+            self._update_array(values)
+        return self
+
+    def _update_array(self, values):
+        present = np.isfinite(values)
+        mask = present.astype(np.float64)
+        centered = np.where(present, values - self.shifts, 0.0)
+        self.n += mask.T @ mask
+        self.sx += centered.T @ mask
+        self.sxx += (centered * centered).T @ mask
+        self.sxy += centered.T @ centered
+        if len(values):
+            self.min = np.fmin(self.min, np.nanmin(np.where(present, values, np.nan), axis=0, initial=np.inf))
+            self.max = np.fmax(self.max, np.nanmax(np.where(present, values, np.nan), axis=0, initial=-np.inf))
+
+    def merge(self, other):
+        """
+        別の集計を足し合わせた新しい集計を返します。
+        列が異なる場合は和集合にそろえます（片方にしかない列どうしの積和は 0 件として扱います）。
+        """
+        columns = self.columns + [col for col in other.columns if col not in self.columns]
+        # 値を見ていない側のシフト量（0）ではなく、値のある側のシフト量を使う
+        seen = np.diag(self.n) > 0
+        shifts = np.array([
+            self.shifts[self.columns.index(col)]
+            if col in self.columns and (col not in other.columns or seen[self.columns.index(col)])
+            else other.shifts[other.columns.index(col)]
+            for col in columns
+        ])
+        merged = PairwiseMoments(columns, shifts)
+        for part in (self, other):
+            merged._add_shifted(part)
+        return merged
+
+    def _add_shifted(self, part):
+        """シフト量の異なる集計を、自分のシフト量に換算して加算します。"""
+        idx = np.array([self.columns.index(col) for col in part.columns], dtype=np.int64)
+        if len(idx) == 0:
+            return
+        # 値 v を (v - s_part) で集計していたものを (v - s_self) に換算する: d = s_part - s_self
+        d = part.shifts - self.shifts[idx]
+        n, sx, sxx, sxy = part.n, part.sx, part.sxx, part.sxy
+        sx_new = sx + d[:, None] * n
+        sxx_new = sxx + 2 * d[:, None] * sx + (d[:, None] ** 2) * n
+        # sxy[i, j] = Σ(a_i)(a_j) ，a = v - s_part
+        sxy_new = sxy + d[:, None] * sx.T + d[None, :] * sx + np.outer(d, d) * n
+        grid = np.ix_(idx, idx)
+        self.n[grid] += n
+        self.sx[grid] += sx_new
+        self.sxx[grid] += sxx_new
+        self.sxy[grid] += sxy_new
+        self.min[idx] = np.fmin(self.min[idx], part.min)
+        self.max[idx] = np.fmax(self.max[idx], part.max)
+
+    def replace_rows(self, removed, added, frame):
+        """
+        removed の行を集計から除き、added の行を加えた新しい集計を返します（行の値を編集した場合など）。
+        合計・二乗和・積和は引き算で更新できますが、最小・最大は除いた値が最小・最大だった可能性のある列だけ
+        frame（更新後の全体の DataFrame）から求め直します。
+        """
+        old = PairwiseMoments(self.columns, self.shifts).update(removed)
+        new = PairwiseMoments(self.columns, self.shifts).update(added)
+        replaced = PairwiseMoments(self.columns, self.shifts)
+        replaced.n = self.n - old.n + new.n
+        replaced.sx = self.sx - old.sx + new.sx
+        replaced.sxx = self.sxx - old.sxx + new.sxx
+        replaced.sxy = self.sxy - old.sxy + new.sxy
+        replaced.min = np.fmin(self.min, new.min)
+        replaced.max = np.fmax(self.max, new.max)
+        for i, col in enumerate(self.columns):
+            if old.min[i] <= self.min[i] or old.max[i] >= self.max[i]:
+                values = frame[col].to_numpy(dtype=np.float64, na_value=np.nan)
+                present = values[np.isfinite(values)]
+                replaced.min[i] = present.min() if len(present) else np.inf
+                replaced.max[i] = present.max() if len(present) else -np.inf
+        return replaced
+
+    def subset(self, columns):
+        """指定した列だけの集計を返します（再集計はせず、保持している行列から取り出します）。"""
+        idx = [self.columns.index(col) for col in columns]
+        sub = PairwiseMoments(columns, self.shifts[idx])
+        grid = np.ix_(idx, idx)
+        sub.n, sub.sx, sub.sxx, sub.sxy = self.n[grid], self.sx[grid], self.sxx[grid], self.sxy[grid]
+        sub.min, sub.max = self.min[idx], self.max[idx]
+        return sub
+
+    def correlation(self, columns=None):
+        """ペアごとの欠損除外によるピアソン相関行列を DataFrame で返します（pandas の corr と同等）。"""
+        m = self.subset(columns) if columns is not None else self
+        n = m.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = m.sxy - m.sx * m.sx.T / n
+            var_i = m.sxx - m.sx ** 2 / n
+            corr = cov / np.sqrt(var_i * var_i.T)
+        corr[n < 2] = np.nan
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, np.where(np.diag(n) >= 2, 1.0, np.nan))
+        return pd.DataFrame(corr, index=m.columns, columns=m.columns)
+
+    def column_summary(self, columns=None):
+        """列ごとの件数・平均・標準偏差（不偏）・最小・最大を DataFrame（describe と同じ行の向き）で返します。"""
+        m = self.subset(columns) if columns is not None else self
+        count = np.diag(m.n)
+        total = np.diag(m.sx)
+        squares = np.diag(m.sxx)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count + m.shifts
+            var = (squares - total ** 2 / count) / (count - 1)
+        std = np.sqrt(np.maximum(var, 0))
+        std[count < 2] = np.nan
+        minimum = np.where(count > 0, m.min, np.nan)
+        maximum = np.where(count > 0, m.max, np.nan)
+        return pd.DataFrame(
+            [count, mean, std, minimum, maximum],
+            index=['count', 'mean', 'std', 'min', 'max'],
+            columns=m.columns
+        )
+
+
+def get_pairwise_moments(df, dataset_key):
+    """データセットのキーごとにキャッシュされた、全数値列の積和の集計を返します。"""
+    moments = _moments_cache.get(dataset_key)
+    if moments is None:
+        moments = PairwiseMoments.from_frame(df)
+        seed_pairwise_moments(dataset_key, moments)
+    return moments
+
+
+def seed_pairwise_moments(dataset_key, moments):
+    """追記などで計算済みの集計を、データセットのキーに対応づけて登録します（全数値列に依存する派生データとして記録）。"""
+    _moments_cache.put(dataset_key, moments)
+    record_dependency(dataset_key, ARTIFACT_MOMENTS, None, moments.columns,
+                      evict=functools.partial(_moments_cache.pop, dataset_key))
+
+
+def cached_pairwise_moments(dataset_key):
+    """キャッシュ済みの集計を返します（なければ None。新たに計算はしません）。"""
+    return _moments_cache.get(dataset_key)
+
+
+class QuantileSketch:
+    """
+    1列分の値の分位点を近似するための KLL スケッチ。
+
+    値はレベルごとのバッファに保持し、レベル h の値は 2**h 件分の重みを持ちます。
+    バッファが容量を超えたらソートして1つおきに上のレベルへ送る（圧縮する）ため、
+    チャンクごとに update しても、全体のデータを保持せずに一定の誤差で分位点を求められます。
+    スケッチどうしは merge で統合できます。値の数が SKETCH_EXACT_MAX_ROWS 以下のうちは圧縮しないので、
+    分位点は pandas の quantile（線形補間）と一致します。
+    """
+
+    def __init__(self, k=SKETCH_K, exact_max_rows=SKETCH_EXACT_MAX_ROWS, seed=0):
+        self.k = k
+        self.exact_max_rows = exact_max_rows
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def nbytes(self):
+        return int(sum(level.nbytes for level in self.levels))
+
+    @property
+    def is_exact(self):
+        return len(self.levels) == 1 and self.count <= self.exact_max_rows
+
+    def copy(self):
+        """現在の状態のコピーを返します（レベルの配列は更新時に置き換えるだけなので、配列自体は共有します）。"""
+        sketch = QuantileSketch(self.k, self.exact_max_rows)
+        sketch.levels = list(self.levels)
+        sketch.count = self.count
+        return sketch
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, values):
+        """値（NaN は除外）をスケッチに加えます。"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if self.is_exact:
+            return
+        level = 0
+        while level < len(self.levels):
+            buffer = self.levels[level]
+            if len(buffer) > self._capacity(level):
+                buffer = np.sort(buffer)
+                # 奇数個なら1つをこのレベルに残し、残りを1つおきに上のレベルへ送る
+                keep = buffer[-1:] if len(buffer) % 2 else buffer[:0]
+                paired = buffer[:len(buffer) - len(keep)]
+                promoted = paired[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def merge(self, other):
+        """2つのスケッチを統合した新しいスケッチを返します。"""
+        merged = QuantileSketch(self.k, self.exact_max_rows)
+        depth = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            np.concatenate([
+                self.levels[h] if h < len(self.levels) else np.empty(0),
+                other.levels[h] if h < len(other.levels) else np.empty(0)
+            ])
+            for h in range(depth)
+        ]
+        merged.count = self.count + other.count
+        merged._compress()
+        return merged
+
+    def quantiles(self, qs):
+        """分位点（0〜1 のリスト）に対応する値の配列を返します。値がなければ NaN です。"""
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+        if self.is_exact:
+            return np.quantile(self.levels[0], qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        # 各値が代表する区間の中央の順位で補間する
+        positions = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(qs, positions, values)
+
+
+def build_quantile_sketches(df, columns=None, chunk_rows=MOMENTS_CHUNK_ROWS):
+    """DataFrame の数値列ごとの分位点スケッチを {列名: スケッチ} で返します（行をチャンクに分けて処理）。"""
+    if columns is None:
+        columns = df.select_dtypes(include=['number']).columns.tolist()
+    sketches = {col: QuantileSketch() for col in columns}
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        for col, sketch in sketches.items():
+            sketch.update(chunk[col].to_numpy(dtype=np.float64, na_value=np.nan))
+    return sketches
+
+
+def merge_quantile_sketches(old_sketches, new_sketches):
+    """列ごとのスケッチの辞書を統合します（片方にしかない列はそのまま残します）。"""
+    merged = dict(old_sketches)
+    for col, sketch in new_sketches.items():
+        merged[col] = merged[col].merge(sketch) if col in merged else sketch
+    return merged
+
+
+def summarize_chunks(chunks, columns=None, progress_callback=None):
+    """
+    DataFrame のチャンクの列（pd.read_csv の chunksize や保存済みデータセットのバッチなど）を1回だけ走査し、
+    (積和の集計, {列名: 分位点スケッチ}) を返します。全体を1つの DataFrame にまとめる必要はありません。
+    progress_callback(処理済みの行数, 集計, スケッチ) を渡すと、チャンクごとに途中の集計のコピーを受け取れます。
+    """
+    moments, sketches = None, None
+    rows_done = 0
+    for chunk in chunks:
+        if moments is None:
+            moments = PairwiseMoments.from_frame(chunk, columns)
+            sketches = build_quantile_sketches(chunk, moments.columns)
+        else:
+            # 最初のチャンクで全て欠損だった列もシフト量を決められるよう、チャンクごとの集計を merge する
+            moments = moments.merge(PairwiseMoments.from_frame(chunk, moments.columns))
+            for col, sketch in sketches.items():
+                sketch.update(chunk[col].to_numpy(dtype=np.float64, na_value=np.nan))
+        rows_done += len(chunk)
+        if progress_callback is not None:
+            progress_callback(
+                rows_done,
+                moments.subset(moments.columns),
+                {col: sketch.copy() for col, sketch in sketches.items()}
+            )
+    if moments is None:
+        moments = PairwiseMoments(columns or [], np.zeros(len(columns or [])))
+        sketches = {col: QuantileSketch() for col in moments.columns}
+    return moments, sketches
+
+
+def iter_row_chunks(df, chunk_rows=MOMENTS_CHUNK_ROWS):
+    """DataFrame を chunk_rows 行ずつのビューに分けて返します（summarize_chunks に渡す用）。"""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def get_quantile_sketches(df, dataset_key, columns):
+    """
+    データセットのキーごとにキャッシュされた分位点スケッチのうち、columns の分を返します。
+    まだスケッチのない列だけを計算して追加するため、選択する列が変わっても計算済みの列は再計算しません。
+    """
+    sketches = _sketch_cache.get(dataset_key) or {}
+    missing = [col for col in columns if col not in sketches]
+    if missing:
+        sketches = {**sketches, **build_quantile_sketches(df, missing)}
+        seed_quantile_sketches(dataset_key, sketches)
+    return {col: sketches[col] for col in columns}
+
+
+def seed_quantile_sketches(dataset_key, sketches):
+    """追記などで計算済みのスケッチを、データセットのキーに対応づけて登録します（列ごとの派生データとして記録）。"""
+    _sketch_cache.put(dataset_key, sketches)
+    for col in sketches:
+        record_dependency(dataset_key, ARTIFACT_QUANTILE_SKETCH, col, [col],
+                          evict=functools.partial(_drop_quantile_sketch, dataset_key, col))
+
+
+def _drop_quantile_sketch(dataset_key, col):
+    """キャッシュ済みのスケッチの辞書から1列分を取り除きます。"""
+    sketches = _sketch_cache.get(dataset_key)
+    if sketches is not None and col in sketches:
+        _sketch_cache.put(dataset_key, {name: sketch for name, sketch in sketches.items() if name != col})
+
+
+def cached_quantile_sketches(dataset_key):
+    """キャッシュ済みのスケッチの辞書を返します（なければ None。新たに計算はしません）。"""
+    return _sketch_cache.get(dataset_key)
+
+
+def describe_from_statistics(moments, sketches, columns):
+    """
+    積和の集計と分位点スケッチから、df.describe() と同じ行（count, mean, std, min, 25%, 50%, 75%, max）の
+    DataFrame を作成します。
+    """
+    summary = moments.column_summary(columns)
+    quartiles = pd.DataFrame(
+        {col: sketches[col].quantiles([0.25, 0.5, 0.75]) for col in columns},
+        index=['25%', '50%', '75%']
+    )
+    return pd.concat([summary.loc[['count', 'mean', 'std', 'min']], quartiles, summary.loc[['max']]])
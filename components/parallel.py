@@ -0,0 +1,274 @@
+# components/parallel.py
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# ワーカープロセス数の既定値（環境変数 DATA_APP_MAX_WORKERS で変更可能）。1 以下なら常に直列で処理する
+DEFAULT_MAX_WORKERS = int(os.environ.get('DATA_APP_MAX_WORKERS', os.cpu_count() or 1))
+# 行の分割による並列集計は、行数がこれ以上の場合だけ行う（小さいデータはプロセス間の受け渡しの方が高くつく）
+PARALLEL_MIN_ROWS = 2_000_000
+# CSV の並列パースは、ファイルの合計サイズがこれ以上の場合だけ行う
+PARALLEL_MIN_CSV_BYTES = 32 * 1024 * 1024 # 32MB
+
+# プロセスプールはプロセス全体で1つだけ持ち、ワーカー数は固定する。呼び出しごとのワーカー数（セッションごとの設定）は
+# 同時に投入するタスクの数で制限し、プールを作り直して他の呼び出しのタスクを取り消すことはしない
+POOL_MAX_WORKERS = max(os.cpu_count() or 1, DEFAULT_MAX_WORKERS)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def resolve_max_workers(max_workers=None):
+    """ワーカー数の指定（None なら既定値）を 1 以上の整数にします。"""
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    return max(int(max_workers), 1)
+
+
+def _get_pool():
+    """プロセス全体で共有するプロセスプールを返します（Streamlit のスレッドから fork しないよう spawn で起動）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool):
+    """
+    ワーカーが異常終了して使えなくなったプールを捨て、次の呼び出しで作り直すようにします。
+    壊れたプールのタスクはすでに失敗しているため、取り消しはしません。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _create_shared(size):
+    return shared_memory.SharedMemory(create=True, size=max(int(size), 1))
+
+
+def _release_shared(shm, unlink=False):
+    shm.close()
+    if unlink:
+        shm.unlink()
+
+
+def _disown_shared(shm):
+    """ワーカーで作成した共有メモリを、ワーカー側の後始末の対象から外します（親プロセスが解放する）。"""
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+# ---- CSV の並列パース ----
+
+def _read_shared_csv(shm, size, read_csv_kwargs):
+    # 共有メモリを参照するバッファはこの関数の中だけで使い、戻るときに解放されるようにする
+    return pd.read_csv(pa.BufferReader(pa.py_buffer(shm.buf)[:size]), **read_csv_kwargs)
+
+
+def _read_shared_table(shm, size):
+    # 共有メモリはこの後解放するため、pandas 側の配列にコピーする
+    return pa.ipc.open_stream(pa.py_buffer(shm.buf)[:size]).read_all().to_pandas()
+
+
+def _call_releasing(shm, func, *args):
+    """
+    共有メモリを参照する func を呼び出し、終わったら共有メモリを閉じます。
+    例外のトレースバックが参照するバッファが残っていると閉じられないため、トレースバックを切り離してから送出します。
+    """
+    try:
+        result = func(shm, *args)
+    except Exception as e:
+        e.__traceback__ = None
+        shm.close()
+        raise e
+    shm.close()
+    return result
+
+
+def _parse_csv_worker(input_name, input_size, read_csv_kwargs):
+    """
+    ワーカープロセスで共有メモリ上の CSV をパースし、結果を Arrow IPC 形式で新しい共有メモリに書き込みます。
+    戻り値は ('arrow', 共有メモリ名, バイト数, 列名のリスト)。Arrow に変換できない列がある場合は ('frame', DataFrame) です。
+    """
+    source = shared_memory.SharedMemory(name=input_name)
+    df = _call_releasing(source, _read_shared_csv, input_size, read_csv_kwargs)
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 1つの列に数値と文字列が混在している場合などは、DataFrame のまま返す
+        return ('frame', df)
+
+    # 書き込みに必要なバイト数を先に数えてから、その大きさの共有メモリに直接書き込む
+    counter = pa.MockOutputStream()
+    with pa.ipc.new_stream(counter, table.schema) as writer:
+        writer.write_table(table)
+    size = counter.size()
+    target = _create_shared(size)
+    _disown_shared(target)
+    _call_releasing(target, _write_shared_table, table)
+    return ('arrow', target.name, size, list(df.columns))
+
+
+def _write_shared_table(shm, table):
+    sink = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+
+
+def _frame_from_result(result):
+    """ワーカーの戻り値から DataFrame を作成し、共有メモリを解放します。"""
+    if result[0] == 'frame':
+        return result[1]
+    _, name, size, columns = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        df = _call_releasing(shm, _read_shared_table, size)
+    finally:
+        shm.unlink()
+    df.columns = columns # 数値の列名（header=None の場合など）を元に戻す
+    # Arrow から戻した文字列の列の欠損は None になるので、pd.read_csv と同じ NaN にそろえる
+    for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+        values = df.iloc[:, position]
+        if values.hasnans:
+            df.isetitem(position, values.where(values.notna(), np.nan))
+    return df
+
+
+def _file_bytes(file):
+    file.seek(0)
+    data = file.getvalue() if hasattr(file, 'getvalue') else file.read()
+    file.seek(0)
+    return data
+
+
+def parse_csv_files(files, max_workers=None, min_bytes=PARALLEL_MIN_CSV_BYTES, **read_csv_kwargs):
+    """
+    複数の CSV ファイルを並列にパースし、ファイルと同じ順序で (DataFrame または例外) のリストを返します。
+    ファイルの内容は共有メモリでワーカーに渡し、結果も Arrow 形式で共有メモリを介して受け取るため、
+    大きな DataFrame を pickle しません。ワーカー数が 1 以下、ファイルが1つだけ、ファイルの
+    合計サイズが小さい場合、またはプロセスプールが使えない場合は、このスレッドで順に pd.read_csv します。
+    """
+    max_workers = min(resolve_max_workers(max_workers), len(files))
+    total_bytes = sum(getattr(file, 'size', 0) or 0 for file in files)
+    if max_workers <= 1 or total_bytes < min_bytes:
+        return _parse_csv_serial(files, read_csv_kwargs)
+
+    inputs = []
+    pool = None
+    try:
+        pool = _get_pool()
+        results = []
+        # 同時に投入するファイルは max_workers 個まで（共有のプールを1つの呼び出しで占有しない）
+        for batch_start in range(0, len(files), max_workers):
+            futures = []
+            for file in files[batch_start:batch_start + max_workers]:
+                data = _file_bytes(file)
+                shm = _create_shared(len(data))
+                shm.buf[:len(data)] = data
+                inputs.append(shm)
+                futures.append(pool.submit(_parse_csv_worker, shm.name, len(data), read_csv_kwargs))
+            for future in futures:
+                try:
+                    results.append(_frame_from_result(future.result()))
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    results.append(e)
+        return results
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        # プロセスを起動できない環境などでは直列処理に切り替える
+        if isinstance(e, BrokenProcessPool) and pool is not None:
+            _discard_pool(pool)
+        return _parse_csv_serial(files, read_csv_kwargs)
+    finally:
+        for shm in inputs:
+            _release_shared(shm, unlink=True)
+
+
+def _parse_csv_serial(files, read_csv_kwargs):
+    results = []
+    for file in files:
+        try:
+            file.seek(0)
+            results.append(pd.read_csv(file, **read_csv_kwargs))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# ---- 行を分割した並列集計 ----
+
+def _apply_to_shared(shm, func, layout, start, stop, args):
+    arrays = {
+        key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)[start:stop]
+        for key, (offset, dtype, shape) in layout['arrays'].items()
+    }
+    return func(arrays, *args)
+
+
+def _partition_worker(func, layout, start, stop, args):
+    """共有メモリ上の配列の [start, stop) 行を参照し、func(配列の辞書, *args) の結果を返します。"""
+    shm = shared_memory.SharedMemory(name=layout['name'])
+    return _call_releasing(shm, _apply_to_shared, func, layout, start, stop, args)
+
+
+def _copy_to_shared(shm, arrays, layout):
+    for key, values in arrays.items():
+        offset, dtype, shape = layout['arrays'][key]
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)[...] = values
+
+
+def map_row_partitions(func, arrays, args=(), max_workers=None, min_rows=PARALLEL_MIN_ROWS):
+    """
+    同じ行数の1次元配列の辞書 arrays を行方向に分割し、各部分に func(部分配列の辞書, *args) を適用した
+    結果のリストを返します（部分集計を返す func と組み合わせ、結果は呼び出し側で統合します）。
+    配列は1つの共有メモリにまとめてワーカーに渡すため、ワーカーはコピーせずに自分の担当行だけを参照します。
+    func はワーカーから import できるモジュールの関数である必要があります。
+    ワーカー数が 1 以下、または行数が min_rows 未満の場合は、このスレッドで全体に1回だけ適用します。
+    """
+    n_rows = len(next(iter(arrays.values()))) if arrays else 0
+    max_workers = resolve_max_workers(max_workers)
+    if max_workers <= 1 or n_rows < min_rows:
+        return [func(arrays, *args)]
+
+    layout = {'arrays': {}}
+    offset = 0
+    for key, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        offset = -(-offset // 8) * 8 # 8バイト境界にそろえる
+        layout['arrays'][key] = (offset, values.dtype.str, values.shape)
+        offset += values.nbytes
+    shm = _create_shared(offset)
+    try:
+        _copy_to_shared(shm, arrays, layout)
+        layout['name'] = shm.name
+
+        bounds = np.linspace(0, n_rows, max_workers + 1).astype(np.int64)
+        pool = None
+        try:
+            # 分割数を max_workers にするので、この呼び出しが同時に使うワーカーは max_workers 個まで
+            pool = _get_pool()
+            futures = [
+                pool.submit(_partition_worker, func, layout, int(start), int(stop), args)
+                for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+            ]
+            return [future.result() for future in futures]
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            if isinstance(e, BrokenProcessPool) and pool is not None:
+                _discard_pool(pool)
+            return [func(arrays, *args)]
+    finally:
+        _release_shared(shm, unlink=True)
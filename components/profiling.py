@@ -0,0 +1,322 @@
+# components/profiling.py
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import pandas as pd
+import plotly.io as pio
+import streamlit as st
+
+from components.dataset import process_rss_bytes
+
+# 環境変数 DATA_APP_PROFILE=1 で、プロファイリングを有効にした状態で起動する
+PROFILING_DEFAULT = os.environ.get('DATA_APP_PROFILE') == '1'
+# 環境変数 DATA_APP_TRACE_ALLOCATIONS=1 で、起動時に tracemalloc を開始する（プロセス全体で有効になり、処理が遅くなる）。
+# tracemalloc はプロセスで1つのため、セッションごとに開始・停止はせず、各セッションは計測に使うかどうかだけを選ぶ
+TRACE_ALLOCATIONS = os.environ.get('DATA_APP_TRACE_ALLOCATIONS') == '1'
+PROFILE_HISTORY_RERUNS = 20 # セッションごとに保持する再実行の記録の数
+PROFILE_HISTORY_STATE_KEY = 'profile_history'
+
+# 現在の再実行の記録。Streamlit はセッションのスクリプトをそれぞれのスレッドで実行するため、スレッドごとに持つ。
+# 記録していない間（プロファイリングが無効、バックグラウンドのジョブのスレッドなど）は None
+_current_recorder = contextvars.ContextVar('profile_recorder', default=None)
+
+# 割り当てを計測中の呼び出しの数（全セッションの合計）。tracemalloc のピークはプロセスで1つのため、
+# 計測中の呼び出しが1つもないときだけリセットし、他の呼び出しが観測しているピークを壊さない
+_traced_spans = 0
+_traced_spans_lock = threading.Lock()
+
+if TRACE_ALLOCATIONS and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def allocation_tracking_available():
+    """tracemalloc による割り当ての計測が使えるか（DATA_APP_TRACE_ALLOCATIONS=1 で起動したか）。"""
+    return tracemalloc.is_tracing()
+
+
+class ProfileSpan:
+    """計測した1回の呼び出し（関数名・分類・時間・入出力の行数・メモリ・図の大きさ）。"""
+
+    def __init__(self, name, category, depth, rows_in=None, bytes_in=None):
+        self.name = name
+        self.category = category
+        self.depth = depth # 呼び出しの入れ子の深さ（0 が最も外側）
+        self.thread_id = threading.get_ident()
+        self.start_ns = None
+        self.end_ns = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_in = bytes_in
+        self.rss_delta_bytes = None # 呼び出しの前後の RSS の差（解放された分があると負になる）
+        self.allocated_bytes = None # tracemalloc で計測した、呼び出し中の割り当てのピーク（同時に動く他のセッションの分を含むことがある）
+        self.payload_bytes = 0 # ブラウザへ送った図（Plotly の JSON）の合計バイト数
+        self.error = None
+        self._rss_start = None
+        self._traced_start = None
+
+    @property
+    def seconds(self):
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'category': self.category,
+            'depth': self.depth,
+            'thread_id': self.thread_id,
+            'seconds': self.seconds,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_in': self.bytes_in,
+            'rss_delta_bytes': self.rss_delta_bytes,
+            'allocated_bytes': self.allocated_bytes,
+            'payload_bytes': self.payload_bytes,
+            'error': self.error,
+        }
+
+
+class ProfileRecorder:
+    """
+    1回の再実行で計測した呼び出しの記録。
+    track_allocations=True の場合は tracemalloc で各呼び出し中の割り当てのピークも計測します。
+    tracemalloc が開始されていない場合（DATA_APP_TRACE_ALLOCATIONS=1 で起動していない場合）は計測しません。
+    """
+
+    def __init__(self, rerun_id, track_allocations=False):
+        self.rerun_id = rerun_id
+        self.track_allocations = track_allocations and allocation_tracking_available()
+        self.started_at = time.time() # Chrome トレースの時刻の基準（エポック秒）
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.spans = [] # 終了した順
+        self._stack = [] # 実行中の呼び出し
+
+    def finish(self):
+        self.end_ns = time.perf_counter_ns()
+
+    @property
+    def seconds(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    @contextlib.contextmanager
+    def span(self, name, category, rows_in=None, bytes_in=None):
+        span = ProfileSpan(name, category, len(self._stack), rows_in=rows_in, bytes_in=bytes_in)
+        self._enter(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            self._exit(span)
+
+    def _enter(self, span):
+        global _traced_spans
+        span._rss_start = process_rss_bytes()
+        if self.track_allocations and tracemalloc.is_tracing():
+            with _traced_spans_lock:
+                if _traced_spans == 0:
+                    tracemalloc.reset_peak()
+                _traced_spans += 1
+                span._traced_start = tracemalloc.get_traced_memory()[0]
+        self._stack.append(span)
+        span.start_ns = time.perf_counter_ns()
+
+    def _exit(self, span):
+        global _traced_spans
+        span.end_ns = time.perf_counter_ns()
+        self._stack.pop()
+        rss = process_rss_bytes()
+        if rss is not None and span._rss_start is not None:
+            span.rss_delta_bytes = rss - span._rss_start
+        if span._traced_start is not None:
+            with _traced_spans_lock:
+                _traced_spans -= 1
+                if tracemalloc.is_tracing():
+                    # ピークは計測中の呼び出しがなくなるまでリセットしないため、開始後のピーク以上になる
+                    span.allocated_bytes = max(tracemalloc.get_traced_memory()[1] - span._traced_start, 0)
+        self.spans.append(span)
+
+    def add_payload(self, nbytes):
+        """実行中の最も内側の呼び出しに、ブラウザへ送った図のバイト数を加えます。"""
+        if self._stack:
+            self._stack[-1].payload_bytes += nbytes
+
+    def records(self):
+        """記録した呼び出しを、開始した順の辞書のリストで返します。"""
+        return [
+            {'rerun_id': self.rerun_id, 'start_seconds': (span.start_ns - self.start_ns) / 1e9, **span.as_dict()}
+            for span in sorted(self.spans, key=lambda span: span.start_ns)
+        ]
+
+
+def _rows_in(args, kwargs):
+    """引数のうち最初の DataFrame の行数と、アップロードされたファイルの合計バイト数を返します。"""
+    rows_in = bytes_in = None
+    for value in list(args) + list(kwargs.values()):
+        if rows_in is None and isinstance(value, pd.DataFrame):
+            rows_in = len(value)
+        elif bytes_in is None and isinstance(value, (list, tuple)) and value and hasattr(value[0], 'size'):
+            bytes_in = sum(int(getattr(file, 'size', 0) or 0) for file in value)
+    return rows_in, bytes_in
+
+
+def _rows_out(result):
+    """戻り値の DataFrame（タプルの場合は最初の DataFrame）の行数。"""
+    if isinstance(result, tuple):
+        result = next((value for value in result if isinstance(value, pd.DataFrame)), None)
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    return None
+
+
+def profiled(category):
+    """
+    関数の呼び出しを計測するデコレータ。プロファイリングが無効な間は、関数をそのまま呼び出すだけです。
+    関数名は 'モジュール名.関数名' で記録します。
+    """
+    def decorate(func):
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _current_recorder.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            rows_in, bytes_in = _rows_in(args, kwargs)
+            with recorder.span(name, category, rows_in=rows_in, bytes_in=bytes_in) as span:
+                result = func(*args, **kwargs)
+                span.rows_out = _rows_out(result)
+                return result
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def profile_span(name, category='app', rows_in=None):
+    """
+    with ブロックの処理を1回の呼び出しとして計測します。ブロックには ProfileSpan を渡すので、
+    出力の行数は span.rows_out に設定します（プロファイリングが無効な場合の span は記録されません）。
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        yield ProfileSpan(name, category, 0, rows_in=rows_in)
+        return
+    with recorder.span(name, category, rows_in=rows_in) as span:
+        yield span
+
+
+def plotly_chart(fig, **kwargs):
+    """st.plotly_chart と同じ。プロファイリング中は、図を JSON にしたときのバイト数を呼び出し元の記録に加えます。"""
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.add_payload(len(pio.to_json(fig, validate=False).encode('utf-8')))
+    return st.plotly_chart(fig, **kwargs)
+
+
+def begin_rerun(state, enabled, track_allocations=False):
+    """
+    再実行の計測を始め、記録（ProfileRecorder）を返します。enabled が False の場合は何も記録せず None を返します。
+    記録は state（st.session_state）に直近 PROFILE_HISTORY_RERUNS 回分を保持します。
+    """
+    previous = _current_recorder.get()
+    if previous is not None and previous.end_ns is None:
+        # 前回の再実行が途中で中断された場合（ウィジェットの操作による再実行など）
+        previous.finish()
+    if not enabled:
+        _current_recorder.set(None)
+        return None
+    history = state.get(PROFILE_HISTORY_STATE_KEY)
+    if history is None:
+        history = state[PROFILE_HISTORY_STATE_KEY] = deque(maxlen=PROFILE_HISTORY_RERUNS)
+    recorder = ProfileRecorder(history[-1].rerun_id + 1 if history else 1, track_allocations=track_allocations)
+    history.append(recorder)
+    _current_recorder.set(recorder)
+    return recorder
+
+
+def end_rerun(recorder):
+    """再実行の計測を終えます（フラグメントだけの再実行は記録しません）。"""
+    if recorder is not None:
+        recorder.finish()
+    _current_recorder.set(None)
+
+
+def to_jsonl(recorders):
+    """記録した呼び出しを、1行に1つの呼び出しの JSON Lines の文字列で返します。"""
+    return ''.join(
+        json.dumps(record, ensure_ascii=False) + '\n'
+        for recorder in recorders for record in recorder.records()
+    )
+
+
+def to_chrome_trace(recorders):
+    """
+    記録した呼び出しを Chrome のトレース形式（chrome://tracing や Perfetto で開ける JSON）の文字列で返します。
+    再実行ごとの全体も1つのイベントとして含めます。
+    """
+    pid = os.getpid()
+    events = []
+    for recorder in recorders:
+        origin_us = recorder.started_at * 1e6
+        thread_id = recorder.spans[0].thread_id if recorder.spans else threading.get_ident()
+        events.append({
+            'name': f'rerun {recorder.rerun_id}', 'cat': 'rerun', 'ph': 'X', 'pid': pid, 'tid': thread_id,
+            'ts': origin_us, 'dur': recorder.seconds * 1e6,
+        })
+        for span in recorder.spans:
+            args = span.as_dict()
+            events.append({
+                'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': span.thread_id,
+                'ts': origin_us + (span.start_ns - recorder.start_ns) / 1e3, 'dur': span.seconds * 1e6,
+                'args': {key: value for key, value in args.items()
+                         if key not in ('name', 'category', 'thread_id', 'seconds') and value is not None},
+            })
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, ensure_ascii=False)
+
+
+def profile_frame(recorder):
+    """1回の再実行の記録を、パネルに表示する DataFrame にします（呼び出しの入れ子は関数名の字下げで表します）。"""
+    records = recorder.records()
+    return pd.DataFrame({
+        '関数': ['　' * record['depth'] + record['name'] for record in records],
+        '時間 (ms)': [record['seconds'] * 1e3 for record in records],
+        '入力行数': [record['rows_in'] for record in records],
+        '出力行数': [record['rows_out'] for record in records],
+        'RSS増加 (MB)': [record['rss_delta_bytes'] / 1024 ** 2 if record['rss_delta_bytes'] is not None else None
+                       for record in records],
+        '割り当て (MB)': [record['allocated_bytes'] / 1024 ** 2 if record['allocated_bytes'] is not None else None
+                        for record in records],
+        '図 (KB)': [record['payload_bytes'] / 1024 for record in records],
+    })
+
+
+def render_profile_panel(state):
+    """サイドバーのプロファイリングのパネル（最新の再実行の内訳、再実行ごとの合計、記録の書き出し）を表示します。"""
+    history = state.get(PROFILE_HISTORY_STATE_KEY)
+    finished = [recorder for recorder in history or [] if recorder.end_ns is not None]
+    if not finished:
+        st.write('まだ記録がありません。操作すると、次の再実行から記録します。')
+        return
+    latest = finished[-1]
+    st.write(f'最新の再実行（#{latest.rerun_id}）: {latest.seconds * 1e3:,.1f} ms、{len(latest.spans)} 件の呼び出し')
+    st.dataframe(profile_frame(latest), hide_index=True)
+    st.write('再実行ごとの時間:')
+    st.dataframe(pd.DataFrame({
+        '再実行': [recorder.rerun_id for recorder in finished],
+        '時間 (ms)': [recorder.seconds * 1e3 for recorder in finished],
+        '図 (KB)': [sum(span.payload_bytes for span in recorder.spans) / 1024 for recorder in finished],
+    }), hide_index=True)
+    st.download_button('JSON Lines で保存', to_jsonl(finished), file_name='profile.jsonl',
+                       mime='application/x-ndjson')
+    st.download_button('Chrome トレースで保存', to_chrome_trace(finished), file_name='profile_trace.json',
+                       mime='application/json')
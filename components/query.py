@@ -0,0 +1,426 @@
+# components/query.py
+
+import hashlib
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache
+from components.filter_index import bitmap_and, bitmap_count, get_column_index, materialize
+
+# 実行結果のキャッシュ。キーはデータセットのキーと最適化後の実行計画
+QUERY_CACHE_BUDGET_BYTES = 512 * 1024 * 1024 # 512MB
+_query_cache = LRUByteCache(QUERY_CACHE_BUDGET_BYTES)
+
+# 2段の集計を1段にまとめられる (外側の集計, 内側の集計) の組と、まとめた後の集計
+_MERGEABLE_AGGREGATIONS = {
+    ('sum', 'sum'): 'sum',
+    ('sum', 'count'): 'count',
+    ('sum', 'size'): 'size',
+    ('min', 'min'): 'min',
+    ('max', 'max'): 'max',
+}
+
+# ---- 実行計画の演算 ----
+# 実行計画は Scan から始まる演算のタプルで、前から順に適用します。どの演算もハッシュ可能で、
+# 最適化後の実行計画はそのまま結果のキャッシュキーになります。
+
+class Scan(NamedTuple):
+    columns: tuple # データセットから読み出す列（None なら全ての列）
+
+
+class Filter(NamedTuple):
+    # 条件のタプル。各条件は ('bitmap', ハッシュ) / ('range', 列, 下限, 上限, 上限を含むか) / ('isin', 列, 値のタプル)
+    predicates: tuple
+
+
+class Project(NamedTuple):
+    columns: tuple
+
+
+class Bucket(NamedTuple):
+    column: str # 日時の列
+    freq: str # 切り捨てる単位（'h'、'D' など pandas の頻度の文字列）。None なら切り捨てない
+    name: str # 結果の列名
+
+
+class Bin(NamedTuple):
+    column: str # 数値または日時の列
+    low: float # ビンの範囲（日時はナノ秒の値）
+    high: float
+    n_bins: int
+    name: str # 結果の列名（ビン番号。欠損は NaN）
+
+
+class Aggregate(NamedTuple):
+    keys: tuple # グループ化する列（空ならデータ全体で1行）
+    aggregations: tuple # (結果の列名, 入力の列, 集計関数) のタプル
+    dropna: tuple = () # キー以外で、欠損の行を集計から除く列（2段の集計をまとめたときに、内側のキーの欠損を除くため）
+
+
+# 1つの列から値を求めて列を追加する演算（集計のキーを作る）
+_DERIVED_KEY_OPS = (Bucket, Bin)
+
+
+def _predicate_columns(predicate):
+    return () if predicate[0] == 'bitmap' else (predicate[1],)
+
+
+# ---- 最適化 ----
+
+def _push_down_filters(ops):
+    """
+    各条件を、その条件が参照する列を作る演算の直後まで前に移動し、隣り合う Filter を1つにまとめます。
+    集計（Aggregate）より前には移動しません（集計後の値に対する条件のため）。
+    Scan の直後まで移動した条件は、データセットの列ごとのインデックスで評価します。
+    """
+    result = []
+    for op in ops:
+        if not isinstance(op, Filter):
+            result.append(op)
+            continue
+        for predicate in op.predicates:
+            position = len(result)
+            while position > 1:
+                previous = result[position - 1]
+                if isinstance(previous, Aggregate):
+                    break
+                if isinstance(previous, _DERIVED_KEY_OPS) and previous.name in _predicate_columns(predicate):
+                    break
+                position -= 1
+            if isinstance(result[position - 1], Filter):
+                merged = result[position - 1]
+                result[position - 1] = Filter(merged.predicates + (predicate,))
+            elif position < len(result) and isinstance(result[position], Filter):
+                merged = result[position]
+                result[position] = Filter((predicate,) + merged.predicates)
+            else:
+                result.insert(position, Filter((predicate,)))
+    return result
+
+
+def _aggregate_inputs(op):
+    """集計が入力から読む列。"""
+    return set(op.keys) | set(op.dropna) | {column for _, column, _ in op.aggregations if column is not None}
+
+
+def _merge_aggregates(ops):
+    """
+    連続する2段の集計を1段にまとめます。
+    外側のキーが内側のキーに含まれ、外側の集計が内側の集計の結果を合算するだけ（合計の合計、件数の合計、最大の最大など）なら
+    1段にします。内側の集計のキーを時間の切り捨てやビン分け（Bucket / Bin）した列で外側が集計する場合は、
+    その演算を内側の集計の前に移して内側のキーに加えてからまとめます（キーから決まる値なので、グループは変わらない）。
+    内側の集計は欠損のキーの行を除くため、まとめた集計でも外側のキーにない内側のキーの欠損の行を除きます（dropna）。
+    """
+    ops = list(ops)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(1, len(ops) - 1):
+            inner, following = ops[i], ops[i + 1]
+            if not isinstance(inner, Aggregate):
+                continue
+            if isinstance(following, Aggregate):
+                merged = _merge_aggregate_pair(inner, following)
+                if merged is not None:
+                    ops[i:i + 2] = [merged]
+                    changed = True
+                    break
+            elif (isinstance(following, _DERIVED_KEY_OPS) and i + 2 < len(ops) and isinstance(ops[i + 2], Aggregate)
+                    and following.column in inner.keys and following.name not in _aggregate_inputs(inner)
+                    and following.name not in {out for out, _, _ in inner.aggregations}):
+                merged = _merge_aggregate_pair(inner._replace(keys=inner.keys + (following.name,)), ops[i + 2])
+                if merged is not None:
+                    ops[i:i + 3] = [following, merged]
+                    changed = True
+                    break
+    return ops
+
+
+def _merge_aggregate_pair(inner, outer):
+    if not set(outer.keys) | set(outer.dropna) <= set(inner.keys):
+        return None
+    inner_outputs = {out: (column, func) for out, column, func in inner.aggregations}
+    aggregations = []
+    for out, column, func in outer.aggregations:
+        if column not in inner_outputs:
+            return None
+        source, inner_func = inner_outputs[column]
+        merged_func = _MERGEABLE_AGGREGATIONS.get((func, inner_func))
+        if merged_func is None:
+            return None
+        aggregations.append((out, source, merged_func))
+    dropped_keys = tuple(key for key in inner.keys if key not in outer.keys)
+    dropna = tuple(dict.fromkeys(inner.dropna + dropped_keys))
+    return Aggregate(outer.keys, tuple(aggregations), dropna)
+
+
+def _prune_columns(ops, source_columns):
+    """
+    末尾から必要な列をたどり、Scan で読み出す列を必要なものだけにします（射影のプッシュダウン）。
+    途中の射影も、それより後で使う列だけに絞ります。Scan の直後の条件はデータセットの列ごとのインデックスで評価するため、
+    条件だけに使う列は読み出しません。
+    """
+    required = None # None は「全ての列」
+    pruned = []
+    for position in range(len(ops) - 1, 0, -1):
+        op = ops[position]
+        if isinstance(op, Project):
+            if required is not None:
+                op = Project(tuple(col for col in op.columns if col in required))
+            required = set(op.columns)
+        elif isinstance(op, Aggregate):
+            required = _aggregate_inputs(op)
+        elif isinstance(op, _DERIVED_KEY_OPS):
+            if required is not None and op.name in required:
+                required.discard(op.name)
+                required.add(op.column)
+        elif isinstance(op, Filter) and required is not None and position > 1:
+            for predicate in op.predicates:
+                required.update(_predicate_columns(predicate))
+        pruned.append(op)
+    if required is None:
+        return ops
+    columns = tuple(col for col in source_columns if col in required)
+    return [Scan(columns)] + pruned[::-1]
+
+
+def optimize(ops, source_columns):
+    """実行計画を最適化します（条件のプッシュダウン、集計の統合、射影のプッシュダウン）。"""
+    ops = _push_down_filters(list(ops))
+    ops = _merge_aggregates(ops)
+    ops = _prune_columns(ops, list(source_columns))
+    return tuple(ops)
+
+
+# ---- 実行 ----
+
+def _scan_bitmap(typed, dataset_key, predicates, bitmaps):
+    """データセットの列に対する条件を、列ごとのインデックスでビットマップにして論理積をとります。"""
+    parts = []
+    for predicate in predicates:
+        kind = predicate[0]
+        if kind == 'bitmap':
+            parts.append(bitmaps[predicate[1]])
+        elif kind == 'range':
+            _, col, low, high, inclusive_high = predicate
+            parts.append(get_column_index(typed, col, dataset_key).range_bitmap(low, high, inclusive_high))
+        else:
+            _, col, values = predicate
+            parts.append(get_column_index(typed, col, dataset_key).isin_bitmap(values))
+    return bitmap_and(parts)
+
+
+def _filter_frame(frame, predicates):
+    """集計後などの DataFrame に対する条件（ブールマスクで評価）。"""
+    mask = np.ones(len(frame), dtype=bool)
+    for predicate in predicates:
+        if predicate[0] == 'range':
+            _, col, low, high, inclusive_high = predicate
+            values = frame[col]
+            if low is not None:
+                mask &= (values >= low).to_numpy()
+            if high is not None:
+                mask &= (values <= high if inclusive_high else values < high).to_numpy()
+        elif predicate[0] == 'isin':
+            mask &= frame[predicate[1]].isin(predicate[2]).to_numpy()
+        else:
+            raise ValueError('行のビットマップによる条件は、集計の前にだけ指定できます。')
+    return frame[mask]
+
+
+def wall_clock(series):
+    """タイムゾーン付きの日時をタイムゾーンなしの現地時刻にします（それ以外の列はそのまま）。"""
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_localize(None)
+    return series
+
+
+def _bucket(series, freq):
+    """
+    日時を freq 単位で切り捨てます。タイムゾーン付きの日時は現地時刻（タイムゾーンなし）にしてから切り捨てるため、
+    夏時間の終わりの重複する時刻も例外にならず、現地時刻の同じ時間帯にまとまります。
+    """
+    series = wall_clock(series)
+    return series if freq is None else series.dt.floor(freq)
+
+
+def bin_numbers(series, low, high, n_bins):
+    """
+    数値・日時（現地時刻のナノ秒）の値を low から high までの n_bins 個の等間隔のビンの番号にします。
+    high は最後のビンに含め、範囲外の値は両端のビンにします。欠損の値は NaN です。
+    """
+    series = wall_clock(series)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy(dtype='datetime64[ns]').view(np.int64).astype(np.float64)
+        values[series.isna().to_numpy()] = np.nan
+    else:
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if high <= low:
+        numbers = np.where(np.isnan(values), np.nan, 0.0)
+    else:
+        with np.errstate(invalid='ignore'):
+            numbers = np.clip(np.floor((values - low) / (high - low) * n_bins), 0, n_bins - 1)
+    return pd.Series(numbers, index=series.index)
+
+
+def _aggregate(frame, op):
+    if op.dropna:
+        present = frame[list(op.dropna)].notna().all(axis=1)
+        if not present.all():
+            frame = frame[present]
+    if op.keys:
+        # 件数（size）は入力の列によらないため、キーの列で数える
+        named = {out: (column if column is not None else op.keys[0], func) for out, column, func in op.aggregations}
+        return frame.groupby(list(op.keys), sort=True, observed=True).agg(**named).reset_index()
+    return pd.DataFrame({
+        out: [len(frame) if func == 'size' else frame[column].agg(func)]
+        for out, column, func in op.aggregations
+    })
+
+
+def execute(dataset, ops, bitmaps):
+    """
+    最適化済みの実行計画を実行して DataFrame を返します。
+    先頭の条件はデータセットの列ごとのインデックスでビットマップにし、Scan の列だけを対象に1回だけ行を取り出します
+    （条件も射影もなければ、データセットの配列をそのまま参照します）。
+    """
+    typed = dataset.typed
+    scan = ops[0]
+    columns = scan.columns if scan.columns is not None else tuple(typed.columns)
+    frame = pd.DataFrame({col: typed[col] for col in columns}, index=typed.index, copy=False)
+    rest = ops[1:]
+    if rest and isinstance(rest[0], Filter):
+        frame = materialize(frame, _scan_bitmap(typed, dataset.key, rest[0].predicates, bitmaps))
+        rest = rest[1:]
+
+    for op in rest:
+        if isinstance(op, Filter):
+            frame = _filter_frame(frame, op.predicates)
+        elif isinstance(op, Project):
+            frame = pd.DataFrame({col: frame[col] for col in op.columns}, index=frame.index, copy=False)
+        elif isinstance(op, _DERIVED_KEY_OPS):
+            if isinstance(op, Bucket):
+                derived = _bucket(frame[op.column], op.freq)
+            else:
+                derived = bin_numbers(frame[op.column], op.low, op.high, op.n_bins)
+            # assign はデータ全体をコピーするため、浅いコピーに列を追加する
+            frame = frame.copy(deep=False)
+            frame[op.name] = derived
+        elif isinstance(op, Aggregate):
+            frame = _aggregate(frame, op)
+    return frame
+
+
+class Query:
+    """
+    データセットに対する遅延評価の問い合わせ。
+    filter / select / bucket / bin / aggregate で演算を積み重ねるだけで、collect() を呼ぶまで計算しません。
+    collect() では実行計画を最適化して（条件と射影をデータセットの読み出しまで移動し、連続する集計を1つにまとめる）
+    1回だけ実行し、結果はデータセットのキーと実行計画ごとにキャッシュします。
+    同じ条件のグラフや分析は、再実行のたびに全体の DataFrame を作り直さず、必要な列と行（または集計結果）だけを受け取ります。
+    """
+
+    def __init__(self, dataset, ops=None, bitmaps=None):
+        self.dataset = dataset
+        self._ops = tuple(ops) if ops is not None else (Scan(None),)
+        self._bitmaps = dict(bitmaps or {})
+
+    def _then(self, op, bitmaps=None):
+        return Query(self.dataset, self._ops + (op,), {**self._bitmaps, **(bitmaps or {})})
+
+    def filter_bitmap(self, bitmap):
+        """ビットマップ（filter_index の形式）で行を絞り込みます。None は条件なしです。"""
+        if bitmap is None:
+            return self
+        if any(isinstance(op, Aggregate) for op in self._ops):
+            raise ValueError('行のビットマップによる条件は、集計の前にだけ指定できます。')
+        digest = hashlib.blake2b(bitmap.tobytes(), digest_size=16).hexdigest()
+        return self._then(Filter((('bitmap', digest),)), {digest: bitmap})
+
+    def filter_range(self, column, low=None, high=None, inclusive_high=True):
+        """low <= 値 <= high（inclusive_high=False なら 値 < high）の行に絞り込みます。"""
+        return self._then(Filter((('range', column, low, high, inclusive_high),)))
+
+    def filter_isin(self, column, values):
+        """値が values のいずれかに一致する行に絞り込みます。"""
+        return self._then(Filter((('isin', column, tuple(values)),)))
+
+    def select(self, columns):
+        """列を選択します（重複は除き、順序は指定どおり）。"""
+        return self._then(Project(tuple(dict.fromkeys(columns))))
+
+    def bucket(self, column, freq, name=None):
+        """
+        日時の列を freq 単位で切り捨てた列を追加します（name を省略すると元の列を置き換えます）。
+        タイムゾーン付きの列は現地時刻で切り捨て、結果はタイムゾーンなしの現地時刻です。freq=None は現地時刻にするだけです。
+        """
+        return self._then(Bucket(column, freq, name or column))
+
+    def bin(self, column, low, high, n_bins, name=None):
+        """数値・日時の列を low から high までの n_bins 個の等間隔のビンの番号にした列を追加します（bin_numbers）。"""
+        return self._then(Bin(column, float(low), float(high), int(n_bins), name or column))
+
+    def aggregate(self, keys, aggregations=None, **named):
+        """
+        keys でグループ化して集計します（キーが欠損の行は除きます）。集計は {結果の列名: (入力の列, 集計関数)} の辞書
+        aggregations か、結果の列名=(入力の列, 集計関数) のキーワード引数で指定します。
+        集計関数は 'sum' / 'count' / 'size' / 'mean' / 'min' / 'max' などです（'size' の入力の列は None でもかまいません）。
+        """
+        aggregations = {**(aggregations or {}), **named}
+        return self._then(Aggregate(
+            tuple(keys), tuple((out, column, func) for out, (column, func) in aggregations.items())
+        ))
+
+    @property
+    def plan(self):
+        """最適化後の実行計画。"""
+        return optimize(self._ops, self.dataset.typed.columns)
+
+    @property
+    def key(self):
+        """
+        結果の行と値を識別するキー（グラフや集計のキャッシュのデータセットのキーとして使えます）。
+        列の選択だけでは行も値も変わらないため、キーには含めません。列を選ぶだけの問い合わせのキーは
+        データセットのキーそのものになり、データセットに対して作成済みの集計（追記モードの時間キューブなど）を使えます。
+        """
+        ops = tuple(op for op in self.plan if not isinstance(op, (Scan, Project)))
+        if not ops:
+            return self.dataset.key
+        return ('query', self.dataset.key, ops)
+
+    def explain(self):
+        """最適化後の実行計画を1行に1つの演算で表した文字列を返します。"""
+        return '\n'.join(repr(op) for op in self.plan)
+
+    def count(self):
+        """
+        結果の行数を返します。集計（と集計後の条件）を含まない場合は、行を取り出さずにビットマップから数えます。
+        """
+        plan = self.plan
+        if any(isinstance(op, Aggregate) for op in plan) or any(isinstance(op, Filter) for op in plan[2:]):
+            return len(self.collect())
+        if len(plan) > 1 and isinstance(plan[1], Filter):
+            typed = self.dataset.typed
+            bitmap = _scan_bitmap(typed, self.dataset.key, plan[1].predicates, self._bitmaps)
+            return bitmap_count(bitmap, len(typed))
+        return len(self.dataset)
+
+    def collect(self):
+        """実行計画を実行し、結果の DataFrame を返します（キャッシュ済みならそれを参照する浅いコピー）。"""
+        plan = self.plan
+        if all(isinstance(op, (Scan, Project)) for op in plan):
+            # 列を選ぶだけならデータセットの配列をそのまま参照するので、キャッシュしない
+            return execute(self.dataset, plan, self._bitmaps)
+        cache_key = (self.dataset.key, plan)
+        result = _query_cache.get(cache_key)
+        if result is None:
+            result = execute(self.dataset, plan, self._bitmaps)
+            _query_cache.put(cache_key, result)
+        return result.copy(deep=False)
+
+
+def get_query_cache():
+    """問い合わせ結果のキャッシュを返します（上限変更や統計の参照用）。"""
+    return _query_cache
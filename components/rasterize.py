@@ -0,0 +1,121 @@
+# components/rasterize.py
+
+import numpy as np
+import pandas as pd
+
+# 散布図の描画方式を切り替える点数のしきい値
+WEBGL_POINT_THRESHOLD = 10_000 # これを超えたら SVG ではなく WebGL (Scattergl) で描画
+RASTER_POINT_THRESHOLD = 300_000 # これを超えたら点を描かず、2次元に集計したラスタとして描画
+
+RASTER_PIXEL_SIZE = 2 # ラスタ1セルあたりの画面上のピクセル数
+DEFAULT_RASTER_HEIGHT_PX = 500
+
+
+def raster_shape(chart_width_px, chart_height_px=DEFAULT_RASTER_HEIGHT_PX):
+    """グラフの大きさからラスタのセル数 (x方向, y方向) を決めます。"""
+    return (max(int(chart_width_px // RASTER_PIXEL_SIZE), 10),
+            max(int(chart_height_px // RASTER_PIXEL_SIZE), 10))
+
+
+def is_rasterizable(series):
+    """数値または日時の列であればラスタ化できます（カテゴリ軸は対象外）。"""
+    dtype = series.dtype
+    return (pd.api.types.is_datetime64_any_dtype(dtype) or
+            (pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)))
+
+
+def has_finite_points(x, y):
+    """x と y がともに有限な点が1つでもあるか（ない場合はラスタにできる範囲がない）。"""
+    return bool((np.isfinite(x) & np.isfinite(y)).any())
+
+
+def _edges(values, n_bins):
+    """有限な値 values の範囲を n_bins 個に等分した境界。値がない場合は [0, 1] を等分します（全セルが空になる）。"""
+    if len(values) == 0:
+        return np.linspace(0.0, 1.0, n_bins + 1)
+    lo, hi = values.min(), values.max()
+    if hi <= lo:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, n_bins + 1)
+
+
+def _cell_index(x, y, x_edges, y_edges):
+    """各点が入るセルの番号 (y方向のビン * x方向のビン数 + x方向のビン) を返します。"""
+    nx, ny = len(x_edges) - 1, len(y_edges) - 1
+    ix = ((x - x_edges[0]) / (x_edges[-1] - x_edges[0]) * nx).astype(np.int64)
+    iy = ((y - y_edges[0]) / (y_edges[-1] - y_edges[0]) * ny).astype(np.int64)
+    np.clip(ix, 0, nx - 1, out=ix)
+    np.clip(iy, 0, ny - 1, out=iy)
+    return iy * nx + ix
+
+
+def rasterize_points(x, y, shape, weights=None):
+    """
+    点群を shape = (x方向のビン数, y方向のビン数) のグリッドに集計します（np.histogram2d と同等）。
+    weights を渡した場合はセルごとの平均値、そうでなければ件数を返します。
+    戻り値は (z[y, x], x_edges, y_edges, counts[y, x]) です。件数0のセルの平均値は NaN です。
+    """
+    nx, ny = shape
+    valid = np.isfinite(x) & np.isfinite(y)
+    if weights is not None:
+        valid &= np.isfinite(weights)
+    x, y = x[valid], y[valid]
+    x_edges, y_edges = _edges(x, nx), _edges(y, ny)
+    cells = _cell_index(x, y, x_edges, y_edges)
+
+    counts = np.bincount(cells, minlength=nx * ny).reshape(ny, nx)
+    if weights is None:
+        return counts.astype(np.float64), x_edges, y_edges, counts
+
+    sums = np.bincount(cells, weights=weights[valid], minlength=nx * ny).reshape(ny, nx)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means, x_edges, y_edges, counts
+
+
+def rasterize_by_category(x, y, codes, n_categories, shape):
+    """
+    カテゴリごとの件数ラスタを返します。戻り値は (counts[category, y, x], x_edges, y_edges) です。
+    codes が負（欠損）の点は除外します。
+    """
+    nx, ny = shape
+    valid = np.isfinite(x) & np.isfinite(y) & (codes >= 0)
+    x, y, codes = x[valid], y[valid], codes[valid].astype(np.int64)
+    x_edges, y_edges = _edges(x, nx), _edges(y, ny)
+    cells = _cell_index(x, y, x_edges, y_edges) + codes * (nx * ny)
+    counts = np.bincount(cells, minlength=n_categories * nx * ny)
+    return counts.reshape(n_categories, ny, nx), x_edges, y_edges
+
+
+def shade_categories(counts, colors):
+    """
+    カテゴリごとの件数ラスタを、件数で重み付けした色の混合で RGBA 画像 (uint8) にします。
+    不透明度は総件数の対数に比例させ、点のないセルは透明にします。
+    colors は各カテゴリの (r, g, b) のリストです。
+    """
+    palette = np.asarray(colors, dtype=np.float64) # (n_categories, 3)
+    total = counts.sum(axis=0).astype(np.float64) # (ny, nx)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mixed = np.einsum('cyx,ck->yxk', counts, palette) / total[..., None]
+    mixed = np.nan_to_num(mixed)
+
+    log_total = np.log1p(total)
+    max_log = log_total.max()
+    alpha = np.zeros_like(log_total) if max_log == 0 else 0.25 + 0.75 * log_total / max_log
+    alpha[total == 0] = 0
+
+    image = np.empty(total.shape + (4,), dtype=np.uint8)
+    image[..., :3] = np.clip(mixed, 0, 255).astype(np.uint8)
+    image[..., 3] = (alpha * 255).astype(np.uint8)
+    return image
+
+
+def hex_to_rgb(color):
+    """'#rrggbb' 形式や 'rgb(r, g, b)' 形式の色を (r, g, b) に変換します。"""
+    color = color.strip()
+    if color.startswith('#'):
+        return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+    if color.startswith('rgb'):
+        parts = color[color.index('(') + 1:color.index(')')].split(',')
+        return tuple(int(float(p)) for p in parts[:3])
+    raise ValueError(f'未対応の色指定です: {color}')
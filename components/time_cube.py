@@ -0,0 +1,393 @@
+# components/time_cube.py
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache
+from components.fingerprint import ARTIFACT_TIME_CUBE, record_dependency
+from components.parallel import map_row_partitions
+
+# 1時間単位の部分集計（キューブ）に保持する統計量。どれも時間帯ごとに足し合わせ（min/maxは比較）で統合できる
+CUBE_STATS = ['sum', 'count', 'sumsq', 'min', 'max']
+_ADDITIVE_STATS = ['sum', 'count', 'sumsq']
+
+GRANULARITY_HOUR_OF_DAY = 'hour_of_day'
+GRANULARITY_DAY = 'day'
+GRANULARITY_WEEKDAY = 'weekday'
+GRANULARITY_MONTH = 'month'
+GRANULARITY_YEAR = 'year'
+GRANULARITY_DATE_HOUR = 'date_hour' # 行が時間帯、列が日付の表（rollup_date_hour）
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# 集計のキーは datetime64 の整数値（1970-01-01 からのナノ秒）の演算で求めた整数コードにし、
+# ラベル（日付・曜日名・'YYYY-MM' など）は集計後の行にだけ付ける
+HOUR_NS = 3600 * 10 ** 9
+DAY_NS = 24 * HOUR_NS
+_NAT = np.iinfo(np.int64).min
+_EPOCH_WEEKDAY = 3 # 1970-01-01 は木曜日（月曜日を 0 とする）
+
+TIME_CUBE_CHUNK_ROWS = 1_000_000 # チャンクに分けて作成する場合の1チャンクあたりの行数
+TIME_CUBE_CACHE_BUDGET_BYTES = 256 * 1024 * 1024 # 256MB
+_time_cube_cache = LRUByteCache(TIME_CUBE_CACHE_BUDGET_BYTES)
+
+
+def build_time_cube(df, time_col, value_cols=None, max_workers=None):
+    """
+    生データから1時間ごとの部分集計（合計・件数・二乗和・最小・最大）を作成します。
+    戻り値は1時間単位の DatetimeIndex を持ち、列が (値の列名, 統計量) の DataFrame です。
+    日・曜日・月・年・時間帯別の平均や日付×時間帯の表は、生データではなくこのキューブから集計できます。
+    行数が多い場合は行を分割してワーカープロセスで部分集計し、最後に時間帯ごとに統合します。
+    """
+    if value_cols is None:
+        value_cols = [col for col in df.select_dtypes(include=['number']).columns if col != time_col]
+    timestamps = df[time_col]
+    if not pd.api.types.is_datetime64_any_dtype(timestamps.dtype):
+        timestamps = pd.to_datetime(timestamps)
+    bucket, unit = _hour_buckets(timestamps)
+
+    # 時間帯は整数（欠損は NaT の値）、値の列は元の数値型のまま渡す（float64 への変換は列ごとに行う）
+    arrays = {'bucket': bucket}
+    for position, col in enumerate(value_cols):
+        values = df[col].to_numpy()
+        if values.dtype.kind not in 'iufb':
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        arrays[f'value{position}'] = values
+    partials = map_row_partitions(_bucket_partials, arrays, args=(len(value_cols), unit), max_workers=max_workers)
+    buckets, parts = _combine_bucket_partials(partials)
+
+    index = pd.DatetimeIndex(buckets.view('M8[ns]'))
+    if timestamps.dt.tz is not None:
+        index = index.tz_localize('UTC').tz_convert(timestamps.dt.tz)
+    parts = {stat: pd.DataFrame(values, index=index, columns=value_cols) for stat, values in parts.items()}
+    return _assemble_cube(parts, value_cols)
+
+
+def _hour_buckets(timestamps):
+    """
+    日時の Series を時間帯の整数の配列にし、(時間帯, 時間帯の単位のナノ秒) を返します（欠損は NaT の値）。
+    タイムゾーンなしの場合は 1970-01-01 からの時間数（整数の割り算）を時間帯にします。
+    タイムゾーン付きの場合は、現地時刻の時の始まりの瞬間（UTC のナノ秒）を時間帯にします。現地時刻で切り捨てると
+    夏時間の終わりの重複する時刻が区別できない（dt.floor が AmbiguousTimeError を送出する）ため、瞬間で区別し、
+    現地時刻はラベルにだけ使います。UTC からの時差が全て1時間の倍数なら、UTC の時間数がそのまま時間帯になります。
+    """
+    ns = timestamps.dt.as_unit('ns').array.asi8
+    missing = ns == _NAT
+    if timestamps.dt.tz is None:
+        return np.where(missing, _NAT, ns // HOUR_NS), HOUR_NS
+    offsets = wall_clock_ns(timestamps) - ns
+    if not (offsets[~missing] % HOUR_NS).any():
+        return np.where(missing, _NAT, ns // HOUR_NS), HOUR_NS
+    return np.where(missing, _NAT, ns - (ns + offsets) % HOUR_NS), 1
+
+
+def hour_bucket_times(timestamps):
+    """日時の Series の各行が属する時間キューブの時間帯（時の始まりの時刻）の DatetimeIndex を返します（欠損は NaT）。"""
+    bucket, unit = _hour_buckets(timestamps)
+    missing = bucket == _NAT
+    index = pd.DatetimeIndex(np.where(missing, _NAT, bucket * np.where(missing, 0, unit)).view('M8[ns]'))
+    if timestamps.dt.tz is not None:
+        index = index.tz_localize('UTC').tz_convert(timestamps.dt.tz)
+    return index
+
+
+def build_time_cube_in_chunks(df, time_col, chunk_rows=TIME_CUBE_CHUNK_ROWS, max_workers=None,
+                              progress_callback=None):
+    """
+    行をチャンクに分けて時間キューブを作成し、チャンクごとにそれまでのキューブを統合します。
+    progress_callback(処理済みの行数, 全体の行数, ここまでのキューブ) を渡すと、チャンクごとに途中結果を受け取れます
+    （バックグラウンドで作成しながら、処理済みの範囲の集計を表示する場合に使います）。
+    """
+    value_cols = [col for col in df.select_dtypes(include=['number']).columns if col != time_col]
+    n_rows = len(df)
+    cube = None
+    for start in range(0, max(n_rows, 1), chunk_rows):
+        part = build_time_cube(df.iloc[start:start + chunk_rows], time_col, value_cols, max_workers=max_workers)
+        cube = part if cube is None else merge_time_cubes(cube, part)
+        if progress_callback is not None:
+            progress_callback(min(start + chunk_rows, n_rows), n_rows, cube)
+    return cube
+
+
+def _bucket_partials(arrays, n_values, unit=1):
+    """
+    時間帯ごとの部分集計を計算します（ワーカープロセスからも呼ばれます）。
+    arrays['bucket'] は時間帯を unit ナノ秒単位で表した整数です。
+    戻り値は (時間帯のナノ秒の配列, {統計量: 行が時間帯・列が値の列の2次元配列}) です。
+    """
+    bucket = arrays['bucket']
+    valid_rows = bucket != _NAT # タイムスタンプが欠損の行は除外
+    # 時間帯を整数コードにし、列ごとに bincount で集計する
+    codes, n_buckets, buckets, present = _bucket_codes(bucket[valid_rows], unit)
+
+    parts = {stat: np.empty((n_buckets, n_values)) for stat in CUBE_STATS}
+    for position in range(n_values):
+        # int8 や float32 の列でも合算であふれないよう、1列ずつ float64 にして集計する
+        values = arrays[f'value{position}'][valid_rows].astype(np.float64)
+        finite = np.isfinite(values)
+        bucket_codes = codes[finite]
+        values = values[finite]
+        parts['sum'][:, position] = np.bincount(bucket_codes, weights=values, minlength=n_buckets)
+        parts['count'][:, position] = np.bincount(bucket_codes, minlength=n_buckets)
+        parts['sumsq'][:, position] = np.bincount(bucket_codes, weights=values * values, minlength=n_buckets)
+        minimum = np.full(n_buckets, np.nan)
+        maximum = np.full(n_buckets, np.nan)
+        np.fmin.at(minimum, bucket_codes, values)
+        np.fmax.at(maximum, bucket_codes, values)
+        parts['min'][:, position] = minimum
+        parts['max'][:, position] = maximum
+    if present is not None:
+        # 時間数をそのままビンにした場合は、行のない時間帯のビンを除く
+        parts = {stat: values[present] for stat, values in parts.items()}
+    return buckets, parts
+
+
+def _bucket_codes(bucket, unit):
+    """
+    時間帯の配列を bincount のビンの番号にします。
+    戻り値は (行ごとのビン, ビンの数, 行のある時間帯の昇順のナノ秒, 行のあるビンの選択または None) です。
+    時間帯が時間数（unit が HOUR_NS）でその範囲が行数以下なら、最小の時間帯からの時間数をそのままビンにし
+    （行のない時間帯が多い場合だけ連番に詰める）、それ以外は pd.factorize で現れる時間帯の連番にします。
+    """
+    if unit == HOUR_NS and len(bucket):
+        low = bucket.min()
+        offsets = bucket - low
+        n_bins = int(offsets.max()) + 1
+        if n_bins <= len(bucket):
+            present = np.bincount(offsets, minlength=n_bins) > 0
+            buckets = (np.flatnonzero(present) + low) * HOUR_NS
+            if n_bins <= 2 * len(buckets):
+                return offsets, n_bins, buckets, present
+            return (np.cumsum(present) - 1)[offsets], len(buckets), buckets, None
+    codes, buckets = pd.factorize(bucket, sort=True)
+    return codes, len(buckets), np.asarray(buckets, dtype=np.int64) * unit, None
+
+
+def _dense_codes(keys):
+    """
+    整数のキー（時間数・日数・月数など）を、現れるキーだけの 0 からの連番にします。
+    現れるキーはキーの範囲にわたる bincount で求めるため、ハッシュ表もソートも使いません
+    （キーの範囲が集計する行数に比べて広すぎない場合に使います）。
+    戻り値は (行ごとの連番, 昇順のキー) です。
+    """
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    low = keys.min()
+    offsets = keys - low
+    present = np.bincount(offsets) > 0
+    return (np.cumsum(present) - 1)[offsets], np.flatnonzero(present) + low
+
+
+def _combine_bucket_partials(partials):
+    """行の範囲ごとの部分集計を、時間帯ごとに統合します（範囲の境界をまたぐ時間帯は合算）。"""
+    if len(partials) == 1:
+        return partials[0]
+    codes, buckets = pd.factorize(np.concatenate([buckets for buckets, _ in partials]), sort=True)
+    n_values = partials[0][1]['sum'].shape[1]
+    combined = {}
+    for stat in CUBE_STATS:
+        stacked = np.concatenate([parts[stat] for _, parts in partials])
+        if stat in _ADDITIVE_STATS:
+            out = np.zeros((len(buckets), n_values))
+            np.add.at(out, codes, stacked)
+        else:
+            out = np.full((len(buckets), n_values), np.nan)
+            (np.fmin if stat == 'min' else np.fmax).at(out, codes, stacked)
+        combined[stat] = out
+    return np.asarray(buckets, dtype=np.int64), combined
+
+
+def _assemble_cube(parts, value_cols):
+    """統計量ごとの DataFrame を、列が (値の列名, 統計量) のキューブにまとめます。"""
+    cube = pd.concat(parts, axis=1).swaplevel(0, 1, axis=1)
+    cube = cube.reindex(columns=pd.MultiIndex.from_product([value_cols, CUBE_STATS]))
+    cube.index = pd.DatetimeIndex(cube.index, name='hour_bucket')
+    return cube
+
+
+def merge_time_cubes(old_cube, new_cube):
+    """
+    2つの時間キューブを統合します。同じ時間帯が両方にある場合（ファイルの境界をまたぐ時間など）は
+    合計・件数・二乗和を足し合わせ、最小・最大は比較して統合します。
+    """
+    value_cols = list(dict.fromkeys(
+        list(old_cube.columns.get_level_values(0)) + list(new_cube.columns.get_level_values(0))
+    ))
+    combined = pd.concat([old_cube, new_cube])
+    if combined.index.is_unique:
+        # 時間帯が重ならない（新しいデータが後ろに続く）場合は並べるだけでよい
+        combined = combined.reindex(columns=pd.MultiIndex.from_product([value_cols, CUBE_STATS]))
+        return combined.sort_index()
+
+    parts = {}
+    for stat in CUBE_STATS:
+        stat_frame = combined.xs(stat, axis=1, level=1)
+        grouped = stat_frame.groupby(level=0, sort=True)
+        if stat in _ADDITIVE_STATS:
+            parts[stat] = grouped.sum()
+        elif stat == 'min':
+            parts[stat] = grouped.min()
+        else:
+            parts[stat] = grouped.max()
+    return _assemble_cube(parts, value_cols)
+
+
+def rebuild_time_cube_buckets(cube, df, time_col, times):
+    """
+    時間キューブのうち times（日時の Series）の時刻を含む時間帯だけを df から集計し直したキューブを返します。
+    行の値を編集した場合などに、編集された行の時間帯だけを更新するために使います（行がなくなった時間帯は除きます）。
+    """
+    value_cols = list(dict.fromkeys(cube.columns.get_level_values(0)))
+    buckets = hour_bucket_times(times).dropna().unique()
+    rows = hour_bucket_times(df[time_col]).isin(buckets)
+    part = build_time_cube(df[rows], time_col, value_cols)
+    kept = cube[~cube.index.isin(buckets)]
+    rebuilt = pd.concat([kept, part]).sort_index()
+    rebuilt.index = pd.DatetimeIndex(rebuilt.index, name='hour_bucket')
+    return rebuilt
+
+
+def get_time_cube(df, time_col, dataset_key, max_workers=None):
+    """データセットのキーとタイムスタンプ列ごとにキャッシュされた時間キューブを返します。"""
+    cache_key = (dataset_key, time_col)
+    cube = _time_cube_cache.get(cache_key)
+    if cube is None:
+        cube = build_time_cube(df, time_col, max_workers=max_workers)
+        seed_time_cube(dataset_key, time_col, cube)
+    return cube
+
+
+def seed_time_cube(dataset_key, time_col, cube):
+    """
+    追記などで計算済みのキューブを、データセットのキーに対応づけて登録します。
+    キューブはタイムスタンプ列と集計した値の列に依存する派生データとして記録します。
+    """
+    cache_key = (dataset_key, time_col)
+    _time_cube_cache.put(cache_key, cube)
+    record_dependency(dataset_key, ARTIFACT_TIME_CUBE, time_col,
+                      [time_col, *cube.columns.get_level_values(0).unique()],
+                      evict=functools.partial(_time_cube_cache.pop, cache_key))
+
+
+def cached_time_cube(dataset_key, time_col):
+    """キャッシュ済みの時間キューブを返します（なければ None。新たに作成はしません）。"""
+    return _time_cube_cache.get((dataset_key, time_col))
+
+
+def cached_time_cubes(dataset_key):
+    """データセットのキーに対してキャッシュ済みの {タイムスタンプ列: キューブ} を返します。"""
+    cubes = {}
+    for cache_key in _time_cube_cache.keys():
+        if cache_key[0] == dataset_key:
+            cube = _time_cube_cache.get(cache_key)
+            if cube is not None:
+                cubes[cache_key[1]] = cube
+    return cubes
+
+
+def _value_partials(cube, value_col):
+    partials = cube[value_col]
+    # 値が1件もない時間帯（全て欠損）は集計から除く
+    return partials[partials['count'] > 0]
+
+
+def _merge_partials(partials, keys):
+    """
+    部分集計を整数のキー（時間帯ごと）ごとに bincount で合算し、キーの昇順の行に平均値を含む DataFrame を返します。
+    インデックスは整数のキーのままで、ラベルは呼び出し側が集計後の行にだけ付けます。
+    """
+    slots, merged_keys = _dense_codes(np.asarray(keys, dtype=np.int64))
+    sums = np.bincount(slots, weights=partials['sum'].to_numpy(), minlength=len(merged_keys))
+    counts = np.bincount(slots, weights=partials['count'].to_numpy(), minlength=len(merged_keys))
+    return pd.DataFrame({'sum': sums, 'count': counts, 'mean': sums / counts}, index=merged_keys)
+
+
+def wall_clock_ns(timestamps):
+    """
+    日時（DatetimeIndex や Series）を、現地時刻での 1970-01-01 からのナノ秒の整数配列にします（欠損は NaT の値）。
+    日・時間帯・曜日・月・年のキーは、この値の整数演算（と datetime64 の月・年への変換）で求めます。
+    """
+    index = pd.DatetimeIndex(timestamps)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.as_unit('ns').asi8
+
+
+def month_codes(ns):
+    """ナノ秒の整数配列を、1970年1月からの月数の整数コードにします（欠損は NaT の値のまま）。"""
+    return ns.view('M8[ns]').astype('M8[M]').view(np.int64)
+
+
+def month_labels(codes):
+    """月数の整数コードを 'YYYY-MM' の文字列にします（集計後の行のラベル用）。"""
+    return np.datetime_as_string(np.asarray(codes, dtype=np.int64).view('M8[M]'), unit='M')
+
+
+def rollup_time_cube(cube, value_col, granularity):
+    """
+    時間キューブを指定の粒度で集計し、['Period', 'Average_Value'] の DataFrame を返します。
+    Period は時間帯なら時（0-23）、日なら日付、曜日なら曜日名、月なら 'YYYY-MM'、年なら西暦です。
+    """
+    partials = _value_partials(cube, value_col)
+    ns = wall_clock_ns(partials.index)
+
+    if granularity == GRANULARITY_HOUR_OF_DAY:
+        merged = _merge_partials(partials, ns // HOUR_NS % 24)
+        periods = merged.index.to_numpy()
+    elif granularity == GRANULARITY_DAY:
+        merged = _merge_partials(partials, ns // DAY_NS)
+        periods = merged.index.to_numpy().astype('M8[D]').astype(object)
+    elif granularity == GRANULARITY_WEEKDAY:
+        merged = _merge_partials(partials, (ns // DAY_NS + _EPOCH_WEEKDAY) % 7)
+        merged = merged.reindex(range(7)) # データのない曜日も行として残す
+        periods = pd.Categorical.from_codes(np.arange(7), categories=WEEKDAY_NAMES, ordered=True)
+    elif granularity == GRANULARITY_MONTH:
+        merged = _merge_partials(partials, month_codes(ns))
+        periods = month_labels(merged.index.to_numpy())
+    elif granularity == GRANULARITY_YEAR:
+        merged = _merge_partials(partials, ns.view('M8[ns]').astype('M8[Y]').view(np.int64) + 1970)
+        periods = merged.index.to_numpy()
+    else:
+        raise ValueError(f'未対応の集計粒度です: {granularity}')
+
+    return pd.DataFrame({'Period': periods, 'Average_Value': merged['mean'].to_numpy()})
+
+
+def rollup_date_hour(cube, value_col, agg='mean'):
+    """
+    時間キューブから、行が時間帯（0-23）、列が日付の表を作成します
+    （従来の pivot_table(index='hour', columns='date', aggfunc=agg) と同じ形）。
+    キューブの1時間ごとの部分集計が通常は表の1つのセルになりますが、夏時間の終わりの日の重複する時刻のように
+    現地時刻の同じ時間帯に複数の部分集計がある場合は、セルごとに合算（最小・最大は比較）してから平均を求めます。
+    agg は 'mean'（平均）、'sum'、'count'、'max'、'min' のいずれかです。
+    """
+    if agg != 'mean' and agg not in CUBE_STATS:
+        raise ValueError(f'未対応の集計方法です: {agg}')
+    partials = _value_partials(cube, value_col)
+    ns = wall_clock_ns(partials.index)
+    hour_codes, hour_values = _dense_codes(ns // HOUR_NS % 24)
+    date_codes, date_values = _dense_codes(ns // DAY_NS)
+    shape = (len(hour_values), len(date_values))
+    cells = hour_codes * shape[1] + date_codes
+    size = shape[0] * shape[1]
+
+    if agg in ('min', 'max'):
+        grid = np.full(size, np.nan)
+        (np.fmin if agg == 'min' else np.fmax).at(grid, cells, partials[agg].to_numpy())
+    else:
+        # 部分集計のあるセルは件数が1以上なので、件数が 0 のセルは部分集計のないセル
+        counts = np.bincount(cells, weights=partials['count'].to_numpy(), minlength=size)
+        if agg == 'count':
+            grid = counts
+        else:
+            grid = np.bincount(cells, weights=partials['sum' if agg == 'mean' else agg].to_numpy(), minlength=size)
+            if agg == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    grid = grid / counts
+        grid = np.where(counts > 0, grid, np.nan)
+    grid = grid.reshape(shape)
+    table = pd.DataFrame(grid, index=pd.Index(hour_values, name='hour'),
+                         columns=pd.Index(date_values.astype('M8[D]').astype(object), name='date'))
+    return table
@@ -0,0 +1,211 @@
+# components/type_inference.py
+
+import functools
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache, frame_fingerprint
+from components.fingerprint import ARTIFACT_TYPED_FRAME, record_dependency
+
+# 型判定に使うサンプル数と判定のしきい値
+SAMPLE_SIZE = 1000
+NUMERIC_THRESHOLD = 0.95 # サンプルのうち数値として解釈できる割合
+DATETIME_THRESHOLD = 0.95 # サンプルのうち日時として解釈できる割合
+CATEGORY_MAX_UNIQUE_RATIO = 0.5 # ユニーク値の割合がこれ以下ならカテゴリ
+CATEGORY_ALWAYS_UNIQUE = 20 # ユニーク値がこの数以下ならカテゴリ
+
+KIND_NUMERIC = 'numeric'
+KIND_DATETIME = 'datetime'
+KIND_CATEGORICAL = 'categorical'
+KIND_STRING = 'string'
+KIND_BOOLEAN = 'boolean'
+
+# 推論したスキーマと型変換済みDataFrameのキャッシュ（データセットのキーごと）
+_SCHEMA_CACHE_SIZE = 128
+_schema_cache = OrderedDict()
+_schema_cache_lock = threading.Lock()
+TYPED_FRAME_CACHE_BUDGET_BYTES = 1024 * 1024 * 1024 # 1GB
+_typed_frame_cache = LRUByteCache(TYPED_FRAME_CACHE_BUDGET_BYTES)
+
+
+def _sample_non_null(series, sample_size):
+    """列全体から等間隔に値を取り出し、欠損を除いたサンプルを返します。"""
+    n = len(series)
+    if n > sample_size:
+        positions = np.linspace(0, n - 1, sample_size).astype(np.int64)
+        series = series.iloc[positions]
+    return series.dropna()
+
+
+def _parse_datetime(values):
+    """日時への変換（形式を推定できない場合の警告は抑制）。"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return pd.to_datetime(values, errors='coerce')
+
+
+def infer_column_kind(series, sample_size=SAMPLE_SIZE):
+    """
+    列のサンプルを1回だけ調べ、numeric / datetime / categorical / string / boolean のいずれかを返します。
+    """
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return KIND_BOOLEAN
+    if pd.api.types.is_numeric_dtype(dtype):
+        return KIND_NUMERIC
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return KIND_DATETIME
+    if isinstance(dtype, pd.CategoricalDtype):
+        return KIND_CATEGORICAL
+
+    sample = _sample_non_null(series, sample_size)
+    if sample.empty:
+        return KIND_STRING
+
+    # 数値として解釈できるか（"1,234" のような表記は文字列のまま扱う）
+    numeric_ratio = pd.to_numeric(sample, errors='coerce').notna().mean()
+    if numeric_ratio >= NUMERIC_THRESHOLD:
+        return KIND_NUMERIC
+
+    # 日時として解釈できるか。"Jan" のような数字を含まない文字列は日時にしない
+    as_text = sample.astype(str)
+    if as_text.str.contains(r'\d', regex=True).mean() >= DATETIME_THRESHOLD:
+        if _parse_datetime(sample).notna().mean() >= DATETIME_THRESHOLD:
+            return KIND_DATETIME
+
+    n_unique = as_text.nunique()
+    if n_unique <= CATEGORY_ALWAYS_UNIQUE or n_unique / len(sample) <= CATEGORY_MAX_UNIQUE_RATIO:
+        return KIND_CATEGORICAL
+    return KIND_STRING
+
+
+def infer_schema(df, sample_size=SAMPLE_SIZE):
+    """DataFrame の各列の種類を推論し、{列名: 種類} の辞書を返します。"""
+    return {col: infer_column_kind(df[col], sample_size) for col in df.columns}
+
+
+def downcast_numeric(series):
+    """
+    数値列を値を失わない範囲で最小のビット幅に縮小します。
+    整数は int8/16/32、浮動小数は float32 で誤差なく表現できる場合のみ float32 にします。
+    """
+    dtype = series.dtype
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(dtype) and dtype != np.float32:
+        values = series.to_numpy()
+        as_float32 = values.astype(np.float32)
+        if np.array_equal(as_float32.astype(values.dtype), values, equal_nan=True):
+            return pd.Series(as_float32, index=series.index, name=series.name)
+    return series
+
+
+def apply_schema(df, schema):
+    """
+    推論済みのスキーマに従って列を一括変換した新しい DataFrame を返します（元の df は変更しません）。
+    """
+    converted = {}
+    for col in df.columns:
+        series = df[col]
+        kind = schema.get(col)
+        if kind == KIND_NUMERIC:
+            if not pd.api.types.is_numeric_dtype(series.dtype):
+                series = pd.to_numeric(series, errors='coerce')
+            series = downcast_numeric(series)
+        elif kind == KIND_DATETIME:
+            if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+                series = _parse_datetime(series)
+        elif kind == KIND_CATEGORICAL:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype('category')
+        converted[col] = series
+    return pd.DataFrame(converted, index=df.index, columns=df.columns, copy=False)
+
+
+def get_cached_schema(dataset_key):
+    """データセットのキーに対応するキャッシュ済みスキーマを返します（なければ None）。"""
+    with _schema_cache_lock:
+        schema = _schema_cache.get(dataset_key)
+        if schema is not None:
+            _schema_cache.move_to_end(dataset_key)
+        return schema
+
+
+def get_cached_typed_frame(dataset_key):
+    """データセットのキーに対応する型変換済み DataFrame を返します（なければ None）。"""
+    typed_df = _typed_frame_cache.get(dataset_key)
+    return typed_df.copy(deep=False) if typed_df is not None else None
+
+
+def seed_typed_frame(dataset_key, typed_df, schema):
+    """追記などで作成した型変換済み DataFrame とスキーマを、データセットのキーに対応づけて登録します。"""
+    with _schema_cache_lock:
+        _schema_cache[dataset_key] = schema
+        while len(_schema_cache) > _SCHEMA_CACHE_SIZE:
+            _schema_cache.popitem(last=False)
+    _put_typed_frame(dataset_key, typed_df)
+
+
+def _put_typed_frame(dataset_key, typed_df):
+    """型変換済み DataFrame をキャッシュに入れ、全ての列に依存する派生データとして記録します。"""
+    _typed_frame_cache.put(dataset_key, typed_df)
+    record_dependency(dataset_key, ARTIFACT_TYPED_FRAME, None, typed_df.columns,
+                      evict=functools.partial(_typed_frame_cache.pop, dataset_key))
+
+
+def concat_typed_frames(old_df, new_df):
+    """
+    型変換済みの DataFrame を縦に結合します。
+    カテゴリ列はカテゴリの和集合にそろえてから結合するため、結合後も category 型のままです
+    （そのまま pd.concat するとカテゴリが異なる列は object 型になってしまう）。
+    """
+    old_parts, new_parts = {}, {}
+    for col in old_df.columns.union(new_df.columns, sort=False):
+        old_col = old_df[col] if col in old_df.columns else None
+        new_col = new_df[col] if col in new_df.columns else None
+        if old_col is not None and new_col is not None and (
+                isinstance(old_col.dtype, pd.CategoricalDtype) or isinstance(new_col.dtype, pd.CategoricalDtype)):
+            old_col = old_col.astype('category')
+            new_col = new_col.astype('category')
+            categories = old_col.cat.categories.union(new_col.cat.categories, sort=False)
+            old_col = old_col.cat.set_categories(categories)
+            new_col = new_col.cat.set_categories(categories)
+        if old_col is not None:
+            old_parts[col] = old_col
+        if new_col is not None:
+            new_parts[col] = new_col
+    return pd.concat(
+        [pd.DataFrame(old_parts, copy=False), pd.DataFrame(new_parts, copy=False)],
+        ignore_index=True
+    )
+
+
+def convert_column_types(df, dataset_key=None):
+    """
+    列の型を推論して一括変換した DataFrame を返します。
+    スキーマと変換結果はデータセットのキーごとにキャッシュするため、
+    同じデータでの再実行では推論も変換も行いません。
+    dataset_key を省略した場合は DataFrame の内容からフィンガープリントを計算します。
+    """
+    if dataset_key is None:
+        dataset_key = frame_fingerprint(df)
+
+    typed_df = _typed_frame_cache.get(dataset_key)
+    if typed_df is not None:
+        return typed_df.copy(deep=False)
+
+    schema = get_cached_schema(dataset_key)
+    if schema is None:
+        schema = infer_schema(df)
+        with _schema_cache_lock:
+            _schema_cache[dataset_key] = schema
+            while len(_schema_cache) > _SCHEMA_CACHE_SIZE:
+                _schema_cache.popitem(last=False)
+
+    typed_df = apply_schema(df, schema)
+    _put_typed_frame(dataset_key, typed_df)
+    return typed_df.copy(deep=False)
@@ -0,0 +1,95 @@
+# tests/test_cache.py
+"""LRUByteCache のバイト数の上限と破棄、DataFrame のバイト数の見積もりを確かめます。"""
+
+import numpy as np
+import pandas as pd
+
+from components.cache import LRUByteCache, file_content_hash, frame_fingerprint, frame_nbytes
+
+
+def _cache(budget):
+    return LRUByteCache(budget, sizeof=len)
+
+
+def test_evicts_least_recently_used_entries_over_budget():
+    cache = _cache(10)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    assert cache.get('a') == 'xxxx' # a を最近使ったものにする
+    cache.put('c', 'xxxx')
+    assert cache.keys() == ['a', 'c']
+    assert cache.resident_bytes == 8
+    assert cache.stats()['evictions'] == 1
+
+
+def test_rejects_values_larger_than_the_budget():
+    cache = _cache(10)
+    cache.put('a', 'xxxx')
+    assert not cache.put('big', 'x' * 11)
+    assert 'big' not in cache and 'a' in cache
+
+
+def test_replacing_and_popping_keep_resident_bytes():
+    cache = _cache(100)
+    cache.put('a', 'xxxx')
+    cache.put('a', 'xx')
+    assert cache.resident_bytes == 2 and len(cache) == 1
+    assert cache.pop('a') == 'xx'
+    assert cache.pop('a', 'missing') == 'missing'
+    assert cache.resident_bytes == 0
+
+
+def test_explicit_nbytes_and_budget_change():
+    cache = _cache(100)
+    for key in 'abcd':
+        cache.put(key, key, nbytes=20)
+    cache.set_budget(50)
+    assert cache.keys() == ['c', 'd']
+    assert cache.resident_bytes == 40
+
+
+def test_hit_rate():
+    cache = _cache(100)
+    cache.put('a', 'x')
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_frame_fingerprint_depends_on_values_names_and_types():
+    df = pd.DataFrame({'a': np.arange(5), 'b': list('abcde')})
+    assert frame_fingerprint(df) == frame_fingerprint(df.copy())
+    changed = df.copy()
+    changed.loc[2, 'a'] = 100
+    assert frame_fingerprint(changed) != frame_fingerprint(df)
+    assert frame_fingerprint(df.rename(columns={'a': 'c'})) != frame_fingerprint(df)
+    assert frame_fingerprint(df.astype({'a': np.float64})) != frame_fingerprint(df)
+
+
+def test_file_content_hash_rewinds_the_file(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_bytes(b'a,b\n1,2\n')
+    with open(path, 'rb') as file:
+        file.read(2)
+        digest = file_content_hash(file)
+        assert file.tell() == 0
+        assert file_content_hash(file) == digest
+
+
+def test_frame_nbytes_estimates_deep_memory_usage():
+    rng = np.random.default_rng(0)
+    n = 50_000
+    words = np.array([f'word{i}' * (i % 5 + 1) for i in range(300)], dtype=object)
+    df = pd.DataFrame({
+        'float': rng.normal(size=n),
+        'object': rng.choice(words, n),
+        'category': pd.Categorical(rng.choice(words, n)),
+        'python_string': pd.array(rng.choice(words, n), dtype='string[python]'),
+        'arrow_string': pd.array(rng.choice(words, n), dtype='string[pyarrow]'),
+        'time': pd.date_range('2024-01-01', periods=n, freq='min', tz='UTC'),
+    })
+    for col in df.columns:
+        expected = df[[col]].memory_usage(deep=True, index=True).sum()
+        assert abs(frame_nbytes(df[[col]]) - expected) <= 0.05 * expected, col
+    assert frame_nbytes(df.iloc[:0]) >= 0
@@ -0,0 +1,72 @@
+# tests/test_csv_streaming.py
+"""チャンク単位で読み込んだ結果が、ファイルごとに read_csv して pd.concat した結果と一致することを確かめます。"""
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.csv_streaming import estimate_row_count, promote_dtype, stream_csv_files
+
+
+class _File(io.BytesIO):
+    def __init__(self, text, name):
+        super().__init__(text.encode())
+        self.name = name
+
+
+FILES = {
+    'same': ['a,b\n1,x\n2,y\n3,z\n', 'a,b\n4,w\n5,v\n'],
+    # 整数と小数の列（float64 に昇格）、整数と文字列の列（object に昇格）
+    'promote': ['a,b\n1,2\n2,3\n3,4\n', 'a,b\n1.5,x\n2.5,y\n'],
+    # 後のファイルにだけある列、前のファイルにだけある列（ない分は欠損）
+    'union': ['a,b\n1,x\n2,y\n', 'b,c\nz,true\nw,false\n', 'a,c\n3,true\n'],
+    'missing': ['a,b\n1,\n,2\n3,4\n', 'a,b\n5,6\n'],
+    'header_only': ['a,b\n', 'a,b\n1,2\n'],
+    'no_trailing_newline': ['a,b\n1,2\n3,4', 'a,b\n5,6'],
+}
+
+
+def _files(name):
+    return [_File(text, f'{name}_{i}.csv') for i, text in enumerate(FILES[name])]
+
+
+@pytest.mark.parametrize('name', list(FILES))
+@pytest.mark.parametrize('chunksize', [1, 2, 100])
+def test_stream_matches_concat(name, chunksize):
+    expected = pd.concat([pd.read_csv(file) for file in _files(name)], ignore_index=True)
+    result = stream_csv_files(_files(name), chunksize=chunksize)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    for col in expected.columns:
+        # 数値の列は同じ数値型、それ以外は object に統合される
+        if pd.api.types.is_numeric_dtype(expected[col].dtype) and not pd.api.types.is_bool_dtype(expected[col]):
+            assert result[col].dtype == expected[col].dtype, col
+        else:
+            assert result[col].dtype == object, col
+
+
+def test_progress_reaches_each_file_total():
+    reports = []
+    stream_csv_files(_files('same'), chunksize=1,
+                     progress_callback=lambda index, name, done, total: reports.append((index, done, total)))
+    finals = {index: (done, total) for index, done, total in reports}
+    assert finals == {0: (3, 3), 1: (2, 2)}
+    assert all(done <= total for _, done, total in reports)
+
+
+def test_estimate_row_count_is_an_upper_bound():
+    for texts in FILES.values():
+        for text in texts:
+            assert estimate_row_count(io.BytesIO(text.encode())) >= len(pd.read_csv(io.StringIO(text)))
+
+
+def test_promote_dtype():
+    assert promote_dtype(None, np.dtype('int64')) == np.dtype('int64')
+    assert promote_dtype(np.dtype('int64'), np.dtype('float32')) == np.dtype('float64')
+    assert promote_dtype(np.dtype('int64'), np.dtype(object)) == np.dtype(object)
+    assert promote_dtype(np.dtype('bool'), np.dtype('int64')) == np.dtype(object)
+
+
+def test_no_files():
+    assert stream_csv_files([]) is None
@@ -0,0 +1,180 @@
+# tests/test_data_editor.py
+"""
+EditLog の版のキーと差分の適用、前の版のキャッシュを変更された範囲だけ更新して引き継いだ結果が、
+編集後のデータから作り直した結果と一致することを確かめます。
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.data_editor import EditLog, load_edited_frame, record_page_edits
+from components.dataset import Dataset
+from components.fingerprint import DatasetFingerprint, cached_fingerprint
+from components.online_stats import (
+    PairwiseMoments, build_quantile_sketches, cached_pairwise_moments, cached_quantile_sketches,
+    get_pairwise_moments, get_quantile_sketches
+)
+from components.time_cube import build_time_cube, cached_time_cube, get_time_cube
+from components.type_inference import convert_column_types, get_cached_typed_frame
+
+
+def _base(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        't': pd.date_range('2024-03-01', periods=n, freq='47min'),
+        'v': rng.normal(size=n),
+        'w': rng.normal(10, 2, n),
+        'n': rng.integers(0, 50, n),
+        's': rng.choice(['a', 'b', 'c'], n),
+    })
+
+
+def _edit(log, kind):
+    if kind == 'value':
+        log.update(3, 'v', 100.0)
+        log.update(250, 'v', -5.0)
+    elif kind == 'revert':
+        # 変更して元の値に戻した列は、値の変わった列に含まれない
+        original = log.value(7, 'w')
+        log.update(7, 'w', 0.0)
+        log.update(7, 'w', original)
+        log.update(8, 'v', 1.5)
+    elif kind == 'time':
+        log.update(10, 't', pd.Timestamp('2024-03-20 05:30'))
+    elif kind == 'text':
+        log.update(11, 's', 'b' if log.value(11, 's') != 'b' else 'c')
+    elif kind == 'insert':
+        log.insert({'t': pd.Timestamp('2024-03-05 12:00'), 'v': 2.0, 'w': 9.0, 'n': 4, 's': 'a'})
+    elif kind == 'delete':
+        log.delete(0)
+        log.delete(120)
+    elif kind == 'mixed':
+        log.update(5, 'v', 0.25)
+        row_id = log.insert({'t': pd.Timestamp('2024-03-06 01:00'), 'v': 1.0, 'w': 8.0, 'n': 1, 's': 'c'})
+        log.update(row_id, 'w', 11.0)
+        log.delete(42)
+
+
+def _apply_by_hand(base, kind):
+    """_edit と同じ編集を pandas で直接適用します（インデックスは行ID）。"""
+    df = base.copy()
+    log = EditLog(base)
+    _edit(log, kind)
+    for delta in log.deltas:
+        if delta.kind == 'update':
+            df.loc[delta.row_id, delta.column] = delta.new
+        elif delta.kind == 'insert':
+            df = pd.concat([df, pd.DataFrame([delta.new], index=[delta.row_id])])
+        else:
+            df = df.drop(index=delta.row_id)
+    return df
+
+
+KINDS = ['value', 'revert', 'time', 'text', 'insert', 'delete', 'mixed']
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_frame_and_pages_match_edits_applied_by_hand(kind):
+    log = EditLog(_base())
+    _edit(log, kind)
+    expected = _apply_by_hand(_base(), kind)
+    pd.testing.assert_frame_equal(log.frame(), expected, check_dtype=False)
+    assert len(log) == len(expected)
+    for start in [0, 100, 450]:
+        pd.testing.assert_frame_equal(log.page(start, start + 100), expected.iloc[start:start + 100],
+                                      check_dtype=False)
+
+
+def test_key_depends_only_on_base_and_edits():
+    first, second = EditLog(_base()), EditLog(_base())
+    assert first.key == second.key
+    for log in (first, second):
+        _edit(log, 'mixed')
+    assert first.key == second.key
+    assert EditLog(_base(seed=1)).key != EditLog(_base()).key
+
+    # 元の値に戻しても版は進むので、キーは編集前と異なる
+    log = EditLog(_base())
+    initial_key = log.key
+    _edit(log, 'revert')
+    assert log.key != initial_key
+    assert log.version_of(initial_key) == 0
+    assert log.version_of(log.key) == log.version == 3
+
+
+def test_unchanged_value_is_not_recorded():
+    log = EditLog(_base())
+    assert not log.update(3, 'v', log.value(3, 'v'))
+    assert log.version == 0
+
+
+def test_record_page_edits():
+    log = EditLog(_base())
+    view = log.page(0, 20)
+    edited = view.copy()
+    edited.loc[4, 'w'] = -1.0
+    edited = edited.drop(index=9)
+    edited = pd.concat([edited, pd.DataFrame([{'t': pd.Timestamp('2024-04-01'), 'v': 0.0, 'w': 1.0, 'n': 2,
+                                               's': 'a'}], index=[999])])
+    assert record_page_edits(log, view, edited) == 3
+    assert [delta.kind for delta in log.deltas] == ['delete', 'update', 'insert']
+    assert log.value(4, 'w') == -1.0 and 9 not in log.row_ids()
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_changes_since(kind):
+    log = EditLog(_base())
+    _edit(log, kind)
+    changes = log.changes_since(0)
+    previous, current = set(range(len(log.base))), set(log.row_ids())
+    assert changes.rows_changed == (previous != current)
+    assert set(changes.added) <= current and set(changes.removed) <= previous
+    assert set(changes.removed) >= previous - current and set(changes.added) >= current - previous
+    assert changes.columns == {delta.column for delta in log.deltas if delta.kind == 'update'}
+
+
+def _seed_caches(dataset):
+    typed = dataset.typed
+    dataset.fingerprint
+    get_pairwise_moments(typed, dataset.key)
+    get_quantile_sketches(typed, dataset.key, ['v', 'w', 'n'])
+    get_time_cube(typed, 't', dataset.key)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_carried_over_caches_match_rebuilt(kind):
+    base = _base()
+    log = EditLog(base)
+    previous = Dataset(base, log.key)
+    _seed_caches(previous)
+
+    _edit(log, kind)
+    df = load_edited_frame(log, previous)
+    carry_over = log.last_carry_over
+    assert carry_over is not None
+
+    expected = convert_column_types(df.copy())
+    typed = get_cached_typed_frame(log.key)
+    pd.testing.assert_frame_equal(typed, expected)
+    changed = DatasetFingerprint.from_frame(previous.typed).changed_columns(DatasetFingerprint.from_frame(expected))
+    assert carry_over.changed == changed
+    assert cached_fingerprint(log.key).changed_columns(DatasetFingerprint.from_frame(expected)) == set()
+
+    moments = cached_pairwise_moments(log.key)
+    expected_moments = PairwiseMoments.from_frame(expected)
+    pd.testing.assert_frame_equal(moments.column_summary(), expected_moments.column_summary())
+    pd.testing.assert_frame_equal(moments.correlation(), expected_moments.correlation())
+
+    # 分位点スケッチは行の追加・削除がなければ、値の変わらない列の分だけ引き継ぐ
+    sketches = cached_quantile_sketches(log.key) or {}
+    expected_sketches = build_quantile_sketches(expected, ['v', 'w', 'n'])
+    for col, sketch in sketches.items():
+        assert col not in changed
+        np.testing.assert_allclose(sketch.quantiles([0.1, 0.5, 0.9]), expected_sketches[col].quantiles([0.1, 0.5, 0.9]))
+
+    cube = cached_time_cube(log.key, 't')
+    expected_cube = build_time_cube(expected, 't')
+    expected_cube = expected_cube[expected_cube.xs('count', axis=1, level=1).sum(axis=1) > 0]
+    cube = cube[cube.xs('count', axis=1, level=1).sum(axis=1) > 0]
+    pd.testing.assert_frame_equal(cube, expected_cube, check_freq=False)
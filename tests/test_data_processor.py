@@ -0,0 +1,88 @@
+# tests/test_data_processor.py
+"""
+追記モードで追加したファイルの分だけ集計して足し合わせた結果が、全てのファイルを読み込み直して
+作成した結果（型変換・時間キューブ・積和の集計・分位点スケッチ）と一致することを確かめます。
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.data_processor import load_and_append_csv, load_and_combine_csv
+from components.online_stats import (
+    PairwiseMoments, build_quantile_sketches, cached_pairwise_moments, cached_quantile_sketches,
+    get_pairwise_moments, get_quantile_sketches
+)
+from components.time_cube import build_time_cube, cached_time_cube, get_time_cube
+from components.type_inference import convert_column_types
+
+
+class _File(io.BytesIO):
+    def __init__(self, text, name):
+        super().__init__(text.encode())
+        self.name = name
+        self.size = len(text)
+
+
+def _csv_files(seed, n_files=3, rows=200, extra_column=False):
+    rng = np.random.default_rng(seed)
+    files = []
+    start = pd.Timestamp('2024-05-01')
+    for i in range(n_files):
+        # ファイルの境界をまたぐ時間帯がある（前のファイルの最後の1時間に次のファイルの行が入る）
+        times = start + pd.to_timedelta(np.sort(rng.integers(0, 3600 * 30, rows)), unit='s')
+        start = times[-1] - pd.Timedelta(minutes=10)
+        df = pd.DataFrame({
+            'time': times.strftime('%Y-%m-%d %H:%M:%S'),
+            'v': rng.normal(100, 5, rows).round(3),
+            'n': rng.integers(0, 1000, rows),
+            'label': rng.choice(['x', 'y', 'z'], rows),
+        })
+        df.loc[rng.random(rows) < 0.1, 'v'] = np.nan
+        if extra_column and i == n_files - 1:
+            df['extra'] = rng.normal(size=rows)
+        files.append(_File(df.to_csv(index=False), f'part{i}.csv'))
+    return files
+
+
+def _seed_caches(typed, dataset_key):
+    get_time_cube(typed, 'time', dataset_key)
+    get_pairwise_moments(typed, dataset_key)
+    get_quantile_sketches(typed, dataset_key, ['v', 'n'])
+
+
+@pytest.mark.parametrize('n_prev, extra_column', [(1, False), (2, False), (2, True)])
+def test_appended_aggregates_match_rebuilt(n_prev, extra_column):
+    files = _csv_files(seed=n_prev * 10 + extra_column, extra_column=extra_column)
+    prev_typed, prev_key = load_and_append_csv(files[:n_prev])
+    _seed_caches(prev_typed, prev_key)
+
+    typed, dataset_key = load_and_append_csv(files)
+    assert dataset_key != prev_key
+    expected = convert_column_types(load_and_combine_csv(files).copy())
+    pd.testing.assert_frame_equal(typed, expected, check_dtype=False)
+
+    cube = cached_time_cube(dataset_key, 'time')
+    assert cube is not None
+    expected_cube = build_time_cube(expected, 'time')
+    pd.testing.assert_frame_equal(cube, expected_cube.reindex(columns=cube.columns), check_freq=False)
+
+    moments = cached_pairwise_moments(dataset_key)
+    expected_moments = PairwiseMoments.from_frame(expected, moments.columns)
+    pd.testing.assert_frame_equal(moments.column_summary(), expected_moments.column_summary())
+    pd.testing.assert_frame_equal(moments.correlation(), expected_moments.correlation())
+
+    sketches = cached_quantile_sketches(dataset_key)
+    expected_sketches = build_quantile_sketches(expected, ['v', 'n'])
+    for col in ['v', 'n']:
+        np.testing.assert_allclose(sketches[col].quantiles([0.1, 0.5, 0.9]),
+                                   expected_sketches[col].quantiles([0.1, 0.5, 0.9]))
+
+
+def test_append_with_unreadable_files_returns_none():
+    files = _csv_files(seed=99, n_files=1)
+    load_and_append_csv(files)
+    typed, dataset_key = load_and_append_csv(files + [_File('', 'empty.csv')])
+    assert typed is None and dataset_key is not None
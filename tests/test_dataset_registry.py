@@ -0,0 +1,156 @@
+# tests/test_dataset_registry.py
+"""共有データセットの登録・参照の解放・破棄を確かめます。"""
+
+import threading
+
+import pandas as pd
+import pytest
+
+from components import dataset_registry
+from components.dataset_registry import acquire_dataset
+
+
+def _frame():
+    return pd.DataFrame({'a': [1, 2, 3]})
+
+
+def test_failed_load_is_not_registered():
+    key = ('test_registry', 'none')
+    with pytest.raises(ValueError):
+        acquire_dataset(key, lambda: None)
+    assert key not in dataset_registry._entries
+
+    # 読み込みに失敗したキーも、次の要求で読み込み直せる
+    handle = acquire_dataset(key, _frame)
+    assert len(handle.dataset) == 3
+    handle.release()
+
+
+def _loader(calls, frame=None):
+    def load():
+        calls.append(1)
+        return _frame() if frame is None else frame
+    return load
+
+
+def test_same_key_shares_one_dataset():
+    key = ('test_registry', 'shared')
+    calls = []
+    first = acquire_dataset(key, _loader(calls))
+    second = acquire_dataset(key, _loader(calls))
+    assert len(calls) == 1
+    assert first.dataset is second.dataset
+    assert dataset_registry._entries[key].refcount == 2
+    first.release()
+    second.release()
+
+
+def test_release_counts_once_per_handle():
+    key = ('test_registry', 'release')
+    first = acquire_dataset(key, _frame)
+    second = acquire_dataset(key, _frame)
+    first.release()
+    first.release()
+    entry = dataset_registry._entries[key]
+    assert entry.refcount == 1 and entry.idle_since is None
+    second.release()
+    assert entry.refcount == 0 and entry.idle_since is not None
+
+
+def test_dropped_handle_releases_reference():
+    key = ('test_registry', 'dropped')
+    handle = acquire_dataset(key, _frame)
+    del handle
+    assert dataset_registry._entries[key].refcount == 0
+
+
+def test_only_idle_datasets_are_evicted():
+    idle_key, held_key = ('test_registry', 'idle'), ('test_registry', 'held')
+    acquire_dataset(idle_key, _frame).release()
+    held = acquire_dataset(held_key, _frame)
+    # 期限の来ていないデータセットは破棄しない
+    dataset_registry.evict_idle_datasets()
+    assert idle_key in dataset_registry._entries
+
+    evictions = dataset_registry.registry_stats()['evictions']
+    assert dataset_registry.evict_idle_datasets(idle_seconds=0) >= 1
+    assert idle_key not in dataset_registry._entries
+    assert held_key in dataset_registry._entries
+    assert dataset_registry.registry_stats()['evictions'] > evictions
+
+    # 破棄した後の要求では読み込み直す
+    calls = []
+    handle = acquire_dataset(idle_key, _loader(calls))
+    assert len(calls) == 1
+    handle.release()
+    held.release()
+
+
+def test_concurrent_requests_wait_for_one_load():
+    key = ('test_registry', 'concurrent')
+    calls = []
+    started, finish = threading.Event(), threading.Event()
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return _frame()
+
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(acquire_dataset(key, slow_load))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and len(handles) == 4
+    assert len({id(handle.dataset) for handle in handles}) == 1
+    for handle in handles:
+        handle.release()
+
+
+def test_waiting_request_reloads_after_failed_load():
+    key = ('test_registry', 'retry')
+    started, finish = threading.Event(), threading.Event()
+
+    def failing_load():
+        started.set()
+        finish.wait(5)
+        return None
+
+    errors, handles = [], []
+
+    def owner():
+        try:
+            acquire_dataset(key, failing_load)
+        except ValueError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: handles.append(acquire_dataset(key, _frame)))
+    waiter.start()
+    finish.set()
+    thread.join(5)
+    waiter.join(5)
+    assert len(errors) == 1
+    assert len(handles) == 1 and len(handles[0].dataset) == 3
+    handles[0].release()
+
+
+def test_registry_stats_count_references():
+    key = ('test_registry', 'stats')
+    before = dataset_registry.registry_stats()
+    handles = [acquire_dataset(key, _frame) for _ in range(3)]
+    stats = dataset_registry.registry_stats()
+    assert stats['references'] == before['references'] + 3
+    assert stats['misses'] == before['misses'] + 1
+    assert stats['hits'] == before['hits'] + 2
+    assert stats['resident_bytes'] > 0
+    for handle in handles:
+        handle.release()
+    assert dataset_registry.registry_stats()['references'] == before['references']
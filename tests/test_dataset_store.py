@@ -0,0 +1,87 @@
+# tests/test_dataset_store.py
+"""保存したデータセットを時刻の範囲と列を指定して開いた結果が、pandas で絞り込んだ結果と一致することを確かめます。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.dataset_store import list_datasets, open_dataset, save_dataset
+
+
+def _frame(tz=None, unit='ns'):
+    rng = np.random.default_rng(0)
+    n = 2000
+    # 夏時間の終わり（2024-11-03）をまたぎ、月の境界も含む
+    t = pd.date_range('2024-10-20', periods=n, freq='17min', tz=tz).as_unit(unit)
+    df = pd.DataFrame({'t': t, 'v': rng.normal(size=n), 'cat': rng.choice(['a', 'b'], n)})
+    df.loc[::50, 't'] = pd.NaT
+    return df
+
+
+def _wall_clock(series):
+    return series.dt.tz_localize(None) if series.dt.tz is not None else series
+
+
+@pytest.mark.parametrize('tz, unit', [(None, 'ns'), (None, 's'), ('US/Eastern', 'ns'), ('US/Eastern', 'ms'), ('UTC', 'us')])
+@pytest.mark.parametrize('start, end', [
+    ('2024-11-02', '2024-11-04'),
+    ('2024-11-03 01:10', '2024-11-03 01:40'),
+    (None, '2024-10-25 12:00:00.5'),
+    ('2024-11-15', None),
+    ('2024-12-01', '2024-12-02'),
+])
+def test_open_dataset_range_matches_pandas(tmp_path, tz, unit, start, end):
+    df = _frame(tz, unit)
+    save_dataset(df, 'ds', time_col='t', store_dir=tmp_path)
+    result = open_dataset('ds', start=start, end=end, store_dir=tmp_path)
+
+    # タイムゾーン付きの列も、タイムゾーンなしの境界を現地時刻として比較する
+    wall = _wall_clock(df['t'])
+    mask = wall.notna()
+    if start is not None:
+        mask &= wall >= pd.Timestamp(start)
+    if end is not None:
+        mask &= wall <= pd.Timestamp(end)
+    expected = df[mask]
+    pd.testing.assert_frame_equal(
+        result.sort_values('t', kind='stable').reset_index(drop=True),
+        expected.sort_values('t', kind='stable').reset_index(drop=True),
+        check_categorical=False
+    )
+
+
+def test_open_dataset_with_tz_aware_bounds(tmp_path):
+    df = _frame('US/Eastern')
+    save_dataset(df, 'tz', time_col='t', store_dir=tmp_path)
+    start = pd.Timestamp('2024-11-03 05:00', tz='UTC')
+    end = pd.Timestamp('2024-11-03 07:00', tz='UTC')
+    result = open_dataset('tz', start=start, end=end, store_dir=tmp_path)
+    expected = df[(df['t'] >= start) & (df['t'] <= end)]
+    np.testing.assert_array_equal(np.sort(result['t'].to_numpy()), np.sort(expected['t'].to_numpy()))
+
+
+@pytest.mark.parametrize('time_col', [None, 't'])
+def test_open_empty_dataset(tmp_path, time_col):
+    df = _frame().iloc[:0]
+    save_dataset(df, 'empty', time_col=time_col, store_dir=tmp_path)
+    for kwargs in [{}, {'start': '2024-01-01', 'end': '2024-02-01'}, {'columns': ['v'], 'start': '2024-01-01'}]:
+        result = open_dataset('empty', store_dir=tmp_path, **kwargs)
+        assert len(result) == 0
+        assert list(result.columns) == kwargs.get('columns', list(df.columns))
+        assert result['v'].dtype == np.float64
+
+
+def test_open_dataset_projects_columns(tmp_path):
+    df = _frame()
+    save_dataset(df, 'ds', time_col='t', store_dir=tmp_path)
+    result = open_dataset('ds', columns=['v'], start='2024-11-01', store_dir=tmp_path)
+    expected = df.loc[df['t'] >= pd.Timestamp('2024-11-01'), 'v']
+    assert list(result.columns) == ['v']
+    np.testing.assert_array_equal(np.sort(result['v'].to_numpy()), np.sort(expected.to_numpy()))
+
+
+def test_list_datasets_skips_staging_dirs(tmp_path):
+    save_dataset(_frame(), 'ds', store_dir=tmp_path)
+    (tmp_path / 'broken.tmp').mkdir()
+    (tmp_path / 'broken.tmp' / 'metadata.json').write_text('{}')
+    assert [metadata['name'] for metadata in list_datasets(tmp_path)] == ['ds']
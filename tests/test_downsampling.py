@@ -0,0 +1,109 @@
+# tests/test_downsampling.py
+"""間引きの結果が点数の上限に収まり、先頭・末尾や極値などの残すべき点を残すことを確かめます。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.downsampling import (
+    METHOD_LTTB, METHOD_MINMAX, downsample_line_indices, grid_thin_indices, line_point_budget, lttb_indices,
+    minmax_indices, numeric_axis, scatter_point_budget
+)
+
+
+def _reference_lttb(x, y, n_out):
+    """LTTB を1点ずつの Python のループで計算します（バケットの境界は lttb_indices と同じ）。"""
+    n = len(x)
+    edges = [int(edge) for edge in np.linspace(1, n - 1, n_out - 1)]
+    selected = [0]
+    for i in range(n_out - 2):
+        next_range = range(edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n) or range(n - 1, n)
+        avg_x = sum(x[j] for j in next_range) / len(next_range)
+        avg_y = sum(y[j] for j in next_range) / len(next_range)
+        a = selected[-1]
+        best, best_area = None, -1.0
+        for j in range(edges[i], edges[i + 1]):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+    return selected + [n - 1]
+
+
+def _series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(0.1, 1.0, n))
+    y = np.cumsum(rng.normal(size=n))
+    y[n // 3] += 100 # スパイク
+    return x, y
+
+
+@pytest.mark.parametrize('n, n_out', [(10, 3), (1000, 50), (1001, 100), (5000, 997)])
+def test_lttb_matches_reference(n, n_out):
+    x, y = _series(n)
+    indices = lttb_indices(x, y, n_out)
+    assert len(indices) == n_out
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert np.all(np.diff(indices) > 0)
+    np.testing.assert_array_equal(indices, _reference_lttb(x, y, n_out))
+
+
+@pytest.mark.parametrize('n, n_out', [(1000, 50), (1001, 100), (5000, 997), (10, 4)])
+def test_minmax_keeps_extremes_and_endpoints(n, n_out):
+    _, y = _series(n)
+    y[::17] = np.nan
+    indices = minmax_indices(y, n_out)
+    assert len(indices) <= n_out
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert np.all(np.diff(indices) > 0)
+    assert np.nanargmax(y) in indices and np.nanargmin(y) in indices
+
+
+@pytest.mark.parametrize('method', [METHOD_LTTB, METHOD_MINMAX])
+def test_downsample_line_indices_budget(method):
+    x, y = _series(20_000)
+    budget = line_point_budget(300)
+    indices = downsample_line_indices(x, y, budget, method=method)
+    assert len(indices) <= budget
+    assert np.all(np.diff(indices) > 0)
+    assert np.argmax(y) in indices
+    # 上限以下なら間引かない
+    np.testing.assert_array_equal(downsample_line_indices(x[:budget], y[:budget], budget, method=method),
+                                  np.arange(budget))
+
+
+def test_lttb_skips_missing_values_and_unsorted_x():
+    x, y = _series(3000)
+    y[::5] = np.nan
+    indices = downsample_line_indices(x, y, 100)
+    assert np.isfinite(y[indices]).all()
+    assert indices[0] == 1 and indices[-1] == 2999 # 先頭の行は y が欠損
+
+    shuffled = np.random.default_rng(1).permutation(x)
+    finite = np.flatnonzero(np.isfinite(y))
+    np.testing.assert_array_equal(downsample_line_indices(shuffled, y, 100),
+                                  finite[lttb_indices(finite.astype(np.float64), y[finite], 100)])
+
+
+def test_grid_thinning_keeps_outliers_and_small_groups():
+    rng = np.random.default_rng(0)
+    n = 50_000
+    x, y = rng.normal(size=n), rng.normal(size=n)
+    x[123], y[123] = 50.0, 50.0 # 孤立した外れ値
+    groups = np.zeros(n, dtype=np.int64)
+    groups[::5000] = 1 # 少数のカテゴリ
+    x[7] = np.nan
+    budget = scatter_point_budget(100)
+    indices = grid_thin_indices(x, y, budget, groups=groups)
+    assert len(indices) <= budget
+    assert np.all(np.diff(indices) > 0)
+    assert 123 in indices and 7 not in indices
+    assert (groups[indices] == 1).sum() == (groups == 1).sum()
+
+
+def test_numeric_axis():
+    times = pd.Series(pd.to_datetime(['2024-01-01', None, '2024-01-02']))
+    values = numeric_axis(times)
+    assert np.isnan(values[1]) and values[2] - values[0] == 86_400 * 10 ** 9
+    np.testing.assert_array_equal(numeric_axis(pd.Series(['b', 'a', 'b'])), [0, 1, 2])
+    np.testing.assert_array_equal(numeric_axis(pd.Series(['b', 'a', 'b']), positional_fallback=False), [0, 1, 0])
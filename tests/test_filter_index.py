@@ -0,0 +1,46 @@
+# tests/test_filter_index.py
+"""CategoryFilterIndex.isin_bitmap の結果が pandas の isin と一致することを確かめます（欠損を含む）。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.filter_index import CATEGORY_BITMAP_MAX, CategoryFilterIndex
+
+
+def _series(kind):
+    rng = np.random.default_rng(0)
+    if kind == 'many':
+        # カテゴリごとのビットマップを作らない数のカテゴリ
+        values = [f'v{i}' for i in range(CATEGORY_BITMAP_MAX * 2)] + [None]
+        return pd.Series(rng.choice(np.array(values, dtype=object), 1000))
+    series = pd.Series(rng.choice(np.array(['a', 'b', 'c', None], dtype=object), 1000))
+    if kind == 'string':
+        return series.astype('string')
+    if kind == 'category':
+        return series.astype('category')
+    return series
+
+
+def _mask(index, values):
+    bitmap = index.isin_bitmap(values)
+    if bitmap is None:
+        return np.ones(index.n_rows, dtype=bool)
+    return np.unpackbits(bitmap, count=index.n_rows).astype(bool)
+
+
+@pytest.mark.parametrize('kind', ['object', 'string', 'category', 'many'])
+@pytest.mark.parametrize('values', [['a'], ['a', None], [None], ['a', 'b', 'c'], ['v1', np.nan], []])
+def test_isin_bitmap_matches_pandas_isin(kind, values):
+    series = _series(kind)
+    index = CategoryFilterIndex(series)
+    expected = series.isin([value for value in values if value is not None and value is not np.nan]).to_numpy()
+    if any(pd.isna(value) for value in values):
+        expected |= series.isna().to_numpy()
+    np.testing.assert_array_equal(_mask(index, values), expected)
+
+
+def test_missing_is_offered_as_a_category():
+    index = CategoryFilterIndex(_series('object'))
+    assert sum(pd.isna(value) for value in index.categories) == 1
+    assert index.isin_bitmap(index.categories) is None
@@ -0,0 +1,144 @@
+# tests/test_fingerprint.py
+"""
+列ごとのフィンガープリントの部分的な更新が全体を計算し直した結果と一致すること、
+依存関係のグラフから値の変わった列に依存する派生データだけが破棄されることを確かめます。
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.fingerprint import (
+    ARTIFACT_COMPUTE, ARTIFACT_FIGURE, ARTIFACT_TIME_CUBE, DatasetFingerprint, dependency_frame, record_dependency,
+    scoped_key, seed_fingerprint, supersede_dataset
+)
+from components.query import Filter
+
+BLOCK_ROWS = 16
+
+
+def _frame(n=100):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'a': rng.normal(size=n),
+        'b': rng.integers(0, 10, n),
+        's': rng.choice(['x', 'y', None], n),
+    })
+
+
+def _edited(df, kind):
+    df = df.copy()
+    if kind == 'cells':
+        df.loc[[3, 40, 99], 'a'] = [1.0, 2.0, 3.0]
+    elif kind == 'dtype':
+        df['b'] = df['b'].astype('float64')
+    elif kind == 'insert':
+        df = pd.concat([df.iloc[:50], pd.DataFrame({'a': [0.5], 'b': [1], 's': ['x']}), df.iloc[50:]],
+                       ignore_index=True)
+    elif kind == 'delete':
+        df = df.drop(index=[20, 21]).reset_index(drop=True)
+    elif kind == 'new_column':
+        df['c'] = 1
+    return df
+
+
+@pytest.mark.parametrize('kind, columns, positions, from_row', [
+    ('cells', ['a'], [3, 40, 99], None),
+    ('dtype', [], [], None),
+    ('insert', [], [], 50),
+    ('delete', [], [], 20),
+    ('new_column', [], [], None),
+])
+def test_updated_fingerprint_matches_rebuilt(kind, columns, positions, from_row):
+    df = _frame()
+    new_df = _edited(df, kind)
+    fingerprint = DatasetFingerprint.from_frame(df, BLOCK_ROWS)
+    updated = fingerprint.updated(new_df, columns, positions, from_row)
+    rebuilt = DatasetFingerprint.from_frame(new_df, BLOCK_ROWS)
+    assert updated.changed_columns(rebuilt) == set()
+    for col in new_df.columns:
+        assert updated.column_digest(col) == rebuilt.column_digest(col)
+
+
+@pytest.mark.parametrize('kind, changed', [
+    ('cells', {'a'}),
+    ('dtype', {'b'}),
+    # 行数が変わると全ての列が変わる
+    ('insert', {'a', 'b', 's'}),
+    ('delete', {'a', 'b', 's'}),
+    ('new_column', {'c'}),
+])
+def test_changed_columns(kind, changed):
+    df = _frame()
+    before = DatasetFingerprint.from_frame(df, BLOCK_ROWS)
+    after = DatasetFingerprint.from_frame(_edited(df, kind), BLOCK_ROWS)
+    assert before.changed_columns(after) == changed
+    assert after.changed_columns(before) == changed
+
+
+def test_scoped_key_ignores_other_columns():
+    df = _frame()
+    old_key, new_key = ('test_fingerprint', 'scoped', 0), ('test_fingerprint', 'scoped', 1)
+    seed_fingerprint(old_key, DatasetFingerprint.from_frame(df))
+    seed_fingerprint(new_key, DatasetFingerprint.from_frame(_edited(df, 'cells')))
+    assert scoped_key(old_key, ['b', 's']) == scoped_key(new_key, ['b', 's'])
+    assert scoped_key(old_key, ['a', 'b']) != scoped_key(new_key, ['a', 'b'])
+    # 列の順序もキーに含める
+    assert scoped_key(old_key, ['b', 's']) != scoped_key(old_key, ['s', 'b'])
+    # フィンガープリントにない列やキーは、そのまま返す
+    assert scoped_key(old_key, ['missing']) == old_key
+    assert scoped_key(('test_fingerprint', 'unknown'), ['a']) == ('test_fingerprint', 'unknown')
+
+
+def test_scoped_key_of_derived_views():
+    df = _frame()
+    old_key, new_key = ('test_fingerprint', 'views', 0), ('test_fingerprint', 'views', 1)
+    seed_fingerprint(old_key, DatasetFingerprint.from_frame(df))
+    seed_fingerprint(new_key, DatasetFingerprint.from_frame(_edited(df, 'cells')))
+    # ビットマップで絞り込んだビューは、使う列だけに依存する
+    filtered = ('filtered', old_key, 'bitmap-hash')
+    assert scoped_key(filtered, ['b']) == scoped_key(('filtered', new_key, 'bitmap-hash'), ['b'])
+    assert scoped_key(filtered, ['b']) != scoped_key(old_key, ['b'])
+    # ビットマップ以外の条件を含む問い合わせは、全ての列に依存するとみなす
+    bitmap_ops = (Filter((('bitmap', 'bitmap-hash'),)),)
+    range_ops = (Filter((('range', 'b', 2, None, False),)),)
+    assert scoped_key(('query', old_key, bitmap_ops), ['b']) == scoped_key(('query', new_key, bitmap_ops), ['b'])
+    assert scoped_key(('query', old_key, range_ops), ['b']) != scoped_key(('query', new_key, range_ops), ['b'])
+
+
+class _Evictions:
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, name):
+        return lambda: self.names.append(name)
+
+
+def test_supersede_evicts_only_dependents_of_changed_columns():
+    old_key, new_key = ('test_fingerprint', 'supersede', 0), ('test_fingerprint', 'supersede', 1)
+    evicted = _Evictions()
+    record_dependency(old_key, ARTIFACT_TIME_CUBE, 't', ['t', 'a', 'b'], evict=evicted('cube'))
+    record_dependency(old_key, ARTIFACT_FIGURE, 'scatter-ab', ['a', 'b'], evict=evicted('scatter-ab'), scoped=True)
+    record_dependency(old_key, ARTIFACT_FIGURE, 'hist-s', ['s'], evict=evicted('hist-s'), scoped=True)
+    record_dependency(old_key, ARTIFACT_COMPUTE, 'mean-s', ['s'], evict=evicted('mean-s'))
+    # 絞り込んだビューの派生データは、元のデータセットの派生データとして記録する
+    record_dependency(('filtered', old_key, 'bitmap-hash'), ARTIFACT_FIGURE, 'filtered-a', ['a'],
+                      evict=evicted('filtered-a'), scoped=True)
+
+    invalidated = supersede_dataset(old_key, new_key, {'a'})
+    assert {artifact.name for artifact in invalidated} == {'t', 'scatter-ab', 'filtered-a'}
+    assert sorted(evicted.names) == ['cube', 'filtered-a', 'scatter-ab']
+
+    # 値の変わらない列だけに依存する scoped な派生データは、新しい版の派生データとして引き継ぐ
+    carried = dependency_frame(new_key)
+    assert carried['名前'].tolist() == ['hist-s']
+    assert sorted(dependency_frame(old_key)['名前']) == ['hist-s', 'mean-s']
+
+    # 次の版への置き換えでも、引き継いだ派生データの破棄が行われる
+    supersede_dataset(new_key, ('test_fingerprint', 'supersede', 2), {'s'})
+    assert evicted.names[-1] == 'hist-s'
+
+
+def test_supersede_unknown_dataset():
+    assert supersede_dataset(('test_fingerprint', 'unknown'), ('test_fingerprint', 'next'), {'a'}) == []
+    assert dependency_frame(('test_fingerprint', 'next')).empty
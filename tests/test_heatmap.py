@@ -0,0 +1,119 @@
+# tests/test_heatmap.py
+"""
+ヒートマップの集計が、pandas の groupby / pivot_table で求めた格子と一致すること、
+データセットに対する集計が行ごとのビン番号から求めた結果（compute_heatmap）と一致することを確かめます。
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.dataset import Dataset
+from components.heatmap import (
+    AGG_COUNT, AGG_MAX, AGG_MEAN, AGG_SUM, MAX_HEATMAP_CATEGORIES, aggregate_grid, bin_axis, compute_heatmap,
+    query_heatmap
+)
+from components.query import Query
+
+
+def _codes(n, n_bins, missing, rng):
+    codes = rng.integers(0, n_bins, n)
+    codes[rng.random(n) < missing] = -1
+    return codes
+
+
+@pytest.mark.parametrize('nx, ny', [(1, 1), (5, 3), (40, 60)])
+@pytest.mark.parametrize('agg', [AGG_MEAN, AGG_SUM, AGG_COUNT, AGG_MAX])
+@pytest.mark.parametrize('with_values', [True, False])
+def test_aggregate_grid_matches_pivot_table(nx, ny, agg, with_values):
+    rng = np.random.default_rng(0)
+    n = 3000
+    x_codes, y_codes = _codes(n, nx, 0.1, rng), _codes(n, ny, 0.1, rng)
+    values = rng.normal(size=n)
+    values[rng.random(n) < 0.2] = np.nan
+    grid = aggregate_grid(x_codes, nx, y_codes, ny, values if with_values else None, agg)
+
+    frame = pd.DataFrame({'x': x_codes, 'y': y_codes, 'v': values if with_values else 1.0})
+    frame = frame[(frame['x'] >= 0) & (frame['y'] >= 0)].dropna()
+    pandas_agg = 'size' if agg == AGG_COUNT or not with_values else agg
+    expected = frame.pivot_table(index='y', columns='x', values='v', aggfunc=pandas_agg)
+    expected = expected.reindex(index=range(ny), columns=range(nx)).to_numpy(dtype=np.float64)
+    if pandas_agg == 'size':
+        expected = np.nan_to_num(expected) # 件数は行のないセルも 0
+    assert grid.shape == (ny, nx)
+    np.testing.assert_allclose(grid, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('n_bins', [1, 7, 50])
+def test_numeric_bins_match_pandas_cut(n_bins):
+    rng = np.random.default_rng(0)
+    series = pd.Series(rng.normal(size=1000))
+    series[::10] = np.nan
+    codes, n, centers = bin_axis(series, n_bins)
+    edges = np.linspace(series.min(), series.max(), n_bins + 1)
+    expected = pd.cut(series, edges, labels=False, include_lowest=True, right=False)
+    expected[series == series.max()] = n_bins - 1 # 最大値は最後のビンに含める
+    np.testing.assert_array_equal(codes, expected.fillna(-1).astype(np.int64).to_numpy())
+    assert n == len(centers) == n_bins
+
+
+def test_few_integer_values_get_one_bin_each():
+    series = pd.Series([3, 5, 4, 3, 7], dtype='int64')
+    codes, n, values = bin_axis(series, 10)
+    np.testing.assert_array_equal(values, np.arange(3, 8))
+    np.testing.assert_array_equal(values[codes], series.to_numpy())
+
+
+def test_many_categories_keep_the_most_frequent():
+    rng = np.random.default_rng(0)
+    series = pd.Series(rng.choice([f'k{i:03d}' for i in range(150)], 5000, p=np.arange(150, 0, -1) / 11325))
+    series[::7] = None
+    codes, n, labels = bin_axis(series)
+    assert n == MAX_HEATMAP_CATEGORIES
+    kept = series.value_counts().sort_index(kind='stable').sort_values(ascending=False, kind='stable')
+    kept = sorted(kept.index[:MAX_HEATMAP_CATEGORIES - 1])
+    assert list(labels[:-1]) == kept
+    shown = series.isin(kept).to_numpy()
+    other = ~shown & series.notna().to_numpy()
+    np.testing.assert_array_equal(labels[codes[shown]], series[shown].to_numpy())
+    np.testing.assert_array_equal(codes[other], MAX_HEATMAP_CATEGORIES - 1)
+    np.testing.assert_array_equal(codes[series.isna().to_numpy()], -1)
+
+
+def _dataset():
+    rng = np.random.default_rng(1)
+    n = 2000
+    df = pd.DataFrame({
+        't': pd.date_range('2024-01-01', periods=n, freq='37min'),
+        'tz': pd.date_range('2024-11-02', periods=n, freq='7min', tz='US/Eastern'),
+        'v': rng.normal(size=n),
+        'hour': rng.integers(0, 24, n),
+        'few': rng.choice(['a', 'b', 'c', None], n),
+        # 軸の上限を超える種類の値（「その他」にまとめる）
+        'many': rng.choice([f'k{i:03d}' for i in range(150)], n),
+        'const': np.full(n, 3.0),
+    })
+    df.loc[::9, 'v'] = np.nan
+    return Dataset(df, ('test_heatmap', n))
+
+
+@pytest.mark.parametrize('x_col, y_col', [
+    ('t', 'v'), ('tz', 'hour'), ('hour', 'few'), ('many', 'v'), ('const', 'few'), ('v', 'hour'),
+])
+@pytest.mark.parametrize('z_col, agg', [
+    (None, AGG_MEAN), ('v', AGG_MEAN), ('v', AGG_SUM), ('v', AGG_COUNT), ('v', AGG_MAX),
+])
+def test_query_heatmap_matches_compute_heatmap(x_col, y_col, z_col, agg):
+    dataset = _dataset()
+    query = Query(dataset).filter_range('hour', 2, None)
+    z, x_values, y_values = query_heatmap(query, x_col, y_col, z_col, agg, x_bins=20, y_bins=15)
+    expected_z, expected_x, expected_y = compute_heatmap(query.collect(), x_col, y_col, z_col, agg, 20, 15)
+    np.testing.assert_allclose(z, expected_z, equal_nan=True)
+    np.testing.assert_array_equal(np.asarray(x_values), np.asarray(expected_x))
+    np.testing.assert_array_equal(np.asarray(y_values), np.asarray(expected_y))
+
+
+def test_query_heatmap_of_empty_selection():
+    query = Query(_dataset()).filter_range('hour', 100, None)
+    z, x_values, y_values = query_heatmap(query, 't', 'few', 'v', AGG_MEAN)
+    assert z.shape == (len(y_values), len(x_values)) == (0, 0)
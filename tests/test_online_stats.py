@@ -0,0 +1,119 @@
+# tests/test_online_stats.py
+"""積和の集計と分位点スケッチから求めた統計量が、pandas の describe / corr と一致することを確かめます（欠損を含む）。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.online_stats import (
+    PairwiseMoments,
+    QuantileSketch,
+    build_quantile_sketches,
+    describe_from_statistics,
+    iter_row_chunks,
+    merge_quantile_sketches,
+    summarize_chunks,
+)
+
+
+def _frame(kind, n=1000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'a': rng.normal(1e6, 1.0, n), # 平均が大きく分散が小さい列（桁落ちしやすい）
+        'b': rng.integers(-50, 50, n),
+        'c': rng.exponential(3.0, n),
+    })
+    df['d'] = df['a'] * 0.5 + rng.normal(0, 0.1, n)
+    if kind == 'missing':
+        for col in ['a', 'c', 'd']:
+            df.loc[rng.random(n) < 0.2, col] = np.nan
+    if kind == 'all_missing':
+        df['c'] = np.nan
+    if kind == 'nullable':
+        df['b'] = df['b'].astype('Int64')
+        df.loc[rng.random(n) < 0.2, 'b'] = pd.NA
+    return df
+
+
+KINDS = ['plain', 'missing', 'all_missing', 'nullable']
+
+
+def _assert_stats_equal(moments, sketches, df):
+    columns = list(df.columns)
+    expected = df.astype('float64').describe()
+    pd.testing.assert_frame_equal(describe_from_statistics(moments, sketches, columns), expected, check_exact=False)
+    pd.testing.assert_frame_equal(moments.correlation(columns), df.astype('float64').corr(), check_exact=False)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_describe_and_correlation_match_pandas(kind):
+    df = _frame(kind)
+    _assert_stats_equal(PairwiseMoments.from_frame(df), build_quantile_sketches(df), df)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('chunk_rows', [1, 7, 333, 5000])
+def test_chunked_summaries_match_pandas(kind, chunk_rows):
+    df = _frame(kind, n=200 if chunk_rows == 1 else 1000)
+    progress = []
+    moments, sketches = summarize_chunks(
+        iter_row_chunks(df, chunk_rows), progress_callback=lambda rows, *_: progress.append(rows)
+    )
+    _assert_stats_equal(moments, sketches, df)
+    assert progress[-1] == len(df)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('split', [0, 1, 500, 999])
+def test_merge_of_parts_matches_whole(kind, split):
+    df = _frame(kind)
+    head, tail = df.iloc[:split], df.iloc[split:]
+    moments = PairwiseMoments.from_frame(head, list(df.columns)).merge(PairwiseMoments.from_frame(tail, list(df.columns)))
+    sketches = merge_quantile_sketches(build_quantile_sketches(head, list(df.columns)),
+                                       build_quantile_sketches(tail, list(df.columns)))
+    _assert_stats_equal(moments, sketches, df)
+
+
+def test_merge_keeps_columns_of_both_sides():
+    df = _frame('plain')
+    moments = PairwiseMoments.from_frame(df[['a', 'b']]).merge(PairwiseMoments.from_frame(df[['c']]))
+    assert set(moments.columns) == {'a', 'b', 'c'}
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('rows', [[0], [3, 10, 500], 'extremes'])
+def test_replace_rows_matches_rebuild(kind, rows):
+    df = _frame(kind)
+    if rows == 'extremes':
+        # 最小・最大の行を書き換えると、その列の最小・最大を求め直す必要がある
+        rows = sorted({df['a'].idxmin(), df['a'].idxmax(), df['d'].idxmax()})
+    edited = df.copy()
+    rng = np.random.default_rng(1)
+    for col in ['a', 'c', 'd']:
+        # 列の値の範囲内で書き換える（全て欠損の列は 0 付近の値にする）
+        center, scale = (df[col].median(), df[col].std()) if df[col].notna().any() else (0.0, 1.0)
+        edited.loc[rows, col] = center + rng.normal(0, scale / 4, len(rows))
+    before = PairwiseMoments.from_frame(df)
+    replaced = before.replace_rows(df.loc[rows], edited.loc[rows], edited)
+    _assert_stats_equal(replaced, build_quantile_sketches(edited), edited)
+
+
+@pytest.mark.parametrize('n', [0, 1, 10, 1000])
+@pytest.mark.parametrize('qs', [[0.0, 0.25, 0.5, 0.75, 1.0], [0.01, 0.999]])
+def test_exact_sketch_matches_pandas_quantile(n, qs):
+    values = pd.Series(np.random.default_rng(0).normal(size=n))
+    values[values > 1.5] = np.nan
+    sketch = QuantileSketch().update(values.to_numpy())
+    assert sketch.is_exact
+    np.testing.assert_allclose(sketch.quantiles(qs), values.quantile(qs).to_numpy())
+
+
+def test_compressed_sketch_stays_close_to_pandas_quantile():
+    values = np.random.default_rng(0).normal(size=200_000)
+    halves = [QuantileSketch(exact_max_rows=1000).update(part) for part in np.array_split(values, 2)]
+    sketch = halves[0].merge(halves[1])
+    assert not sketch.is_exact and sketch.count == len(values)
+    qs = np.linspace(0.05, 0.95, 19)
+    # 順位の誤差で評価する（KLL の誤差保証は順位に対するもの）
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(qs)) / len(values)
+    np.testing.assert_allclose(ranks, qs, atol=0.02)
@@ -0,0 +1,93 @@
+# tests/test_parallel.py
+"""ワーカープロセスで並列に処理した結果が、同じ処理を直列に行った結果と一致することを確かめます。"""
+
+import functools
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components import parallel, time_cube
+from components.parallel import map_row_partitions, parse_csv_files
+from components.time_cube import _bucket_partials, _combine_bucket_partials, _hour_buckets, build_time_cube
+
+
+class _File(io.BytesIO):
+    def __init__(self, text, name):
+        super().__init__(text.encode())
+        self.name = name
+        self.size = len(text)
+
+
+CSV_FILES = {
+    'numbers': ['a,b\n1,2.5\n3,\n5,6.5\n', 'a,b\n7,8.5\n'],
+    'strings': ['a,b\n1,x\n2,\n', 'a,b\n3,"y,z"\n4,w\n'],
+    # 数値と文字列が混在する列は Arrow に変換できないので DataFrame のまま受け取る
+    'mixed': ['a\n1\nx\n2\n' * 1000, 'a\n3\n'],
+    'header_only': ['a,b\n', 'a,b\n1,2\n'],
+}
+
+
+def _files(name):
+    return [_File(text, f'{name}_{i}.csv') for i, text in enumerate(CSV_FILES[name])]
+
+
+@pytest.mark.parametrize('name', list(CSV_FILES))
+@pytest.mark.parametrize('read_csv_kwargs', [{}, {'header': None}, {'dtype': str}])
+def test_parallel_csv_parse_matches_read_csv(name, read_csv_kwargs, monkeypatch):
+    # プロセスプールが使えずに直列処理に切り替わった場合は失敗させる
+    monkeypatch.setattr(parallel, '_parse_csv_serial', None)
+    expected = [pd.read_csv(file, **read_csv_kwargs) for file in _files(name)]
+    result = parse_csv_files(_files(name), max_workers=2, min_bytes=0, **read_csv_kwargs)
+    assert len(result) == len(expected)
+    for frame, expected_frame in zip(result, expected):
+        pd.testing.assert_frame_equal(frame, expected_frame)
+
+
+def test_parallel_csv_parse_returns_errors_per_file(monkeypatch):
+    monkeypatch.setattr(parallel, '_parse_csv_serial', None)
+    files = [_File('a,b\n1,2\n', 'ok.csv'), _File('', 'empty.csv'), _File('a\n3\n', 'ok2.csv')]
+    result = parse_csv_files(files, max_workers=2, min_bytes=0)
+    assert isinstance(result[1], Exception)
+    pd.testing.assert_frame_equal(result[0], pd.read_csv(io.StringIO('a,b\n1,2\n')))
+    pd.testing.assert_frame_equal(result[2], pd.read_csv(io.StringIO('a\n3\n')))
+
+
+def _cube_arrays(tz, n=20000):
+    rng = np.random.default_rng(0)
+    times = pd.Series(pd.date_range('2024-10-30', periods=n, freq='1min', tz=tz))
+    times[::17] = pd.NaT
+    bucket, unit = _hour_buckets(times)
+    values = rng.normal(size=n)
+    values[::11] = np.nan
+    return {'bucket': bucket, 'value0': values, 'value1': rng.integers(0, 100, n)}, unit
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern', 'Asia/Kolkata'])
+@pytest.mark.parametrize('max_workers', [2, 3, 7])
+def test_parallel_bucket_partials_match_serial(tz, max_workers):
+    arrays, unit = _cube_arrays(tz)
+    serial = map_row_partitions(_bucket_partials, arrays, args=(2, unit), max_workers=1)
+    parallel = map_row_partitions(_bucket_partials, arrays, args=(2, unit), max_workers=max_workers, min_rows=0)
+    # 行の範囲ごとに分かれて返り、範囲の境界をまたぐ時間帯は統合時に合算される
+    assert len(serial) == 1 and len(parallel) == max_workers
+    expected_buckets, expected = _combine_bucket_partials(serial)
+    buckets, combined = _combine_bucket_partials(parallel)
+    np.testing.assert_array_equal(buckets, expected_buckets)
+    for stat, values in expected.items():
+        np.testing.assert_allclose(combined[stat], values, err_msg=stat)
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern'])
+def test_parallel_time_cube_matches_serial(tz, monkeypatch):
+    arrays, _ = _cube_arrays(None)
+    df = pd.DataFrame({
+        't': pd.date_range('2024-10-30', periods=len(arrays['bucket']), freq='1min', tz=tz),
+        'v': arrays['value0'],
+        'n': arrays['value1'],
+    })
+    expected = build_time_cube(df, 't', max_workers=1)
+    # 小さいデータでもワーカープロセスで行を分割して集計させる
+    monkeypatch.setattr(time_cube, 'map_row_partitions', functools.partial(map_row_partitions, min_rows=0))
+    pd.testing.assert_frame_equal(build_time_cube(df, 't', max_workers=4), expected)
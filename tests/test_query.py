@@ -0,0 +1,125 @@
+# tests/test_query.py
+"""最適化した実行計画の結果が、演算を書かれた順にそのまま pandas で評価した結果（集計は groupby）と一致することを確かめます。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.dataset import Dataset
+from components.filter_index import build_column_index
+from components.query import Aggregate, Bin, Bucket, Filter, Project, Query
+
+
+def _dataset():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        't': pd.date_range('2024-01-01', periods=n, freq='h'),
+        'v': rng.normal(size=n),
+        'w': rng.integers(0, 10, n).astype(float),
+        'cat': rng.choice(['a', 'b', 'c', None], n),
+        # 夏時間の終わり（2024-11-03 の 01:00 が2回ある）をまたぐタイムゾーン付きの日時
+        'tz': pd.date_range('2024-11-02', periods=n, freq='15min', tz='US/Eastern'),
+    })
+    df.loc[::7, 'v'] = np.nan
+    df.loc[::11, 'w'] = np.nan
+    return Dataset(df, ('test_query', n))
+
+
+def _unoptimized(query):
+    """実行計画の演算を書かれた順に、ブールマスクと列の選択で評価します。"""
+    typed = query.dataset.typed
+    frame = typed
+
+    def column(col):
+        # 射影で除いた列の条件は、データセットの列で評価する
+        return frame[col] if col in frame.columns else typed.loc[frame.index, col]
+
+    for op in query._ops[1:]:
+        if isinstance(op, Project):
+            frame = frame[list(op.columns)]
+        elif isinstance(op, Bucket):
+            values = frame[op.column]
+            if values.dt.tz is not None:
+                values = values.dt.tz_localize(None)
+            frame = frame.assign(**{op.name: values if op.freq is None else values.dt.floor(op.freq)})
+        elif isinstance(op, Bin):
+            edges = np.linspace(op.low, op.high, op.n_bins + 1)
+            values = frame[op.column].to_numpy(dtype=np.float64, na_value=np.nan)
+            numbers = np.clip(np.digitize(values, edges) - 1, 0, op.n_bins - 1).astype(np.float64)
+            frame = frame.assign(**{op.name: np.where(np.isnan(values), np.nan, numbers)})
+        elif isinstance(op, Aggregate):
+            if op.keys:
+                named = {out: (col if col is not None else op.keys[0], func) for out, col, func in op.aggregations}
+                frame = frame.groupby(list(op.keys), observed=True).agg(**named).reset_index()
+            else:
+                frame = pd.DataFrame({out: [len(frame) if func == 'size' else frame[col].agg(func)]
+                                      for out, col, func in op.aggregations})
+        elif isinstance(op, Filter):
+            mask = pd.Series(True, index=frame.index)
+            for predicate in op.predicates:
+                if predicate[0] == 'bitmap':
+                    rows = np.unpackbits(query._bitmaps[predicate[1]], count=len(typed)).astype(bool)
+                    mask &= pd.Series(rows, index=typed.index).loc[frame.index]
+                elif predicate[0] == 'range':
+                    _, col, low, high, inclusive_high = predicate
+                    values = column(col)
+                    if low is not None:
+                        mask &= values >= low
+                    if high is not None:
+                        mask &= values <= high if inclusive_high else values < high
+                else:
+                    _, col, values = predicate
+                    mask &= column(col).isin(values)
+            frame = frame[mask]
+    return frame
+
+
+def _queries(dataset):
+    query = Query(dataset)
+    bitmap = build_column_index(dataset.typed['w']).range_bitmap(2, 6)
+    return [
+        query.filter_range('v', -0.5, 0.5).select(['t', 'v']),
+        query.select(['t', 'w']).filter_range('v', 0, None),
+        query.filter_isin('cat', ['a', None]).select(['cat', 'v']),
+        query.filter_isin('cat', ['a', 'b', 'c']).select(['cat']),
+        query.select(['v', 'w', 'cat']).filter_bitmap(bitmap).filter_isin('cat', ['b']).select(['w']),
+        query.filter_range('t', np.datetime64('2024-01-03'), np.datetime64('2024-01-05'), inclusive_high=False),
+        query.select(['w']),
+        # 時間の切り捨てと集計
+        query.filter_range('v', -1, None).bucket('t', 'D', 'day').aggregate(['day'], s=('v', 'sum'), n=('v', 'count')),
+        query.bucket('tz', 'h', 'hour').aggregate(['hour'], n=(None, 'size'), m=('v', 'max')),
+        # 2段の集計（外側のキーにない内側のキー w に欠損がある）
+        query.aggregate(['cat', 'w'], s=('v', 'sum'), c=('v', 'count'), n=('v', 'size'), m=('v', 'min'))
+             .aggregate(['cat'], s=('s', 'sum'), c=('c', 'sum'), n=('n', 'sum'), m=('m', 'min')),
+        query.aggregate(['cat', 'w'], s=('v', 'sum')).aggregate([], s=('s', 'sum')),
+        # 1時間ごとの集計を日ごとにまとめる（切り捨てを内側の集計の前に移してから1段にする）
+        query.bucket('t', 'h', 'hour').aggregate(['hour'], s=('v', 'sum'), n=(None, 'size'))
+             .bucket('hour', 'D', 'day').aggregate(['day'], s=('s', 'sum'), n=('n', 'sum')),
+        # まとめられない集計（平均の平均）と、集計後の条件
+        query.aggregate(['cat', 'w'], m=('v', 'mean')).aggregate(['cat'], m=('m', 'mean')),
+        query.filter_isin('cat', ['a', 'b']).aggregate(['cat'], s=('v', 'sum')).filter_range('s', 0, None),
+        query.select(['v', 'w']).bin('w', 0, 9, 4, 'b').aggregate(['b'], s=('v', 'sum'), n=(None, 'size')),
+        query.bin('t', pd.Timestamp('2024-01-02').value, pd.Timestamp('2024-01-10').value, 5, 'b')
+             .aggregate(['b'], n=(None, 'size')),
+        query.filter_isin('cat', ['a']).aggregate([], mean=('v', 'mean'), n=(None, 'size')),
+    ]
+
+
+@pytest.mark.parametrize('position', range(17))
+def test_optimized_plan_matches_unoptimized(position):
+    dataset = _dataset()
+    query = _queries(dataset)[position]
+    expected = _unoptimized(query)
+    pd.testing.assert_frame_equal(query.collect(), expected)
+    assert query.count() == len(expected)
+
+
+def test_consecutive_aggregates_merge_into_one():
+    queries = _queries(_dataset())
+    for position in (9, 10, 11):
+        aggregates = [op for op in queries[position].plan if isinstance(op, Aggregate)]
+        assert len(aggregates) == 1
+    # 外側のキーにない内側のキーの欠損の行は、まとめた集計でも除く
+    assert [op for op in queries[9].plan if isinstance(op, Aggregate)][0].dropna == ('w',)
+    assert len([op for op in queries[12].plan if isinstance(op, Aggregate)]) == 2
@@ -0,0 +1,82 @@
+# tests/test_rasterize.py
+"""点群のラスタへの集計が np.histogram2d と一致することを確かめます。"""
+
+import numpy as np
+import pytest
+
+from components.rasterize import (
+    has_finite_points, hex_to_rgb, rasterize_by_category, rasterize_points, shade_categories
+)
+
+
+def _points(n=20_000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=n)
+    y = rng.exponential(size=n)
+    x[::97] = np.nan
+    y[::89] = np.inf
+    return x, y
+
+
+@pytest.mark.parametrize('shape', [(10, 10), (37, 23), (600, 250)])
+def test_counts_match_histogram2d(shape):
+    x, y = _points()
+    z, x_edges, y_edges, counts = rasterize_points(x, y, shape)
+    finite = np.isfinite(x) & np.isfinite(y)
+    expected, _, _ = np.histogram2d(y[finite], x[finite], bins=[y_edges, x_edges])
+    assert z.shape == (shape[1], shape[0])
+    np.testing.assert_array_equal(z, expected)
+    np.testing.assert_array_equal(counts, expected)
+    assert x_edges[0] == x[finite].min() and x_edges[-1] == x[finite].max()
+
+
+def test_weighted_means_match_histogram2d():
+    x, y = _points()
+    weights = np.random.default_rng(1).normal(size=len(x))
+    weights[::13] = np.nan
+    means, x_edges, y_edges, counts = rasterize_points(x, y, (40, 30), weights=weights)
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(weights)
+    sums, _, _ = np.histogram2d(y[valid], x[valid], bins=[y_edges, x_edges], weights=weights[valid])
+    expected_counts, _, _ = np.histogram2d(y[valid], x[valid], bins=[y_edges, x_edges])
+    np.testing.assert_array_equal(counts, expected_counts)
+    with np.errstate(invalid='ignore'):
+        np.testing.assert_allclose(means, sums / expected_counts, equal_nan=True)
+
+
+def test_constant_and_empty_inputs():
+    z, x_edges, _, _ = rasterize_points(np.full(5, 3.0), np.arange(5.0), (10, 10))
+    assert z.sum() == 5 and x_edges[0] < 3.0 < x_edges[-1]
+    z, _, _, _ = rasterize_points(np.full(3, np.nan), np.arange(3.0), (10, 10))
+    assert z.sum() == 0
+    assert not has_finite_points(np.array([np.nan, 1.0]), np.array([1.0, np.inf]))
+    assert has_finite_points(np.array([np.nan, 1.0]), np.array([1.0, 2.0]))
+
+
+def test_category_rasters_sum_to_the_point_raster():
+    x, y = _points()
+    codes = np.random.default_rng(2).integers(-1, 4, len(x)) # -1 は欠損
+    counts, x_edges, y_edges = rasterize_by_category(x, y, codes, 4, (30, 20))
+    assert counts.shape == (4, 20, 30)
+    for category in range(4):
+        selected = np.isfinite(x) & np.isfinite(y) & (codes == category)
+        expected, _, _ = np.histogram2d(y[selected], x[selected], bins=[y_edges, x_edges])
+        np.testing.assert_array_equal(counts[category], expected)
+
+
+def test_shade_categories():
+    counts = np.zeros((2, 2, 2), dtype=np.int64)
+    counts[0, 0, 0] = 10
+    counts[1, 0, 0] = 10
+    counts[1, 1, 1] = 1
+    image = shade_categories(counts, [(255, 0, 0), (0, 0, 255)])
+    assert image.shape == (2, 2, 4) and image.dtype == np.uint8
+    assert tuple(image[0, 0, :3]) == (127, 0, 127) and image[0, 0, 3] == 255
+    assert tuple(image[1, 1, :3]) == (0, 0, 255) and 0 < image[1, 1, 3] < 255
+    assert image[0, 1, 3] == 0 and image[1, 0, 3] == 0
+
+
+def test_hex_to_rgb():
+    assert hex_to_rgb('#ff8000') == (255, 128, 0)
+    assert hex_to_rgb('rgb(1, 2.5, 3)') == (1, 2, 3)
+    with pytest.raises(ValueError):
+        hex_to_rgb('red')
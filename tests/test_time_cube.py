@@ -0,0 +1,107 @@
+# tests/test_time_cube.py
+"""時間キューブからの集計が、生データに対する pandas の groupby / pivot_table と一致することを確かめます。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.time_cube import (
+    GRANULARITY_DAY, GRANULARITY_HOUR_OF_DAY, GRANULARITY_MONTH, GRANULARITY_WEEKDAY, GRANULARITY_YEAR,
+    WEEKDAY_NAMES, build_time_cube, build_time_cube_in_chunks, merge_time_cubes, rebuild_time_cube_buckets,
+    rollup_date_hour, rollup_time_cube
+)
+
+
+def _frame(tz=None, n=5000, freq='7min', start='2024-10-28'):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        # tz を指定すると夏時間の終わり（2024-11-03 の 01:00 台が2回ある）をまたぐ
+        't': pd.date_range(start, periods=n, freq=freq, tz=tz),
+        'v': rng.normal(size=n),
+        'k': rng.integers(0, 5, n).astype(np.int8),
+    })
+    df.loc[::13, 'v'] = np.nan
+    df.loc[::29, 't'] = pd.NaT
+    return df
+
+
+def _local(df):
+    t = df['t']
+    return t.dt.tz_localize(None) if t.dt.tz is not None else t
+
+
+def _expected_rollup(df, granularity):
+    t = _local(df)
+    valid = t.notna() & df['v'].notna()
+    t, v = t[valid], df.loc[valid, 'v']
+    if granularity == GRANULARITY_HOUR_OF_DAY:
+        keys = t.dt.hour
+    elif granularity == GRANULARITY_DAY:
+        keys = t.dt.date
+    elif granularity == GRANULARITY_WEEKDAY:
+        keys = t.dt.day_name()
+    elif granularity == GRANULARITY_MONTH:
+        keys = t.dt.strftime('%Y-%m')
+    else:
+        keys = t.dt.year
+    means = v.groupby(keys.to_numpy()).mean()
+    if granularity == GRANULARITY_WEEKDAY:
+        means = means.reindex(WEEKDAY_NAMES)
+    return means
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern', 'Asia/Kolkata'])
+@pytest.mark.parametrize('granularity', [
+    GRANULARITY_HOUR_OF_DAY, GRANULARITY_DAY, GRANULARITY_WEEKDAY, GRANULARITY_MONTH, GRANULARITY_YEAR
+])
+def test_rollup_matches_groupby(tz, granularity):
+    df = _frame(tz, freq='53min')
+    result = rollup_time_cube(build_time_cube(df, 't'), 'v', granularity)
+    expected = _expected_rollup(df, granularity)
+    np.testing.assert_array_equal(np.asarray(result['Period'], dtype=object), expected.index.to_numpy(dtype=object))
+    np.testing.assert_allclose(result['Average_Value'].to_numpy(), expected.to_numpy())
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern', 'Asia/Kolkata'])
+@pytest.mark.parametrize('agg', ['mean', 'sum', 'count', 'min', 'max'])
+def test_rollup_date_hour_matches_pivot_table(tz, agg):
+    df = _frame(tz)
+    table = rollup_date_hour(build_time_cube(df, 't'), 'v', agg)
+    t = _local(df)
+    frame = pd.DataFrame({'hour': t.dt.hour, 'date': t.dt.date, 'v': df['v']}).dropna()
+    expected = frame.pivot_table(index='hour', columns='date', values='v', aggfunc=agg)
+    np.testing.assert_array_equal(table.index.to_numpy(), expected.index.to_numpy())
+    np.testing.assert_array_equal(table.columns.to_numpy(), expected.columns.to_numpy())
+    np.testing.assert_allclose(table.to_numpy(), expected.to_numpy(dtype=np.float64))
+
+
+def test_fall_back_hours_stay_separate_in_the_cube():
+    # 夏時間の終わりの 01:00 台の2つの時間（EDT と EST）は、キューブでは別の時間帯になる
+    df = pd.DataFrame({'t': pd.date_range('2024-11-03 00:00', periods=12, freq='30min', tz='US/Eastern'),
+                       'v': np.arange(12.0)})
+    cube = build_time_cube(df, 't')
+    expected = df.groupby(df['t'].dt.tz_convert('UTC').dt.floor('h'))['v'].agg(['sum', 'count'])
+    np.testing.assert_array_equal(cube.index.tz_convert('UTC'), expected.index)
+    np.testing.assert_allclose(cube[('v', 'sum')].to_numpy(), expected['sum'].to_numpy())
+    assert str(cube.index.tz) == 'US/Eastern'
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern'])
+def test_chunked_and_merged_cubes_match_a_single_build(tz):
+    df = _frame(tz)
+    whole = build_time_cube(df, 't')
+    chunked = build_time_cube_in_chunks(df, 't', chunk_rows=777)
+    merged = merge_time_cubes(build_time_cube(df.iloc[:2500], 't'), build_time_cube(df.iloc[2500:], 't'))
+    pd.testing.assert_frame_equal(chunked, whole)
+    pd.testing.assert_frame_equal(merged, whole)
+
+
+@pytest.mark.parametrize('tz', [None, 'US/Eastern'])
+def test_rebuild_buckets_matches_a_fresh_build(tz):
+    df = _frame(tz)
+    cube = build_time_cube(df, 't')
+    edited = df.copy()
+    rows = [100, 101, 1200, 1201, 4000]
+    edited.loc[rows, 'v'] = 1000.0
+    rebuilt = rebuild_time_cube_buckets(cube, edited, 't', df.loc[rows, 't'])
+    pd.testing.assert_frame_equal(rebuilt, build_time_cube(edited, 't'))
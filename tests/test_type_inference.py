@@ -0,0 +1,78 @@
+# tests/test_type_inference.py
+"""列の種類の推論と一括変換が、値を変えずに期待どおりの型にすることを確かめます。"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.type_inference import (
+    KIND_BOOLEAN, KIND_CATEGORICAL, KIND_DATETIME, KIND_NUMERIC, KIND_STRING,
+    apply_schema, concat_typed_frames, convert_column_types, downcast_numeric, infer_column_kind, infer_schema
+)
+
+N = 200
+
+
+@pytest.mark.parametrize('values, kind', [
+    (np.arange(N), KIND_NUMERIC),
+    ([str(i) for i in range(N)], KIND_NUMERIC),
+    ([f'{i}.5' for i in range(N - 5)] + ['n/a'] * 5, KIND_NUMERIC), # 数値として解釈できない値が少しだけある
+    ([f'2024-01-{i % 28 + 1:02d}' for i in range(N)], KIND_DATETIME),
+    (['Jan', 'Feb', 'Mar', 'Apr'] * (N // 4), KIND_CATEGORICAL),
+    ([f'id-{i}' for i in range(N)], KIND_STRING),
+    ([True, False] * (N // 2), KIND_BOOLEAN),
+    ([None] * N, KIND_STRING),
+    (['1,234'] * N, KIND_CATEGORICAL), # 区切り文字付きの数値は数値にしない
+])
+def test_infer_column_kind(values, kind):
+    assert infer_column_kind(pd.Series(values)) == kind
+
+
+def test_apply_schema_converts_values_like_pandas():
+    df = pd.DataFrame({
+        'n': [str(i) for i in range(N - 1)] + ['x'],
+        't': [f'2024-02-{i % 28 + 1:02d} 10:00' for i in range(N)],
+        'c': ['a', 'b', None, 'c'] * (N // 4),
+        's': [f'id-{i}' for i in range(N)],
+    })
+    schema = infer_schema(df)
+    typed = apply_schema(df, schema)
+    assert schema == {'n': KIND_NUMERIC, 't': KIND_DATETIME, 'c': KIND_CATEGORICAL, 's': KIND_STRING}
+    np.testing.assert_array_equal(typed['n'].to_numpy(dtype=np.float64, na_value=np.nan),
+                                  pd.to_numeric(df['n'], errors='coerce').to_numpy())
+    pd.testing.assert_series_equal(typed['t'], pd.to_datetime(df['t']))
+    assert isinstance(typed['c'].dtype, pd.CategoricalDtype)
+    assert typed['c'].astype(object).fillna('<NA>').tolist() == df['c'].fillna('<NA>').tolist()
+    pd.testing.assert_series_equal(typed['s'], df['s'])
+
+
+@pytest.mark.parametrize('values, dtype', [
+    (np.array([1, 2, 100], dtype=np.int64), np.int8),
+    (np.array([1, 2, 40_000], dtype=np.int64), np.int32),
+    (np.array([0.5, 1.25, np.nan]), np.float32), # float32 で誤差なく表せる
+    (np.array([0.1, 0.2]), np.float64), # float32 では誤差が出る
+])
+def test_downcast_numeric_keeps_values(values, dtype):
+    series = downcast_numeric(pd.Series(values))
+    assert series.dtype == dtype
+    np.testing.assert_array_equal(series.to_numpy(dtype=values.dtype), values)
+
+
+def test_convert_column_types_caches_by_key():
+    df = pd.DataFrame({'n': [str(i) for i in range(N)]})
+    key = ('test_type_inference', 'cache')
+    first = convert_column_types(df, key)
+    # 同じキーでは推論も変換もせず、キャッシュした結果を返す
+    second = convert_column_types(df.assign(n='changed'), key)
+    pd.testing.assert_frame_equal(first, second)
+    assert pd.api.types.is_integer_dtype(first['n'].dtype)
+
+
+def test_concat_typed_frames_keeps_categories():
+    old = pd.DataFrame({'c': pd.Categorical(['a', 'b']), 'v': [1.0, 2.0]})
+    new = pd.DataFrame({'c': pd.Categorical(['c', 'a']), 'w': [3, 4]})
+    combined = concat_typed_frames(old, new)
+    assert isinstance(combined['c'].dtype, pd.CategoricalDtype)
+    assert combined['c'].tolist() == ['a', 'b', 'c', 'a']
+    assert combined['v'].isna().tolist() == [False, False, True, True]
+    assert combined['w'].tolist()[2:] == [3, 4]